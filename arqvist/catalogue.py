@@ -0,0 +1,348 @@
+#!/bin/env python
+#
+#     catalogue.py: catalogue of data dirs
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Catalogue of data dirs
+
+Provides the Catalogue class, which stores the results of scanning
+many data dirs (sizes, file types, owners, compression and checksums
+for each file, plus the library summaries for SOLiD data) in a single
+SQLite database, so that questions about the whole collection of
+data dirs can be answered without rescanning each one, for example:
+
+>>> cat = Catalogue('catalogue.db')
+>>> cat.add(DataDir('/data/solid0123_20111014_FRAG_BC'))
+>>> cat.summary(by=('run',),extensions=('csfasta',),
+...             compression=('none',))
+[('/data/solid0123_20111014_FRAG_BC', 12, 73458923520)]
+>>> cat.summary(by=('group',),extensions=('fastq',))
+[('bioinf', 2201, 1203458923520), ('seqfac', 120, 30458923520)]
+
+Each data dir ('run') is catalogued separately: adding a data dir
+which is already in the catalogue replaces the entries for that
+data dir only, so the catalogue can be refreshed one data dir at a
+time.
+
+Paths and other strings are stored as text decoded as Latin-1, which
+maps each byte to one character, so paths which aren't valid UTF-8
+are stored without loss (and distinct paths stay distinct); strings
+are returned as the original byte strings.
+
+"""
+
+import os
+import time
+import sqlite3
+from .core import format_checksums
+from .core import entry_type
+from .core import to_unicode
+from .profiling import profiler
+
+# Version of the database schema
+SCHEMA_VERSION = 2
+
+# Fields which summaries can be grouped by, and the
+# corresponding columns
+SUMMARY_FIELDS = {
+    'run': 'runs.path',
+    'name': 'runs.name',
+    'ext': 'files.ext',
+    'compression': 'files.compression',
+    'owner': 'files.owner',
+    'group': 'files.grp',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    key TEXT PRIMARY KEY,
+    value TEXT);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    nfiles INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    catalogued REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS files (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    relpath TEXT NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    ext TEXT NOT NULL,
+    compression TEXT NOT NULL,
+    owner TEXT,
+    grp TEXT,
+    md5 TEXT,
+    uncompressed_md5 TEXT,
+    checksums TEXT);
+CREATE INDEX IF NOT EXISTS files_run ON files (run_id);
+CREATE INDEX IF NOT EXISTS files_ext ON files (ext,compression);
+CREATE INDEX IF NOT EXISTS files_owner ON files (owner);
+CREATE INDEX IF NOT EXISTS files_grp ON files (grp);
+CREATE INDEX IF NOT EXISTS files_md5 ON files (md5);
+CREATE TABLE IF NOT EXISTS libraries (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    sample TEXT NOT NULL,
+    library TEXT NOT NULL,
+    name TEXT NOT NULL,
+    grp TEXT,
+    timestamps TEXT,
+    nfile_sets INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS libraries_run ON libraries (run_id);
+"""
+
+#######################################################################
+# Classes
+#######################################################################
+
+class Catalogue:
+    """
+    Class for cataloguing data dirs in an SQLite database
+
+    """
+    def __init__(self,db_file):
+        """
+        Open (or create) a catalogue
+
+        Raises Exception if the database was created
+        with a different version of the schema.
+        """
+        self._db_file = db_file
+        self._conn = sqlite3.connect(db_file)
+        self._conn.text_factory = _from_db
+        self._conn.executescript(SCHEMA)
+        version = self._conn.execute("SELECT value FROM metadata "
+                                     "WHERE key = 'schema_version'"
+                                     ).fetchone()
+        if version is None:
+            with self._conn:
+                self._conn.execute("INSERT INTO metadata VALUES "
+                                   "('schema_version',?)",
+                                   (str(SCHEMA_VERSION),))
+        elif int(version[0]) != SCHEMA_VERSION:
+            raise Exception("%s: catalogue has schema version %s "
+                            "(expected %s)" % (db_file,version[0],
+                                               SCHEMA_VERSION))
+
+    def close(self):
+        """
+        Close the catalogue
+        """
+        self._conn.close()
+
+    def add(self,datadir,libraries=None):
+        """
+        Add or refresh the entries for a data dir
+
+        Any existing entries for the data dir are
+        replaced.
+
+        Arguments:
+          datadir: DataDir instance to catalogue
+          libraries: (optional) list of SolidLibrary
+            instances for the data dir (e.g. from a
+            SolidDataDir)
+        """
+        dirn = _to_db(datadir.path)
+        with profiler.timer('catalogue_add'):
+            with self._conn:
+                self._remove(dirn)
+                cursor = self._conn.execute(
+                    "INSERT INTO runs (path,name,nfiles,size,catalogued) "
+                    "VALUES (?,?,?,?,?)",
+                    (dirn,_to_db(datadir.name),len(datadir),datadir.size,
+                     time.time()))
+                run_id = cursor.lastrowid
+                self._conn.executemany(
+                    "INSERT INTO files VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                    ((run_id,
+                      _to_db(f.relpath(datadir.path)),
+                      (entry_type(f) or 'other'),
+                      f.size,
+                      f.timestamp,
+                      _to_db(f.ext),
+                      (f.compression if f.compression else ''),
+                      _to_db(f.user),
+                      _to_db(f.group),
+                      f.md5,
+                      f.uncompressed_md5,
+                      format_checksums(f.checksums))
+                     for f in datadir.files()))
+                if libraries:
+                    self._conn.executemany(
+                        "INSERT INTO libraries VALUES (?,?,?,?,?,?,?)",
+                        ((run_id,
+                          _to_db(lib.sample_name),
+                          _to_db(lib.library_name),
+                          _to_db(lib.name),
+                          _to_db(lib.group),
+                          ','.join([str(t) for t in lib.timestamps]),
+                          len(lib.get_file_sets()))
+                         for lib in libraries))
+        profiler.count('files_catalogued',len(datadir))
+
+    def remove(self,dirn):
+        """
+        Remove the entries for a data dir
+
+        Returns True if the data dir was in the
+        catalogue, False if not.
+        """
+        with self._conn:
+            return self._remove(_to_db(os.path.abspath(dirn)))
+
+    def runs(self):
+        """
+        Return the catalogued data dirs
+
+        Returns a list of tuples (path,nfiles,size,
+        catalogued), where 'catalogued' is the time the
+        entries were last refreshed (in seconds since the
+        epoch), sorted by path.
+        """
+        return self._conn.execute("SELECT path,nfiles,size,catalogued "
+                                  "FROM runs ORDER BY path").fetchall()
+
+    def summary(self,by=('run',),extensions=None,compression=None,
+                owners=None,groups=None,runs=None):
+        """
+        Return the number and total size of matching files
+
+        Only regular files (i.e. not directories or
+        symlinks) are included.
+
+        Arguments:
+          by: list of fields to group the totals by (see
+            SUMMARY_FIELDS)
+          extensions: (optional) list of file extensions
+            to include
+          compression: (optional) list of compression
+            types to include ('none' matches uncompressed
+            files)
+          owners: (optional) list of users to include
+          groups: (optional) list of groups to include
+          runs: (optional) list of glob patterns which
+            data dir paths or names must match
+
+        For example, to find the data dirs with
+        uncompressed csfasta files:
+
+        >>> cat.summary(by=('run',),extensions=('csfasta',),
+        ...             compression=('none',))
+
+        Returns a list of tuples with the values of the
+        'by' fields followed by the number of files and
+        the total size, sorted by the 'by' fields.
+        """
+        for field in by:
+            if field not in SUMMARY_FIELDS:
+                raise Exception("Unrecognised field: '%s'" % field)
+        columns = [SUMMARY_FIELDS[field] for field in by]
+        where = ["files.type = 'file'"]
+        params = []
+        for column,values in (('files.ext',extensions),
+                              ('files.compression',
+                               ([('' if c == 'none' else c)
+                                 for c in compression]
+                                if compression else None)),
+                              ('files.owner',owners),
+                              ('files.grp',groups)):
+            if values:
+                where.append("%s IN (%s)" % (column,
+                                             ','.join(['?']*len(values))))
+                params.extend(_to_db(values))
+        if runs:
+            where.append("(%s)" % ' OR '.join(
+                ["runs.path GLOB ? OR runs.name GLOB ?"]*len(runs)))
+            for pattern in _to_db(runs):
+                params.extend([pattern,pattern])
+        sql = "SELECT %s FROM files JOIN runs ON files.run_id = runs.id " \
+              "WHERE %s" % (', '.join(columns +
+                                      ['COUNT(*)','SUM(files.size)']),
+                            ' AND '.join(where))
+        if columns:
+            sql += " GROUP BY %s ORDER BY %s" % (', '.join(columns),
+                                                 ', '.join(columns))
+        with profiler.timer('catalogue_query'):
+            results = self._conn.execute(sql,params).fetchall()
+        return [r[:-1] + ((r[-1] if r[-1] else 0),) for r in results]
+
+    def libraries(self,runs=None,groups=None):
+        """
+        Return the SOLiD libraries in the catalogue
+
+        Arguments:
+          runs: (optional) list of glob patterns which
+            data dir paths or names must match
+          groups: (optional) list of library groups to
+            include
+
+        Returns a list of tuples (path,sample,library,
+        group,timestamps,nfile_sets), sorted by data dir
+        path and library name.
+        """
+        where = []
+        params = []
+        if runs:
+            where.append("(%s)" % ' OR '.join(
+                ["runs.path GLOB ? OR runs.name GLOB ?"]*len(runs)))
+            for pattern in _to_db(runs):
+                params.extend([pattern,pattern])
+        if groups:
+            where.append("libraries.grp IN (%s)" %
+                         ','.join(['?']*len(groups)))
+            params.extend(_to_db(groups))
+        sql = "SELECT runs.path,libraries.sample,libraries.library," \
+              "libraries.grp,libraries.timestamps,libraries.nfile_sets " \
+              "FROM libraries JOIN runs ON libraries.run_id = runs.id"
+        if where:
+            sql += " WHERE %s" % ' AND '.join(where)
+        sql += " ORDER BY runs.path,libraries.name"
+        return self._conn.execute(sql,params).fetchall()
+
+    def execute(self,sql,params=()):
+        """
+        Run an SQL query on the catalogue
+
+        Returns a tuple (columns,rows) where 'columns' is
+        the list of column names.
+        """
+        cursor = self._conn.execute(sql,_to_db(params))
+        columns = [d[0] for d in (cursor.description or [])]
+        return (columns,cursor.fetchall())
+
+    def _remove(self,dirn):
+        # Remove entries for a data dir (should be called
+        # inside a transaction)
+        run = self._conn.execute("SELECT id FROM runs WHERE path = ?",
+                                 (dirn,)).fetchone()
+        if run is None:
+            return False
+        for table in ('files','libraries'):
+            self._conn.execute("DELETE FROM %s WHERE run_id = ?" % table,
+                               run)
+        self._conn.execute("DELETE FROM runs WHERE id = ?",run)
+        return True
+
+#######################################################################
+# Functions
+#######################################################################
+
+def _to_db(value):
+    # Convert byte strings (e.g. paths) to text for storing
+    # in the database (see '_from_db')
+    return to_unicode(value,'latin-1')
+
+def _from_db(data):
+    # Convert text from the database (as UTF-8) back to the
+    # original byte string; text which didn't come from
+    # '_to_db' (e.g. from an SQL query) is returned as UTF-8
+    text = data.decode('utf-8')
+    try:
+        return text.encode('latin-1')
+    except UnicodeEncodeError:
+        return data
@@ -11,46 +11,152 @@ Archiving and curation helper utility for NGS data
 
 import os
 import sys
+import time
+import shlex
 import logging
 import cmd as cmd_
 import bcftbx.utils as utils
 from bcftbx.cmdparse import CommandParser
 from .core import DataDir,ArchiveSymlink
-from .core import get_file_extensions,get_size
-from .solid import SolidDataDir
+from .core import get_file_extensions,get_size,convert_size
+from .core import print_list,print_yes_no
+from .core import checksum_candidates
+from .core import NGS_FILE_TYPES
+from .profiling import profiler
+from .progress import get_progress_reporter
+from .progress import format_time
+from . import hashing
+from . import scanner
+from .hashing import available_algorithms
+from .compression import CODECS
+from .compression import DEFAULT_CODEC
+from .compression import ESTIMATE_SAMPLES
+from .compression import ESTIMATE_SAMPLE_SIZE
+from .compression import get_codec
+from .compression import estimate_compression
+from .compression import CompressionPlan
+from .shards import SHARD_DEPTH
+from .output import NdjsonWriter
 
 from . import get_version
 __version__ = get_version()
 
+# NB modules which are slow to import (e.g. the SOLiD and FASTQ
+# modules, and the server) are only imported by the functions which
+# need them, to keep start up fast for the simple commands
+
+# Commands which can be answered by a running server
+SERVED_COMMANDS = ('info',
+                   'list_files',
+                   'symlinks',
+                   'duplicates',
+                   'report_solid',
+                   'match_solid',)
+
+# Commands which can be profiled
+PROFILED_COMMANDS = ('info',
+                     'stage',
+                     'init_cache',
+                     'list_files',
+                     'primary_data',
+                     'report_solid',
+                     'match_solid',
+                     'fastq_info',
+                     'symlinks',
+                     'repair_links',
+                     'md5sums',
+                     'duplicates',
+                     'dedupe',
+                     'temp_files',
+                     'related',
+                     'set_permissions',
+                     'compress',
+                     'scan_shard',
+                     'merge_shards',
+                     'catalogue',
+                     'query',
+                     'export',
+                     'batch',)
+
+# Commands which can be run from a batch
+BATCH_COMMANDS = SERVED_COMMANDS + ('primary_data',
+                                    'related',
+                                    'temp_files',
+                                    'md5sums',
+                                    'fastq_info',)
+
 #######################################################################
 # Classes
 #######################################################################
 
 class Shell(cmd_.Cmd):
-    def __init__(self,dirn):
+    def __init__(self,dirn,watch=False,poll_interval=None):
         cmd_.Cmd.__init__(self)
+        self._watch = watch
+        self._poll_interval = poll_interval
+        self._watcher = None
+        self._load(dirn)
+    def _load(self,dirn):
+        # Load the data dir and reset the derived views
         print "Loading data for %s" % dirn
         self._datadir = DataDir(dirn)
         print "Loaded data for %d files" % len(self._datadir)
         self.prompt = "[%s>: " % self._datadir.name
+        self._reset_views()
+        if self._watch:
+            # Keep the data dir up to date with changes
+            from .watch import get_watcher
+            from .watch import POLL_INTERVAL
+            if self._watcher is not None:
+                self._watcher.close()
+            self._watcher = get_watcher(self._datadir,
+                                        interval=(self._poll_interval
+                                                  if self._poll_interval
+                                                  else POLL_INTERVAL))
+    def precmd(self,line):
+        # Apply any changes to the data dir before running
+        # the command
+        if self._watcher is not None and self._watcher.poll():
+            self._reset_views()
+            print "Updated data for %d files" % len(self._datadir)
+        return line
+    def postloop(self):
+        if self._watcher is not None:
+            self._watcher.close()
+    def _reset_views(self):
+        # Discard views derived from the data dir
+        self._solid_datadir = None
+        self._symlinks = None
+    @property
+    def solid_datadir(self):
+        # SOLiD view of the data dir (built on first use)
+        if self._solid_datadir is None:
+            self._solid_datadir = get_solid_datadir(self._datadir)
+        return self._solid_datadir
+    @property
+    def symlinks(self):
+        # Analysis of symlinks in the data dir (built on first use)
+        if self._symlinks is None:
+            self._symlinks = analyse_symlinks(self._datadir)
+        return self._symlinks
     def do_info(self,rest):
         self._datadir.info()
     def help_info(self):
         print "info: prints summary information about DIR"
     def do_primary_data(self,rest):
-        find_primary_data(self._datadir.path)
+        find_primary_data(self._datadir)
     def help_primary_data(self):
         print "primary_data: list of primary data files"
     def do_symlinks(self,rest):
-        find_symlinks(self._datadir.path)
+        find_symlinks(self._datadir,symlinks=self.symlinks)
     def help_symlinks(self):
         print "symlinks: list of symbolic links"
     def do_related(self,rest):
-        find_related(self._datadir.path)
+        find_related(self._datadir,symlinks=self.symlinks)
     def help_related(self):
         print "related: list linked external directories"
     def do_report_solid(self,rest):
-        SolidDataDir(self._datadir.path).report()
+        self.solid_datadir.report()
     def help_report_solid(self):
         print "report_solid: prints summary of SOLiD data in DIR"
     def do_match_solid(self,rest):
@@ -58,18 +164,27 @@ class Shell(cmd_.Cmd):
         if len(dirs) < 1:
             print "Need to supply at least one analysis dir"
             return
-        SolidDataDir(self._datadir.path).match_primary_data(*dirs)
+        self.solid_datadir.match_primary_data(*dirs)
     def help_match_solid(self):
         print "match_solid DIR1 [DIR2...]: check symlinks to primary "
         "data from analysis dirs"
+    def do_refresh(self,rest):
+        print "Rescanning %s" % self._datadir.path
+        if self._datadir.rescan():
+            self._reset_views()
+            print "Loaded data for %d files" % len(self._datadir)
+        else:
+            print "No changes"
+    def help_refresh(self):
+        print "refresh: rescan DIR to pick up changes"
     def do_quit(self,rest):
         return True
     def do_stage(self,rest):
         staging_dir = os.path.abspath(rest)
-        stage_data(self._datadir.path,staging_dir)
+        stage_data(self._datadir,staging_dir)
         dirn = os.path.join(staging_dir,self._datadir.name)
         print "Switching to %s" % dirn
-        self._datadir = DataDir(dirn)
+        self._load(dirn)
     def help_stage(self):
         print "stage NEWDIR: make a staging copy of DIR under NEWDIR"
     def help_quit(self):
@@ -79,41 +194,200 @@ class Shell(cmd_.Cmd):
 # Functions
 #######################################################################
 
-def stage_data(datadir,staging_dir):
+def get_datadir(datadir):
+    """
+    Return a DataDir instance
+
+    'datadir' can be either a path or an existing
+    DataDir instance (which is returned as is).
+    """
+    if isinstance(datadir,DataDir):
+        return datadir
+    return DataDir(datadir)
+
+def get_solid_datadir(datadir):
+    """
+    Return a SolidDataDir instance
+
+    'datadir' can be either a path or an existing
+    DataDir instance (in which case the SolidDataDir
+    is populated from its files, which are shared with
+    the DataDir so that MD5 sums generated from either
+    are kept by both).
+    """
+    from .solid import SolidDataDir
+    if isinstance(datadir,SolidDataDir):
+        return datadir
+    if isinstance(datadir,DataDir):
+        return SolidDataDir(datadir.path,files=datadir.files(),
+                            read_cache=False)
+    return SolidDataDir(datadir)
+
+def stage_data(datadir,staging_dir,engine='rsync',
+               nthreads=None,algorithm='md5',progress=False,
+               dry_run=False,delete=False):
     """
     Make a staging copy of data dir
+
+    'engine' is either 'rsync' (copy using 'rsync'), or
+    'internal' (copy files in parallel using 'nthreads'
+    threads, generating checksums with 'algorithm' as
+    they're copied; see the 'staging' module, which also
+    sets the default number of threads).
+
+    With the 'internal' engine an existing staged copy
+    is updated by copying only new and changed entries;
+    if 'delete' is True then entries which are no longer
+    in the data dir are also removed from the staged
+    copy, and if 'progress' is True then progress is
+    reported on stderr.
+
+    Returns zero on success, non-zero if there were
+    errors.
     """
-    DataDir(datadir).copy_to(staging_dir)
+    datadir = get_datadir(datadir)
+    if engine == 'rsync':
+        if delete:
+            raise NotImplementedError("'delete' not implemented for "
+                                      "the 'rsync' engine")
+        return datadir.copy_to(staging_dir,dry_run=dry_run)
+    elif engine == 'internal':
+        from .staging import stage_dir
+        from .staging import STAGING_THREADS
+        return stage_dir(datadir,staging_dir,
+                         nthreads=(nthreads if nthreads
+                                   else STAGING_THREADS),
+                         algorithm=algorithm,progress=progress,
+                         dry_run=dry_run,delete=delete)
+    raise ValueError("Unknown staging engine '%s'" % engine)
 
-def compress_files(datadir,extensions,dry_run=False):
+def compress_files(datadir,extensions,dry_run=False,progress=False,
+                   codec=DEFAULT_CODEC):
     """
-    Compress (bzip2) files with specified extensions
+    Compress files with specified extensions
+
+    'codec' is the name of the compression codec to use
+    (see 'compression.CODECS'; defaults to bzip2).
+
+    If 'progress' is True then report progress on stderr.
     """
     n_files = 0
     n_compressed = 0
     n_error = 0
     n_no_action = 0
-    d = DataDir(datadir)
-    for f in d.files(extensions=extensions):
+    d = get_datadir(datadir)
+    files = d.files(extensions=extensions)
+    pending = [f for f in files if not f.compression]
+    progress = get_progress_reporter("Compressing",
+                                     sum([f.size for f in pending]),
+                                     total_items=len(pending),
+                                     enabled=(progress and not dry_run))
+    for f in files:
         n_files += 1
-        status = f.compress(dry_run=dry_run)
+        size = f.size
+        compressed = f.compression
+        status = f.compress(dry_run=dry_run,codec=codec)
         if status == 0:
             n_compressed += 1
         elif status > 0:
             n_error += 1
+        if not compressed:
+            progress.update(size,1)
+    progress.finish()
     print "%d files found, %d compressed, %d failed" % (n_files,
                                                         n_compressed,
                                                         n_error)
 
-def find_related(datadir):
+def plan_compression(datadir,extensions,codec=DEFAULT_CODEC,
+                     nsamples=ESTIMATE_SAMPLES,
+                     sample_size=ESTIMATE_SAMPLE_SIZE):
+    """
+    Report projected savings and time for compressing files
+
+    Estimates the compression ratio and throughput for
+    each file with the specified extensions from
+    'nsamples' blocks of 'sample_size' bytes, and
+    reports the projected compressed size, saving and
+    time (for compression and verification) for each
+    file type, each top-level subdirectory and in total.
+
+    Returns the CompressionPlan.
+    """
+    d = get_datadir(datadir)
+    codec = get_codec(codec)
+    plan = CompressionPlan()
+    n_skipped = 0
+    for f in d.files(extensions=extensions):
+        if f.is_link or f.is_dir:
+            continue
+        if f.compression or \
+           os.path.exists("%s.%s" % (f.path,codec.ext)):
+            n_skipped += 1
+            continue
+        ext = (f.ext if f.ext in NGS_FILE_TYPES else 'other')
+        relpath = f.relpath(d.path)
+        subdir = (relpath.split(os.sep)[0] if os.sep in relpath else '.')
+        try:
+            estimate = estimate_compression(f.path,codec,
+                                            nsamples=nsamples,
+                                            sample_size=sample_size)
+        except Exception,ex:
+            logging.error("%s: unable to estimate compression: %s" %
+                          (f,ex))
+            continue
+        plan.add(f.size,estimate,groups=(('extension',ext),
+                                         ('subdir',subdir)))
+    # Report
+    print "Compression plan for %s using %s (%d samples of %s per file)" % \
+        (d.path,codec.name,nsamples,utils.format_file_size(sample_size))
+    header = "\tFiles\tSize\tCompressed\tSaving\tRatio\tTime"
+    for category,title in (('extension','File type'),
+                           ('subdir','Subdirectory')):
+        print "# %s%s" % (title,header)
+        for name,estimate in plan.groups(category):
+            print "%s\t%s" % (name,format_estimate(estimate))
+    print "Total\t%s" % format_estimate(plan.total)
+    if n_skipped:
+        print "%d files already compressed (skipped)" % n_skipped
+    return plan
+
+def format_estimate(estimate):
+    """
+    Format a CompressionEstimate for reporting
+    """
+    return "%d\t%s\t%s\t%s\t%s\t%s" % \
+        (estimate.nfiles,
+         utils.format_file_size(estimate.size),
+         utils.format_file_size(int(estimate.compressed_size)),
+         utils.format_file_size(int(estimate.saving)),
+         ("%.2f" % estimate.ratio if estimate.ratio else '-'),
+         format_time(estimate.time))
+
+def find_related(datadir,symlinks=None):
     """
     Examine symlinks and find those pointing outside this dir
 
+    'symlinks' is an optional list of symlinks (as returned
+    by 'analyse_symlinks') to use instead of examining
+    the data dir.
+
     TODO:
     - functionality not implemented, should be just 'symlinks'?
 
     """
-    external_dirs = DataDir(datadir).related_dirs()
+    if symlinks is None:
+        external_dirs = get_datadir(datadir).related_dirs()
+    else:
+        external_dirs = []
+        for ln,status,resolved_target,alt_target in symlinks:
+            if not status.startswith('E'):
+                continue
+            if os.path.isdir(resolved_target):
+                d = resolved_target
+            else:
+                d = os.path.dirname(resolved_target)
+            if d not in external_dirs:
+                external_dirs.append(d)
     if external_dirs:
         for d in external_dirs:
             print d
@@ -123,69 +397,162 @@ def find_related(datadir):
 def find_primary_data(datadir):
     """
     Look for primary data files (csfasta, qual and fastq)
+
+    'datadir' can be a path or a DataDir instance.
     """
     list_files(datadir,
                extensions=('csfasta','qual','fastq','xsq',),
                fields=('relpath','size'),)
 
-def find_symlinks(datadir):
+def analyse_symlinks(datadir):
     """
-    Examine symlinks and find those pointing outside this dir
+    Examine symlinks in the data dir
+
+    Returns a list of tuples of the form
+    (symlink,status,resolved_target,alternative_target)
+    where 'status' is the link classifier prefixed
+    with 'E' if the link points outside the data dir
+    (or with '-' otherwise).
     """
-    for ln in DataDir(datadir).symlinks():
+    datadir = get_datadir(datadir)
+    dirn = datadir.path
+    symlinks = []
+    for ln in datadir.symlinks():
         # Get link target and resolve to an absolute path
         resolved_target = ln.resolve_target()
         # Check link status
-        absolute = ln.is_absolute
-        broken = ln.is_broken
         alt_target = ln.alternative_target
-        external = ln.external_to(datadir)
+        external = ln.external_to(dirn)
         # Assemble status
         status = ln.classifier
         if external:
             status = 'E' + status
         else:
             status = '-' + status
-        print "[%s]\t%s" % (status,os.path.relpath(ln.path,datadir))
+        symlinks.append((ln,status,resolved_target,alt_target))
+    return symlinks
+
+def find_symlinks(datadir,symlinks=None,output=None):
+    """
+    Examine symlinks and find those pointing outside this dir
+
+    'symlinks' is an optional list of symlinks (as returned
+    by 'analyse_symlinks') to report instead of examining
+    the data dir.
+
+    If 'output' is an NdjsonWriter then write a 'symlink'
+    record for each link instead of printing the report.
+    """
+    datadir = get_datadir(datadir)
+    dirn = datadir.path
+    if symlinks is None:
+        symlinks = analyse_symlinks(datadir)
+    for ln,status,resolved_target,alt_target in symlinks:
+        if output is not None:
+            output.write('symlink',
+                         path=os.path.relpath(ln.path,dirn),
+                         status=status,
+                         target=ln.target,
+                         resolved_target=resolved_target,
+                         alternative_target=alt_target,
+                         external=status.startswith('E'),
+                         broken=ln.is_broken)
+            continue
+        print "[%s]\t%s" % (status,os.path.relpath(ln.path,dirn))
         print "\t->: %s" % ln.target
         print "\t->: %s" % resolved_target
         print "\t->: %s" % alt_target
 
-def find_md5sums(datadir,outfile=None):
+def find_md5sums(datadir,outfile=None,progress=False,algorithm='md5'):
     """
     Print MD5 sums for files in data directory
+
+    'algorithm' specifies the checksum algorithm
+    to use instead of MD5 (see
+    'hashing.available_algorithms').
+
+    If 'progress' is True then report progress on stderr.
     """
-    dd = DataDir(datadir)
-    dd.md5sums()
+    dd = get_datadir(datadir)
+    progress = checksums_progress_reporter([dd],algorithm,progress)
+    dd.checksums(algorithm,progress=progress)
+    progress.finish()
     if outfile is None:
         fp = sys.stdout
     else:
         fp = open(outfile,'w')
-    for f in dd.files():
+    # Sort by path so the output doesn't depend on the order
+    # the files were scanned in
+    for f in sorted(dd.files(),key=lambda f: f.relpath(dd.path)):
         if f.is_link or f.is_dir:
             # Skip links and directories
             continue
-        fp.write("%s  %s\n" % (f.md5,f.relpath(datadir)))
-    if outfile is None:
+        fp.write("%s  %s\n" % (f.stored_checksums(algorithm)[0],
+                               f.relpath(dd.path)))
+    if outfile is not None:
         fp.close()
 
-def find_duplicates(*dirs):
+def find_duplicates(*dirs,**kws):
     """
     Locate duplicated files across multiple dirs
 
+    'dirs' can be paths or DataDir instances.
+
+    The 'algorithm' keyword specifies the checksum
+    algorithm to use instead of MD5 (see
+    'hashing.available_algorithms'); weak algorithms
+    (i.e. 'crc32') can't be used, since files with the
+    same checksum are reported as duplicates.
+
+    Files are compared on the checksums of their
+    uncompressed contents, but checksums are only
+    generated for files which can't be ruled out by
+    their uncompressed size and a checksum of the start
+    of their contents (so compressed files are only
+    decompressed completely if they could duplicate
+    another file).
+
+    If the 'progress' keyword is True then report
+    progress of the checksum generation on stderr.
+
+    If the 'output' keyword is an NdjsonWriter then write
+    a 'duplicate' record for each duplicated checksum
+    (listing the paths with that checksum), followed by
+    a 'summary' record, instead of printing the report.
+
     """
-    # Look for duplicated MD5 checksums
+    algorithm = kws.get('algorithm','md5')
+    if algorithm not in available_algorithms(weak=False):
+        raise ValueError("Hash algorithm '%s' can't be used to "
+                         "identify duplicates" % algorithm)
+    output = kws.get('output',None)
+    dirs = [get_datadir(d) for d in dirs]
+    # Generate checksums, only for files which could be
+    # duplicates (see 'checksum_candidates')
+    files = []
+    for dd in dirs:
+        if output is None:
+            print "Acquiring %s checksums for %s" % (algorithm,dd.path)
+        files.extend(dd.files())
+    pending = checksum_candidates(files,algorithm)
+    progress = get_progress_reporter("Computing %s checksums" % algorithm,
+                                     sum([f.size for f in pending]),
+                                     total_items=len(pending),
+                                     enabled=kws.get('progress',False))
+    for f in pending:
+        f.get_checksums(algorithm,progress=progress)
+    progress.finish()
+    # Look for duplicated checksums
     checksums = {}
-    for d in dirs:
-        dd = DataDir(d)
-        # Generate Md5 checksums
-        print "Acquiring MD5 sums for %s" % dd.path
-        dd.md5sums()
+    for dd in dirs:
         for f in dd.files():
             if f.is_link or f.is_dir:
                 # Skip links and directories
                 continue
-            chksum = f.uncompressed_md5
+            chksum = f.stored_checksums(algorithm)[1]
+            if chksum is None:
+                # Unable to checksum contents
+                continue
             # Store checksum info
             if chksum not in checksums:
                 checksums[chksum] = []
@@ -194,30 +561,68 @@ def find_duplicates(*dirs):
     n_duplicates = 0
     for chksum in checksums:
         if len(checksums[chksum]) > 1:
+            n_duplicates += 1
+            if output is not None:
+                output.write('duplicate',
+                             checksum=chksum,
+                             algorithm=algorithm,
+                             paths=checksums[chksum])
+                continue
             print "%s (%d)" % (chksum,len(checksums[chksum]))
             for chk in checksums[chksum]:
                 print "%s" % chk
             print
-            n_duplicates += 1
     # Finished
-    if not n_duplicates:
+    if output is not None:
+        output.write('summary',duplicates=n_duplicates)
+    elif not n_duplicates:
         print "No duplicates found"
     else:
         print "%d duplicated checksums identified" % (n_duplicates)
 
-def find_tmp_files(datadir):
+def checksums_progress_reporter(datadirs,algorithm='md5',enabled=True):
+    """
+    Return a progress reporter for generating checksums
+
+    The totals are the number and size of the files
+    in 'datadirs' which don't already have checksums
+    for 'algorithm'.
+    """
+    pending = []
+    for d in datadirs:
+        pending.extend(d.checksums_pending(algorithm))
+    return get_progress_reporter("Computing %s checksums" % algorithm,
+                                 sum([f.size for f in pending]),
+                                 total_items=len(pending),
+                                 enabled=enabled)
+
+def find_tmp_files(datadir,output=None):
     """
     Report temporary files/directories
 
+    If 'output' is an NdjsonWriter then write a 'temp_file'
+    record for each file or directory (with the size in
+    bytes), followed by a 'summary' record, instead of
+    printing the report.
+
     """
+    datadir = get_datadir(datadir)
     nfiles = 0
     total_size = 0
-    for f in DataDir(datadir).list_temp():
+    for f in datadir.list_temp():
         size = get_size(f)
         total_size += size
         nfiles += 1
-        print "%s\t%s" % (os.path.relpath(f,datadir),
+        if output is not None:
+            output.write('temp_file',
+                         path=os.path.relpath(f,datadir.path),
+                         size=size)
+            continue
+        print "%s\t%s" % (os.path.relpath(f,datadir.path),
                           utils.format_file_size(size))
+    if output is not None:
+        output.write('summary',nfiles=nfiles,size=total_size)
+        return
     if not nfiles:
         print "No files or directories found"
         return
@@ -226,7 +631,7 @@ def find_tmp_files(datadir):
 def list_files(datadir,extensions=None,owners=None,groups=None,compression=None,
                subdir=None,sort_keys=None,min_size=None,
                fields=('owner','group','relpath','size'),
-               delimiter='\t'):
+               delimiter='\t',output=None):
     """
     Report files owned by specific users and/or groups
 
@@ -239,16 +644,26 @@ def list_files(datadir,extensions=None,owners=None,groups=None,compression=None,
     'relpath' - Relative path
     'size'    - File size (human readable)
 
+    'datadir' can be a path or a DataDir instance.
+
+    If 'output' is an NdjsonWriter then write a 'file'
+    record for each file (with all the fields, the size in
+    bytes and the classifier as a separate field),
+    followed by a 'summary' record, instead of printing
+    the report.
+
     """
     # Check the fields
     for field in fields:
         if field not in ('owner','group','path','relpath','size',):
             raise Exception("Unrecognised field: '%s'" % field)
     # Collect files and report
+    datadir = get_datadir(datadir)
+    dirn = datadir.path
     nfiles = 0
     total_size = 0
     if min_size: min_size = convert_size(min_size)
-    for f in DataDir(datadir).files(extensions=extensions,
+    for f in datadir.files(extensions=extensions,
                                     compression=compression,
                                     owners=owners,groups=groups,
                                     subdir=subdir,
@@ -256,6 +671,15 @@ def list_files(datadir,extensions=None,owners=None,groups=None,compression=None,
         if min_size and f.size < min_size: continue
         total_size += f.size
         nfiles += 1
+        if output is not None:
+            output.write('file',
+                         owner=f.user,
+                         group=f.group,
+                         path=f.path,
+                         relpath=f.relpath(dirn),
+                         size=f.size,
+                         classifier=f.classifier)
+            continue
         # Assemble line from fields
         line = []
         for field in fields:
@@ -266,26 +690,356 @@ def list_files(datadir,extensions=None,owners=None,groups=None,compression=None,
             elif field == 'path':
                 line.append("%s%s" % (f.path,f.classifier))
             elif field == 'relpath':
-                line.append("%s%s" % (f.relpath(datadir),f.classifier))
+                line.append("%s%s" % (f.relpath(dirn),f.classifier))
             elif field == 'size':
                 line.append(utils.format_file_size(f.size))
         print delimiter.join([str(x) for x in line])
+    if output is not None:
+        output.write('summary',nfiles=nfiles,size=total_size)
+        return
     if not nfiles:
         print "No files found"
         return
     print "%d found, total size: %s" % (nfiles,utils.format_file_size(total_size))
 
+def report_fastqs(datadir,nprocs=None):
+    """
+    Report statistics and validation status for FASTQ files
+
+    """
+    from .fastq import get_fastq_stats,check_pairs
+    datadir = get_datadir(datadir)
+    results = get_fastq_stats(datadir,nprocs=nprocs)
+    if not results:
+        print "No FASTQ files found"
+        return
+    n_bad = 0
+    print "# File\tStatus\t#reads\tLengths"
+    for f,stats in results:
+        status = stats.status
+        if not stats.ok:
+            status = "%s (%s)" % (status,stats.message)
+            n_bad += 1
+        print "%s\t%s\t%d\t%s" % (f.relpath(datadir.path),
+                                  status,
+                                  stats.nreads,
+                                  stats.lengths())
+    pairs = check_pairs(results)
+    if pairs:
+        print "# R1/R2 pairs"
+        for r1,r2,status in pairs:
+            print "%s\t%s" % (r1.relpath(datadir.path),status)
+    print "%d FASTQ files checked, %d with errors, %d pairs" % (len(results),
+                                                              n_bad,
+                                                              len(pairs))
+
 def report_solid(datadir):
     """
     Try to group primary data and sort into samples etc for SOLiD runs
     """
 
+def scan_shards(datadir,nshards,index=None,outfile=None,outdir=None,
+                depth=SHARD_DEPTH,algorithm=None,progress=False,
+                nprocs=None):
+    """
+    Scan shards of a data dir and write partial results
+
+    If 'index' is specified (counting from 1) then just
+    that shard is scanned and the partial results are
+    written to 'outfile' (or to a file with the default
+    name in 'outdir'); otherwise all the shards are
+    scanned using 'nprocs' local processes and the
+    partial results are written to 'outdir'.
+
+    If 'algorithm' is specified then checksums are also
+    generated for the files in each shard.
+    """
+    from . import shards
+    if index is None:
+        for partial_file in shards.scan_shards(datadir,nshards,
+                                               outdir=outdir,
+                                               depth=depth,
+                                               algorithm=algorithm,
+                                               nprocs=nprocs):
+            print "Wrote %s" % partial_file
+        return
+    if outfile is None:
+        outfile = shards.partial_file_name(os.path.abspath(datadir),
+                                           nshards,index-1)
+        if outdir is not None:
+            outfile = os.path.join(outdir,outfile)
+    shard = shards.scan_shard(datadir,nshards,index-1,outfile,depth=depth,
+                              algorithm=algorithm,progress=progress)
+    print "Shard %d/%d: %d files (%s), wrote %s" % \
+        (index,nshards,len(shard),utils.format_file_size(shard.size),
+         outfile)
+
+def merge_shards(datadir,partial_files,outfile=None,algorithm=None):
+    """
+    Merge partial results from shards into the cache
+
+    Writes the merged results to the cache of the data
+    dir and prints a summary. If 'outfile' is specified
+    then the checksums generated with 'algorithm' are
+    also written to it (in the same format as the
+    'md5sums' command; any checksums missing from the
+    partial results are generated).
+    """
+    from . import shards
+    datadir = shards.merge_shards(datadir,partial_files)
+    print_summary(datadir.summary())
+    if outfile is not None:
+        find_md5sums(datadir,outfile=outfile,algorithm=algorithm)
+
+def print_summary(summary):
+    """
+    Print the summary of a data dir
+
+    'summary' is a dictionary returned by
+    'DataDir.summary'.
+    """
+    print "Dir   : %s" % summary['path']
+    print "Size  : %s" % utils.format_file_size(summary['size'])
+    print "#files: %d" % summary['nfiles']
+    print "File types: %s" % print_list(summary['extensions'])
+    print "Compression types: %s" % print_list(summary['compression'])
+    print "Users : %s" % print_list(summary['users'])
+    print "Groups: %s" % print_list(summary['groups'])
+    for name in ('oldest','newest'):
+        if summary[name] is not None:
+            print "%s: %s %s" % (name.title(),
+                                 time.ctime(summary[name][0]),
+                                 summary[name][1])
+    print "File permissions:"
+    print "- unreadable by owner: %s" % \
+        print_yes_no(summary['usr_unreadable'])
+    print "- unreadable by group: %s" % \
+        print_yes_no(summary['grp_unreadable'])
+    print "- unwritable by group: %s" % \
+        print_yes_no(summary['grp_unwritable'])
+
+def catalogue_dirs(db_file,dirs,remove=False,refresh=False):
+    """
+    Add data dirs to a catalogue (or remove them)
+
+    Each data dir in 'dirs' is scanned and its entries
+    in the catalogue 'db_file' are replaced; SOLiD
+    libraries are also catalogued for data dirs with
+    csfasta files. If 'refresh' is True then all the
+    data dirs already in the catalogue are also
+    rescanned (and any which no longer exist are
+    removed). If 'remove' is True then the data dirs
+    are removed from the catalogue instead.
+
+    If no data dirs are specified then the catalogued
+    data dirs are listed.
+    """
+    from .catalogue import Catalogue
+    catalogue = Catalogue(db_file)
+    try:
+        dirs = [os.path.abspath(d) for d in dirs]
+        if remove:
+            for d in dirs:
+                if not catalogue.remove(d):
+                    logging.warning("%s: not in catalogue" % d)
+            return
+        if refresh:
+            for run in catalogue.runs():
+                path = run[0]
+                if path in dirs:
+                    continue
+                elif os.path.isdir(path):
+                    dirs.append(path)
+                else:
+                    print "Removing %s: no longer exists" % path
+                    catalogue.remove(path)
+        if not dirs:
+            print "# Dir\tFiles\tSize\tCatalogued"
+            for path,nfiles,size,catalogued in catalogue.runs():
+                print "%s\t%d\t%s\t%s" % (path,nfiles,
+                                           utils.format_file_size(size),
+                                           time.ctime(catalogued))
+            return
+        for d in dirs:
+            datadir = DataDir(d)
+            libraries = None
+            if 'csfasta' in datadir.extensions:
+                libraries = get_solid_datadir(datadir).libraries
+            catalogue.add(datadir,libraries=libraries)
+            print "Catalogued %s: %d files (%s)" % \
+                (d,len(datadir),utils.format_file_size(datadir.size))
+    finally:
+        catalogue.close()
+
+def query_catalogue(db_file,by=('run',),extensions=None,compression=None,
+                    owners=None,groups=None,runs=None,libraries=False,
+                    sql=None):
+    """
+    Report totals for files across the data dirs in a catalogue
+
+    Prints the number and total size of matching files
+    in the catalogue 'db_file', grouped by the fields
+    in 'by' (see 'catalogue.SUMMARY_FIELDS'). Files can
+    be filtered by extension, compression type (use
+    'none' for uncompressed files), owner and group;
+    'runs' is a list of glob patterns which the paths
+    or names of data dirs must match.
+
+    If 'libraries' is True then the SOLiD libraries
+    in the matching data dirs are listed instead; if
+    'sql' is specified then the results of that SQL
+    query are printed instead.
+    """
+    from .catalogue import Catalogue
+    catalogue = Catalogue(db_file)
+    try:
+        if sql:
+            columns,rows = catalogue.execute(sql)
+            print "# %s" % '\t'.join(columns)
+            for row in rows:
+                print '\t'.join([str(x) for x in row])
+            return
+        if libraries:
+            print "# Dir\tSample\tLibrary\tGroup\tTimestamps\tFile sets"
+            for row in catalogue.libraries(runs=runs,groups=groups):
+                print "%s\t%s\t%s\t%s\t%s\t%d" % row
+            return
+        results = catalogue.summary(by=by,
+                                    extensions=extensions,
+                                    compression=compression,
+                                    owners=owners,
+                                    groups=groups,
+                                    runs=runs)
+        print "# %s" % '\t'.join([f.title() for f in by] +
+                                  ['Files','Size'])
+        nfiles = 0
+        total_size = 0
+        for row in results:
+            values = [(x if x else '-') for x in row[:-2]]
+            print '\t'.join(values + ["%d" % row[-2],
+                                      utils.format_file_size(row[-1])])
+            nfiles += row[-2]
+            total_size += row[-1]
+        print "Total: %d files (%s)" % (nfiles,
+                                        utils.format_file_size(total_size))
+    finally:
+        catalogue.close()
+
+def export_data(datadir,outfile,format=None,row_group_size=None):
+    """
+    Export the file list for a data dir in a columnar format
+
+    'format' is 'parquet' or 'npz' (see the 'export'
+    module; by default it's taken from the extension of
+    'outfile').
+    """
+    from .export import export_datadir
+    from .export import ROW_GROUP_SIZE
+    d = get_datadir(datadir)
+    nrows = export_datadir(d,outfile,format=format,
+                           row_group_size=(row_group_size
+                                           if row_group_size
+                                           else ROW_GROUP_SIZE))
+    print "Exported %d entries to %s" % (nrows,outfile)
+
+def dedupe_dirs(dirs,manifest_file=None,verify='bytes',symlinks=True,
+                algorithm='md5',dry_run=False,progress=False):
+    """
+    Replace duplicated files across data dirs with links
+
+    The first copy of each duplicated file (in the order
+    the dirs are supplied, and then by path) is kept and
+    the others are replaced with hard links (or symlinks
+    across file systems; see the 'dedupe' module). The
+    replacements are recorded in 'manifest_file' so that
+    they can be reversed with 'undo_dedupe_dirs'.
+
+    If 'progress' is True then report progress of the
+    checksum generation on stderr.
+    """
+    from .dedupe import duplicate_groups
+    from .dedupe import dedupe_files
+    dirs = [get_datadir(d) for d in dirs]
+    progress = checksums_progress_reporter(dirs,algorithm,progress)
+    groups = duplicate_groups(dirs,algorithm=algorithm,progress=progress)
+    progress.finish()
+    if dry_run or manifest_file is None:
+        manifest = None
+    else:
+        manifest = open(manifest_file,'w')
+    try:
+        result = dedupe_files(groups,manifest,verify=verify,
+                              symlinks=symlinks,algorithm=algorithm,
+                              dry_run=dry_run)
+    finally:
+        if manifest is not None:
+            manifest.close()
+    if not dry_run:
+        # Update the data dirs (and their caches)
+        for dd in dirs:
+            dd.update_paths(result.replaced)
+    print "%d duplicated files: %d hard links, %d symlinks, %d skipped" % \
+        (sum([len(g)-1 for g in groups]),
+         len(result.hardlinks),
+         len(result.symlinks),
+         len(result.skipped))
+    print "%s %s" % (("Would reclaim" if dry_run else "Reclaimed"),
+                     utils.format_file_size(result.nbytes))
+    if manifest is not None:
+        print "Manifest written to %s" % manifest_file
+
+def undo_dedupe_dirs(manifest_file,dry_run=False):
+    """
+    Reverse the replacements recorded by 'dedupe_dirs'
+    """
+    from .dedupe import undo_dedupe
+    restored,skipped = undo_dedupe(manifest_file,dry_run=dry_run)
+    print "%d files %srestored, %d skipped" % (len(restored),
+                                                ("would be "
+                                                 if dry_run else ""),
+                                                len(skipped))
+
+def repair_links(datadir,search_dirs=None,rebase=None,relative=False,
+                 dry_run=False):
+    """
+    Repair broken symbolic links in a data dir
+
+    Broken links are pointed at the compressed (or
+    uncompressed) version of their target, or at their
+    target with an absolute prefix replaced (if 'rebase'
+    is a tuple (old_base,new_base)), or at a file with
+    the same name in the data dir or one of 'search_dirs'
+    (if any are given). If 'relative' is True then
+    absolute links to targets inside the data dir are
+    also made relative (see the 'links' module).
+    """
+    from .links import PathIndex
+    from .links import plan_repairs
+    from .links import apply_repairs
+    dd = get_datadir(datadir)
+    if search_dirs is None:
+        search_dirs = []
+    index = PathIndex([dd] + [get_datadir(d) for d in search_dirs])
+    repairs,unresolved = plan_repairs(dd,index,search=bool(search_dirs),
+                                      rebase=rebase,relative=relative)
+    updated = apply_repairs(repairs,dry_run=dry_run)
+    if not dry_run:
+        # Update the data dir (and its cache)
+        dd.update_paths(updated)
+    for path in unresolved:
+        print "[unresolved] %s: %s" % (path,os.readlink(path))
+    print "%d links %supdated, %d broken links unresolved" % \
+        (len(updated),("would be " if dry_run else ""),len(unresolved))
+
 #######################################################################
 # Main program
 #######################################################################
 
-def main(args=None):
+def make_parser():
+    """
+    Create the command line parser for the utility
 
+    """
     # Set up the command line parser
     p = CommandParser(description="Utility for archiving and curating "
                       "NGS sequence data.",
@@ -302,7 +1056,45 @@ def main(args=None):
     p.add_command('stage',help="Make a staging copy of data",
                   usage='%prog stage DIR STAGING_DIR',
                   description="Copy DIR to STAGING_DIR and set up for "
-                  "archiving and curation.")
+                  "archiving and curation. With the 'internal' engine, "
+                  "re-running on an existing staged copy only copies "
+                  "new and changed files.")
+    p.parser_for('stage').add_option('--engine',action='store',
+                                     dest='engine',default='rsync',
+                                     choices=('rsync','internal'),
+                                     help="Method to copy the data: "
+                                     "'rsync' (the default) or 'internal' "
+                                     "(copy files in parallel and generate "
+                                     "checksums for the staged copy while "
+                                     "copying)")
+    p.parser_for('stage').add_option('--threads',action='store',
+                                     dest='nthreads',type='int',
+                                     default=None,
+                                     help="Number of threads to copy files "
+                                     "with for the 'internal' engine "
+                                     "(default: 4)")
+    p.parser_for('stage').add_option('--hash',action='store',
+                                     dest='algorithm',default='md5',
+                                     choices=available_algorithms(),
+                                     help="Checksum algorithm to use for "
+                                     "the 'internal' engine: one of %s "
+                                     "(default: md5)" %
+                                     ', '.join(available_algorithms()))
+    p.parser_for('stage').add_option('--block-size',action='store',
+                                     dest='block_size',default=None,
+                                     help="Size of blocks to read when "
+                                     "copying with the 'internal' engine "
+                                     "(e.g. '4M'; default: %s)" %
+                                     hashing.BLOCK_SIZE)
+    p.parser_for('stage').add_option('--dry-run',action='store_true',
+                                     dest='dry_run',default=False,
+                                     help="Report what would be copied "
+                                     "without copying anything")
+    p.parser_for('stage').add_option('--delete',action='store_true',
+                                     dest='delete',default=False,
+                                     help="Remove files from an existing "
+                                     "staged copy which are no longer in "
+                                     "DIR ('internal' engine only)")
     #
     # Initialise a cache subdirectory
     p.add_command('init_cache',help="Initialise a cache subdirectory",
@@ -363,6 +1155,20 @@ def main(args=None):
                   description="Determine which SOLiD datasets found in DIR "
                   "are also linked from ANALYSIS_DIR.")
     #
+    # FASTQ statistics
+    p.add_command('fastq_info',help="Validate and summarise FASTQ files",
+                  usage='%prog fastq_info DIR',
+                  description="Count reads, check for truncated or "
+                  "corrupted files and check R1/R2 pairing for the FASTQ "
+                  "files found in DIR. Results are cached if DIR has a "
+                  "cache subdirectory.")
+    p.parser_for('fastq_info').add_option('-n','--nprocs',action='store',
+                                          dest='nprocs',type='int',
+                                          default=None,
+                                          help="Number of processes to "
+                                          "use for scanning files "
+                                          "(default: number of CPUs)")
+    #
     # List symlinks
     p.add_command('symlinks',help="List symlinks",
                   usage='%prog symlinks DIR',
@@ -384,12 +1190,90 @@ def main(args=None):
                   description="Look for duplicated files across one or "
                   "more data directories")
     #
+    # Replace duplicates with links
+    p.add_command('dedupe',help="Replace duplicated files with links",
+                  usage='%prog dedupe OPTIONS DIR [DIR ...]',
+                  description="Replace duplicated files across one or "
+                  "more data directories with hard links (or relative "
+                  "symlinks across file systems) to a single copy. The "
+                  "first copy found (in the order the DIRs are given) is "
+                  "kept; each duplicate is verified against it before "
+                  "it's replaced, and the replacements are recorded in "
+                  "a manifest which can be used to reverse them.")
+    p.parser_for('dedupe').add_option('--manifest',action='store',
+                                      dest='manifest',default=None,
+                                      help="Record the replacements in "
+                                      "MANIFEST (default: "
+                                      "'dedupe-TIMESTAMP.tsv' in the "
+                                      "current directory)")
+    p.parser_for('dedupe').add_option('--verify',action='store',
+                                      dest='verify',default='bytes',
+                                      choices=(['bytes',] +
+                                               available_algorithms()),
+                                      help="How to verify duplicates "
+                                      "before replacing them: 'bytes' "
+                                      "(compare byte-for-byte) or the "
+                                      "name of a second checksum "
+                                      "algorithm (default: bytes)")
+    p.parser_for('dedupe').add_option('--hardlinks-only',
+                                      action='store_true',
+                                      dest='hardlinks_only',default=False,
+                                      help="Only replace duplicates with "
+                                      "hard links; leave duplicates on a "
+                                      "different file system alone")
+    p.parser_for('dedupe').add_option('--dry-run',action='store_true',
+                                      dest='dry_run',default=False,
+                                      help="Report what would be replaced "
+                                      "without changing anything")
+    p.parser_for('dedupe').add_option('--undo',action='store',
+                                      dest='undo',default=None,
+                                      help="Reverse the replacements "
+                                      "recorded in the manifest UNDO "
+                                      "(replacing each link with a copy "
+                                      "of the original file)")
+    #
     # Find duplicates
     p.add_command('temp_files',help="Find temporary files & directories",
                   usage='%prog temp_files DIR [DIR ...]',
                   description="Look for temporary files and directories "
                   "in DIR.")
     #
+    # Repair broken links
+    p.add_command('repair_links',help="Repair broken symbolic links",
+                  usage='%prog repair_links OPTIONS DIR',
+                  description="Repair all the broken symbolic links in "
+                  "DIR in one pass, by pointing them at the compressed "
+                  "(or uncompressed) version of their target, at their "
+                  "target with an absolute prefix replaced (--rebase) or "
+                  "at a file with the same name (--search). Targets are "
+                  "looked up in the scanned directories rather than "
+                  "checked individually.")
+    p.parser_for('repair_links').add_option('--search',action='append',
+                                            dest='search_dirs',default=[],
+                                            help="Also look for files "
+                                            "with the same name as the "
+                                            "targets of broken links in "
+                                            "DIR and SEARCH_DIRS (can be "
+                                            "specified multiple times)")
+    p.parser_for('repair_links').add_option('--rebase',action='store',
+                                            dest='rebase',nargs=2,
+                                            default=None,
+                                            metavar='OLD NEW',
+                                            help="Replace the leading "
+                                            "part OLD of absolute targets "
+                                            "of broken links with NEW")
+    p.parser_for('repair_links').add_option('--relative',
+                                            action='store_true',
+                                            dest='relative',default=False,
+                                            help="Also make absolute links "
+                                            "to targets inside DIR "
+                                            "relative")
+    p.parser_for('repair_links').add_option('--dry-run',
+                                            action='store_true',
+                                            dest='dry_run',default=False,
+                                            help="Report the repairs "
+                                            "without changing anything")
+    #
     # Look for related directories
     p.add_command('related',help="Locate related data directories",
                   usage='%prog related DIR SEARCH_DIR [SEARCH_DIR ...]',
@@ -415,66 +1299,657 @@ def main(args=None):
     p.add_command('compress',help="Compress data files",
                   usage='%prog compress DIR EXT [EXT..]',
                   description="Compress data files in DIR with matching "
-                  "file extensions using bzip2.")
+                  "file extensions (using bzip2 by default).")
     p.parser_for('compress').add_option('--dry-run',action='store_true',
                                         dest='dry_run',default=False,
-                                        help="Report actions but don't "
-                                        "perform them")
+                                        help="Don't compress anything; "
+                                        "instead estimate the compression "
+                                        "ratio and throughput from samples "
+                                        "of each file, and report the "
+                                        "projected savings and time by file "
+                                        "type, subdirectory and in total")
+    p.parser_for('compress').add_option('--samples',action='store',
+                                        dest='nsamples',type='int',
+                                        default=ESTIMATE_SAMPLES,
+                                        help="Number of blocks to sample "
+                                        "from each file for --dry-run "
+                                        "(default: %d)" % ESTIMATE_SAMPLES)
+    p.parser_for('compress').add_option('--sample-size',action='store',
+                                        dest='sample_size',
+                                        default=str(ESTIMATE_SAMPLE_SIZE),
+                                        help="Size of each sampled block "
+                                        "for --dry-run (e.g. '512K'; "
+                                        "default: %d)" %
+                                        ESTIMATE_SAMPLE_SIZE)
+    p.parser_for('compress').add_option('--codec',action='store',
+                                        dest='codec',default=DEFAULT_CODEC,
+                                        choices=CODECS,
+                                        help="Compression to use: one of "
+                                        "%s ('bgzf' produces blocked gzip "
+                                        "compatible with htslib tools; "
+                                        "default: %s)" % (', '.join(CODECS),
+                                                          DEFAULT_CODEC))
     #
     # Interactive shell
     p.add_command('shell',help="Run interactively",
-                  usage='%prog shell DIR',
+                  usage='%prog shell [--watch] DIR',
                   description="Run commands interactively on DIR")
+    p.parser_for('shell').add_option('--watch',action='store_true',
+                                     dest='watch',default=False,
+                                     help="Keep the data for DIR (and its "
+                                     "cache) up to date with changes to "
+                                     "the files, using inotify if "
+                                     "available (otherwise DIR is "
+                                     "rescanned before a command if it "
+                                     "hasn't been scanned within the "
+                                     "poll interval)")
+    p.parser_for('shell').add_option('--poll-interval',action='store',
+                                     dest='poll_interval',type='float',
+                                     default=None,
+                                     help="Minimum interval in seconds "
+                                     "between rescans with --watch when "
+                                     "inotify isn't available (default: "
+                                     "5.0)")
+    #
+    # Batch
+    p.add_command('batch',help="Run multiple commands on a data dir",
+                  usage='%prog batch OPTIONS DIR [SCRIPT]',
+                  description="Run a set of commands on DIR, scanning "
+                  "DIR only once, and write the output from each command "
+                  "to a separate file. Commands are read from SCRIPT (one "
+                  "per line, without DIR, e.g. 'list_files --minsize 1G') "
+                  "and/or specified using -c. Available commands: %s." %
+                  ', '.join(BATCH_COMMANDS))
+    p.parser_for('batch').add_option('-c','--command',action='append',
+                                     dest='commands',default=[],
+                                     help="Command to run (can be "
+                                     "specified multiple times)")
+    p.parser_for('batch').add_option('-o','--outdir',action='store',
+                                     dest='outdir',default=None,
+                                     help="Write output files to OUTDIR "
+                                     "(default: current directory)")
+    #
+    # Sharded scanning
+    p.add_command('scan_shard',help="Scan one shard of a data dir",
+                  usage='%prog scan_shard OPTIONS DIR',
+                  description="Split DIR into the number of shards "
+                  "specified by --shards, and scan (and optionally "
+                  "generate checksums for) the shard specified by "
+                  "--index, writing the partial results to a file; "
+                  "each shard can be scanned by a separate job. If "
+                  "--index isn't specified then scan all the shards "
+                  "using local processes. Use 'merge_shards' to "
+                  "combine the partial results.")
+    p.parser_for('scan_shard').add_option('--shards',action='store',
+                                          dest='nshards',type='int',
+                                          default=None,
+                                          help="Number of shards to "
+                                          "split DIR into")
+    p.parser_for('scan_shard').add_option('--index',action='store',
+                                          dest='index',type='int',
+                                          default=None,
+                                          help="Shard to scan (from 1 "
+                                          "to the number of shards)")
+    p.parser_for('scan_shard').add_option('--depth',action='store',
+                                          dest='depth',type='int',
+                                          default=SHARD_DEPTH,
+                                          help="Directory depth to make "
+                                          "the shards at (default: %d)" %
+                                          SHARD_DEPTH)
+    p.parser_for('scan_shard').add_option('--md5sums',
+                                          action='store_true',
+                                          dest='md5sums',default=False,
+                                          help="Also generate checksums "
+                                          "for the files in the shard")
+    p.parser_for('scan_shard').add_option('-o',action='store',
+                                          dest='outfile',default=None,
+                                          help="Write partial results "
+                                          "to OUTFILE (default: "
+                                          "DIR.shard-INDEX-of-SHARDS.tsv)")
+    p.parser_for('scan_shard').add_option('--outdir',action='store',
+                                          dest='outdir',default=None,
+                                          help="Directory to write "
+                                          "partial results to (default: "
+                                          "current directory)")
+    p.parser_for('scan_shard').add_option('-n','--nprocs',action='store',
+                                          dest='nprocs',type='int',
+                                          default=None,
+                                          help="Number of processes to "
+                                          "use when scanning all the "
+                                          "shards (default: number of "
+                                          "CPUs)")
+    p.add_command('merge_shards',help="Merge partial results from shards",
+                  usage='%prog merge_shards OPTIONS DIR PARTIAL '
+                  '[PARTIAL ...]',
+                  description="Merge the PARTIAL result files for all "
+                  "the shards of DIR (from 'scan_shard') into the cache "
+                  "for DIR, and print a summary of DIR.")
+    p.parser_for('merge_shards').add_option('-o',action='store',
+                                            dest='outfile',default=None,
+                                            help="Also write checksums "
+                                            "to OUTFILE (in the same "
+                                            "format as 'md5sums')")
+    for cmd in ('scan_shard','merge_shards',):
+        p.parser_for(cmd).add_option('--hash',action='store',
+                                     dest='algorithm',default='md5',
+                                     choices=available_algorithms(),
+                                     help="Checksum algorithm to use: "
+                                     "one of %s (default: md5)" %
+                                     ', '.join(available_algorithms()))
+    #
+    # Catalogue
+    p.add_command('catalogue',help="Add data dirs to a catalogue",
+                  usage='%prog catalogue OPTIONS [DIR ...]',
+                  description="Scan each DIR and add it to the catalogue "
+                  "database (replacing any existing entries for DIR), "
+                  "so that it can be searched by the 'query' command. "
+                  "If no DIRs are specified then list the catalogued "
+                  "directories.")
+    p.parser_for('catalogue').add_option('--refresh',action='store_true',
+                                         dest='refresh',default=False,
+                                         help="Also rescan all the "
+                                         "directories already in the "
+                                         "catalogue")
+    p.parser_for('catalogue').add_option('--remove',action='store_true',
+                                         dest='remove',default=False,
+                                         help="Remove each DIR from the "
+                                         "catalogue")
+    #
+    # Query catalogue
+    p.add_command('query',help="Query the catalogue",
+                  usage='%prog query OPTIONS',
+                  description="Report the number and total size of "
+                  "files matching the specified criteria across all "
+                  "the directories in the catalogue, grouped by the "
+                  "fields specified by --by.")
+    p.parser_for('query').add_option('--by',action='store',
+                                     dest='by',default='run',
+                                     help="Comma-separated list of fields "
+                                     "to group totals by: one or more of "
+                                     "run, name, ext, compression, owner "
+                                     "and group (default: run)")
+    p.parser_for('query').add_option('--extensions',action='store',
+                                     dest='extensions',default=None,
+                                     help="Only include files with "
+                                     "matching extensions")
+    p.parser_for('query').add_option('--compression',action='store',
+                                     dest='compression',default=None,
+                                     help="Only include files with "
+                                     "matching compression extensions "
+                                     "('none' for uncompressed files)")
+    p.parser_for('query').add_option('--owners',action='store',
+                                     dest='owners',default=None,
+                                     help="Only include files owned by "
+                                     "specified users")
+    p.parser_for('query').add_option('--groups',action='store',
+                                     dest='groups',default=None,
+                                     help="Only include files in "
+                                     "specified groups (or libraries in "
+                                     "specified library groups, with "
+                                     "--libraries)")
+    p.parser_for('query').add_option('--runs',action='store',
+                                     dest='runs',default=None,
+                                     help="Only include directories whose "
+                                     "paths or names match one of the "
+                                     "specified glob patterns")
+    p.parser_for('query').add_option('--libraries',action='store_true',
+                                     dest='libraries',default=False,
+                                     help="List SOLiD libraries instead "
+                                     "of files")
+    p.parser_for('query').add_option('--sql',action='store',
+                                     dest='sql',default=None,
+                                     help="Run the SQL query SQL on the "
+                                     "catalogue database and print the "
+                                     "results")
+    for cmd in ('catalogue','query',):
+        p.parser_for(cmd).add_option('--db',action='store',
+                                     dest='db_file',
+                                     default=os.environ.get(
+                                         'ARQVIST_CATALOGUE',None),
+                                     help="Catalogue database file "
+                                     "(default is taken from the "
+                                     "ARQVIST_CATALOGUE environment "
+                                     "variable, if set)")
+    #
+    # Export
+    p.add_command('export',help="Export the list of files",
+                  usage='%prog export OPTIONS DIR OUTFILE',
+                  description="Write the list of files under DIR to "
+                  "OUTFILE in a columnar format (one row per file, with "
+                  "the path, size, blocks, mtime, uid, gid, mode, "
+                  "extension, compression and MD5 sums) for analysis "
+                  "with other tools e.g. pandas.")
+    p.parser_for('export').add_option('--format',action='store',
+                                      dest='format',default=None,
+                                      choices=('parquet','npz',),
+                                      help="Output format: 'parquet' "
+                                      "(needs pyarrow) or 'npz' (needs "
+                                      "numpy) (default: from the "
+                                      "extension of OUTFILE, or "
+                                      "'parquet' if pyarrow is "
+                                      "installed, otherwise 'npz')")
+    p.parser_for('export').add_option('--row-group-size',action='store',
+                                      dest='row_group_size',type='int',
+                                      default=None,
+                                      help="Number of rows to write at "
+                                      "a time (default: 100000)")
+    #
+    # Server
+    p.add_command('serve',help="Serve cached data dir information",
+                  usage='%prog serve OPTIONS SOCKET [DIR ...]',
+                  description="Run a server which keeps data for "
+                  "directories in memory and answers queries from "
+                  "commands run with the --server option via the Unix "
+                  "domain socket SOCKET. Data for each DIR is loaded "
+                  "on start up.")
+    p.parser_for('serve').add_option('--refresh',action='store',
+                                     dest='refresh',type='float',
+                                     default=30.0,
+                                     help="Rescan directories if the "
+                                     "last scan is older than REFRESH "
+                                     "seconds (default: 30)")
+    # Checksum algorithm options ('crc32' is only offered for
+    # 'dedupe', which verifies the duplicates before replacing
+    # them)
+    for cmd in ('md5sums','duplicates','dedupe',):
+        algorithms = available_algorithms(weak=(cmd == 'dedupe'))
+        p.parser_for(cmd).add_option('--hash',action='store',
+                                     dest='algorithm',default='md5',
+                                     choices=algorithms,
+                                     help="Checksum algorithm to use: "
+                                     "one of %s (default: md5)" %
+                                     ', '.join(algorithms))
+        p.parser_for(cmd).add_option('--block-size',action='store',
+                                     dest='block_size',default=None,
+                                     help="Size of blocks to read when "
+                                     "generating checksums (e.g. '4M'; "
+                                     "default: %s)" % hashing.BLOCK_SIZE)
+        p.parser_for(cmd).add_option('--mmap',action='store_true',
+                                     dest='use_mmap',default=False,
+                                     help="Use mmap to read uncompressed "
+                                     "files when generating checksums")
+    # Structured output options
+    for cmd in SERVED_COMMANDS + ('temp_files',):
+        p.parser_for(cmd).add_option('--json',action='store_true',
+                                     dest='json',default=False,
+                                     help="Write the results as a stream "
+                                     "of JSON records, one per line "
+                                     "(NDJSON), instead of text")
+    # Progress reporting options
+    for cmd in ('stage','md5sums','duplicates','dedupe','compress',
+                'scan_shard',):
+        p.parser_for(cmd).add_option('--progress',action='store_true',
+                                     dest='progress',default=False,
+                                     help="Report progress (bytes "
+                                     "processed, throughput and estimated "
+                                     "time remaining) on stderr; progress "
+                                     "is updated in place on a terminal, "
+                                     "otherwise a line is written every "
+                                     "minute")
+    # Scanning options
+    for cmd in PROFILED_COMMANDS:
+        if cmd in ('query','merge_shards',):
+            # Don't scan directories
+            continue
+        p.parser_for(cmd).add_option('--scan-threads',action='store',
+                                     dest='scan_threads',type='int',
+                                     default=None,
+                                     help="Number of threads to use for "
+                                     "scanning directories, to keep many "
+                                     "metadata operations in flight on "
+                                     "high-latency (e.g. network) file "
+                                     "systems (default: scan "
+                                     "sequentially)")
+    # Profiling options
+    for cmd in PROFILED_COMMANDS:
+        p.parser_for(cmd).add_option('--profile',action='store_true',
+                                     dest='profile',default=False,
+                                     help="Report time spent in each "
+                                     "phase, throughput and cache "
+                                     "statistics on stderr on completion")
+        p.parser_for(cmd).add_option('--profile-json',action='store',
+                                     dest='profile_json',default=None,
+                                     help="Write profiling data as JSON "
+                                     "to PROFILE_JSON")
+        p.parser_for(cmd).add_option('--cprofile',action='store',
+                                     dest='cprofile',default=None,
+                                     help="Run under cProfile and dump "
+                                     "the statistics to CPROFILE (for "
+                                     "analysis with the 'pstats' module)")
+    # Options for commands which can use a server
+    for cmd in SERVED_COMMANDS:
+        p.parser_for(cmd).add_option('--server',action='store',
+                                     dest='server',
+                                     default=os.environ.get(
+                                         'ARQVIST_SERVER',None),
+                                     help="Send query to the server "
+                                     "listening on socket SERVER (default "
+                                     "is taken from the ARQVIST_SERVER "
+                                     "environment variable, if set)")
+    return p
+
+def run_query(cmd,options,args,get_datadir=get_datadir,
+              get_solid_datadir=get_solid_datadir,output=None):
+    """
+    Run one of the query commands
+
+    'get_datadir' and 'get_solid_datadir' are the
+    functions used to obtain DataDir and SolidDataDir
+    instances from a path.
+
+    'output' is an optional NdjsonWriter to write the
+    results to as records (see the 'output' module).
+
+    """
+    if cmd == 'info':
+        get_datadir(args[0]).info(output=output)
+    elif cmd == 'list_files':
+        list_files(get_datadir(args[0]),
+                   extensions=split_option(options.extensions),
+                   owners=split_option(options.owners),
+                   groups=split_option(options.groups),
+                   compression=split_option(options.compression),
+                   subdir=options.subdir,
+                   sort_keys=split_option(options.sortkeys),
+                   min_size=options.min_size,
+                   output=output)
+    elif cmd == 'report_solid':
+        get_solid_datadir(args[0]).report(output=output)
+    elif cmd == 'match_solid':
+        get_solid_datadir(args[0]).match_primary_data(*args[1:],
+                                                      output=output)
+    elif cmd == 'symlinks':
+        find_symlinks(get_datadir(args[0]),output=output)
+    elif cmd == 'duplicates':
+        find_duplicates(*[get_datadir(d) for d in args],
+                        progress=options.progress,
+                        algorithm=options.algorithm,
+                        output=output)
+    else:
+        raise Exception("%s: not a query command" % cmd)
+
+def handle_request(argv,store):
+    """
+    Handle a request sent to the server
+
+    'argv' is the command line sent by the client and
+    'store' is the server's DataDirStore.
+
+    Returns the exit status.
+
+    """
+    cmd,options,args = make_parser().parse_args(argv)
+    if cmd not in SERVED_COMMANDS:
+        print "%s: command not available from server" % cmd
+        return 1
+    # Only return records to the client for JSON output
+    output = get_output(options,fp=sys.stdout)
+    stdout = sys.stdout
+    if output is not None:
+        sys.stdout = sys.stderr
+    try:
+        run_query(cmd,options,args,
+                  get_datadir=store.get,
+                  get_solid_datadir=lambda d: store.get_view(
+                      d,'solid',get_solid_datadir),
+                  output=output)
+    finally:
+        sys.stdout = stdout
+    return 0
+
+def run_batch(datadir,commands,outdir=None):
+    """
+    Run multiple commands on a data dir
+
+    The data dir is scanned once and the resulting
+    DataDir instance is used for all the commands.
+
+    'commands' is a list of command lines (e.g.
+    'list_files --minsize 1G'), which shouldn't include
+    the data dir. The output of each command is written
+    to a file 'NN_COMMAND.txt' in 'outdir' (or the
+    current directory). Empty commands are skipped.
+
+    Returns the number of commands which failed.
+
+    """
+    datadir = get_datadir(datadir)
+    if outdir is None:
+        outdir = os.getcwd()
+    elif not os.path.exists(outdir):
+        os.makedirs(outdir)
+    solid_datadir = []
+    def resolve(d):
+        # Reuse the DataDir if the path matches
+        if os.path.abspath(d) == datadir.path:
+            return datadir
+        return get_datadir(d)
+    def resolve_solid(d):
+        # Reuse the SOLiD view once it's been built
+        if os.path.abspath(d) != datadir.path:
+            return get_solid_datadir(d)
+        if not solid_datadir:
+            solid_datadir.append(get_solid_datadir(datadir))
+        return solid_datadir[0]
+    p = make_parser()
+    n_failed = 0
+    for i,command in enumerate(commands):
+        argv = shlex.split(command)
+        if not argv:
+            # Skip empty commands
+            continue
+        cmd = argv[0]
+        outfile = os.path.join(outdir,"%02d_%s.txt" % (i+1,cmd))
+        if cmd not in BATCH_COMMANDS:
+            logging.error("%s: can't run from batch" % cmd)
+            n_failed += 1
+            continue
+        start_time = time.time()
+        stdout = sys.stdout
+        fp = None
+        try:
+            cmd,options,args = p.parse_args([cmd,datadir.path] + argv[1:])
+            fp = open(outfile,'w')
+            output = get_output(options,fp=fp)
+            # For JSON output only the records go to the output
+            # file (other messages go to stderr)
+            sys.stdout = (fp if output is None else sys.stderr)
+            if cmd in SERVED_COMMANDS:
+                run_query(cmd,options,args,
+                          get_datadir=resolve,
+                          get_solid_datadir=resolve_solid,
+                          output=output)
+            elif cmd == 'primary_data':
+                find_primary_data(datadir)
+            elif cmd == 'related':
+                find_related(datadir)
+            elif cmd == 'temp_files':
+                find_tmp_files(datadir,output=output)
+            elif cmd == 'md5sums':
+                find_md5sums(datadir,options.outfile,
+                             progress=options.progress,
+                             algorithm=options.algorithm)
+            elif cmd == 'fastq_info':
+                report_fastqs(datadir,nprocs=options.nprocs)
+            status = "ok"
+        except SystemExit:
+            status = "FAILED (bad command line)"
+            n_failed += 1
+        except Exception,ex:
+            logging.error("'%s' failed: %s" % (command,ex))
+            status = "FAILED"
+            n_failed += 1
+        finally:
+            sys.stdout = stdout
+            if fp is not None:
+                fp.close()
+        print "%s\t%s\t%s\t%.1fs" % (command,
+                                    os.path.basename(outfile),
+                                    status,
+                                    time.time()-start_time)
+    return n_failed
+
+def get_output(options,fp=None):
+    """
+    Return an NdjsonWriter if JSON output was requested
+
+    Returns an NdjsonWriter writing to 'fp' (see the
+    'output' module) if the '--json' option was
+    specified, otherwise returns None.
+    """
+    if getattr(options,'json',False):
+        return NdjsonWriter(fp)
+    return None
+
+def split_option(value,delimiter=','):
+    """
+    Split a comma-separated option value into a list
+
+    Returns None if the value is None.
+
+    """
+    if value is None:
+        return None
+    return value.split(delimiter)
+
+def main(args=None):
+
     # Process command line
-    cmd,options,args = p.parse_args()
+    if args is None:
+        args = sys.argv[1:]
+    argv = args
+    p = make_parser()
+    cmd,options,args = p.parse_args(argv)
+
+    # Structured output: the records are written to stdout,
+    # so anything else is sent to stderr
+    output = get_output(options,fp=sys.stdout)
 
     # Report name and version
-    print "%s version %s" % (os.path.basename(sys.argv[0]),__version__)
+    if output is None:
+        print "%s version %s" % (os.path.basename(sys.argv[0]),__version__)
+
+    # Send queries to a server
+    if cmd in SERVED_COMMANDS and options.server:
+        from .server import send_request
+        status,response = send_request(options.server,argv)
+        # NB the response is unicode, so encode it explicitly
+        # (otherwise writing fails when stdout is a pipe)
+        sys.stdout.write(response.encode('utf-8'))
+        if status:
+            sys.exit(status)
+        return
+
+    # Settings for reading files
+    if getattr(options,'block_size',None):
+        hashing.configure(block_size=convert_size(options.block_size))
+    if getattr(options,'use_mmap',False):
+        hashing.configure(use_mmap=True)
+    if getattr(options,'scan_threads',None) is not None:
+        scanner.configure(threads=options.scan_threads)
+
+    # Run the command, with profiling if requested
+    profile = getattr(options,'profile',False)
+    profile_json = getattr(options,'profile_json',None)
+    cprofile_file = getattr(options,'cprofile',None)
+    if profile or profile_json:
+        profiler.enable()
+    stdout = sys.stdout
+    if output is not None:
+        sys.stdout = sys.stderr
+    try:
+        if cprofile_file:
+            import cProfile
+            prof = cProfile.Profile()
+            try:
+                prof.runcall(run_command,cmd,options,args,output)
+            finally:
+                prof.dump_stats(cprofile_file)
+        else:
+            run_command(cmd,options,args,output=output)
+    finally:
+        sys.stdout = stdout
+        if profile:
+            profiler.report()
+        if profile_json:
+            profiler.write_json(profile_json)
+
+def run_command(cmd,options,args,output=None):
+    """
+    Run a command from the command line
+
+    'output' is an optional NdjsonWriter for commands
+    which can write their results as records.
 
+    """
     if cmd == 'info':
         if len(args) != 1:
             sys.stderr.write("Need to supply a data dir\n")
             sys.exit(1)
-        DataDir(args[0]).info()
+        run_query(cmd,options,args,output=output)
     elif cmd == 'stage':
         if len(args) != 2:
             sys.stderr.write("Need to supply a data dir and staging location\n")
             sys.exit(1)
-        stage_data(args[0],args[1])
+        if options.delete and options.engine != 'internal':
+            sys.stderr.write("--delete requires --engine internal\n")
+            sys.exit(1)
+        status = stage_data(args[0],args[1],
+                            engine=options.engine,
+                            nthreads=options.nthreads,
+                            algorithm=options.algorithm,
+                            progress=options.progress,
+                            dry_run=options.dry_run,
+                            delete=options.delete)
+        if status:
+            sys.exit(1)
     elif cmd == 'init_cache':
         DataDir(args[0]).init_cache()
     elif cmd == 'list_files':
-        list_files(args[0],
-                   extensions=(None if options.extensions is None \
-                               else options.extensions.split(',')),
-                   owners=(None if options.owners is None \
-                           else options.owners.split(',')),
-                   groups=(None if options.groups is None \
-                           else options.groups.split(',')),
-                   compression=(None if options.compression is None \
-                                else options.compression.split(',')),
-                   subdir=options.subdir,
-                   sort_keys=(None if options.sortkeys is None \
-                              else options.sortkeys.split(',')),
-                   min_size=options.min_size)
+        run_query(cmd,options,args,output=output)
     elif cmd == 'primary_data':
         find_primary_data(args[0])
     elif cmd == 'report_solid':
-        SolidDataDir(args[0]).report()
+        run_query(cmd,options,args,output=output)
     elif cmd == 'match_solid':
         if len(args) < 2:
             sys.stderr.write("Need to supply a SOLiD data dir and at "
                              "least one analysis directory\n")
             sys.exit(1)
-        SolidDataDir(args[0]).match_primary_data(*args[1:])
+        run_query(cmd,options,args,output=output)
+    elif cmd == 'fastq_info':
+        report_fastqs(args[0],nprocs=options.nprocs)
     elif cmd == 'symlinks':
-        find_symlinks(args[0])
+        run_query(cmd,options,args,output=output)
+    elif cmd == 'repair_links':
+        if len(args) != 1:
+            sys.stderr.write("Need to supply a data dir\n")
+            sys.exit(1)
+        repair_links(args[0],search_dirs=options.search_dirs,
+                     rebase=options.rebase,relative=options.relative,
+                     dry_run=options.dry_run)
     elif cmd == 'md5sums':
-        find_md5sums(args[0],options.outfile)
+        find_md5sums(args[0],options.outfile,progress=options.progress,
+                     algorithm=options.algorithm)
     elif cmd == 'duplicates':
-        find_duplicates(*args)
+        run_query(cmd,options,args,output=output)
+    elif cmd == 'dedupe':
+        if options.undo:
+            undo_dedupe_dirs(options.undo,dry_run=options.dry_run)
+        else:
+            if len(args) < 1:
+                sys.stderr.write("Need to supply at least one data dir\n")
+                sys.exit(1)
+            manifest = options.manifest
+            if manifest is None:
+                manifest = "dedupe-%s.tsv" % time.strftime("%Y%m%d%H%M%S")
+            dedupe_dirs(args,manifest_file=manifest,verify=options.verify,
+                        symlinks=(not options.hardlinks_only),
+                        algorithm=options.algorithm,
+                        dry_run=options.dry_run,
+                        progress=options.progress)
     elif cmd == 'temp_files':
-        find_tmp_files(args[0])
+        find_tmp_files(args[0],output=output)
     elif cmd == 'set_permissions':
         DataDir(args[0]).set_permissions(mode=options.mode,
                                          group=options.group)
@@ -483,9 +1958,104 @@ def main(args=None):
             sys.stderr.write("Need to supply a data dir and at least "
                              "one extension\n")
             sys.exit(1)
-        compress_files(args[0],args[1:],dry_run=options.dry_run)
+        if options.dry_run:
+            plan_compression(args[0],args[1:],codec=options.codec,
+                             nsamples=options.nsamples,
+                             sample_size=int(convert_size(
+                                 options.sample_size)))
+        else:
+            compress_files(args[0],args[1:],progress=options.progress,
+                           codec=options.codec)
     elif cmd == 'related':
         find_related(args[0])
     elif cmd == 'shell':
-        Shell(args[0]).cmdloop()
+        Shell(args[0],watch=options.watch,
+              poll_interval=options.poll_interval).cmdloop()
+    elif cmd == 'batch':
+        if len(args) < 1 or len(args) > 2:
+            sys.stderr.write("Need to supply a data dir and optionally "
+                             "a script\n")
+            sys.exit(1)
+        commands = []
+        if len(args) == 2:
+            with open(args[1],'r') as fp:
+                for line in fp:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        commands.append(line)
+        commands.extend([c for c in options.commands if c.strip()])
+        if not commands:
+            sys.stderr.write("No commands to run\n")
+            sys.exit(1)
+        if run_batch(args[0],commands,outdir=options.outdir):
+            sys.exit(1)
+    elif cmd == 'scan_shard':
+        if len(args) != 1:
+            sys.stderr.write("Need to supply a data dir\n")
+            sys.exit(1)
+        if not options.nshards or options.nshards < 1:
+            sys.stderr.write("Need to supply the number of shards\n")
+            sys.exit(1)
+        if options.index is not None and \
+           (options.index < 1 or options.index > options.nshards):
+            sys.stderr.write("Shard index must be between 1 and %d\n" %
+                             options.nshards)
+            sys.exit(1)
+        scan_shards(args[0],options.nshards,
+                    index=options.index,
+                    outfile=options.outfile,
+                    outdir=options.outdir,
+                    depth=options.depth,
+                    algorithm=(options.algorithm if options.md5sums
+                               else None),
+                    progress=options.progress,
+                    nprocs=options.nprocs)
+    elif cmd == 'merge_shards':
+        if len(args) < 2:
+            sys.stderr.write("Need to supply a data dir and partial "
+                             "result files\n")
+            sys.exit(1)
+        try:
+            merge_shards(args[0],args[1:],outfile=options.outfile,
+                         algorithm=options.algorithm)
+        except Exception,ex:
+            sys.stderr.write("Failed to merge shards: %s\n" % ex)
+            sys.exit(1)
+    elif cmd in ('catalogue','query',):
+        if not options.db_file:
+            sys.stderr.write("Need to supply a catalogue database (use "
+                             "--db or set ARQVIST_CATALOGUE)\n")
+            sys.exit(1)
+        if cmd == 'catalogue':
+            catalogue_dirs(options.db_file,args,
+                           remove=options.remove,
+                           refresh=options.refresh)
+        else:
+            query_catalogue(options.db_file,
+                            by=split_option(options.by),
+                            extensions=split_option(options.extensions),
+                            compression=split_option(options.compression),
+                            owners=split_option(options.owners),
+                            groups=split_option(options.groups),
+                            runs=split_option(options.runs),
+                            libraries=options.libraries,
+                            sql=options.sql)
+    elif cmd == 'export':
+        if len(args) != 2:
+            sys.stderr.write("Need to supply a data dir and an output "
+                             "file\n")
+            sys.exit(1)
+        try:
+            export_data(args[0],args[1],format=options.format,
+                        row_group_size=options.row_group_size)
+        except Exception,ex:
+            sys.stderr.write("Failed to export: %s\n" % ex)
+            sys.exit(1)
+    elif cmd == 'serve':
+        if len(args) < 1:
+            sys.stderr.write("Need to supply a socket path\n")
+            sys.exit(1)
+        from .server import serve
+        serve(args[0],handle_request,dirs=args[1:],
+              refresh_interval=options.refresh)
         
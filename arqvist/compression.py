@@ -0,0 +1,629 @@
+#!/bin/env python
+#
+#     compression.py: compression codecs
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Compression codecs
+
+Provides a common interface to the compression formats handled by
+arqvist:
+
+bz2  : bzip2 (the default, best ratio of the fast options)
+gzip : gzip (fastest to decompress)
+bgzf : blocked gzip as used for BAM and tabix-indexed files; the
+       output is multi-member gzip which can be read by standard
+       gzip tools as well as htslib-based tools
+xz   : xz/LZMA (best ratio but slowest to compress)
+
+Each codec can compress a file and open a compressed file to read
+the uncompressed contents. Compression uses the external 'bzip2',
+'gzip' and 'xz' programs (BGZF is written in-process); reading uses
+the Python modules where possible, falling back to 'xz -dc' if no
+'lzma' module is available.
+
+Codecs can also compress and decompress data in memory, which is
+used to estimate the compression ratio and throughput for files
+from samples of their contents (see 'estimate_compression' and the
+CompressionPlan class).
+
+Example usage:
+
+>>> codec = get_codec('gzip')
+>>> codec.compress('reads.fastq','reads.fastq.gz')
+0
+>>> fp = codec.open('reads.fastq.gz')
+
+"""
+
+import os
+import bz2
+import gzip
+import time
+import zlib
+import struct
+import logging
+import hashlib
+import subprocess
+from cStringIO import StringIO
+
+# Compression types (i.e. file extensions)
+COMPRESSION_TYPES = ('gz','bz2','xz')
+
+# Codec names
+CODECS = ('bz2','gzip','bgzf','xz')
+
+# Default codec
+DEFAULT_CODEC = 'bz2'
+
+# Maximum size of uncompressed data in each BGZF block
+# (same as used by htslib)
+BGZF_BLOCK_SIZE = 0xff00
+
+# Default number and size of samples for estimates
+ESTIMATE_SAMPLES = 4
+ESTIMATE_SAMPLE_SIZE = 1024*1024
+
+# BGZF end-of-file marker block
+BGZF_EOF = "\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43" \
+           "\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+#######################################################################
+# Classes
+#######################################################################
+
+class Codec(object):
+    """
+    Base class for compression codecs
+
+    Subclasses should set the 'name' and 'ext' attributes
+    and implement the 'open' method, and either implement
+    'command' (to compress using an external program) or
+    override 'compress' and 'describe'.
+
+    """
+    name = None
+    ext = None
+
+    def open(self,path):
+        """
+        Open a compressed file for reading uncompressed contents
+        """
+        raise NotImplementedError("Subclass must implement 'open'")
+
+    def command(self,path):
+        """
+        Return Command which writes compressed 'path' to stdout
+        """
+        raise NotImplementedError("Subclass must implement 'command'")
+
+    def describe(self,path):
+        """
+        Return a description of the compression of 'path'
+        """
+        return str(self.command(path))
+
+    def compress(self,path,outfile):
+        """
+        Compress 'path' to 'outfile'
+
+        Returns the exit status (zero indicates success).
+        """
+        return self.command(path).run_subprocess(log=outfile)
+
+    def compress_data(self,data):
+        """
+        Return compressed version of 'data'
+
+        The compression settings should match those used
+        by 'compress'.
+        """
+        raise NotImplementedError("Subclass must implement "
+                                  "'compress_data'")
+
+    def decompress_data(self,data):
+        """
+        Return uncompressed version of 'data'
+        """
+        raise NotImplementedError("Subclass must implement "
+                                  "'decompress_data'")
+
+    def uncompressed_size(self,path):
+        """
+        Return the size of the uncompressed contents of 'path'
+
+        Returns None unless the size can be obtained
+        without decompressing the file (see the subclasses).
+        """
+        return None
+
+    def decompressor(self):
+        """
+        Return an incremental decompressor (or None)
+
+        The returned object has a 'decompress' method which
+        takes successive chunks of compressed data and
+        returns the uncompressed data which is available so
+        far (see StreamDecompressor). Returns None if the
+        codec can't decompress incrementally in-process.
+        """
+        return None
+
+class Bzip2Codec(Codec):
+    """
+    bzip2 compression
+    """
+    name = 'bz2'
+    ext = 'bz2'
+
+    def open(self,path):
+        return bz2.BZ2File(path,'r')
+
+    def command(self,path):
+        from auto_process_ngs import applications
+        return applications.Command('bzip2','-c',path)
+
+    def compress_data(self,data):
+        return bz2.compress(data,9)
+
+    def decompress_data(self,data):
+        return bz2.decompress(data)
+
+    def decompressor(self):
+        return StreamDecompressor(bz2.BZ2Decompressor)
+
+class GzipCodec(Codec):
+    """
+    gzip compression
+    """
+    name = 'gzip'
+    ext = 'gz'
+
+    def open(self,path):
+        return gzip.GzipFile(path,'rb')
+
+    def command(self,path):
+        from auto_process_ngs import applications
+        return applications.Command('gzip','-c',path)
+
+    def compress_data(self,data):
+        c = zlib.compressobj(6,zlib.DEFLATED,31)
+        return c.compress(data) + c.flush()
+
+    def decompress_data(self,data):
+        return gzip.GzipFile(fileobj=StringIO(data),mode='rb').read()
+
+    def decompressor(self):
+        return StreamDecompressor(lambda: zlib.decompressobj(31))
+
+    def uncompressed_size(self,path):
+        return gzip_uncompressed_size(path)
+
+class BgzfCodec(GzipCodec):
+    """
+    Blocked gzip (BGZF) compression
+
+    Output is written in-process and can be read as
+    ordinary (multi-member) gzip.
+    """
+    name = 'bgzf'
+    ext = 'gz'
+
+    def describe(self,path):
+        return "bgzf %s" % path
+
+    def compress(self,path,outfile,level=6):
+        write_bgzf(path,outfile,level=level)
+        return 0
+
+    def compress_data(self,data):
+        return ''.join([bgzf_block(data[i:i+BGZF_BLOCK_SIZE])
+                        for i in xrange(0,len(data),BGZF_BLOCK_SIZE)]) + \
+            BGZF_EOF
+
+class XzCodec(Codec):
+    """
+    xz (LZMA) compression
+    """
+    name = 'xz'
+    ext = 'xz'
+
+    def open(self,path):
+        lzma = get_lzma_module()
+        if lzma is not None:
+            return lzma.LZMAFile(path,'rb')
+        return XzPipe(path)
+
+    def command(self,path):
+        from auto_process_ngs import applications
+        return applications.Command('xz','-c',path)
+
+    def compress_data(self,data):
+        lzma = get_lzma_module()
+        if lzma is not None:
+            return lzma.compress(data)
+        return run_filter(['xz','-c'],data)
+
+    def decompress_data(self,data):
+        lzma = get_lzma_module()
+        if lzma is not None:
+            return lzma.decompress(data)
+        return run_filter(['xz','-dc'],data)
+
+    def decompressor(self):
+        lzma = get_lzma_module()
+        if lzma is not None:
+            return StreamDecompressor(lzma.LZMADecompressor)
+        return None
+
+class StreamDecompressor:
+    """
+    Incremental decompressor for multi-stream data
+
+    Wraps decompressor objects (e.g. from 'zlib' or 'bz2')
+    created by 'factory', starting a new one each time the
+    end of a stream is reached, so that files with several
+    concatenated streams (e.g. BGZF, or the output of
+    'pbzip2') are decompressed completely.
+    """
+    def __init__(self,factory):
+        self._factory = factory
+        self._decompressor = factory()
+
+    def decompress(self,data):
+        """
+        Return uncompressed data available from 'data'
+        """
+        output = []
+        while data:
+            try:
+                output.append(self._decompressor.decompress(data))
+            except EOFError:
+                # Previous stream already finished
+                self._decompressor = self._factory()
+                continue
+            data = self._decompressor.unused_data
+            if data:
+                # Start of the next stream
+                self._decompressor = self._factory()
+        return ''.join(output)
+
+class XzPipe:
+    """
+    Read uncompressed contents of an xz file via 'xz -dc'
+
+    Used when no 'lzma' module is available. Provides
+    'read', 'readline', iteration and 'close'; 'close'
+    raises IOError if 'xz' reported an error.
+    """
+    def __init__(self,path):
+        self._path = path
+        self._proc = subprocess.Popen(['xz','-dc',path],
+                                      stdout=subprocess.PIPE)
+
+    def read(self,size=-1):
+        return self._proc.stdout.read(size)
+
+    def readline(self):
+        return self._proc.stdout.readline()
+
+    def __iter__(self):
+        return iter(self._proc.stdout)
+
+    def close(self):
+        if self._proc.stdout.closed:
+            return
+        self._proc.stdout.close()
+        if self._proc.wait() != 0:
+            raise IOError("%s: 'xz -dc' failed (exit status %s)" %
+                          (self._path,self._proc.returncode))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+        return False
+
+class CompressionPlan:
+    """
+    Class for accumulating compression estimates for files
+
+    Estimates are projected from samples for each file
+    (see 'estimate_compression') and accumulated in
+    named groups (for example by file extension), along
+    with an overall total.
+
+    """
+    def __init__(self):
+        """
+        Create a new CompressionPlan instance
+        """
+        self._groups = {}
+        self.total = CompressionEstimate()
+
+    def add(self,size,estimate,groups=()):
+        """
+        Add the estimate for a file
+
+        Arguments:
+          size: size of the file in bytes
+          estimate: tuple (sampled_bytes,compressed_bytes,
+            compress_time,verify_time) for the samples
+            from the file
+          groups: list of (category,name) tuples for the
+            groups that the file belongs to, for example
+            [('extension','fastq'),('subdir','run1')]
+        """
+        for group in groups:
+            if group not in self._groups:
+                self._groups[group] = CompressionEstimate()
+            self._groups[group].add(size,estimate)
+        self.total.add(size,estimate)
+
+    def groups(self,category):
+        """
+        Return list of (name,CompressionEstimate) for a category
+        """
+        return sorted([(g[1],self._groups[g]) for g in self._groups
+                       if g[0] == category])
+
+class CompressionEstimate:
+    """
+    Class holding projected compression size and time
+
+    """
+    def __init__(self):
+        self.nfiles = 0
+        self.size = 0
+        self.compressed_size = 0.0
+        self.compress_time = 0.0
+        self.verify_time = 0.0
+
+    def add(self,size,estimate):
+        """
+        Add the projection for a file from its sample estimate
+        """
+        sampled,compressed,compress_time,verify_time = estimate
+        self.nfiles += 1
+        self.size += size
+        if not sampled:
+            return
+        scale = float(size)/float(sampled)
+        self.compressed_size += compressed*scale
+        self.compress_time += compress_time*scale
+        self.verify_time += verify_time*scale
+
+    @property
+    def saving(self):
+        """
+        Projected space saving in bytes
+        """
+        return self.size - self.compressed_size
+
+    @property
+    def ratio(self):
+        """
+        Projected compression ratio (original/compressed size)
+        """
+        if not self.compressed_size:
+            return None
+        return self.size/self.compressed_size
+
+    @property
+    def time(self):
+        """
+        Projected time in seconds (compression and verification)
+        """
+        return self.compress_time + self.verify_time
+
+#######################################################################
+# Functions
+#######################################################################
+
+def get_codec(name=DEFAULT_CODEC):
+    """
+    Return the codec for a codec name or compression type
+
+    'name' can be one of the codec names in CODECS or
+    one of the compression types in COMPRESSION_TYPES
+    (e.g. 'gz', as returned by 'get_file_extensions').
+
+    Raises ValueError for an unrecognised name.
+    """
+    if name in ('gzip','gz'):
+        return GzipCodec()
+    elif name == 'bgzf':
+        return BgzfCodec()
+    elif name == 'bz2':
+        return Bzip2Codec()
+    elif name == 'xz':
+        return XzCodec()
+    raise ValueError("Unsupported compression '%s' (available: %s)" %
+                     (name,', '.join(CODECS)))
+
+def open_file(path):
+    """
+    Open a file for reading, decompressing if necessary
+
+    The compression type is determined from the file
+    extension.
+    """
+    ext = os.path.splitext(path)[1].lstrip('.')
+    if ext in COMPRESSION_TYPES:
+        return get_codec(ext).open(path)
+    return open(path,'rb')
+
+def sample_blocks(path,nsamples=ESTIMATE_SAMPLES,
+                  sample_size=ESTIMATE_SAMPLE_SIZE):
+    """
+    Generate blocks of data sampled from a file
+
+    Returns 'nsamples' blocks of 'sample_size' bytes
+    spread evenly through the file (including the start
+    and end), or the whole file as a single block if
+    it's smaller than the total sample size.
+    """
+    size = os.path.getsize(path)
+    with open(path,'rb') as fp:
+        if size <= nsamples*sample_size:
+            yield fp.read()
+            return
+        if nsamples == 1:
+            offsets = [0]
+        else:
+            offsets = [i*(size-sample_size)//(nsamples-1)
+                       for i in range(nsamples)]
+        for offset in offsets:
+            fp.seek(offset)
+            yield fp.read(sample_size)
+
+def estimate_compression(path,codec=DEFAULT_CODEC,
+                         nsamples=ESTIMATE_SAMPLES,
+                         sample_size=ESTIMATE_SAMPLE_SIZE):
+    """
+    Estimate compression for a file from samples
+
+    Samples blocks from the file (see 'sample_blocks')
+    and compresses each one with the codec, timing both
+    the compression and the verification (decompressing
+    and generating an MD5 sum for the original data)
+    which is performed by 'ArchiveFile.compress'.
+
+    Returns a tuple (sampled_bytes,compressed_bytes,
+    compress_time,verify_time).
+    """
+    if isinstance(codec,basestring):
+        codec = get_codec(codec)
+    sampled = 0
+    compressed = 0
+    compress_time = 0.0
+    verify_time = 0.0
+    for data in sample_blocks(path,nsamples=nsamples,
+                              sample_size=sample_size):
+        start = time.time()
+        cdata = codec.compress_data(data)
+        compress_time += time.time() - start
+        start = time.time()
+        hashlib.md5(codec.decompress_data(cdata))
+        verify_time += time.time() - start
+        sampled += len(data)
+        compressed += len(cdata)
+    return (sampled,compressed,compress_time,verify_time)
+
+def run_filter(cmd,data):
+    """
+    Pipe data through an external program and return the output
+
+    Raises IOError if the program fails.
+    """
+    p = subprocess.Popen(cmd,stdin=subprocess.PIPE,stdout=subprocess.PIPE)
+    output = p.communicate(data)[0]
+    if p.returncode != 0:
+        raise IOError("'%s' failed (exit status %s)" % (' '.join(cmd),
+                                                        p.returncode))
+    return output
+
+def get_lzma_module():
+    """
+    Return the 'lzma' module (or None if not available)
+
+    Tries the standard library 'lzma' and then
+    'backports.lzma'.
+    """
+    try:
+        import lzma
+        return lzma
+    except ImportError:
+        pass
+    try:
+        from backports import lzma
+        return lzma
+    except ImportError:
+        return None
+
+def bgzf_block(data,level=6):
+    """
+    Return a compressed BGZF block for 'data'
+
+    'data' should be no larger than BGZF_BLOCK_SIZE.
+    """
+    c = zlib.compressobj(level,zlib.DEFLATED,-15)
+    cdata = c.compress(data) + c.flush()
+    # Header (including 'BC' extra subfield with the
+    # total block size minus one), compressed data and
+    # trailer (CRC32 and uncompressed size)
+    header = struct.pack('<BBBBIBBHBBHH',
+                         31,139,8,4,0,0,255,6,66,67,2,len(cdata)+25)
+    trailer = struct.pack('<II',
+                          zlib.crc32(data) & 0xffffffff,
+                          len(data))
+    return header + cdata + trailer
+
+def write_bgzf(path,outfile,level=6):
+    """
+    Write BGZF-compressed version of 'path' to 'outfile'
+    """
+    with open(path,'rb') as fin:
+        with open(outfile,'wb') as fout:
+            while True:
+                data = fin.read(BGZF_BLOCK_SIZE)
+                if not data:
+                    break
+                fout.write(bgzf_block(data,level=level))
+            fout.write(BGZF_EOF)
+
+def gzip_uncompressed_size(path):
+    """
+    Return the uncompressed size of a BGZF file from its trailers
+
+    The sizes in the trailers of all the blocks are added
+    up (the blocks are located from the sizes in their
+    headers, so only the headers and trailers are read).
+
+    Other gzip files aren't handled: their trailer only
+    gives the size of the last gzip member (modulo
+    2**32), which isn't the size of the whole contents
+    for multi-member files (e.g. from concatenating
+    gzip files).
+
+    Returns None if the file isn't BGZF (or is
+    truncated).
+    """
+    with open(path,'rb') as fp:
+        bsize = _bgzf_block_size(fp)
+        if bsize is None:
+            # Not BGZF
+            return None
+        # Add up the sizes of the BGZF blocks
+        file_size = os.fstat(fp.fileno()).st_size
+        size = 0
+        offset = 0
+        while offset < file_size:
+            if bsize is None or offset + bsize > file_size:
+                # Not all BGZF blocks, or truncated
+                return None
+            fp.seek(offset + bsize - 4)
+            size += struct.unpack('<I',fp.read(4))[0]
+            offset += bsize
+            fp.seek(offset)
+            bsize = _bgzf_block_size(fp)
+        return size
+
+def _bgzf_block_size(fp):
+    # Return the total size of the BGZF block starting at the
+    # current position (from the 'BC' extra subfield), or None
+    # if there isn't one
+    header = fp.read(12)
+    if len(header) != 12 or header[:4] != '\x1f\x8b\x08\x04':
+        return None
+    xlen = struct.unpack('<H',header[10:12])[0]
+    extra = fp.read(xlen)
+    pos = 0
+    while pos + 4 <= len(extra):
+        si,slen = extra[pos:pos+2],struct.unpack('<H',extra[pos+2:pos+4])[0]
+        if si == 'BC' and slen == 2:
+            return struct.unpack('<H',extra[pos+4:pos+6])[0] + 1
+        pos += 4 + slen
+    return None
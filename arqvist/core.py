@@ -10,14 +10,20 @@ Core classes and functions
 """
 
 import os
-import bz2
+import pwd
+import grp
+import stat
 import fnmatch
 import itertools
 import logging
 import tempfile
 import bcftbx.utils as utils
-import bcftbx.Md5sum as Md5sum
-from auto_process_ngs import applications
+from .profiling import profiler
+from . import hashing
+from . import scanner
+from .compression import get_codec
+from .compression import COMPRESSION_TYPES
+from .compression import DEFAULT_CODEC
 
 # File extensions for Next Generation Sequencing (NGS)
 NGS_FILE_TYPES = ('fa',
@@ -38,6 +44,15 @@ NGS_FILE_TYPES = ('fa',
                   'xsq',
                   'xls')
 
+# Number of bytes at the start of the uncompressed contents
+# used for prefix checksums (see 'checksum_candidates')
+PREFIX_SIZE = 64*1024
+
+# Cached user and group names for uids and gids (see
+# 'lookup_user' and 'lookup_group')
+_USER_NAMES = {}
+_GROUP_NAMES = {}
+
 #######################################################################
 # Classes
 #######################################################################
@@ -51,13 +66,29 @@ class ArchiveFile(utils.PathInfo):
         """
         Create and populate a new ArchiveFile instance
         """
+        with profiler.timer('stat'):
+            self._set_path(filen)
+        self.md5 = None
+        self.uncompressed_md5 = None
+        # Checksums for algorithms other than MD5
+        self.checksums = {}
+
+    def _set_path(self,filen):
+        """
+        Set the path and update the file information
+        """
         utils.PathInfo.__init__(self,filen)
         # !!!FIXME should be able to st_size from PathInfo!!!
-        self.size = os.lstat(filen).st_size
+        st = os.lstat(filen)
+        self.size = st.st_size
+        self.blocks = st.st_blocks
+        self.mode = st.st_mode
+        self._uid = st.st_uid
+        self._gid = st.st_gid
+        self.dev = st.st_dev
+        self.ino = st.st_ino
         self.timestamp = self.mtime
         self.ext,self.compression = get_file_extensions(filen)
-        self.md5 = None
-        self.uncompressed_md5 = None
 
     @property
     def basename(self):
@@ -66,6 +97,65 @@ class ArchiveFile(utils.PathInfo):
         """
         return os.path.basename(self.path)
 
+    @property
+    def uid(self):
+        """
+        Return the uid of the owner
+        """
+        return self._uid
+
+    @property
+    def gid(self):
+        """
+        Return the gid of the group
+        """
+        return self._gid
+
+    @property
+    def user(self):
+        """
+        Return the name of the owner (see 'lookup_user')
+        """
+        return lookup_user(self._uid)
+
+    @property
+    def group(self):
+        """
+        Return the name of the group (see 'lookup_group')
+        """
+        return lookup_group(self._gid)
+
+    @property
+    def is_link(self):
+        """
+        Check if the path is a symbolic link
+
+        Uses the mode from when the file was scanned,
+        rather than accessing the file system again.
+        """
+        return stat.S_ISLNK(self.mode)
+
+    @property
+    def is_dir(self):
+        """
+        Check if the path is a directory (and not a link)
+
+        Uses the mode from when the file was scanned,
+        rather than accessing the file system again.
+        """
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def inode_key(self):
+        """
+        Key identifying the file contents independently of the path
+
+        Returns tuple (dev,ino,size,timestamp), which is
+        unchanged if the file is renamed or moved within
+        the same filesystem.
+        """
+        return (self.dev,self.ino,self.size,self.timestamp)
+
     @property
     def classifier(self):
         """
@@ -100,36 +190,178 @@ class ArchiveFile(utils.PathInfo):
 
         Returns tuple (md5,md5_uncompressed_contents).
 
+        """
+        return self.get_checksums('md5')
+
+    def get_checksums(self,algorithm=hashing.DEFAULT_ALGORITHM,
+                      progress=None):
+        """
+        Generate checksums using the specified algorithm
+
+        Generate and return checksums for the file and
+        for the uncompressed contents, using one of the
+        algorithms from 'hashing.available_algorithms'.
+
+        MD5 sums are stored in the 'md5' and
+        'uncompressed_md5' properties; checksums for
+        other algorithms are stored in the 'checksums'
+        dictionary.
+
+        'progress' is an optional ProgressReporter which
+        is updated as each block of the file is read
+        (the total for the file is the file size).
+
+        Returns tuple (checksum,checksum_uncompressed_contents).
+
         """
         if self.is_link or self.is_dir:
             # Ignore links or directories
             return (None,None)
-        if self.md5 is None:
-            # Generate MD5 sum
-            self.md5 = Md5sum.md5sum(self.path)
-        if self.uncompressed_md5 is None:
-            # Generate MD5 for uncompressed contents
+        checksum,uncompressed_checksum = self.stored_checksums(algorithm)
+        nbytes = [0]
+        if progress is not None:
+            def callback(n):
+                nbytes[0] += n
+                progress.update(n)
+        else:
+            callback = None
+        if checksum is None:
+            # Generate checksum
+            with profiler.timer(algorithm,nbytes=self.size,item=self.path):
+                checksum = hashing.hash_file(self.path,algorithm,
+                                             callback=callback)
+        if uncompressed_checksum is None:
+            # Generate checksum for uncompressed contents
             if not self.compression:
-                self.uncompressed_md5 = self.md5
-            elif self.compression == 'bz2':
-                fp = bz2.BZ2File(self.path,'r')
-                self.uncompressed_md5 = Md5sum.md5sum(fp)
-            elif self.compression == 'gz':
-                fp = gzip.GzipFile(self.path,'rb')
-                self.uncompressed_md5 = Md5sum.md5sum(fp)
+                uncompressed_checksum = checksum
+            elif self.compression in COMPRESSION_TYPES:
+                with profiler.timer('%s_uncompressed' % algorithm,
+                                    nbytes=self.size,item=self.path):
+                    fp = get_codec(self.compression).open(self.path)
+                    try:
+                        uncompressed_checksum = hashing.hash_file(fp,
+                                                                  algorithm)
+                    finally:
+                        fp.close()
             else:
-                logging.warning("%s: md5sums not implemented for "
+                logging.warning("%s: checksums not implemented for "
                                 "compression type '%s'"
                                 % (self,self.compression))
-        return (self.md5,self.uncompressed_md5)
+        self.set_checksums(algorithm,checksum,uncompressed_checksum)
+        if progress is not None:
+            # Account for any bytes which weren't read
+            progress.update(max(self.size - nbytes[0],0),1)
+        return (checksum,uncompressed_checksum)
+
+    def stored_checksums(self,algorithm=hashing.DEFAULT_ALGORITHM):
+        """
+        Return the stored checksums for an algorithm
+
+        Returns tuple (checksum,checksum_uncompressed_contents),
+        with None for checksums which haven't been generated.
+        """
+        if algorithm == 'md5':
+            return (self.md5,self.uncompressed_md5)
+        return self.checksums.get(algorithm,(None,None))
+
+    def set_checksums(self,algorithm,checksum,uncompressed_checksum):
+        """
+        Store the checksums for an algorithm
+        """
+        if algorithm == 'md5':
+            self.md5 = checksum
+            self.uncompressed_md5 = uncompressed_checksum
+        else:
+            self.checksums[algorithm] = (checksum,uncompressed_checksum)
 
-    def compress(self,dry_run=False):
+    def get_uncompressed_size(self):
+        """
+        Return the size of the uncompressed contents
+
+        For compressed files the size is only returned if
+        it can be obtained without decompressing the file
+        (e.g. from the block trailers of a BGZF file; see
+        'gzip_uncompressed_size').
+
+        Returns None if the size isn't available.
+        """
+        if not self.compression:
+            return self.size
+        if self.compression not in COMPRESSION_TYPES:
+            return None
+        with profiler.timer('uncompressed_size',item=self.path):
+            return get_codec(self.compression).uncompressed_size(self.path)
+
+    def get_prefix_checksum(self,algorithm=hashing.DEFAULT_ALGORITHM,
+                            nbytes=PREFIX_SIZE):
+        """
+        Return checksum for the start of the uncompressed contents
+
+        Generates the checksum for (up to) the first 'nbytes'
+        bytes of the uncompressed contents, which for a
+        compressed file only needs the start of the file to
+        be decompressed. If the whole of the contents was
+        read then the checksums for the file are also stored
+        (as for 'get_checksums').
+
+        Returns None if the contents can't be decompressed
+        incrementally.
+        """
+        if self.is_link or self.is_dir:
+            return None
+        with profiler.timer('prefix_%s' % algorithm,item=self.path):
+            if not self.compression:
+                with open(self.path,'rb') as fp:
+                    data = fp.read(nbytes)
+                    complete = (len(data) < nbytes or not fp.read(1))
+                contents = data
+            elif self.compression in COMPRESSION_TYPES:
+                decompressor = get_codec(self.compression).decompressor()
+                if decompressor is None:
+                    return None
+                output = []
+                noutput = 0
+                complete = False
+                with open(self.path,'rb') as fp:
+                    while noutput < nbytes:
+                        buf = fp.read(nbytes)
+                        if not buf:
+                            complete = True
+                            break
+                        output.append(decompressor.decompress(buf))
+                        noutput += len(output[-1])
+                    if not complete and not fp.read(1):
+                        complete = True
+                contents = ''.join(output)
+                data = contents[:nbytes]
+            else:
+                return None
+            hasher = hashing.get_hasher(algorithm)
+            hasher.update(data)
+            checksum = hasher.hexdigest()
+            if complete:
+                # Have all the contents
+                if len(contents) > nbytes:
+                    hasher = hashing.get_hasher(algorithm)
+                    hasher.update(contents)
+                    uncompressed_checksum = hasher.hexdigest()
+                else:
+                    uncompressed_checksum = checksum
+                self.set_checksums(algorithm,
+                                   (uncompressed_checksum
+                                    if not self.compression
+                                    else self.stored_checksums(algorithm)[0]),
+                                   uncompressed_checksum)
+        return checksum
+
+    def compress(self,dry_run=False,codec=DEFAULT_CODEC):
         """
         Compress the file
 
-        Performs compression using bzip2, and transfers
-        the timestamp from the original file to the
-        compressed version.
+        Performs compression using the specified codec
+        (bzip2 by default, see 'compression.CODECS'), and
+        transfers the timestamp from the original file to
+        the compressed version.
 
         If 'dry_run' is True then report the compression
         operation but don't report anything.
@@ -144,9 +376,10 @@ class ArchiveFile(utils.PathInfo):
         if self.compression:
             logging.warning("%s: already compressed" % self)
             return -1
+        codec = get_codec(codec)
         # Check for existing compressed file
-        bz2file = self.path + '.bz2'
-        if os.path.exists(bz2file):
+        compressed_file = "%s.%s" % (self.path,codec.ext)
+        if os.path.exists(compressed_file):
             logging.warning("%s: compressed copy already exists" % self)
             return -1
         # Get MD5 checksum
@@ -155,42 +388,52 @@ class ArchiveFile(utils.PathInfo):
         # Capture timestamp for parent directory
         parent_mtime = os.lstat(os.path.dirname(self.path)).st_mtime
         # Compress to a temp file
-        bzip2_cmd = applications.Command('bzip2','-c',self.path)
-        print bzip2_cmd
+        print codec.describe(self.path)
         if dry_run:
             return -1
-        fd,tmpbz2 = tempfile.mkstemp(dir=os.path.dirname(self.path),
-                                     suffix='.bz2.tmp')
-        # Execute the compression command
+        fd,tmpfile = tempfile.mkstemp(dir=os.path.dirname(self.path),
+                                      suffix='.%s.tmp' % codec.ext)
+        os.close(fd)
+        # Execute the compression
         try:
-            status = bzip2_cmd.run_subprocess(log=tmpbz2)
+            with profiler.timer('compress',nbytes=self.size,item=self.path):
+                status = codec.compress(self.path,tmpfile)
         except Exception,ex:
             logging.error("Exception compressing %s: %s" % (self,ex))
             status = 1
         if status != 0:
             logging.error("Compression failed for %s" % self)
         else:
+            profiler.count('compress_bytes_in',self.size)
+            profiler.count('compress_bytes_out',os.path.getsize(tmpfile))
             # Verify the checksum for the contents of the
             # compressed file
-            uncompressed_checksum = Md5sum.md5sum(bz2.BZ2File(tmpbz2,'r'))
+            with profiler.timer('compress_verify',nbytes=self.size):
+                fp = codec.open(tmpfile)
+                try:
+                    uncompressed_checksum = hashing.hash_file(fp,'md5')
+                finally:
+                    fp.close()
             if uncompressed_checksum == checksum:
                 # Rename the compressed file, reset the timestamps
                 # and remove the source
-                os.rename(tmpbz2,bz2file)
-                os.utime(bz2file,(self.mtime,self.mtime))
+                os.chmod(tmpfile,stat.S_IMODE(os.lstat(self.path).st_mode))
+                os.rename(tmpfile,compressed_file)
+                os.utime(compressed_file,(self.mtime,self.mtime))
                 os.remove(self.path)
                 os.utime(os.path.dirname(self.path),(parent_mtime,parent_mtime))
-                # Update attributes
-                self.__path = bz2file
-                self.__st = os.lstat(self.__path)
-                self.compression = 'bz2'
+                # Update attributes (checksums for the
+                # uncompressed contents are still valid)
+                self._set_path(compressed_file)
                 self.md5 = None
+                self.checksums = dict([(a,(None,self.checksums[a][1]))
+                                       for a in self.checksums])
             else:
                 logging.error("Bad checksum for compressed version of %s" % self)
                 status = 1
         # Remove the temp file
-        if os.path.exists(tmpbz2):
-            os.remove(tmpbz2)
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
         # Finish
         return status
 
@@ -258,13 +501,7 @@ class ArchiveSymlink(utils.Symlink):
         if not self.is_broken:
             return None
         # Check for alternatives
-        target = self.resolve_target()
-        for ext in ('.gz','.bz2'):
-            alt_target = target + ext
-            if os.path.exists(alt_target):
-                return alt_target
-        alt_target,ext = os.path.splitext(target)
-        if ext in ('.gz','.bz2'):
+        for alt_target in get_alternative_paths(self.resolve_target()):
             if os.path.exists(alt_target):
                 return alt_target
         # Nothing found
@@ -317,47 +554,81 @@ class DataDir:
       curation
 
     """
-    def __init__(self,dirn,files=None):
+    def __init__(self,dirn,files=None,read_cache=True,scan_threads=None):
         """
         Create a new DataDir instance
 
         files: optional, if specified then should be a list
                of ArchiveFile instances to populate the DataDir
                with
+        read_cache: optional, if False then don't load MD5
+               sums from the cache (e.g. if the files
+               already have them)
+        scan_threads: optional, number of threads to use
+               to scan the directory (see the 'scanner'
+               module; defaults to scanner.SCAN_THREADS,
+               and zero means scan sequentially)
 
         """
         self._dirn = os.path.abspath(dirn)
+        self._reset()
+        # Populate
+        if files is not None:
+            # List of files supplied
+            for f in files: self._add_file(f)
+        else:
+            # Collect list of files
+            if scan_threads is None:
+                scan_threads = scanner.SCAN_THREADS
+            with profiler.timer('scan'):
+                if scan_threads:
+                    for f in scanner.scan_dir(self._dirn,ArchiveFile,
+                                              nthreads=scan_threads):
+                        self._add_file(f)
+                        profiler.count('files_scanned')
+                else:
+                    for path in self._walk():
+                        self._add_file(ArchiveFile(path))
+                        profiler.count('files_scanned')
+        # Update cache (if present)
+        if read_cache:
+            self.update_cache()
+
+    def _reset(self):
+        """
+        Clear the stored files and associated info
+        """
         self._nfiles = 0
         self._size = 0
         self._files = []
         self._extensions = []
         self._compression = []
-        self._users = []
-        self._groups = []
+        self._uids = set()
+        self._gids = set()
         self.oldest = None
         self.newest = None
         self.usr_unreadable = False
         self.grp_unreadable = False
         self.grp_unwritable = False
-        # Populate
-        if files is not None:
-            # List of files supplied
-            for f in files: self._add_file(f)
-        else:
-            # Collect list of files
-            for d in os.walk(self._dirn):
-                if os.path.basename(d[0]) == '.archiver':
+
+    def _walk(self):
+        """
+        Generate paths for files and directories under the data dir
+
+        The '.archiver' cache directory and its contents
+        are skipped.
+        """
+        for d in os.walk(self._dirn):
+            if os.path.basename(d[0]) == '.archiver':
+                # Skip the cache directory
+                continue
+            for f in d[1]:
+                if f == '.archiver':
                     # Skip the cache directory
                     continue
-                for f in d[1]:
-                    if f == '.archiver':
-                        # Skip the cache directory
-                        continue
-                    self._add_file(ArchiveFile(os.path.normpath(os.path.join(d[0],f))))
-                for f in d[2]:
-                    self._add_file(ArchiveFile(os.path.normpath(os.path.join(d[0],f))))
-        # Update cache (if present)
-        self.update_cache()
+                yield os.path.normpath(os.path.join(d[0],f))
+            for f in d[2]:
+                yield os.path.normpath(os.path.join(d[0],f))
 
     def _add_file(self,f):
         """
@@ -373,11 +644,9 @@ class DataDir:
             self._extensions.append(f.ext)
         if f.compression and f.compression not in self._compression:
             self._compression.append(f.compression)
-        # Users and groups
-        if f.user not in self._users:
-            self._users.append(f.user)
-        if f.group not in self._groups:
-            self._groups.append(f.group)
+        # Users and groups (names are only looked up on output)
+        self._uids.add(f.uid)
+        self._gids.add(f.gid)
         # Oldest and newest modification times
         try:
             self.oldest = f if f.timestamp < self.oldest.timestamp else self.oldest
@@ -392,6 +661,192 @@ class DataDir:
         # Return the file instance
         return f
 
+    def rescan(self):
+        """
+        Rescan the directory and update the stored files
+
+        Files and directories whose size, timestamp and
+        mode are unchanged since the last scan keep their
+        existing ArchiveFile instance (including any MD5
+        sums); new or modified entries get new instances
+        (keeping the MD5 sums if only the permissions have
+        changed) and entries which no longer exist are
+        dropped.
+
+        New entries which are the same file as an existing
+        entry (i.e. have the same device, inode, size and
+        timestamp, for example because the file has been
+        renamed or moved) take the MD5 sums from the
+        existing entry.
+
+        Returns True if anything changed, False otherwise.
+        """
+        existing = dict([(f.path,f) for f in self._files])
+        by_inode = dict([(f.inode_key,f) for f in self._files
+                         if f.md5 is not None])
+        files = []
+        changed = False
+        with profiler.timer('rescan'):
+            for path in self._walk():
+                f = existing.pop(path,None)
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    # Removed since the walk
+                    continue
+                profiler.count('files_rescanned')
+                if f is None or \
+                   f.size != st.st_size or \
+                   f.timestamp != st.st_mtime or \
+                   f.mode != st.st_mode:
+                    old_f = f
+                    f = ArchiveFile(path)
+                    if old_f is not None and \
+                       old_f.size == f.size and \
+                       old_f.timestamp == f.timestamp:
+                        # Only the permissions changed
+                        moved = old_f
+                    else:
+                        moved = by_inode.get(f.inode_key)
+                    if moved is not None:
+                        f.md5 = moved.md5
+                        f.uncompressed_md5 = moved.uncompressed_md5
+                        f.checksums = dict(moved.checksums)
+                    changed = True
+                files.append(f)
+        if existing:
+            # Some files were removed
+            changed = True
+        self._reset()
+        for f in files:
+            self._add_file(f)
+        return changed
+
+    def update_paths(self,paths):
+        """
+        Update the stored files for paths which have changed
+
+        For use when the paths which have changed are
+        already known (e.g. from file system events, see
+        the 'watch' module), so that only those paths are
+        examined instead of rescanning the whole directory:
+
+        - paths which no longer exist are dropped, along
+          with everything under them for directories;
+        - new paths get new ArchiveFile instances, as does
+          everything under them for directories (e.g. a
+          directory moved into the data dir);
+        - paths whose size or timestamp has changed get
+          new instances without MD5 sums; if only the
+          permissions have changed then the new instance
+          keeps the MD5 sums.
+
+        The directories containing the paths are also
+        checked (since creating, removing or renaming an
+        entry changes the timestamp of its directory).
+
+        As for 'rescan', new entries which are the same
+        file as an existing entry (e.g. a renamed file)
+        take the MD5 sums from the existing entry. Paths
+        outside the data dir or under an '.archiver'
+        directory are ignored.
+
+        Returns True if anything changed, False otherwise.
+        """
+        existing = dict([(f.path,f) for f in self._files])
+        by_inode = dict([(f.inode_key,f) for f in self._files
+                         if f.md5 is not None])
+        removed = set()
+        added = []
+        seen = set()
+        paths = set([os.path.normpath(os.path.join(self._dirn,p))
+                     for p in paths])
+        paths.update([os.path.dirname(p) for p in paths])
+        with profiler.timer('update_paths'):
+            for path in sorted(paths):
+                relpath = os.path.relpath(path,self._dirn)
+                if relpath == '.' or relpath.startswith('..') or \
+                   '.archiver' in relpath.split(os.sep):
+                    continue
+                if path in seen:
+                    # Already added with its parent directory
+                    continue
+                profiler.count('paths_updated')
+                f = existing.get(path)
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    st = None
+                if st is None:
+                    # Removed (along with any contents)
+                    if f is not None:
+                        removed.add(path)
+                        if f.is_dir:
+                            prefix = path + os.sep
+                            removed.update([p for p in existing
+                                            if p.startswith(prefix)])
+                    continue
+                if f is not None:
+                    if f.size == st.st_size and \
+                       f.timestamp == st.st_mtime and \
+                       f.mode == st.st_mode:
+                        # Unchanged
+                        continue
+                    # Modified
+                    removed.add(path)
+                    try:
+                        new_f = ArchiveFile(path)
+                    except OSError:
+                        # Removed in the meantime
+                        continue
+                    if f.size == new_f.size and \
+                       f.timestamp == new_f.timestamp:
+                        # Only the permissions changed
+                        new_f.md5 = f.md5
+                        new_f.uncompressed_md5 = f.uncompressed_md5
+                        new_f.checksums = dict(f.checksums)
+                    added.append(new_f)
+                    seen.add(path)
+                    continue
+                # New entry
+                new_paths = [path]
+                if stat.S_ISDIR(st.st_mode):
+                    for d in os.walk(path):
+                        d[1][:] = [x for x in d[1] if x != '.archiver']
+                        new_paths.extend([os.path.join(d[0],x)
+                                          for x in d[1] + d[2]])
+                for p in new_paths:
+                    if p in seen or \
+                       (p in existing and p not in removed):
+                        continue
+                    try:
+                        new_f = ArchiveFile(p)
+                    except OSError:
+                        # Removed in the meantime
+                        continue
+                    moved = by_inode.get(new_f.inode_key)
+                    if moved is not None:
+                        new_f.md5 = moved.md5
+                        new_f.uncompressed_md5 = moved.uncompressed_md5
+                        new_f.checksums = dict(moved.checksums)
+                    if p in existing:
+                        # Replaces an entry that was removed
+                        removed.add(p)
+                    added.append(new_f)
+                    seen.add(p)
+        if not (removed or added):
+            return False
+        if removed:
+            # Aggregates can't be updated for removed entries,
+            # so rebuild them (from the stored information)
+            files = [f for f in self._files if f.path not in removed]
+            self._reset()
+            for f in files:
+                self._add_file(f)
+        for f in added:
+            self._add_file(f)
+        return True
+
     def __del__(self):
         self.write_cache()
 
@@ -421,6 +876,15 @@ class DataDir:
     def update_cache(self):
         """
         Update the cache of file information
+
+        Cached MD5 sums are matched to files by their path
+        relative to the data dir, and are only used if the
+        size and timestamp are unchanged. Files which are
+        missing from the cache are also matched on their
+        device and inode numbers, size and timestamp (see
+        'ArchiveFile.inode_key'), so that files which have
+        been renamed or moved within the data dir don't
+        need to have their MD5 sums regenerated.
         """
         # Convenience variable to save lookup time
         dirn = self._dirn
@@ -433,15 +897,38 @@ class DataDir:
         data = {}
         if os.path.exists(md5info):
             # Read in cached data
-            with open(md5info,'r') as fp:
-                for line in fp:
-                    items = line.rstrip('\n').split('\t')
-                    data[items[0]] = {
-                        'size': int(items[1]),
-                        'time': float(items[2]),
-                        'md5' : items[3],
-                        'uncompressed_md5': items[4]
-                    }
+            with profiler.timer('cache_read',
+                                nbytes=os.path.getsize(md5info)):
+                with open(md5info,'r') as fp:
+                    for line in fp:
+                        items = line.rstrip('\n').split('\t')
+                        data[items[0]] = {
+                            'size': int(items[1]),
+                            'time': float(items[2]),
+                            'md5' : items[3],
+                            'uncompressed_md5': items[4],
+                            'checksums': {}
+                        }
+                        try:
+                            data[items[0]]['checksums'] = \
+                                parse_checksums(items[7])
+                        except IndexError:
+                            pass
+                        try:
+                            data[items[0]]['inode_key'] = (int(items[5]),
+                                                           int(items[6]),
+                                                           int(items[1]),
+                                                           float(items[2]))
+                        except IndexError:
+                            # Older cache without inode information
+                            pass
+            # Index entries by inode for files which have moved
+            by_inode = {}
+            for path in data:
+                try:
+                    by_inode[data[path]['inode_key']] = path
+                except KeyError:
+                    pass
             # Verify and remove outdated items
             # i.e. those which are missing, or where size or timestamp
             # has changed
@@ -458,12 +945,28 @@ class DataDir:
                         filen.md5 = f['md5'] if f['md5'] else None
                         filen.uncompressed_md5 = f['uncompressed_md5'] \
                                                  if f['uncompressed_md5'] else None
+                        filen.checksums = f['checksums']
+                        profiler.count('cache_hits')
                     else:
                         # Size or timestamp mismatch
                         print "%s: size and/or timestamp differs from cache" % path
                         del(data[path])
+                        profiler.count('cache_stale')
                 except KeyError:
-                    print "%s: missing from cache" % path
+                    try:
+                        # Look for the same file under another path
+                        f = data[by_inode[filen.inode_key]]
+                    except KeyError:
+                        print "%s: missing from cache" % path
+                        profiler.count('cache_misses')
+                        continue
+                    print "%s: moved from %s" % (path,
+                                                 by_inode[filen.inode_key])
+                    filen.md5 = f['md5'] if f['md5'] else None
+                    filen.uncompressed_md5 = f['uncompressed_md5'] \
+                                             if f['uncompressed_md5'] else None
+                    filen.checksums = dict(f['checksums'])
+                    profiler.count('cache_moved')
 
     def write_cache(self):
         """
@@ -477,14 +980,15 @@ class DataDir:
             return
         # MD5 information
         md5info = os.path.join(cachedir,'md5info')
-        with open(md5info,'w') as fp:
-            for f in self._files:
-                fp.write("%s\t%s\t%s\t%s\t%s\n" % \
-                         (f.relpath(dirn),
-                          f.size,
-                          f.timestamp,
-                          (f.md5 if f.md5 else ''),
-                          (f.uncompressed_md5 if f.uncompressed_md5 else '')))
+        with profiler.timer('cache_write'):
+            # Entries are sorted by path, so the cache is the same
+            # regardless of the order the files were scanned in
+            entries = sorted([format_cache_entry(f,dirn)
+                              for f in self._files])
+            with open(md5info,'w') as fp:
+                for entry in entries:
+                    fp.write("%s\n" % '\t'.join(entry))
+        profiler.count('cache_entries_written',len(self._files))
 
     @property
     def name(self):
@@ -526,14 +1030,14 @@ class DataDir:
         """
         User names associated with directory contents
         """
-        return self._users
+        return sorted(set([lookup_user(uid) for uid in self._uids]))
 
     @property
     def groups(self):
         """
         Group names associated with directory contents
         """
-        return self._groups
+        return sorted(set([lookup_group(gid) for gid in self._gids]))
 
     def files(self,extensions=None,owners=None,groups=None,compression=None,
               subdir=None,pattern=None,sort_keys=None):
@@ -549,9 +1053,13 @@ class DataDir:
             files = [f for f in itertools.ifilter(lambda x: x.compression in compression,
                                                   self._files)]
         if owners:
-            files = [f for f in itertools.ifilter(lambda x: str(x.user) in owners,files)]
+            uids = set([uid for uid in self._uids
+                        if str(lookup_user(uid)) in owners])
+            files = [f for f in itertools.ifilter(lambda x: x.uid in uids,files)]
         if groups:
-            files = [f for f in itertools.ifilter(lambda x: str(x.group) in groups,files)]
+            gids = set([gid for gid in self._gids
+                        if str(lookup_group(gid)) in groups])
+            files = [f for f in itertools.ifilter(lambda x: x.gid in gids,files)]
         if subdir:
             files = [f for f in itertools.ifilter(lambda x:
                                                   x.relpath(self._dirn).startswith(subdir),
@@ -598,12 +1106,38 @@ class DataDir:
                     external_dirs.append(d)
         return external_dirs
 
-    def md5sums(self):
+    def md5sums_pending(self):
+        """
+        Return list of files which still need MD5 sums
+        """
+        return self.checksums_pending('md5')
+
+    def md5sums(self,progress=None):
         """
         Generate MD5sums
+
+        'progress' is an optional ProgressReporter which
+        is updated as each file is processed.
         """
-        for f in self._files:
-            f.get_md5sums()
+        self.checksums('md5',progress=progress)
+
+    def checksums_pending(self,algorithm=hashing.DEFAULT_ALGORITHM):
+        """
+        Return list of files which still need checksums
+        """
+        return [f for f in self._files
+                if not (f.is_link or f.is_dir) and
+                None in f.stored_checksums(algorithm)]
+
+    def checksums(self,algorithm=hashing.DEFAULT_ALGORITHM,progress=None):
+        """
+        Generate checksums using the specified algorithm
+
+        'progress' is an optional ProgressReporter which
+        is updated as each file is processed.
+        """
+        for f in self.checksums_pending(algorithm):
+            f.get_checksums(algorithm,progress=progress)
 
     def set_permissions(self,mode=None,group=None):
         """
@@ -616,10 +1150,45 @@ class DataDir:
             f.chown(group=gid)
             os.system('chmod %s %s' % (mode,f.path))
 
-    def info(self):
+    def summary(self):
+        """
+        Return a dictionary summarising the contents
+
+        The summary has the number of files, the total size,
+        the file and compression types, users and groups,
+        the paths of the oldest and newest files (and their
+        timestamps) and the permissions flags. It doesn't
+        depend on the order that the files were scanned in.
+        """
+        dirn = self._dirn
+        files = [(f.timestamp,f.relpath(dirn)) for f in self._files]
+        return {
+            'path': dirn,
+            'nfiles': self._nfiles,
+            'size': self._size,
+            'extensions': sorted(self._extensions),
+            'compression': sorted(self._compression),
+            'users': sorted([str(u) for u in self.users]),
+            'groups': sorted([str(g) for g in self.groups]),
+            'oldest': (min(files) if files else None),
+            'newest': (max(files) if files else None),
+            'usr_unreadable': self.usr_unreadable,
+            'grp_unreadable': self.grp_unreadable,
+            'grp_unwritable': self.grp_unwritable,
+        }
+
+    def info(self,output=None):
         """
         Report information about the directory 
+
+        If 'output' is an NdjsonWriter (see the 'output'
+        module) then write a 'datadir' record followed by
+        a 'subdir' record for each top-level subdirectory,
+        instead of printing the report.
         """
+        if output is not None:
+            self._info_records(output)
+            return
         # Report information
         print "Dir   : %s" % self._dirn
         print "Size  : %s (%s)" % (utils.format_file_size(self.size),
@@ -653,9 +1222,47 @@ class DataDir:
         print "- unwritable by group: %s" % print_yes_no(self.grp_unwritable)
         print "#Temp files: %d" % len(self.list_temp())
 
+    def _info_records(self,output):
+        """
+        Write the information about the directory as records
+        """
+        dirn = self._dirn
+        output.write('datadir',
+                     path=dirn,
+                     size=self.size,
+                     has_cache=self.has_cache,
+                     nfiles=len(self),
+                     extensions=self.extensions,
+                     compression=self.compression,
+                     users=self.users,
+                     groups=self.groups,
+                     oldest=({'path': self.oldest.relpath(dirn),
+                              'mtime': self.oldest.timestamp}
+                             if self.oldest else None),
+                     newest=({'path': self.newest.relpath(dirn),
+                              'mtime': self.newest.timestamp}
+                             if self.newest else None),
+                     usr_unreadable=self.usr_unreadable,
+                     grp_unreadable=self.grp_unreadable,
+                     grp_unwritable=self.grp_unwritable,
+                     temp_files=len(self.list_temp()))
+        for subdir in utils.list_dirs(dirn):
+            sd = DataDir(os.path.join(dirn,subdir),
+                         files=self.files(subdir=subdir))
+            output.write('subdir',
+                         path=subdir,
+                         nfiles=len(sd),
+                         size=sd.size,
+                         extensions=sd.extensions,
+                         users=sd.users,
+                         usr_unreadable=sd.usr_unreadable,
+                         grp_unreadable=sd.grp_unreadable,
+                         grp_unwritable=sd.grp_unwritable)
+
     def copy_to(self,working_dir,chmod=None,dry_run=False):
         """Copy (rsync) data dir to another location
         """
+        from auto_process_ngs import applications
         rsync_cmd = applications.general.rsync(self._dirn,
                                                working_dir,
                                                dry_run=dry_run,
@@ -687,8 +1294,8 @@ def get_file_extensions(filen):
     Extract extension and compression type from filename
 
     Returns a tuple (ext,compression) where compression
-    is one of '','gz' or 'bz2' (empty string indicates no
-    compression) and ext is the trailing file extension
+    is one of '','gz', 'bz2' or 'xz' (empty string indicates
+    no compression) and ext is the trailing file extension
     once any compression extension has been removed.
 
     For example:
@@ -707,13 +1314,271 @@ def get_file_extensions(filen):
     ext = ''
     compression = ''
     file_parts = os.path.basename(filen).split('.')
-    if file_parts[-1] in ('gz','bz2'):
+    if file_parts[-1] in COMPRESSION_TYPES:
         compression = file_parts[-1]
         file_parts = file_parts[:-1]
     if len(file_parts) > 1:
         ext = file_parts[-1]
     return (ext,compression)
 
+def get_alternative_paths(path):
+    """
+    Return the compressed and uncompressed alternatives for a path
+
+    Returns a list with the path with each of the
+    compression extensions appended and, if the path
+    has a compression extension, the path without it
+    (i.e. where to look for the compressed version of
+    an uncompressed file, or vice versa).
+
+    For example:
+    >>> get_alternative_paths('test.fastq')
+    ['test.fastq.gz', 'test.fastq.bz2', 'test.fastq.xz']
+    >>> get_alternative_paths('test.fastq.gz')
+    ['test.fastq.gz.gz', 'test.fastq.gz.bz2', 'test.fastq.gz.xz', 'test.fastq']
+
+    """
+    alt_paths = ["%s.%s" % (path,ext) for ext in COMPRESSION_TYPES]
+    alt_path,ext = os.path.splitext(path)
+    if ext.lstrip('.') in COMPRESSION_TYPES:
+        alt_paths.append(alt_path)
+    return alt_paths
+
+def checksum_candidates(files,algorithm=hashing.DEFAULT_ALGORITHM,
+                        prefix_size=PREFIX_SIZE):
+    """
+    Return files which need checksums to find duplicated contents
+
+    Of the files which don't already have a checksum for
+    their uncompressed contents, returns those which could
+    have the same uncompressed contents as another file,
+    so that full checksums (and full decompression of
+    compressed files) are only generated where they're
+    needed to identify duplicates.
+
+    Files are ruled out using cheap filters:
+
+    - the uncompressed size, where it's known (i.e. for
+      uncompressed files, and compressed files where it
+      can be read from the file e.g. BGZF; see
+      'ArchiveFile.get_uncompressed_size'), which must
+      match that of another file;
+    - the checksum for the first 'prefix_size' bytes of
+      the uncompressed contents (see
+      'ArchiveFile.get_prefix_checksum'), which must also
+      match that of another file with a compatible size.
+
+    Files whose whole contents fit in the prefix get
+    their full checksums as a side effect, and so are
+    also not returned.
+
+    Arguments:
+      files: list of ArchiveFile instances (links and
+        directories are ignored)
+      algorithm: checksum algorithm
+      prefix_size: number of bytes to use for the
+        prefix checksums
+    """
+    files = [f for f in files if not (f.is_link or f.is_dir)]
+    # Uncompressed sizes (None if unknown)
+    keys = {}
+    counts = {}
+    nunknown = 0
+    for f in files:
+        try:
+            size = f.get_uncompressed_size()
+        except (IOError,OSError),ex:
+            logging.warning("%s: unable to get uncompressed size: %s" %
+                            (f.path,ex))
+            size = None
+        key = size
+        keys[f.path] = key
+        if key is None:
+            nunknown += 1
+        else:
+            counts[key] = counts.get(key,0) + 1
+    def matches_size(f):
+        # Check if any other file could have the same size
+        key = keys[f.path]
+        if key is None:
+            return len(files) > 1
+        return counts[key] + nunknown > 1
+    pending = [f for f in files
+               if f.stored_checksums(algorithm)[1] is None and
+               matches_size(f)]
+    profiler.count('checksums_skipped_by_size',
+                   len([f for f in files
+                        if f.stored_checksums(algorithm)[1] is None])
+                   - len(pending))
+    if not pending:
+        return []
+    # Prefix checksums for the pending files and any others
+    # they could match
+    pending_keys = set([keys[f.path] for f in pending])
+    prefixes = {}
+    for f in files:
+        key = keys[f.path]
+        if not (key is None or None in pending_keys or
+                key in pending_keys):
+            continue
+        if not matches_size(f):
+            continue
+        try:
+            prefixes[f.path] = f.get_prefix_checksum(algorithm,
+                                                     nbytes=prefix_size)
+        except (IOError,OSError,EOFError),ex:
+            logging.warning("%s: unable to get prefix checksum: %s" %
+                            (f.path,ex))
+            prefixes[f.path] = None
+    # Group by prefix checksum (files without one could
+    # match anything)
+    groups = {}
+    for path in prefixes:
+        groups.setdefault(prefixes[path],[]).append(path)
+    wildcards = groups.get(None,[])
+    candidates = []
+    for f in pending:
+        if f.stored_checksums(algorithm)[1] is not None:
+            # Got full checksums from the prefix
+            continue
+        prefix = prefixes[f.path]
+        key = keys[f.path]
+        if prefix is None:
+            others = prefixes.keys()
+        else:
+            others = groups[prefix] + wildcards
+        for path in others:
+            if path == f.path:
+                continue
+            if key is None or keys[path] is None or keys[path] == key:
+                candidates.append(f)
+                break
+    profiler.count('checksums_skipped_by_prefix',
+                   len(pending) - len(candidates))
+    return candidates
+
+def format_cache_entry(f,dirn):
+    """
+    Return the fields of the cache entry for a file
+
+    Returns a list of strings (path relative to 'dirn',
+    size, timestamp, MD5 sums, device and inode numbers,
+    and other checksums).
+    """
+    # Note that repr is used for the timestamp so it can
+    # be read back without loss of precision
+    return [f.relpath(dirn),
+            str(f.size),
+            repr(f.timestamp),
+            (f.md5 if f.md5 else ''),
+            (f.uncompressed_md5 if f.uncompressed_md5 else ''),
+            str(f.dev),
+            str(f.ino),
+            format_checksums(f.checksums)]
+
+def format_checksums(checksums):
+    """
+    Convert a dictionary of checksums to a string for the cache
+
+    'checksums' is a dictionary where the keys are
+    algorithm names and the values are tuples
+    (checksum,checksum_uncompressed_contents); the
+    string has the form 'ALG=CHECKSUM:CHECKSUM,...'.
+    """
+    return ','.join(["%s=%s:%s" % (algorithm,
+                                   checksums[algorithm][0],
+                                   checksums[algorithm][1])
+                     for algorithm in sorted(checksums)
+                     if None not in checksums[algorithm]])
+
+def parse_checksums(s):
+    """
+    Convert a string from the cache to a dictionary of checksums
+
+    Reverses the operation of 'format_checksums'.
+    """
+    checksums = {}
+    for item in s.split(','):
+        if not item:
+            continue
+        algorithm,values = item.split('=')
+        checksum,uncompressed_checksum = values.split(':')
+        checksums[algorithm] = (checksum,uncompressed_checksum)
+    return checksums
+
+def entry_type(f):
+    """
+    Return the type of an ArchiveFile
+
+    Returns one of 'file', 'dir' or 'link', or None for
+    other types (e.g. devices or named pipes).
+    """
+    if stat.S_ISLNK(f.mode):
+        return 'link'
+    elif stat.S_ISDIR(f.mode):
+        return 'dir'
+    elif stat.S_ISREG(f.mode):
+        return 'file'
+    return None
+
+def to_unicode(value,encoding='utf-8'):
+    """
+    Convert byte strings (e.g. paths) in a value to unicode
+
+    Byte strings are decoded using 'encoding', with any
+    invalid bytes replaced (so use 'latin-1' where the
+    conversion needs to be reversible). Lists, tuples
+    and dictionaries are converted recursively (tuples
+    become lists); other values are returned unchanged.
+    """
+    if isinstance(value,str):
+        return value.decode(encoding,'replace')
+    elif isinstance(value,dict):
+        return dict([(to_unicode(k,encoding),to_unicode(v,encoding))
+                     for k,v in value.items()])
+    elif isinstance(value,(list,tuple)):
+        return [to_unicode(v,encoding) for v in value]
+    return value
+
+def lookup_user(uid):
+    """
+    Return the user name for a uid
+
+    Each uid is only looked up once per process (since
+    on hosts using e.g. LDAP or SSSD each lookup can be
+    a network round trip). Returns None if there is no
+    user with the uid.
+    """
+    try:
+        return _USER_NAMES[uid]
+    except KeyError:
+        profiler.count('user_lookups')
+        try:
+            name = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            name = None
+        _USER_NAMES[uid] = name
+        return name
+
+def lookup_group(gid):
+    """
+    Return the group name for a gid
+
+    Each gid is only looked up once per process (see
+    'lookup_user'). Returns None if there is no group
+    with the gid.
+    """
+    try:
+        return _GROUP_NAMES[gid]
+    except KeyError:
+        profiler.count('group_lookups')
+        try:
+            name = grp.getgrgid(gid).gr_name
+        except KeyError:
+            name = None
+        _GROUP_NAMES[gid] = name
+        return name
+
 def get_size(f,block_size=1):
     """Return size of a file or directory
 
@@ -0,0 +1,408 @@
+#!/bin/env python
+#
+#     dedupe.py: replace duplicated files with links
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Replace duplicated files with links
+
+Finds files with identical contents across one or more data dirs and
+replaces all but one copy of each with a link to the copy which is
+kept, to reclaim the space:
+
+>>> groups = duplicate_groups([DataDir('/data/primary'),
+...                            DataDir('/data/analysis')])
+>>> with open('dedupe.tsv','w') as manifest:
+...     result = dedupe_files(groups,manifest)
+
+Candidates are files with the same size and checksum; each one is
+verified against the copy which is kept (byte-for-byte, or with a
+second hash algorithm) immediately before it's replaced. Duplicates
+on the same file system as the kept copy are replaced with hard
+links, otherwise with relative symbolic links. Files which have
+changed since they were scanned, or which have a different owner,
+group or permissions to the kept copy, are left alone.
+
+As for 'ArchiveFile.compress', the timestamps of the directories
+containing the replaced files are preserved. (A hard link necessarily
+has the timestamp of the copy which is kept, since they're the same
+file.)
+
+Each replacement is recorded in a manifest as it's made, with the
+original size, timestamp, permissions and ownership, so that it can
+be reversed with 'undo_dedupe':
+
+>>> undo_dedupe('dedupe.tsv')
+
+"""
+
+import os
+import stat
+import shutil
+import logging
+import tempfile
+from . import hashing
+from .profiling import profiler
+
+# Fields in the manifest
+MANIFEST_FIELDS = ('action',
+                   'path',
+                   'target',
+                   'size',
+                   'mtime',
+                   'mode',
+                   'uid',
+                   'gid',
+                   'checksum')
+
+# Size of blocks to read when comparing files
+COMPARE_BLOCK_SIZE = 1024*1024
+
+#######################################################################
+# Classes
+#######################################################################
+
+class DedupeResult:
+    """
+    Class for collecting the outcome of deduplication
+
+    Attributes:
+      hardlinks: list of paths replaced by hard links
+      symlinks: list of paths replaced by symlinks
+      skipped: list of paths which were left alone
+      nbytes: total size of the replaced files
+
+    """
+    def __init__(self):
+        self.hardlinks = []
+        self.symlinks = []
+        self.skipped = []
+        self.nbytes = 0
+
+    @property
+    def replaced(self):
+        """
+        Return list of all the replaced paths
+        """
+        return self.hardlinks + self.symlinks
+
+#######################################################################
+# Functions
+#######################################################################
+
+def duplicate_groups(datadirs,algorithm='md5',progress=None,min_size=1):
+    """
+    Return groups of candidate duplicate files
+
+    Generates checksums for the files in each DataDir
+    (if not already present) and groups the files which
+    have the same size and checksum. Links, directories
+    and files smaller than 'min_size' bytes are ignored.
+
+    Returns a list of lists of ArchiveFile instances:
+    the files in each group are ordered by data dir (in
+    the order supplied) and then by path, and the first
+    file in each group is the copy to keep.
+
+    Arguments:
+      datadirs: list of DataDir instances
+      algorithm: checksum algorithm to use
+      progress: optional ProgressReporter to update as
+        checksums are generated
+      min_size: minimum size of files to include
+    """
+    groups = {}
+    for i,dd in enumerate(datadirs):
+        dd.checksums(algorithm,progress=progress)
+        for f in dd.files():
+            if f.is_link or f.is_dir or f.size < min_size:
+                continue
+            checksum = f.stored_checksums(algorithm)[0]
+            if checksum is None:
+                # Unable to checksum
+                continue
+            key = (f.size,checksum)
+            if key not in groups:
+                groups[key] = []
+            groups[key].append((i,f.path,f))
+    return [[f for i,path,f in sorted(groups[key])]
+            for key in sorted(groups,key=lambda k: min(groups[k]))
+            if len(groups[key]) > 1]
+
+def dedupe_files(groups,manifest=None,verify='bytes',symlinks=True,
+                 algorithm='md5',dry_run=False):
+    """
+    Replace duplicated files with links
+
+    The first file in each group is kept, and each of
+    the others is verified against it and replaced with
+    a hard link (on the same file system) or a relative
+    symlink (on a different file system).
+
+    Arguments:
+      groups: list of groups of ArchiveFile instances
+        (e.g. from 'duplicate_groups')
+      manifest: (optional) file-like object to record
+        the replacements in (see 'write_manifest_entry')
+      verify: either 'bytes' (compare the contents
+        byte-for-byte), or the name of a hash algorithm
+        to compare checksums with (which should be
+        different to the one used to find the groups)
+      symlinks: if False then don't replace duplicates
+        on a different file system to the kept copy
+      algorithm: the algorithm used to find the groups
+        (for recording in the manifest)
+      dry_run: if True then report what would be done
+        without changing anything
+
+    Returns a DedupeResult.
+    """
+    result = DedupeResult()
+    if manifest is not None:
+        manifest.write("#%s\n" % '\t'.join(MANIFEST_FIELDS))
+    for group in groups:
+        keeper = group[0]
+        try:
+            keeper_st = os.lstat(keeper.path)
+        except OSError,ex:
+            logging.warning("%s: %s" % (keeper.path,ex))
+            result.skipped.extend([f.path for f in group[1:]])
+            continue
+        if not _unchanged(keeper,keeper_st):
+            logging.warning("%s: changed since scan, skipping" %
+                            keeper.path)
+            result.skipped.extend([f.path for f in group[1:]])
+            continue
+        keeper_checksum = None
+        for f in group[1:]:
+            try:
+                st = os.lstat(f.path)
+            except OSError,ex:
+                logging.warning("%s: %s" % (f.path,ex))
+                result.skipped.append(f.path)
+                continue
+            if (st.st_dev,st.st_ino) == (keeper_st.st_dev,
+                                         keeper_st.st_ino):
+                # Already the same file
+                continue
+            if not _unchanged(f,st):
+                logging.warning("%s: changed since scan, skipping" %
+                                f.path)
+                result.skipped.append(f.path)
+                continue
+            if (st.st_mode,st.st_uid,st.st_gid) != \
+               (keeper_st.st_mode,keeper_st.st_uid,keeper_st.st_gid):
+                logging.warning("%s: permissions or ownership differ "
+                                "from %s, skipping" % (f.path,keeper.path))
+                result.skipped.append(f.path)
+                continue
+            if st.st_dev == keeper_st.st_dev:
+                action = 'hardlink'
+            elif symlinks:
+                action = 'symlink'
+            else:
+                logging.warning("%s: on a different file system to %s, "
+                                "skipping" % (f.path,keeper.path))
+                result.skipped.append(f.path)
+                continue
+            # Verify the contents
+            with profiler.timer('dedupe_verify',nbytes=f.size,item=f.path):
+                if verify == 'bytes':
+                    same = same_contents(keeper.path,f.path)
+                else:
+                    if keeper_checksum is None:
+                        keeper_checksum = hashing.hash_file(keeper.path,
+                                                            verify)
+                    same = (hashing.hash_file(f.path,verify) ==
+                            keeper_checksum)
+            if not same:
+                logging.warning("%s: contents differ from %s, skipping" %
+                                (f.path,keeper.path))
+                result.skipped.append(f.path)
+                continue
+            print "%s %s -> %s" % (('Hardlink' if action == 'hardlink'
+                                    else 'Symlink'),f.path,keeper.path)
+            if not dry_run:
+                replace_with_link(f.path,keeper.path,action)
+                if manifest is not None:
+                    write_manifest_entry(manifest,action,f.path,keeper.path,
+                                         st,f.stored_checksums(algorithm)[0])
+            if action == 'hardlink':
+                result.hardlinks.append(f.path)
+            else:
+                result.symlinks.append(f.path)
+            result.nbytes += st.st_size
+            profiler.count('dedupe_%ss' % action)
+    return result
+
+def undo_dedupe(manifest_file,dry_run=False):
+    """
+    Reverse the replacements recorded in a manifest
+
+    Each link recorded in the manifest is replaced with
+    a copy of its target, with the original timestamp,
+    permissions and (where possible) ownership; the
+    timestamps of the parent directories are preserved.
+    Links which have been changed or removed since the
+    manifest was written are left alone.
+
+    Returns a tuple (restored,skipped) with lists of
+    the paths which were restored and skipped.
+    """
+    entries = read_manifest(manifest_file)
+    restored = []
+    skipped = []
+    for entry in reversed(entries):
+        path = entry['path']
+        target = entry['target']
+        if not _is_link_to(path,target,entry['action']):
+            logging.warning("%s: no longer a link to %s, skipping" %
+                            (path,target))
+            skipped.append(path)
+            continue
+        print "Restore %s from %s" % (path,target)
+        if not dry_run:
+            restore_copy(path,target,
+                         mode=entry['mode'],
+                         mtime=entry['mtime'],
+                         uid=entry['uid'],
+                         gid=entry['gid'])
+        restored.append(path)
+    return (restored,skipped)
+
+def same_contents(path1,path2,block_size=COMPARE_BLOCK_SIZE):
+    """
+    Check if two files have the same contents byte-for-byte
+    """
+    with open(path1,'rb') as fp1:
+        with open(path2,'rb') as fp2:
+            while True:
+                data1 = fp1.read(block_size)
+                data2 = fp2.read(block_size)
+                if data1 != data2:
+                    return False
+                if not data1:
+                    return True
+
+def replace_with_link(path,target,action='hardlink'):
+    """
+    Replace a file with a hard link or relative symlink
+
+    The link is made under a temporary name in the
+    same directory and then renamed over the file, so
+    the file is never missing; the timestamp of the
+    directory is preserved.
+    """
+    dirn = os.path.dirname(path)
+    parent_mtime = os.lstat(dirn).st_mtime
+    fd,tmp = tempfile.mkstemp(dir=dirn,prefix='.%s.' % os.path.basename(path),
+                              suffix='.dedupe')
+    os.close(fd)
+    os.remove(tmp)
+    try:
+        if action == 'hardlink':
+            os.link(target,tmp)
+        elif action == 'symlink':
+            os.symlink(os.path.relpath(target,dirn),tmp)
+        else:
+            raise Exception("Unknown action '%s'" % action)
+        os.rename(tmp,path)
+    finally:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+    os.utime(dirn,(parent_mtime,parent_mtime))
+
+def restore_copy(path,target,mode,mtime,uid=None,gid=None):
+    """
+    Replace a link with a copy of its target
+
+    The copy is made under a temporary name in the
+    same directory, given the specified permissions,
+    timestamp and (if possible) ownership, and then
+    renamed over the link; the timestamp of the
+    directory is preserved.
+    """
+    dirn = os.path.dirname(path)
+    parent_mtime = os.lstat(dirn).st_mtime
+    fd,tmp = tempfile.mkstemp(dir=dirn,prefix='.%s.' % os.path.basename(path),
+                              suffix='.undo')
+    os.close(fd)
+    try:
+        shutil.copyfile(target,tmp)
+        os.chmod(tmp,stat.S_IMODE(mode))
+        if uid is not None and gid is not None:
+            try:
+                os.chown(tmp,uid,gid)
+            except OSError,ex:
+                logging.warning("%s: unable to restore ownership: %s" %
+                                (path,ex))
+        os.utime(tmp,(mtime,mtime))
+        os.rename(tmp,path)
+    finally:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+    os.utime(dirn,(parent_mtime,parent_mtime))
+
+def write_manifest_entry(fp,action,path,target,st,checksum=None):
+    """
+    Write an entry to a manifest
+
+    'st' is the result of 'lstat' for the file before
+    it was replaced. The entry is flushed immediately,
+    so the manifest is complete even if deduplication
+    is interrupted.
+    """
+    fp.write("%s\n" % '\t'.join([action,
+                                 path,
+                                 target,
+                                 str(st.st_size),
+                                 repr(st.st_mtime),
+                                 str(st.st_mode),
+                                 str(st.st_uid),
+                                 str(st.st_gid),
+                                 (checksum if checksum else '')]))
+    fp.flush()
+
+def read_manifest(manifest_file):
+    """
+    Read the entries from a manifest
+
+    Returns a list of dictionaries with keys from
+    MANIFEST_FIELDS.
+    """
+    entries = []
+    with open(manifest_file,'r') as fp:
+        for line in fp:
+            if line.startswith('#'):
+                continue
+            items = line.rstrip('\n').split('\t')
+            if len(items) != len(MANIFEST_FIELDS):
+                raise Exception("%s: bad manifest line: %s" %
+                                (manifest_file,line.rstrip('\n')))
+            entry = dict(zip(MANIFEST_FIELDS,items))
+            for field in ('size','mode','uid','gid'):
+                entry[field] = int(entry[field])
+            entry['mtime'] = float(entry['mtime'])
+            entries.append(entry)
+    return entries
+
+def _unchanged(f,st):
+    # Check if a file has the same size and timestamp as
+    # when it was scanned
+    return f.size == st.st_size and f.timestamp == st.st_mtime
+
+def _is_link_to(path,target,action):
+    # Check if a path is (still) the link made by dedupe
+    try:
+        st = os.lstat(path)
+        target_st = os.stat(target)
+    except OSError:
+        return False
+    if action == 'hardlink':
+        return (st.st_dev,st.st_ino) == (target_st.st_dev,target_st.st_ino)
+    elif action == 'symlink':
+        return stat.S_ISLNK(st.st_mode) and \
+            os.path.normpath(os.path.join(os.path.dirname(path),
+                                          os.readlink(path))) == target
+    return False
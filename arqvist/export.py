@@ -0,0 +1,250 @@
+#!/bin/env python
+#
+#     export.py: export data dir file lists in columnar formats
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Export data dir file lists in columnar formats
+
+Writes the files stored in a DataDir as a table with one row per file
+(or directory or symlink), for analysis with other tools (e.g.
+pandas):
+
+>>> export_datadir(datadir,'inventory.parquet')
+
+The columns are given by EXPORT_COLUMNS: paths are relative to the
+data dir, 'mtime' is in seconds since the epoch, and 'uid', 'gid'
+and 'mode' are the numeric values from 'lstat'.
+
+Two formats are supported:
+
+- 'parquet': Apache Parquet (requires 'pyarrow'); the rows are
+  written in row groups of 'row_group_size' rows, so memory use is
+  bounded regardless of the number of files. Missing values (e.g.
+  files without MD5 sums) are nulls, and the path to the data dir
+  is stored in the file metadata under 'arqvist.datadir'.
+
+- 'npz': NumPy '.npz' archive (requires 'numpy') with one array per
+  column, which can be loaded with e.g.
+
+  >>> pandas.DataFrame(dict(numpy.load('inventory.npz')))
+
+  Each column is filled in chunks of 'row_group_size' rows via a
+  memory-mapped temporary file, so memory use is also bounded.
+  Strings are fixed-width byte strings, missing strings are empty
+  and missing numbers are -1; the path to the data dir is stored in
+  an additional zero-dimensional array 'datadir'.
+
+"""
+
+import os
+import shutil
+import zipfile
+import tempfile
+from .core import to_unicode
+from .profiling import profiler
+
+# Columns to export, and their types
+EXPORT_COLUMNS = (('path','string'),
+                  ('size','int64'),
+                  ('blocks','int64'),
+                  ('mtime','float64'),
+                  ('uid','int64'),
+                  ('gid','int64'),
+                  ('mode','int64'),
+                  ('ext','string'),
+                  ('compression','string'),
+                  ('md5','string'),
+                  ('uncompressed_md5','string'))
+
+# Export formats and their file extensions
+EXPORT_FORMATS = ('parquet','npz')
+
+# Default number of rows in each row group
+ROW_GROUP_SIZE = 100000
+
+#######################################################################
+# Functions
+#######################################################################
+
+def export_datadir(datadir,outfile,format=None,
+                   row_group_size=ROW_GROUP_SIZE):
+    """
+    Export the files in a DataDir
+
+    Arguments:
+      datadir: DataDir instance to export
+      outfile: path of the file to write
+      format: (optional) 'parquet' or 'npz'; if not
+        specified then the format is taken from the
+        extension of 'outfile', or else is 'parquet' if
+        'pyarrow' is available and 'npz' otherwise
+      row_group_size: number of rows to write at a time
+
+    Returns the number of rows written.
+
+    Raises Exception if the format isn't recognised or
+    the module it needs isn't available.
+    """
+    if format is None:
+        format = os.path.splitext(outfile)[1].lstrip('.').lower()
+        if format not in EXPORT_FORMATS:
+            format = ('parquet' if get_pyarrow_module() is not None
+                      else 'npz')
+    if format == 'parquet':
+        writer = write_parquet
+    elif format == 'npz':
+        writer = write_npz
+    else:
+        raise Exception("Unrecognised export format '%s'" % format)
+    with profiler.timer('export'):
+        nrows = writer(datadir,outfile,row_group_size=row_group_size)
+    profiler.count('rows_exported',nrows)
+    return nrows
+
+def write_parquet(datadir,outfile,row_group_size=ROW_GROUP_SIZE):
+    """
+    Write the files in a DataDir to a Parquet file
+
+    Returns the number of rows written.
+    """
+    pyarrow = get_pyarrow_module()
+    if pyarrow is None:
+        raise Exception("'pyarrow' is needed to write Parquet files")
+    import pyarrow.parquet
+    types = { 'string': pyarrow.string(),
+              'int64': pyarrow.int64(),
+              'float64': pyarrow.float64() }
+    names = [name for name,type_ in EXPORT_COLUMNS]
+    schema = pyarrow.schema([pyarrow.field(name,types[type_])
+                             for name,type_ in EXPORT_COLUMNS],
+                            metadata={'arqvist.datadir': datadir.path})
+    writer = pyarrow.parquet.ParquetWriter(outfile,schema)
+    nrows = 0
+    try:
+        for rows in iter_row_groups(datadir,row_group_size):
+            columns = zip(*rows)
+            arrays = []
+            for (name,type_),values in zip(EXPORT_COLUMNS,columns):
+                if type_ == 'string':
+                    values = to_unicode(values)
+                arrays.append(pyarrow.array(values,type=types[type_]))
+            writer.write_table(pyarrow.Table.from_arrays(arrays,
+                                                         schema=schema))
+            nrows += len(rows)
+    finally:
+        writer.close()
+    return nrows
+
+def write_npz(datadir,outfile,row_group_size=ROW_GROUP_SIZE):
+    """
+    Write the files in a DataDir to a NumPy '.npz' file
+
+    Returns the number of rows written.
+    """
+    numpy = get_numpy_module()
+    if numpy is None:
+        raise Exception("'numpy' is needed to write '.npz' files")
+    from numpy.lib.format import open_memmap
+    # Sizes of the columns (strings are fixed width)
+    nrows = len(datadir.files())
+    widths = dict([(name,1) for name,type_ in EXPORT_COLUMNS
+                   if type_ == 'string'])
+    for row in iter_rows(datadir):
+        for (name,type_),value in zip(EXPORT_COLUMNS,row):
+            if type_ == 'string' and value:
+                widths[name] = max(widths[name],len(value))
+    dtypes = dict([(name,('S%d' % widths[name] if type_ == 'string'
+                          else type_))
+                   for name,type_ in EXPORT_COLUMNS])
+    # Write each column to a temporary .npy file in chunks
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(outfile)),
+                              prefix='.export.')
+    try:
+        arrays = dict([(name,open_memmap(os.path.join(tmpdir,
+                                                      "%s.npy" % name),
+                                         mode='w+',dtype=dtypes[name],
+                                         shape=(nrows,)))
+                       for name,type_ in EXPORT_COLUMNS])
+        start = 0
+        for rows in iter_row_groups(datadir,row_group_size):
+            end = start + len(rows)
+            for (name,type_),values in zip(EXPORT_COLUMNS,zip(*rows)):
+                if type_ == 'string':
+                    values = [(v if v is not None else '') for v in values]
+                else:
+                    values = [(v if v is not None else -1) for v in values]
+                arrays[name][start:end] = values
+            start = end
+        for name in arrays:
+            arrays[name].flush()
+        del(arrays)
+        numpy.save(os.path.join(tmpdir,'datadir.npy'),
+                   numpy.array(datadir.path))
+        # Assemble the .npz archive
+        tmpfile = os.path.join(tmpdir,'export.npz')
+        with zipfile.ZipFile(tmpfile,'w',zipfile.ZIP_STORED,
+                             allowZip64=True) as npz:
+            for name in [name for name,type_ in EXPORT_COLUMNS] + \
+                ['datadir']:
+                npz.write(os.path.join(tmpdir,"%s.npy" % name),
+                          "%s.npy" % name)
+        os.rename(tmpfile,outfile)
+    finally:
+        shutil.rmtree(tmpdir)
+    return nrows
+
+def iter_rows(datadir):
+    """
+    Generate a row for each file in a DataDir
+
+    Each row is a tuple of values for EXPORT_COLUMNS,
+    with None for missing values.
+    """
+    dirn = datadir.path
+    for f in datadir.files():
+        yield (f.relpath(dirn),
+               f.size,
+               f.blocks,
+               f.timestamp,
+               f.uid,
+               f.gid,
+               f.mode,
+               f.ext,
+               f.compression,
+               f.md5,
+               f.uncompressed_md5)
+
+def iter_row_groups(datadir,row_group_size=ROW_GROUP_SIZE):
+    """
+    Generate lists of up to 'row_group_size' rows
+    """
+    rows = []
+    for row in iter_rows(datadir):
+        rows.append(row)
+        if len(rows) == row_group_size:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+def get_pyarrow_module():
+    """
+    Return the 'pyarrow' module (or None if not available)
+    """
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        return None
+
+def get_numpy_module():
+    """
+    Return the 'numpy' module (or None if not available)
+    """
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
@@ -0,0 +1,357 @@
+#!/bin/env python
+#
+#     fastq.py: FASTQ-specific classes and functions
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+FASTQ-specific classes and functions
+
+"""
+
+import os
+import zlib
+import logging
+import multiprocessing
+from .hashing import hash_file
+from .compression import open_file
+
+# Name of the cache file for FASTQ statistics
+FASTQ_CACHE = 'fastqinfo'
+
+#######################################################################
+# Classes
+#######################################################################
+
+class FastqStats:
+    """
+    Class for storing statistics for a single FASTQ file
+
+    Holds the number of reads, the minimum, maximum and
+    total read lengths, the validation status and a
+    digest of the read names (used to check consistency
+    of R1/R2 pairs).
+
+    'status' is one of:
+
+    'ok'        : file was read successfully
+    'truncated' : file ended part way through a read or
+                  compressed stream
+    'corrupt'   : file contains malformed records or
+                  couldn't be decompressed
+
+    """
+    def __init__(self,nreads=0,min_length=None,max_length=None,
+                 total_bases=0,status='ok',names_digest=0,message=''):
+        """
+        Create a new FastqStats instance
+        """
+        self.nreads = int(nreads)
+        self.min_length = (None if min_length is None
+                           else int(min_length))
+        self.max_length = (None if max_length is None
+                           else int(max_length))
+        self.total_bases = int(total_bases)
+        self.status = status
+        self.names_digest = int(names_digest)
+        self.message = message
+
+    @property
+    def mean_length(self):
+        """
+        Return the mean read length (or None if no reads)
+        """
+        if not self.nreads:
+            return None
+        return float(self.total_bases)/float(self.nreads)
+
+    @property
+    def ok(self):
+        """
+        Check whether the file was read without errors
+        """
+        return (self.status == 'ok')
+
+    def add_read(self,name,length):
+        """
+        Update the statistics with a single read
+        """
+        self.nreads += 1
+        self.total_bases += length
+        if self.min_length is None or length < self.min_length:
+            self.min_length = length
+        if self.max_length is None or length > self.max_length:
+            self.max_length = length
+        self.names_digest = zlib.crc32(name,self.names_digest)
+
+    def lengths(self):
+        """
+        Return string summarising the read lengths
+
+        The string is of the form 'MIN-MAX (MEAN)', or
+        just 'LENGTH' if all reads have the same length.
+        """
+        if not self.nreads:
+            return '-'
+        if self.min_length == self.max_length:
+            return "%d" % self.min_length
+        return "%d-%d (%.1f)" % (self.min_length,
+                                 self.max_length,
+                                 self.mean_length)
+
+    def to_line(self,md5):
+        """
+        Return a tab-delimited line for the cache file
+        """
+        return "%s\t%d\t%s\t%s\t%d\t%s\t%d\t%s\n" % \
+            (md5,
+             self.nreads,
+             ('' if self.min_length is None else self.min_length),
+             ('' if self.max_length is None else self.max_length),
+             self.total_bases,
+             self.status,
+             self.names_digest,
+             self.message)
+
+    @classmethod
+    def from_line(cls,line):
+        """
+        Create a new FastqStats instance from a cache line
+
+        Returns a tuple (md5,FastqStats).
+        """
+        items = line.rstrip('\n').split('\t')
+        return (items[0],
+                cls(nreads=items[1],
+                    min_length=(items[2] if items[2] else None),
+                    max_length=(items[3] if items[3] else None),
+                    total_bases=items[4],
+                    status=items[5],
+                    names_digest=items[6],
+                    message=items[7]))
+
+#######################################################################
+# Functions
+#######################################################################
+
+def open_fastq(path):
+    """
+    Open a FASTQ file for reading
+
+    Handles uncompressed and compressed files (see
+    'compression.COMPRESSION_TYPES'), based on the file
+    extension.
+    """
+    return open_file(path)
+
+def read_name(header):
+    """
+    Extract the read name from a FASTQ header line
+
+    The leading '@', anything after the first space and
+    any trailing '/1' or '/2' are removed, so that R1
+    and R2 reads from the same pair return the same name.
+    """
+    name = header[1:].rstrip('\n').split(' ')[0]
+    if name.endswith('/1') or name.endswith('/2'):
+        name = name[:-2]
+    return name
+
+def scan_fastq(path):
+    """
+    Stream a FASTQ file and collect statistics
+
+    Reads each record in turn and checks that it is
+    well-formed; compressed files are decompressed on
+    the fly, and truncated or corrupted compressed
+    streams are detected.
+
+    Returns a FastqStats instance.
+    """
+    stats = FastqStats()
+    try:
+        fp = open_fastq(path)
+        try:
+            while True:
+                header = fp.readline()
+                if not header:
+                    # Clean end of file
+                    break
+                seq = fp.readline()
+                sep = fp.readline()
+                qual = fp.readline()
+                if not qual.endswith('\n'):
+                    # Final record incomplete or missing
+                    # its trailing newline
+                    if not qual or len(qual) < len(seq.rstrip('\n')):
+                        stats.status = 'truncated'
+                        stats.message = "incomplete record after " \
+                                        "read %d" % stats.nreads
+                        break
+                if not header.startswith('@') or not sep.startswith('+'):
+                    stats.status = 'corrupt'
+                    stats.message = "bad record at read %d" % \
+                                    (stats.nreads+1)
+                    break
+                seq = seq.rstrip('\n')
+                if len(seq) != len(qual.rstrip('\n')):
+                    stats.status = 'corrupt'
+                    stats.message = "sequence and quality lengths " \
+                                    "differ at read %d" % (stats.nreads+1)
+                    break
+                stats.add_read(read_name(header),len(seq))
+        finally:
+            fp.close()
+    except (IOError,EOFError,zlib.error),ex:
+        # Errors raised by the decompressors on
+        # truncated or corrupted streams
+        if isinstance(ex,EOFError) or str(ex).startswith('CRC check'):
+            stats.status = 'truncated'
+        else:
+            stats.status = 'corrupt'
+        stats.message = str(ex)
+    return stats
+
+def get_pair_name(path):
+    """
+    Return the name of the R2 file matching an R1 file
+
+    Returns None if the file doesn't look like an R1
+    file from a read pair (e.g. 'PJB_S1_L001_R1_001.fastq.gz'
+    or 'PJB_R1.fastq').
+    """
+    dirn,filen = os.path.split(path)
+    for tag in ('_R1_','_R1.'):
+        i = filen.rfind(tag)
+        if i > -1:
+            return os.path.join(dirn,
+                                filen[:i] + tag.replace('1','2') +
+                                filen[i+len(tag):])
+    return None
+
+def read_fastq_cache(cachedir):
+    """
+    Read cached FASTQ statistics
+
+    Returns a dictionary where keys are MD5 sums and
+    values are FastqStats instances.
+    """
+    data = {}
+    cachefile = os.path.join(cachedir,FASTQ_CACHE)
+    if os.path.exists(cachefile):
+        with open(cachefile,'r') as fp:
+            for line in fp:
+                md5,stats = FastqStats.from_line(line)
+                data[md5] = stats
+    return data
+
+def write_fastq_cache(cachedir,data):
+    """
+    Write FASTQ statistics to the cache
+
+    'data' should be a dictionary where keys are MD5
+    sums and values are FastqStats instances.
+    """
+    cachefile = os.path.join(cachedir,FASTQ_CACHE)
+    with open(cachefile,'w') as fp:
+        for md5 in data:
+            fp.write(data[md5].to_line(md5))
+
+def get_fastq_stats(datadir,nprocs=None):
+    """
+    Collect statistics for FASTQ files in a DataDir
+
+    The FASTQ files are scanned in parallel using a pool
+    of 'nprocs' worker processes (defaults to the number
+    of CPUs).
+
+    Results are cached in the '.archiver' subdirectory
+    (if present) keyed by the MD5 sum of each file, so
+    unchanged files aren't rescanned on subsequent runs
+    (and the worker processes are only started if there
+    are files to hash or scan). MD5 sums are taken from
+    the DataDir cache where available. Only the entries
+    for the current FASTQ files are kept in the cache.
+
+    Returns a list of (ArchiveFile,FastqStats) tuples.
+    """
+    fastqs = [f for f in datadir.files(extensions=('fastq','fq'))
+              if not f.is_link and not f.is_dir]
+    if not fastqs:
+        return []
+    cachedir = os.path.join(datadir.path,'.archiver')
+    use_cache = os.path.exists(cachedir)
+    pool = None
+    try:
+        if use_cache:
+            # Generate any missing MD5 sums
+            no_md5 = [f for f in fastqs if f.md5 is None]
+            if no_md5:
+                pool = multiprocessing.Pool(nprocs)
+                for f,md5 in zip(no_md5,
+                                 pool.map(hash_file,
+                                          [f.path for f in no_md5])):
+                    f.md5 = md5
+            cache = read_fastq_cache(cachedir)
+        else:
+            cache = {}
+        # Scan files that aren't in the cache
+        to_scan = [f for f in fastqs if f.md5 not in cache]
+        if to_scan:
+            if pool is None:
+                pool = multiprocessing.Pool(nprocs)
+            for f,stats in zip(to_scan,
+                               pool.map(scan_fastq,
+                                        [f.path for f in to_scan])):
+                if use_cache:
+                    cache[f.md5] = stats
+                else:
+                    cache[f.path] = stats
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if use_cache:
+        # Drop entries for files which have changed or gone
+        current = dict([(f.md5,cache[f.md5]) for f in fastqs])
+        if to_scan or len(current) != len(cache):
+            write_fastq_cache(cachedir,current)
+        return [(f,cache[f.md5]) for f in fastqs]
+    return [(f,cache[f.path]) for f in fastqs]
+
+def check_pairs(results):
+    """
+    Check consistency of R1/R2 FASTQ pairs
+
+    'results' is a list of (ArchiveFile,FastqStats)
+    tuples as returned by 'get_fastq_stats'.
+
+    Returns a list of tuples (r1,r2,status) where 'r1'
+    and 'r2' are ArchiveFile instances ('r2' is None if
+    the R2 file is missing) and 'status' is a string
+    describing the result of the checks ('ok' if the
+    pair is consistent).
+    """
+    stats = {}
+    for f,s in results:
+        stats[f.path] = (f,s)
+    pairs = []
+    for f,s in results:
+        r2_path = get_pair_name(f.path)
+        if r2_path is None:
+            continue
+        try:
+            r2,s2 = stats[r2_path]
+        except KeyError:
+            pairs.append((f,None,"R2 missing"))
+            continue
+        if not s.ok or not s2.ok:
+            status = "not checked (invalid file)"
+        elif s.nreads != s2.nreads:
+            status = "read counts differ (%d/%d)" % (s.nreads,s2.nreads)
+        elif s.names_digest != s2.names_digest:
+            status = "read names differ"
+        else:
+            status = "ok"
+        pairs.append((f,r2,status))
+    return pairs
@@ -0,0 +1,270 @@
+#!/bin/env python
+#
+#     hashing.py: checksum algorithms for file contents
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Checksum algorithms for file contents
+
+Provides a common interface to the hash algorithms which can be used
+to generate checksums for files:
+
+md5    : the default, for compatibility with existing caches and
+         checksum files
+sha1   : faster than MD5 on most hardware
+sha256 : can use hardware acceleration (SHA extensions) if the
+         underlying OpenSSL supports it
+blake2b: fast cryptographic hash (only if supported by 'hashlib')
+crc32  : very fast but weak 32-bit checksum, intended only as a
+         prefilter (e.g. for finding candidate duplicates)
+
+Files are read into a single preallocated buffer using 'readinto'
+(or optionally via 'mmap'), so no new string is allocated for each
+block, and 'posix_fadvise' is used (where available) to tell the
+kernel that the file is read sequentially and to drop each block
+from the page cache once it has been hashed, so that hashing large
+amounts of data doesn't evict the cached data of other jobs.
+
+Example usage:
+
+>>> hash_file('/path/to/file','sha256')
+'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
+
+"""
+
+import os
+import io
+import zlib
+import mmap
+import hashlib
+
+# Default algorithm
+DEFAULT_ALGORITHM = 'md5'
+
+# Size of blocks to read
+BLOCK_SIZE = 1024*1024
+
+# Whether to use mmap (rather than readinto) for files
+USE_MMAP = False
+
+# Whether to drop hashed data from the page cache
+DROP_CACHE = True
+
+# Advice values for posix_fadvise (Linux values are
+# used if not available from the 'os' module)
+POSIX_FADV_SEQUENTIAL = getattr(os,'POSIX_FADV_SEQUENTIAL',2)
+POSIX_FADV_DONTNEED = getattr(os,'POSIX_FADV_DONTNEED',4)
+
+# Cached posix_fadvise function (see get_fadvise)
+_fadvise = None
+
+#######################################################################
+# Classes
+#######################################################################
+
+class Crc32:
+    """
+    CRC32 checksum with the same interface as 'hashlib' objects
+
+    """
+    name = 'crc32'
+    def __init__(self):
+        self._crc = 0
+    def update(self,data):
+        self._crc = zlib.crc32(data,self._crc)
+    def hexdigest(self):
+        return "%08x" % (self._crc & 0xffffffff)
+
+#######################################################################
+# Functions
+#######################################################################
+
+def available_algorithms(weak=True):
+    """
+    Return list of the available hash algorithms
+
+    If 'weak' is False then algorithms which are only
+    suitable as a prefilter (i.e. 'crc32') are omitted.
+    """
+    algorithms = ['md5','sha1','sha256']
+    if hasattr(hashlib,'blake2b'):
+        algorithms.append('blake2b')
+    if weak:
+        algorithms.append('crc32')
+    return algorithms
+
+def get_hasher(algorithm=DEFAULT_ALGORITHM):
+    """
+    Return a new hash object for an algorithm
+
+    The returned object has 'update' and 'hexdigest'
+    methods.
+
+    Raises ValueError if the algorithm isn't available.
+    """
+    if algorithm not in available_algorithms():
+        raise ValueError("Unsupported hash algorithm '%s' (available: "
+                         "%s)" % (algorithm,
+                                  ', '.join(available_algorithms())))
+    if algorithm == 'crc32':
+        return Crc32()
+    return hashlib.new(algorithm)
+
+def configure(block_size=None,use_mmap=None,drop_cache=None):
+    """
+    Set the defaults used for reading files
+
+    Arguments which are None leave the corresponding
+    default unchanged.
+    """
+    global BLOCK_SIZE,USE_MMAP,DROP_CACHE
+    if block_size is not None:
+        if block_size < 1:
+            raise ValueError("Bad block size: %s" % block_size)
+        BLOCK_SIZE = int(block_size)
+    if use_mmap is not None:
+        USE_MMAP = bool(use_mmap)
+    if drop_cache is not None:
+        DROP_CACHE = bool(drop_cache)
+
+def get_fadvise():
+    """
+    Return a function for calling posix_fadvise
+
+    The function has the signature
+    fadvise(fd,offset,length,advice). It uses
+    'os.posix_fadvise' if available, otherwise calls
+    'posix_fadvise' from the C library via ctypes; if
+    neither is available then it does nothing. Errors
+    are ignored since the advice is only a hint.
+    """
+    global _fadvise
+    if _fadvise is not None:
+        return _fadvise
+    posix_fadvise = getattr(os,'posix_fadvise',None)
+    if posix_fadvise is None:
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c'))
+            posix_fadvise = libc.posix_fadvise
+            posix_fadvise.argtypes = [ctypes.c_int,
+                                      ctypes.c_int64,
+                                      ctypes.c_int64,
+                                      ctypes.c_int]
+        except (ImportError,OSError,AttributeError):
+            posix_fadvise = None
+    if posix_fadvise is None:
+        def fadvise(fd,offset,length,advice):
+            pass
+    else:
+        def fadvise(fd,offset,length,advice):
+            try:
+                posix_fadvise(fd,offset,length,advice)
+            except OSError:
+                pass
+    _fadvise = fadvise
+    return _fadvise
+
+def hash_file(f,algorithm=DEFAULT_ALGORITHM,block_size=None,
+              use_mmap=None,drop_cache=None,callback=None):
+    """
+    Return the checksum for a file
+
+    'f' can be a path or a file-like object (e.g. a
+    BZ2File, to generate the checksum for the
+    uncompressed contents of a compressed file).
+
+    Arguments:
+      f: path or file-like object to read from
+      algorithm: hash algorithm to use
+      block_size: (optional) size of blocks to read
+        (defaults to BLOCK_SIZE)
+      use_mmap: (optional) if True then use mmap to
+        read files (defaults to USE_MMAP)
+      drop_cache: (optional) if True then drop the
+        blocks from the page cache once they've been
+        hashed (defaults to DROP_CACHE)
+      callback: (optional) function which is called
+        with the number of bytes in each block read
+    """
+    if block_size is None:
+        block_size = BLOCK_SIZE
+    if use_mmap is None:
+        use_mmap = USE_MMAP
+    if drop_cache is None:
+        drop_cache = DROP_CACHE
+    hasher = get_hasher(algorithm)
+    if isinstance(f,basestring):
+        with io.open(f,'rb',buffering=0) as fp:
+            if use_mmap:
+                _hash_mmap(hasher,fp.fileno(),block_size,drop_cache,
+                           callback)
+            else:
+                _hash_fd(hasher,fp,block_size,drop_cache,callback)
+    else:
+        _hash_stream(hasher,f,block_size,callback)
+    return hasher.hexdigest()
+
+def _hash_fd(hasher,fp,block_size,drop_cache,callback):
+    # Read an unbuffered file into a reusable buffer
+    fd = fp.fileno()
+    fadvise = get_fadvise()
+    fadvise(fd,0,0,POSIX_FADV_SEQUENTIAL)
+    buf = bytearray(block_size)
+    offset = 0
+    while True:
+        n = fp.readinto(buf)
+        if not n:
+            break
+        hasher.update(buffer(buf,0,n))
+        if drop_cache:
+            fadvise(fd,offset,n,POSIX_FADV_DONTNEED)
+        offset += n
+        if callback is not None:
+            callback(n)
+
+def _hash_mmap(hasher,fd,block_size,drop_cache,callback):
+    # Read a file via mmap
+    size = os.fstat(fd).st_size
+    if not size:
+        # Can't mmap an empty file
+        return
+    fadvise = get_fadvise()
+    fadvise(fd,0,0,POSIX_FADV_SEQUENTIAL)
+    m = mmap.mmap(fd,0,access=mmap.ACCESS_READ)
+    try:
+        for offset in xrange(0,size,block_size):
+            n = min(block_size,size-offset)
+            hasher.update(buffer(m,offset,n))
+            if drop_cache:
+                fadvise(fd,offset,n,POSIX_FADV_DONTNEED)
+            if callback is not None:
+                callback(n)
+    finally:
+        m.close()
+
+def _hash_stream(hasher,fp,block_size,callback):
+    # Read from a file-like object (e.g. decompressor)
+    try:
+        readinto = fp.readinto
+    except AttributeError:
+        readinto = None
+    if readinto is not None:
+        buf = bytearray(block_size)
+        while True:
+            n = readinto(buf)
+            if not n:
+                break
+            hasher.update(buffer(buf,0,n))
+            if callback is not None:
+                callback(n)
+    else:
+        while True:
+            data = fp.read(block_size)
+            if not data:
+                break
+            hasher.update(data)
+            if callback is not None:
+                callback(len(data))
@@ -0,0 +1,310 @@
+#!/bin/env python
+#
+#     links.py: repair broken symbolic links in bulk
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Repair broken symbolic links in bulk
+
+Plans and applies fixes for all the broken symbolic links in a data
+dir in one pass, for example after 'compress' has replaced files
+which analysis dirs link to:
+
+>>> index = PathIndex([datadir])
+>>> repairs,unresolved = plan_repairs(datadir,index)
+>>> apply_repairs(repairs)
+
+For each broken link the replacement target is (in order of
+preference):
+
+- the compressed or uncompressed version of the target (see
+  'get_alternative_paths');
+- the target with an absolute prefix replaced (e.g. after the data
+  has been moved), if 'rebase' is specified;
+- a file with the same name (or the name of its compressed or
+  uncompressed version) in the index, if 'search' is specified and
+  exactly one such file is found.
+
+Working absolute links to targets inside the data dir can also be
+made relative (so they still work if the data dir is moved).
+
+Checks for whether targets exist are answered from a PathIndex of
+the scanned data dirs rather than by probing the file system for
+each link; only targets outside the indexed dirs (or under a link
+to a directory) are checked on the file system.
+
+"""
+
+import os
+import logging
+import tempfile
+from .core import get_alternative_paths
+from .profiling import profiler
+
+#######################################################################
+# Classes
+#######################################################################
+
+class PathIndex:
+    """
+    Index of the paths in one or more scanned data dirs
+
+    """
+    def __init__(self,datadirs=()):
+        """
+        Create a new PathIndex instance
+
+        Arguments:
+          datadirs: list of DataDir instances to index
+        """
+        self._roots = []
+        self._paths = set()
+        self._links = set()
+        self._names = {}
+        for datadir in datadirs:
+            self.add(datadir)
+
+    def add(self,datadir):
+        """
+        Add the paths from a DataDir to the index
+        """
+        self._roots.append(datadir.path)
+        self._paths.add(datadir.path)
+        for f in datadir.files():
+            self._paths.add(f.path)
+            if f.is_link:
+                self._links.add(f.path)
+            elif not f.is_dir:
+                name = os.path.basename(f.path)
+                if name not in self._names:
+                    self._names[name] = []
+                self._names[name].append(f.path)
+
+    def covers(self,path):
+        """
+        Check if a path is inside one of the indexed dirs
+        """
+        for root in self._roots:
+            if path == root or path.startswith(root + os.sep):
+                return True
+        return False
+
+    def exists(self,path):
+        """
+        Check if a path exists
+
+        The index is used for paths inside the indexed
+        dirs, unless the path is under a link (which may
+        point to a directory); otherwise the file system
+        is checked.
+        """
+        if self.covers(path) and not self._under_link(path):
+            profiler.count('link_index_lookups')
+            return path in self._paths
+        profiler.count('link_probes')
+        return os.path.exists(path)
+
+    def find(self,name):
+        """
+        Return the paths of the indexed files called 'name'
+        """
+        return self._names.get(name,[])
+
+    def _under_link(self,path):
+        # Check if any parent of a path is a link in the index
+        if not self._links:
+            return False
+        dirn = os.path.dirname(path)
+        while self.covers(dirn):
+            if dirn in self._links:
+                return True
+            parent = os.path.dirname(dirn)
+            if parent == dirn:
+                break
+            dirn = parent
+        return False
+
+class LinkRepair:
+    """
+    Class describing a planned repair for a symbolic link
+
+    Attributes:
+      path: path of the link
+      target: the current target of the link
+      new_target: the new target for the link
+      reason: one of 'alternative', 'rebase', 'search'
+        (for broken links) or 'relative' (for working
+        links which are made relative)
+
+    """
+    def __init__(self,path,target,new_target,reason):
+        self.path = path
+        self.target = target
+        self.new_target = new_target
+        self.reason = reason
+
+    def __repr__(self):
+        return "%s: %s -> %s (%s)" % (self.path,self.target,
+                                      self.new_target,self.reason)
+
+#######################################################################
+# Functions
+#######################################################################
+
+def plan_repairs(datadir,index=None,search=False,rebase=None,
+                 relative=False):
+    """
+    Plan repairs for the symbolic links in a data dir
+
+    Arguments:
+      datadir: DataDir instance
+      index: (optional) PathIndex to check the existence
+        of targets with (by default the data dir is
+        indexed); it should include any other dirs that
+        links can be repaired to point to
+      search: if True then look for files in the index
+        with the same name as the target of broken links
+      rebase: (optional) tuple (old_base,new_base) to
+        replace leading parts of absolute targets
+      relative: if True then make absolute links (working
+        or repaired) to targets inside the data dir into
+        relative links
+
+    Returns a tuple (repairs,unresolved), where 'repairs'
+    is a list of LinkRepair instances and 'unresolved' is
+    a list of the broken links which couldn't be repaired.
+    """
+    if index is None:
+        index = PathIndex([datadir])
+    dirn = datadir.path
+    repairs = []
+    unresolved = []
+    with profiler.timer('plan_repairs'):
+        for ln in datadir.symlinks():
+            target = ln.resolve_target()
+            if index.exists(target):
+                # Working link
+                if not (relative and ln.is_absolute and
+                        _is_inside(target,dirn)):
+                    continue
+                new_path = target
+                reason = 'relative'
+            else:
+                new_path,reason = find_replacement(ln,index,search=search,
+                                                   rebase=rebase)
+                if new_path is None:
+                    unresolved.append(ln.path)
+                    continue
+            if not ln.is_absolute or (relative and
+                                      _is_inside(new_path,dirn)):
+                new_target = os.path.relpath(new_path,
+                                             os.path.dirname(ln.path))
+            else:
+                new_target = new_path
+            if new_target == ln.target:
+                continue
+            repairs.append(LinkRepair(ln.path,ln.target,new_target,reason))
+    return (repairs,unresolved)
+
+def find_replacement(ln,index,search=False,rebase=None):
+    """
+    Find a replacement target for a broken link
+
+    Arguments:
+      ln: ArchiveSymlink instance for the link
+      index: PathIndex to check the existence of targets
+      search: if True then also look for files in the
+        index with the same name as the target
+      rebase: (optional) tuple (old_base,new_base) to
+        replace leading parts of absolute targets
+
+    Returns a tuple (path,reason) where 'path' is the
+    absolute path to the new target, or (None,None) if
+    no replacement was found.
+    """
+    target = ln.resolve_target()
+    # Compressed or uncompressed version
+    for alt_target in get_alternative_paths(target):
+        if index.exists(alt_target):
+            return (alt_target,'alternative')
+    # Rebased target
+    if rebase is not None and ln.is_absolute:
+        old_base,new_base = [os.path.normpath(p) for p in rebase]
+        if target == old_base or target.startswith(old_base + os.sep):
+            new_target = new_base + target[len(old_base):]
+            for path in [new_target] + get_alternative_paths(new_target):
+                if index.exists(path):
+                    return (path,'rebase')
+    # Files with the same name
+    if search:
+        names = [os.path.basename(p)
+                 for p in [target] + get_alternative_paths(target)]
+        paths = set()
+        for name in names:
+            paths.update(index.find(name))
+        paths.discard(ln.path)
+        if len(paths) == 1:
+            return (paths.pop(),'search')
+        elif len(paths) > 1:
+            logging.warning("%s: %d possible targets for %s, not "
+                            "repairing" % (ln.path,len(paths),target))
+    return (None,None)
+
+def apply_repairs(repairs,dry_run=False):
+    """
+    Apply planned repairs to symbolic links
+
+    Each link is replaced with one pointing to its new
+    target (see 'replace_symlink'). Links which are no
+    longer as they were when the repairs were planned
+    are left alone.
+
+    Returns a list of the paths of the links which were
+    (or with 'dry_run', would be) updated.
+    """
+    updated = []
+    for repair in repairs:
+        print "[%s] %s: %s -> %s" % (repair.reason,repair.path,
+                                     repair.target,repair.new_target)
+        if not dry_run:
+            try:
+                if os.readlink(repair.path) != repair.target:
+                    logging.warning("%s: link has changed, skipping" %
+                                    repair.path)
+                    continue
+                replace_symlink(repair.path,repair.new_target)
+            except OSError,ex:
+                logging.warning("%s: failed to update link: %s" %
+                                (repair.path,ex))
+                continue
+        updated.append(repair.path)
+        profiler.count('links_repaired')
+    return updated
+
+def replace_symlink(path,new_target):
+    """
+    Point a symbolic link at a new target
+
+    The new link is made under a temporary name in the
+    same directory and then renamed over the old one,
+    so the link is never missing; the timestamp of the
+    directory is preserved.
+    """
+    dirn = os.path.dirname(path)
+    parent_mtime = os.lstat(dirn).st_mtime
+    fd,tmp = tempfile.mkstemp(dir=dirn,prefix='.%s.' % os.path.basename(path),
+                              suffix='.link')
+    os.close(fd)
+    os.remove(tmp)
+    try:
+        os.symlink(new_target,tmp)
+        os.rename(tmp,path)
+    finally:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+    os.utime(dirn,(parent_mtime,parent_mtime))
+
+def _is_inside(path,dirn):
+    # Check if a path is inside a directory
+    return not os.path.relpath(path,dirn).startswith('..')
@@ -0,0 +1,69 @@
+#!/bin/env python
+#
+#     output.py: structured output for reports
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Structured output for reports
+
+The reporting functions and methods (e.g. 'list_files',
+'DataDir.info', 'SolidDataDir.report') print human-readable text by
+default; if they are given an NdjsonWriter via their 'output'
+argument then instead they write a stream of records as
+newline-delimited JSON (NDJSON), one JSON object per line:
+
+>>> list_files(datadir,output=NdjsonWriter())
+{"group": "bioinf", "owner": "pjb", "path": "/data/run1/README", ...}
+...
+
+Each record has a 'type' field identifying what it describes (e.g.
+'file', 'symlink', 'library'), and reports which end with totals
+finish with a 'summary' record. Records are written (and flushed)
+as they are produced, so a long listing can be processed
+incrementally by a downstream job.
+
+Paths and other strings which aren't valid UTF-8 are written with
+the invalid bytes replaced.
+
+"""
+
+import sys
+import json
+from .core import to_unicode
+
+#######################################################################
+# Classes
+#######################################################################
+
+class NdjsonWriter:
+    """
+    Class for writing records as newline-delimited JSON
+
+    """
+    def __init__(self,fp=None):
+        """
+        Create a new NdjsonWriter instance
+
+        Arguments:
+          fp: (optional) file-like object to write to
+            (defaults to whatever 'sys.stdout' is when
+            each record is written)
+        """
+        self._fp = fp
+        self.nrecords = 0
+
+    def write(self,record_type,**fields):
+        """
+        Write a record
+
+        Arguments:
+          record_type: value for the 'type' field
+          fields: the other fields in the record
+        """
+        record = dict(fields)
+        record['type'] = record_type
+        fp = (self._fp if self._fp is not None else sys.stdout)
+        fp.write("%s\n" % json.dumps(to_unicode(record),sort_keys=True))
+        fp.flush()
+        self.nrecords += 1
@@ -0,0 +1,248 @@
+#!/bin/env python
+#
+#     profiling.py: timing and throughput instrumentation
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Timing and throughput instrumentation
+
+Provides a module-level Profiler instance 'profiler' which collects
+counters (e.g. files scanned, cache hits) and timers for named phases
+(e.g. 'stat', 'md5', 'compress') along with the number of bytes
+processed by each phase, so throughput can be reported.
+
+Profiling is disabled by default, in which case the timers do nothing
+and the counters aren't updated, so instrumented code pays very
+little for it. Example usage:
+
+>>> from arqvist.profiling import profiler
+>>> profiler.enable()
+>>> with profiler.timer('md5',nbytes=f.size,item=f.path):
+...     f.get_md5sums()
+>>> profiler.count('cache_hits')
+>>> profiler.report()
+
+"""
+
+import sys
+import time
+import json
+
+#######################################################################
+# Classes
+#######################################################################
+
+class Profiler:
+    """
+    Class for collecting counters and phase timings
+
+    """
+    def __init__(self):
+        """
+        Create a new (disabled) Profiler instance
+        """
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all collected data
+        """
+        self._counters = {}
+        self._phases = {}
+        self._items = []
+        self._start_time = time.time()
+
+    def enable(self):
+        """
+        Turn on data collection
+        """
+        self.enabled = True
+        self.reset()
+
+    def disable(self):
+        """
+        Turn off data collection
+        """
+        self.enabled = False
+
+    def count(self,name,n=1):
+        """
+        Increment the counter 'name' by 'n'
+        """
+        if self.enabled:
+            self._counters[name] = self._counters.get(name,0) + n
+
+    def timer(self,name,nbytes=0,item=None):
+        """
+        Return a context manager which times a phase
+
+        'nbytes' is the number of bytes processed in this
+        call (used to calculate throughput), and 'item' is
+        an optional identifier (e.g. a file path) for
+        recording the time taken for individual items.
+        """
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self,name,nbytes,item)
+
+    def add_time(self,name,elapsed,nbytes=0,item=None):
+        """
+        Add the time for one call to phase 'name'
+        """
+        if not self.enabled:
+            return
+        try:
+            phase = self._phases[name]
+        except KeyError:
+            phase = [0,0.0,0]
+            self._phases[name] = phase
+        phase[0] += 1
+        phase[1] += elapsed
+        phase[2] += nbytes
+        if item is not None:
+            self._items.append((name,str(item),elapsed,nbytes))
+
+    @property
+    def counters(self):
+        """
+        Return dictionary of counter names and values
+        """
+        return dict(self._counters)
+
+    @property
+    def phases(self):
+        """
+        Return dictionary of phase data
+
+        Values are dictionaries with keys 'calls', 'time',
+        'bytes' and 'mb_per_sec'.
+        """
+        phases = {}
+        for name in self._phases:
+            ncalls,elapsed,nbytes = self._phases[name]
+            phases[name] = { 'calls': ncalls,
+                             'time': elapsed,
+                             'bytes': nbytes,
+                             'mb_per_sec': mb_per_sec(nbytes,elapsed) }
+        return phases
+
+    @property
+    def compression_ratio(self):
+        """
+        Return the overall compression ratio (or None)
+        """
+        bytes_in = self._counters.get('compress_bytes_in',0)
+        bytes_out = self._counters.get('compress_bytes_out',0)
+        if not bytes_out:
+            return None
+        return float(bytes_in)/float(bytes_out)
+
+    def slowest(self,n=5):
+        """
+        Return the 'n' slowest items
+
+        Returns a list of tuples (phase,item,time,bytes).
+        """
+        return sorted(self._items,key=lambda x: x[2],reverse=True)[:n]
+
+    def as_dict(self):
+        """
+        Return all the collected data as a dictionary
+        """
+        return { 'wall_time': time.time() - self._start_time,
+                 'counters': self.counters,
+                 'phases': self.phases,
+                 'compression_ratio': self.compression_ratio,
+                 'items': [{ 'phase': phase,
+                             'item': item,
+                             'time': elapsed,
+                             'bytes': nbytes }
+                           for phase,item,elapsed,nbytes in self._items] }
+
+    def write_json(self,filen):
+        """
+        Write the collected data to a JSON file
+        """
+        with open(filen,'w') as fp:
+            json.dump(self.as_dict(),fp,indent=2,sort_keys=True)
+
+    def report(self,fp=None):
+        """
+        Write a summary table of the collected data
+
+        Writes to stderr by default.
+        """
+        if fp is None:
+            fp = sys.stderr
+        fp.write("Profile summary (wall time %.3fs):\n" %
+                 (time.time() - self._start_time))
+        fp.write("# Phase\tCalls\tTime(s)\tBytes\tMB/s\n")
+        phases = self.phases
+        for name in sorted(phases):
+            phase = phases[name]
+            fp.write("%s\t%d\t%.3f\t%s\t%s\n" %
+                     (name,
+                      phase['calls'],
+                      phase['time'],
+                      (phase['bytes'] if phase['bytes'] else '-'),
+                      ("%.1f" % phase['mb_per_sec']
+                       if phase['bytes'] else '-')))
+        if self._counters:
+            fp.write("# Counter\tValue\n")
+            for name in sorted(self._counters):
+                fp.write("%s\t%s\n" % (name,self._counters[name]))
+        if self.compression_ratio is not None:
+            fp.write("Compression ratio: %.2f\n" % self.compression_ratio)
+        slowest = self.slowest()
+        if slowest:
+            fp.write("# Slowest items\tPhase\tTime(s)\tMB/s\n")
+            for phase,item,elapsed,nbytes in slowest:
+                fp.write("%s\t%s\t%.3f\t%.1f\n" %
+                         (item,phase,elapsed,mb_per_sec(nbytes,elapsed)))
+
+class _Timer:
+    """
+    Internal class implementing a timer context manager
+    """
+    def __init__(self,profiler,name,nbytes,item):
+        self._profiler = profiler
+        self._name = name
+        self._nbytes = nbytes
+        self._item = item
+    def __enter__(self):
+        self._start = time.time()
+        return self
+    def __exit__(self,exc_type,exc_value,traceback):
+        self._profiler.add_time(self._name,
+                                time.time() - self._start,
+                                self._nbytes,
+                                self._item)
+        return False
+
+class _NullTimer:
+    """
+    Internal class implementing a do-nothing context manager
+    """
+    def __enter__(self):
+        return self
+    def __exit__(self,exc_type,exc_value,traceback):
+        return False
+
+_null_timer = _NullTimer()
+
+#######################################################################
+# Functions
+#######################################################################
+
+def mb_per_sec(nbytes,elapsed):
+    """
+    Return throughput in MB/s (zero if no time elapsed)
+    """
+    if not elapsed:
+        return 0.0
+    return float(nbytes)/1048576.0/elapsed
+
+# Shared instance used by the instrumented code
+profiler = Profiler()
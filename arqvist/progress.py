@@ -0,0 +1,244 @@
+#!/bin/env python
+#
+#     progress.py: progress reporting for long-running operations
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Progress reporting for long-running operations
+
+Provides the ProgressReporter class, which tracks the number of
+bytes (and optionally items) processed against a total which is
+known in advance (e.g. from the sizes of the files found by a scan)
+and reports the progress along with the recent throughput and an
+estimate of the time remaining.
+
+On a terminal the progress is shown on a single line which is
+updated in place; otherwise (e.g. for jobs running under a batch
+scheduler) a timestamped line is written periodically.
+
+Updates are cheap (an addition and a clock check), so 'update' can
+be called for every file or every chunk of data; output is only
+generated when the reporting interval has elapsed. Example usage:
+
+>>> progress = ProgressReporter("Hashing",total_bytes=size)
+>>> for f in files:
+...     f.get_md5sums()
+...     progress.update(f.size,1)
+>>> progress.finish()
+
+"""
+
+import sys
+import time
+import collections
+
+# Default reporting intervals (seconds)
+TTY_INTERVAL = 0.5
+LOG_INTERVAL = 60.0
+
+#######################################################################
+# Classes
+#######################################################################
+
+class ProgressReporter:
+    """
+    Class for reporting progress of a long-running operation
+
+    """
+    def __init__(self,description,total_bytes,total_items=None,
+                 fp=None,tty=None,interval=None,window=30.0):
+        """
+        Create a new ProgressReporter instance
+
+        Arguments:
+          description: text describing the operation
+          total_bytes: total number of bytes to process
+          total_items: (optional) total number of items
+            (e.g. files) to process
+          fp: (optional) stream to write progress to
+            (defaults to stderr)
+          tty: (optional) if True then update a single
+            line in place, if False then write a new line
+            for each report (default is to detect whether
+            'fp' is a terminal)
+          interval: (optional) minimum time in seconds
+            between reports (defaults to TTY_INTERVAL or
+            LOG_INTERVAL as appropriate)
+          window: (optional) time in seconds over which
+            the rolling throughput is calculated
+        """
+        if fp is None:
+            fp = sys.stderr
+        if tty is None:
+            try:
+                tty = fp.isatty()
+            except AttributeError:
+                tty = False
+        if interval is None:
+            interval = (TTY_INTERVAL if tty else LOG_INTERVAL)
+        self.description = description
+        self.total_bytes = total_bytes
+        self.total_items = total_items
+        self.bytes_done = 0
+        self.items_done = 0
+        self._fp = fp
+        self._tty = tty
+        self._interval = interval
+        self._window = window
+        self._start_time = time.time()
+        self._next_report = self._start_time + interval
+        self._samples = collections.deque([(self._start_time,0)])
+        self._line_length = 0
+
+    def update(self,nbytes=0,nitems=0):
+        """
+        Record that more bytes and/or items have been processed
+        """
+        self.bytes_done += nbytes
+        self.items_done += nitems
+        now = time.time()
+        if now >= self._next_report:
+            self._next_report = now + self._interval
+            self._add_sample(now)
+            self._write(self.status(now))
+
+    def finish(self):
+        """
+        Write the final report
+        """
+        now = time.time()
+        elapsed = now - self._start_time
+        line = "%s: %s in %s (%s/s)" % \
+               (self.description,
+                format_bytes(self.bytes_done),
+                format_time(elapsed),
+                format_bytes(self.bytes_done/elapsed if elapsed else 0))
+        if self.total_items is not None:
+            line += ", %d items" % self.items_done
+        self._write(line)
+        if self._tty:
+            self._fp.write("\n")
+            self._fp.flush()
+
+    @property
+    def throughput(self):
+        """
+        Return the recent throughput in bytes per second
+        """
+        return self._throughput(time.time())
+
+    @property
+    def eta(self):
+        """
+        Return estimated time remaining in seconds (or None)
+        """
+        return self._eta(time.time())
+
+    def status(self,now=None):
+        """
+        Return a line describing the current progress
+        """
+        if now is None:
+            now = time.time()
+        if self.total_bytes:
+            percent = " (%.1f%%)" % (100.0*self.bytes_done/self.total_bytes)
+        else:
+            percent = ""
+        line = "%s: %s/%s%s" % (self.description,
+                                format_bytes(self.bytes_done),
+                                format_bytes(self.total_bytes),
+                                percent)
+        if self.total_items is not None:
+            line += " %d/%d items" % (self.items_done,self.total_items)
+        line += " %s/s" % format_bytes(self._throughput(now))
+        eta = self._eta(now)
+        if eta is not None:
+            line += " ETA %s" % format_time(eta)
+        return line
+
+    def _add_sample(self,now):
+        # Record current position and discard samples which
+        # are outside the window
+        self._samples.append((now,self.bytes_done))
+        while len(self._samples) > 2 and \
+              now - self._samples[1][0] > self._window:
+            self._samples.popleft()
+
+    def _throughput(self,now):
+        # Throughput since the oldest sample in the window
+        t0,bytes0 = self._samples[0]
+        if now <= t0:
+            return 0.0
+        return float(self.bytes_done - bytes0)/(now - t0)
+
+    def _eta(self,now):
+        # Time remaining at the current throughput
+        throughput = self._throughput(now)
+        if not throughput:
+            return None
+        return max(self.total_bytes - self.bytes_done,0)/throughput
+
+    def _write(self,line):
+        # Output a line
+        if self._tty:
+            padding = ' '*max(self._line_length - len(line),0)
+            self._fp.write("\r%s%s" % (line,padding))
+            self._line_length = len(line)
+        else:
+            self._fp.write("[%s] %s\n" % (time.strftime("%Y-%m-%d %H:%M:%S"),
+                                          line))
+        self._fp.flush()
+
+class NullProgressReporter:
+    """
+    Progress reporter which doesn't report anything
+
+    Can be used in place of a ProgressReporter when
+    progress reporting is turned off.
+
+    """
+    def __init__(self,*args,**kws):
+        self.bytes_done = 0
+        self.items_done = 0
+    def update(self,nbytes=0,nitems=0):
+        pass
+    def finish(self):
+        pass
+
+#######################################################################
+# Functions
+#######################################################################
+
+def get_progress_reporter(description,total_bytes,total_items=None,
+                          enabled=True):
+    """
+    Return a progress reporter
+
+    Returns a ProgressReporter writing to stderr if
+    'enabled' is True, otherwise a NullProgressReporter.
+    """
+    if not enabled:
+        return NullProgressReporter()
+    return ProgressReporter(description,total_bytes,
+                            total_items=total_items)
+
+def format_bytes(nbytes):
+    """
+    Return a human-readable size (e.g. '1.2G')
+    """
+    nbytes = float(nbytes)
+    for units in 'BKMGT':
+        if nbytes < 1024.0 or units == 'T':
+            break
+        nbytes = nbytes/1024.0
+    if units == 'B':
+        return "%dB" % nbytes
+    return "%.1f%s" % (nbytes,units)
+
+def format_time(secs):
+    """
+    Return a time interval in the form H:MM:SS
+    """
+    secs = int(round(secs))
+    return "%d:%02d:%02d" % (secs//3600,(secs//60)%60,secs%60)
@@ -0,0 +1,149 @@
+#!/bin/env python
+#
+#     scanner.py: concurrent scanning of directory trees
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Concurrent scanning of directory trees
+
+On network file systems (e.g. NFS) each 'lstat' or 'listdir' is a
+round trip to the server, so a sequential walk of a large tree is
+limited by the latency rather than the bandwidth. The 'scan_dir'
+function in this module keeps many of these operations in flight at
+once using a pool of threads (the system calls release the GIL), and
+returns the entries in the same order as the sequential walk used by
+'DataDir', so that the resulting DataDir is identical:
+
+>>> files = scan_dir('/data/run1',ArchiveFile,nthreads=64)
+
+The tree is scanned a level at a time: the directories at each level
+are listed concurrently, and then the entries in all of them are
+examined concurrently, so the number of operations in flight is only
+limited by the number of threads and the number of entries at each
+level.
+
+The default number of threads used by 'DataDir' is set by
+'configure'; if it's zero (the default) then the sequential walk is
+used.
+
+"""
+
+import os
+import stat
+
+# Default number of threads for scanning (zero means
+# use the sequential walk)
+SCAN_THREADS = 0
+
+# Number of entries handed to each thread at a time
+SCAN_CHUNK_SIZE = 16
+
+#######################################################################
+# Functions
+#######################################################################
+
+def configure(threads=None):
+    """
+    Set the default number of threads used for scanning
+
+    If 'threads' is zero then the sequential walk is
+    used; None leaves the default unchanged.
+    """
+    global SCAN_THREADS
+    if threads is not None:
+        if threads < 0:
+            raise ValueError("Bad number of threads: %s" % threads)
+        SCAN_THREADS = int(threads)
+
+def scan_dir(dirn,factory,nthreads=None,skip='.archiver'):
+    """
+    Scan a directory tree concurrently
+
+    Makes an object for each file, directory and symlink
+    under 'dirn' by calling 'factory' with its path
+    (e.g. ArchiveFile), using a pool of threads; the
+    objects must have a 'mode' attribute with the
+    'st_mode' from 'lstat'.
+
+    The objects are returned in the same order as paths
+    are generated by 'DataDir._walk' (i.e. depth-first
+    in the order of 'os.walk', with the subdirectories
+    in each directory before the files). Directories
+    called 'skip' and their contents are omitted (but,
+    as for 'DataDir._walk', any subdirectories they
+    contain are still scanned).
+
+    Arguments:
+      dirn: top-level directory to scan
+      factory: function returning an object for a path
+      nthreads: number of threads (defaults to
+        SCAN_THREADS)
+      skip: name of directories to omit
+    """
+    # NB imported here as multiprocessing is slow to import
+    from multiprocessing.pool import ThreadPool
+    if not nthreads:
+        nthreads = max(SCAN_THREADS,1)
+    # Entries for each directory as tuples (subdirs,files)
+    # where each is a list of (name,object)
+    listings = {}
+    pool = ThreadPool(nthreads)
+    try:
+        level = [dirn]
+        while level:
+            names = pool.map(_listdir,level)
+            paths = []
+            for d,dir_names in zip(level,names):
+                paths.extend([os.path.join(d,name) for name in dir_names])
+            entries = pool.map(factory,paths,chunksize=SCAN_CHUNK_SIZE)
+            # Symlinks are listed with the subdirectories if they
+            # point to a directory (as for 'os.walk')
+            link_paths = [p for p,f in zip(paths,entries)
+                          if stat.S_ISLNK(f.mode)]
+            link_dirs = set([p for p,is_dir in
+                             zip(link_paths,pool.map(os.path.isdir,
+                                                     link_paths))
+                             if is_dir])
+            # Sort the entries into their directories
+            next_level = []
+            i = 0
+            for d,dir_names in zip(level,names):
+                subdirs = []
+                files = []
+                for name in dir_names:
+                    path = paths[i]
+                    f = entries[i]
+                    i += 1
+                    if stat.S_ISDIR(f.mode):
+                        subdirs.append((name,f))
+                        next_level.append(path)
+                    elif path in link_dirs:
+                        subdirs.append((name,f))
+                    else:
+                        files.append((name,f))
+                listings[d] = (subdirs,files)
+            level = next_level
+    finally:
+        pool.close()
+        pool.join()
+    # Assemble the results in walk order
+    results = []
+    stack = [dirn]
+    while stack:
+        d = stack.pop()
+        subdirs,files = listings[d]
+        if os.path.basename(d) != skip:
+            results.extend([f for name,f in subdirs if name != skip])
+            results.extend([f for name,f in files])
+        stack.extend(reversed([os.path.join(d,name)
+                               for name,f in subdirs
+                               if stat.S_ISDIR(f.mode)]))
+    return results
+
+def _listdir(d):
+    # List a directory, ignoring errors (as for 'os.walk')
+    try:
+        return os.listdir(d)
+    except OSError:
+        return []
@@ -0,0 +1,266 @@
+#!/bin/env python
+#
+#     server.py: daemon serving cached data dir information
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Daemon for serving cached data dir information over a local socket
+
+The server keeps DataDir instances (and views of them such as
+SolidDataDir, which share their files) resident in memory and answers queries from clients over a Unix domain socket,
+so repeated queries avoid the cost of starting up and rescanning
+the directories.
+
+Requests and responses are single lines of JSON: a request is of
+the form {"argv": [CMD,ARG,...], "cwd": CWD} and the response has
+the form {"status": STATUS, "output": OUTPUT}. Relative paths in
+the request are interpreted with respect to CWD.
+
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import logging
+import SocketServer
+from StringIO import StringIO
+from .core import DataDir
+
+#######################################################################
+# Classes
+#######################################################################
+
+class DataDirStore:
+    """
+    Class for holding resident DataDir instances
+
+    Instances are created on first request and kept
+    fresh by incremental rescans, which are performed
+    on request if the last scan is more than
+    'refresh_interval' seconds old.
+
+    There is a single DataDir instance for each path;
+    views built from it (see 'get_view') are kept until
+    a rescan finds changes. Only the DataDir instances
+    write their caches, so MD5 sums generated via a
+    view aren't overwritten by another instance for the
+    same directory.
+
+    """
+    def __init__(self,refresh_interval=30.0):
+        """
+        Create a new DataDirStore instance
+        """
+        self.refresh_interval = refresh_interval
+        self._datadirs = {}
+        self._views = {}
+        self._last_scan = {}
+
+    def get(self,dirn):
+        """
+        Return the resident DataDir for a directory
+        """
+        path = os.path.abspath(dirn)
+        try:
+            d = self._datadirs[path]
+        except KeyError:
+            logging.info("Loading %s" % path)
+            d = DataDir(path)
+            self._datadirs[path] = d
+            self._last_scan[path] = time.time()
+            return d
+        if time.time() - self._last_scan[path] > self.refresh_interval:
+            logging.info("Rescanning %s" % path)
+            if d.rescan():
+                # Discard views of the old files
+                for key in self._views.keys():
+                    if key[0] == path:
+                        del(self._views[key])
+            self._last_scan[path] = time.time()
+        return d
+
+    def get_view(self,dirn,name,make_view):
+        """
+        Return a resident view of the DataDir for a directory
+
+        'make_view' is a function which builds the view
+        (e.g. a SolidDataDir) from the resident DataDir;
+        it should share the DataDir's files rather than
+        scanning or reading the cache again. The view is
+        kept (under 'name') until the DataDir changes.
+        """
+        d = self.get(dirn)
+        key = (d.path,name)
+        try:
+            return self._views[key]
+        except KeyError:
+            logging.info("Building %s view of %s" % (name,d.path))
+            view = make_view(d)
+            self._views[key] = view
+            return view
+
+    def write_caches(self):
+        """
+        Write the caches for all resident instances
+        """
+        for key in self._datadirs:
+            self._datadirs[key].write_cache()
+
+    def __len__(self):
+        return len(self._datadirs)
+
+class DataDirServer(SocketServer.UnixStreamServer):
+    """
+    Server answering queries over a Unix domain socket
+
+    Requests are handled one at a time; for each request
+    the command line in the request is passed to the
+    'handler' function along with the DataDirStore, and
+    anything written to stdout is returned to the client.
+
+    The handler function should return the exit status.
+
+    """
+    def __init__(self,socket_path,handler,store):
+        """
+        Create a new DataDirServer instance
+        """
+        self.socket_path = os.path.abspath(socket_path)
+        self.store = store
+        self._handler = handler
+        SocketServer.UnixStreamServer.__init__(self,
+                                               self.socket_path,
+                                               _RequestHandler)
+
+    def run(self,argv,cwd=None):
+        """
+        Run a request and return tuple (status,output)
+
+        If 'cwd' is supplied then the request is run from
+        that directory.
+
+        An empty request is treated as a 'ping' and
+        returns immediately.
+        """
+        if not argv:
+            return (0,'')
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        server_cwd = os.getcwd()
+        try:
+            if cwd:
+                os.chdir(cwd)
+            try:
+                status = self._handler(argv,self.store)
+            except SystemExit,ex:
+                status = ex.code
+            except Exception,ex:
+                logging.error("Exception handling '%s': %s" %
+                              (' '.join(argv),ex))
+                print "Error: %s" % ex
+                status = 1
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+            os.chdir(server_cwd)
+        return (status,output)
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Internal class handling a single client request
+    """
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line)
+            # Paths are sent as UTF-8 (see 'send_request')
+            argv = [arg.encode('utf-8') for arg in request['argv']]
+            cwd = request.get('cwd',None)
+            if cwd is not None:
+                cwd = cwd.encode('utf-8')
+        except (ValueError,KeyError,TypeError,AttributeError):
+            logging.error("Bad request: %r" % line)
+            return
+        start_time = time.time()
+        status,output = self.server.run(argv,cwd=cwd)
+        logging.info("%s: finished in %.3fs" % (' '.join(argv),
+                                                time.time()-start_time))
+        self.wfile.write(json.dumps({'status': status,
+                                     'output': output}) + '\n')
+
+#######################################################################
+# Functions
+#######################################################################
+
+def serve(socket_path,handler,dirs=(),refresh_interval=30.0):
+    """
+    Run the server until interrupted
+
+    'handler' is the function used to run each request
+    (see DataDirServer), 'dirs' is an optional list of
+    directories to preload.
+
+    The socket is removed and the caches are written
+    when the server stops.
+    """
+    socket_path = os.path.abspath(socket_path)
+    if os.path.exists(socket_path):
+        # Check for stale socket from a previous server
+        try:
+            send_request(socket_path,[])
+            raise Exception("%s: server already running" % socket_path)
+        except socket.error:
+            os.remove(socket_path)
+    store = DataDirStore(refresh_interval=refresh_interval)
+    for d in dirs:
+        print "Loading %s" % d
+        print "Loaded data for %d files" % len(store.get(d))
+    server = DataDirServer(socket_path,handler,store)
+    # Handle SIGTERM as a normal shutdown
+    signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))
+    print "Serving on %s" % socket_path
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print "Shutting down"
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        store.write_caches()
+
+def send_request(socket_path,argv):
+    """
+    Send a request to a running server
+
+    The request includes the current working directory,
+    so relative paths in 'argv' are resolved correctly
+    by the server.
+
+    Returns a tuple (status,output) where 'status' is
+    the exit status of the command and 'output' is the
+    text that it generated.
+
+    Raises socket.error if the server can't be contacted.
+    """
+    s = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        s.connect(socket_path)
+        fp = s.makefile('rw')
+        fp.write(json.dumps({'argv': argv,
+                             'cwd': os.getcwd()}) + '\n')
+        fp.flush()
+        line = fp.readline()
+        fp.close()
+    finally:
+        s.close()
+    if not line:
+        return (1,'')
+    response = json.loads(line)
+    return (response['status'],response['output'])
@@ -0,0 +1,394 @@
+#!/bin/env python
+#
+#     shards.py: sharded scanning of data dirs
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Sharded scanning of data dirs
+
+For very large data dirs the time to scan (and generate checksums
+for) the whole tree from a single node is limited by the file
+system metadata servers. This module splits a data dir into a number
+of shards, each made up of some of its subdirectories, so that each
+shard can be scanned (and optionally checksummed) by a separate job,
+for example on different nodes of a cluster:
+
+>>> scan_shard('/data/project',nshards=8,index=0,
+...            outfile='project.shard-1-of-8.tsv')
+
+Each job writes a partial result file, and once all the jobs have
+finished the partial results are merged into the '.archiver' cache
+of the data dir:
+
+>>> datadir = merge_shards('/data/project',partial_files)
+
+The merged cache (and the summary returned by 'DataDir.summary') is
+the same as from scanning the whole data dir in a single process.
+
+Shards are made by listing the data dir down to a fixed depth (the
+'shard depth', 1 by default i.e. the top-level entries); each entry
+at the shard depth is assigned to a shard (along with everything
+under it) by a hash (CRC32) of its path relative to the data dir,
+and the directories above the shard depth are assigned the same way
+(without their contents). The assignment of an entry only depends on
+its own path, so each job can work out its own shard independently
+and entries don't move between shards when others are added or
+removed.
+
+"""
+
+import os
+import stat
+import zlib
+import datetime
+import logging
+from .core import DataDir
+from .core import ArchiveFile
+from .core import format_cache_entry
+from .core import parse_checksums
+from .core import get_file_extensions
+from .profiling import profiler
+from .progress import get_progress_reporter
+
+# Default depth to make shards at
+SHARD_DEPTH = 1
+
+#######################################################################
+# Classes
+#######################################################################
+
+class ShardDataDir(DataDir):
+    """
+    DataDir for the files in one shard of a data dir
+
+    MD5 sums are loaded from the cache of the data dir
+    but the cache is never written (since it would only
+    contain the files from this shard): the results are
+    instead merged into the cache by 'merge_shards'.
+
+    """
+    def write_cache(self):
+        pass
+
+class ShardEntry(ArchiveFile):
+    """
+    ArchiveFile populated from a partial result file
+
+    Holds the information recorded by 'scan_shard' for
+    a file, so that the files from partial results can
+    be used in a DataDir without accessing the file
+    system again.
+
+    """
+    def __init__(self,path,size,timestamp,mode,uid,gid,dev,ino,
+                 md5=None,uncompressed_md5=None,checksums=None):
+        # NB doesn't call the base class __init__, which
+        # gets information from the file system
+        self._path = path
+        self.size = size
+        # Number of blocks isn't recorded in the partial results
+        self.blocks = None
+        self.timestamp = timestamp
+        self.mode = mode
+        self._uid = uid
+        self._gid = gid
+        self.dev = dev
+        self.ino = ino
+        self.ext,self.compression = get_file_extensions(path)
+        self.md5 = md5
+        self.uncompressed_md5 = uncompressed_md5
+        self.checksums = (checksums if checksums is not None else {})
+
+    @property
+    def path(self):
+        return self._path
+
+    def relpath(self,dirn):
+        return os.path.relpath(self._path,dirn)
+
+    @property
+    def mtime(self):
+        return self.timestamp
+
+    @property
+    def datetime(self):
+        return datetime.datetime.fromtimestamp(self.timestamp)
+
+    @property
+    def is_file(self):
+        return stat.S_ISREG(self.mode)
+
+    @property
+    def is_executable(self):
+        return bool(self.mode & stat.S_IXUSR)
+
+    @property
+    def is_readable(self):
+        return bool(self.mode & stat.S_IRUSR)
+
+    @property
+    def is_group_readable(self):
+        return bool(self.mode & stat.S_IRGRP)
+
+    @property
+    def is_group_writable(self):
+        return bool(self.mode & stat.S_IWGRP)
+
+#######################################################################
+# Functions
+#######################################################################
+
+def shard_entries(dirn,nshards,index,depth=SHARD_DEPTH):
+    """
+    Return the entries in a shard of a data dir
+
+    Arguments:
+      dirn: path to the data dir
+      nshards: total number of shards
+      index: index of the shard (from zero)
+      depth: depth to make the shards at
+
+    Entries are assigned to shards by a hash of their
+    path relative to 'dirn' (see 'shard_index').
+
+    Returns a list of tuples (path,recursive) where
+    'recursive' is True if everything under 'path' is
+    also in the shard.
+    """
+    if index < 0 or index >= nshards:
+        raise ValueError("Shard index %d out of range for %d shards" %
+                         (index,nshards))
+    entries = []
+    level = [dirn]
+    for i in range(depth):
+        next_level = []
+        for d in level:
+            for name in sorted(os.listdir(d)):
+                if name == '.archiver':
+                    continue
+                path = os.path.join(d,name)
+                if i < depth-1 and os.path.isdir(path) and \
+                   not os.path.islink(path):
+                    recursive = False
+                    next_level.append(path)
+                else:
+                    recursive = True
+                if shard_index(os.path.relpath(path,dirn),nshards) == index:
+                    entries.append((path,recursive))
+        level = next_level
+    return entries
+
+def shard_index(relpath,nshards):
+    """
+    Return the index of the shard for an entry
+
+    Uses the CRC32 of 'relpath' (the path of the entry
+    relative to the data dir), which is stable across
+    processes and Python versions.
+    """
+    return (zlib.crc32(relpath) & 0xffffffff) % nshards
+
+def walk_shard(dirn,nshards,index,depth=SHARD_DEPTH):
+    """
+    Generate paths for files and directories in a shard
+
+    The '.archiver' cache directory and its contents
+    are skipped (as for 'DataDir').
+    """
+    for path,recursive in shard_entries(dirn,nshards,index,depth):
+        yield path
+        if not recursive or os.path.islink(path) or \
+           not os.path.isdir(path):
+            continue
+        for d in os.walk(path):
+            for f in d[1]:
+                if f == '.archiver':
+                    continue
+                yield os.path.join(d[0],f)
+            d[1][:] = [f for f in d[1] if f != '.archiver']
+            for f in d[2]:
+                yield os.path.join(d[0],f)
+
+def scan_shard(dirn,nshards,index,outfile,depth=SHARD_DEPTH,
+               algorithm=None,progress=False):
+    """
+    Scan one shard of a data dir and write a partial result file
+
+    Arguments:
+      dirn: path to the data dir
+      nshards: total number of shards
+      index: index of the shard (from zero)
+      outfile: path to write the partial results to
+      depth: depth to make the shards at
+      algorithm: (optional) if specified then also
+        generate checksums for the files in the shard
+        using this algorithm
+      progress: if True then report progress of the
+        checksum generation on stderr
+
+    Returns the ShardDataDir for the shard.
+    """
+    dirn = os.path.abspath(dirn)
+    with profiler.timer('scan'):
+        files = []
+        for path in walk_shard(dirn,nshards,index,depth):
+            files.append(ArchiveFile(os.path.normpath(path)))
+            profiler.count('files_scanned')
+    datadir = ShardDataDir(dirn,files=files)
+    if algorithm is not None:
+        pending = datadir.checksums_pending(algorithm)
+        reporter = get_progress_reporter("Computing %s checksums for "
+                                         "shard %d/%d" % (algorithm,
+                                                          index+1,
+                                                          nshards),
+                                         sum([f.size for f in pending]),
+                                         total_items=len(pending),
+                                         enabled=progress)
+        datadir.checksums(algorithm,progress=reporter)
+        reporter.finish()
+    write_partial(datadir,nshards,index,outfile)
+    return datadir
+
+def scan_shards(dirn,nshards,outdir=None,depth=SHARD_DEPTH,
+                algorithm=None,nprocs=None):
+    """
+    Scan all the shards of a data dir in parallel processes
+
+    Runs 'scan_shard' for each shard using a pool of
+    'nprocs' local processes (default is the number of
+    CPUs), writing the partial result files to 'outdir'
+    (default is the current directory).
+
+    Returns the list of partial result files.
+    """
+    # NB imported here as multiprocessing is slow to import
+    import multiprocessing
+    dirn = os.path.abspath(dirn)
+    if outdir is None:
+        outdir = os.getcwd()
+    outfiles = [os.path.join(outdir,partial_file_name(dirn,nshards,i))
+                for i in range(nshards)]
+    jobs = [(dirn,nshards,i,outfiles[i],depth,algorithm)
+            for i in range(nshards)]
+    pool = multiprocessing.Pool(nprocs)
+    try:
+        pool.map(_scan_shard_job,jobs)
+    finally:
+        pool.close()
+        pool.join()
+    return outfiles
+
+def merge_shards(dirn,partial_files,write_cache=True):
+    """
+    Merge partial result files into a DataDir
+
+    Checks that the partial results are all for the
+    data dir 'dirn' and cover all of its shards, and
+    makes a DataDir from the combined results (which
+    is equivalent to scanning the whole data dir). If
+    'write_cache' is True then the cache for the data
+    dir is created if necessary and the results are
+    written to it.
+
+    Raises Exception if the partial results are
+    inconsistent or incomplete.
+    """
+    dirn = os.path.abspath(dirn)
+    nshards = None
+    indexes = set()
+    files = {}
+    for partial_file in partial_files:
+        shard_dirn,shard_nshards,index,entries = read_partial(partial_file)
+        if shard_dirn != dirn:
+            raise Exception("%s: partial results are for %s, not %s" %
+                            (partial_file,shard_dirn,dirn))
+        if nshards is None:
+            nshards = shard_nshards
+        elif shard_nshards != nshards:
+            raise Exception("%s: partial results are for %d shards, "
+                            "expected %d" % (partial_file,shard_nshards,
+                                             nshards))
+        if index in indexes:
+            raise Exception("%s: duplicate results for shard %d" %
+                            (partial_file,index+1))
+        indexes.add(index)
+        for f in entries:
+            if f.path in files:
+                raise Exception("%s: %s is in more than one shard" %
+                                (partial_file,f.path))
+            files[f.path] = f
+    missing = sorted(set(range(nshards or 0)) - indexes)
+    if nshards is None or missing:
+        raise Exception("Missing partial results for shard(s): %s" %
+                        ', '.join([str(i+1) for i in missing]))
+    datadir = DataDir(dirn,files=[files[p] for p in sorted(files)],
+                      read_cache=False)
+    if write_cache:
+        datadir.init_cache()
+        datadir.write_cache()
+    return datadir
+
+def write_partial(datadir,nshards,index,outfile):
+    """
+    Write a partial result file for a shard
+
+    The file has a header line '#shard INDEX NSHARDS
+    DIR' followed by a line for each file, with the
+    same fields as the cache plus the mode, uid and
+    gid.
+    """
+    dirn = datadir.path
+    with open(outfile,'w') as fp:
+        fp.write("#shard\t%d\t%d\t%s\n" % (index,nshards,dirn))
+        for f in datadir.files():
+            fp.write("%s\n" % '\t'.join(format_cache_entry(f,dirn) +
+                                        [str(f.mode),
+                                         str(f.uid),
+                                         str(f.gid)]))
+
+def read_partial(partial_file):
+    """
+    Read a partial result file for a shard
+
+    Returns a tuple (dirn,nshards,index,entries) where
+    'entries' is a list of ShardEntry instances.
+    """
+    entries = []
+    with open(partial_file,'r') as fp:
+        header = fp.readline().rstrip('\n').split('\t')
+        if header[0] != '#shard' or len(header) != 4:
+            raise Exception("%s: not a partial result file" %
+                            partial_file)
+        index = int(header[1])
+        nshards = int(header[2])
+        dirn = header[3]
+        for line in fp:
+            items = line.rstrip('\n').split('\t')
+            entries.append(ShardEntry(
+                os.path.join(dirn,items[0]),
+                size=int(items[1]),
+                timestamp=float(items[2]),
+                mode=int(items[8]),
+                uid=int(items[9]),
+                gid=int(items[10]),
+                dev=int(items[5]),
+                ino=int(items[6]),
+                md5=(items[3] if items[3] else None),
+                uncompressed_md5=(items[4] if items[4] else None),
+                checksums=parse_checksums(items[7])))
+    return (dirn,nshards,index,entries)
+
+def partial_file_name(dirn,nshards,index):
+    """
+    Return the default name for a partial result file
+    """
+    return "%s.shard-%d-of-%d.tsv" % (os.path.basename(dirn.rstrip(os.sep)),
+                                      index+1,nshards)
+
+def _scan_shard_job(args):
+    # Scan a shard in a worker process
+    dirn,nshards,index,outfile,depth,algorithm = args
+    scan_shard(dirn,nshards,index,outfile,depth=depth,
+               algorithm=algorithm)
+    return outfile
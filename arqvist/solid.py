@@ -12,8 +12,8 @@ SOLiD-specific classes and functions
 import os
 import core
 import logging
-import bcftbx.SolidData as SolidData
 import bcftbx.utils as utils
+from .profiling import profiler
 
 #######################################################################
 # Classes
@@ -217,18 +217,40 @@ class SolidDataDir(core.DataDir):
     Subclass of DataDir with additional methods specifically for
     examining SOLiD data
     """
-    def __init__(self,dirn):
+    def __init__(self,dirn,files=None,read_cache=True):
         """
         Create a new SolidDataDir instance for dirn
 
+        files: optional, if specified then should be a list
+               of ArchiveFile instances to populate the
+               SolidDataDir with (for example from an existing
+               DataDir), instead of scanning the directory
+        read_cache: optional, if False then don't load MD5
+               sums from the cache (e.g. if 'files' already
+               have them)
+
         """
         # Init base class
-        core.DataDir.__init__(self,dirn)
+        core.DataDir.__init__(self,dirn,files=files,read_cache=read_cache)
         self._primary_data = None
         self._libraries = None
         self._library_names = None
         self._library_groups = None
-        self._populate()
+        with profiler.timer('solid_populate'):
+            self._populate()
+
+    def rescan(self):
+        """
+        Rescan the directory and update the SOLiD data
+
+        The libraries are only regenerated if the
+        rescan detects changes.
+        """
+        changed = core.DataDir.rescan(self)
+        if changed:
+            with profiler.timer('solid_populate'):
+                self._populate()
+        return changed
 
     def _populate(self):
         """
@@ -313,10 +335,43 @@ class SolidDataDir(core.DataDir):
         """
         return filter(lambda l: l.group == group,self._libraries)
 
-    def report(self):
+    def report(self,output=None):
         """
         Report
-        """
+
+        If 'output' is an NdjsonWriter (see the 'output'
+        module) then write a 'group' record for each
+        library group and a 'library' record for each
+        library (listing the files for each timestamp),
+        followed by a 'summary' record, instead of
+        printing the report.
+        """
+        if output is not None:
+            for group in self.library_groups:
+                output.write('group',
+                             name=group,
+                             libraries=sorted([l.name for l in
+                                               self.libraries_in_group(group)]))
+            for lib in self.libraries:
+                timestamps = []
+                for timestamp in lib.timestamps:
+                    files = []
+                    for file_set in lib.get_file_sets(timestamp):
+                        files.extend([f.relpath(self._dirn)
+                                      for f in file_set.files])
+                    timestamps.append({'timestamp': timestamp,
+                                       'files': files})
+                output.write('library',
+                             name=lib.name,
+                             fullname=lib.fullname,
+                             sample=lib.sample_name,
+                             library=lib.library_name,
+                             group=lib.group,
+                             timestamps=timestamps)
+            output.write('summary',
+                         libraries=len(self.libraries),
+                         groups=len(self.library_groups))
+            return
         if len(self.libraries) == 0:
             print "No libraries found: not a SOLiD primary data directory?"
             return
@@ -339,7 +394,7 @@ class SolidDataDir(core.DataDir):
                     for f in file_set.f5:
                         print "- %s" % f.relpath(self._dirn)
 
-    def match_primary_data(self,*analysis_dirs):
+    def match_primary_data(self,*analysis_dirs,**kws):
         """
         Match up primary data with links from analysis dirs
 
@@ -350,10 +405,20 @@ class SolidDataDir(core.DataDir):
         This method reports for each library whether the
         primary data is referenced.
 
+        If the 'output' keyword is an NdjsonWriter (see the
+        'output' module) then write a 'match' record for
+        each library instead of printing the report.
+
         """
+        output = kws.get('output',None)
         # Check there is primary data here
         if len(self.libraries) == 0:
-            print "%s: doesn't appear to contain any libraries" % self.name
+            if output is None:
+                print "%s: doesn't appear to contain any libraries" % \
+                    self.name
+            else:
+                logging.warning("%s: doesn't appear to contain any "
+                                "libraries" % self.name)
             return
         # Collect all symlink targets from analysis dirs
         symlinks = {}
@@ -362,12 +427,14 @@ class SolidDataDir(core.DataDir):
             if not os.path.isdir(dirn):
                 logging.error("No directory %s" % dirn)
                 continue
-            print "Collecting symlinks from %s" % os.path.basename(dirn)
-            for ln in core.DataDir(dirn).symlinks():
-                target = ln.resolve_target()
-                if target not in symlinks:
-                    symlinks[target] = []
-                symlinks[target].append((ln,target))
+            if output is None:
+                print "Collecting symlinks from %s" % os.path.basename(dirn)
+            with profiler.timer('collect_symlinks',item=dirn):
+                for ln in core.DataDir(dirn).symlinks():
+                    target = ln.resolve_target()
+                    if target not in symlinks:
+                        symlinks[target] = []
+                    symlinks[target].append((ln,target))
         # Check primary data files against links
         lib_links = {}
         for lib in self.libraries:
@@ -381,9 +448,11 @@ class SolidDataDir(core.DataDir):
                         lib_links[lib.name]['file_sets'].append(fset)
                         break
         # Report
-        print "Primary data links from analysis dir for each group:"
+        if output is None:
+            print "Primary data links from analysis dir for each group:"
         for group in self.library_groups:
-            print "* %s *" % group
+            if output is None:
+                print "* %s *" % group
             for lib in self.libraries_in_group(group):
                 msg = []
                 # Check that there are references
@@ -418,7 +487,14 @@ class SolidDataDir(core.DataDir):
                         else:
                             msg.append("partially referenced")
                 # Print message
-                print "- %s:\t%s" % (lib.name,'; '.join(msg))
+                if output is None:
+                    print "- %s:\t%s" % (lib.name,'; '.join(msg))
+                else:
+                    output.write('match',
+                                 group=group,
+                                 library=lib.name,
+                                 status='; '.join(msg),
+                                 linked_file_sets=len(file_sets))
 
 #######################################################################
 # Functions
@@ -466,6 +542,7 @@ def get_library_names_and_timestamps(name):
 
     """
     # Extract timestamp
+    import bcftbx.SolidData as SolidData
     timestamp = SolidData.extract_library_timestamp(name)
     if timestamp is None:
         timestamp = 'unknown'
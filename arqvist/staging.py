@@ -0,0 +1,495 @@
+#!/bin/env python
+#
+#     staging.py: in-process staging of data dirs
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+In-process staging of data dirs
+
+Provides an alternative to staging data dirs with 'rsync' (see
+'DataDir.copy_to'), which copies the files across a pool of threads
+and generates the checksums for each file from the data as it's
+copied. The checksums are written directly to the '.archiver' cache
+of the staged copy, so staging and checksumming needs a single read
+of the source data (rather than one read by rsync, and two more to
+generate checksums for the staged file and its uncompressed
+contents).
+
+As with 'rsync -a', the data dir is copied into the staging
+directory (i.e. 'DIR' is staged to 'STAGING_DIR/DIR'); directories,
+files and symlinks are copied with their permissions, modification
+times and (where allowed, e.g. when running as root) owner and
+group, and symlinks are copied as symlinks (with their targets
+unchanged). The '.archiver' cache directory of the source
+isn't copied.
+
+If the staged copy already exists (e.g. because an earlier stage was
+interrupted) then the scans of the source and the staged copy are
+compared to make a StagingPlan, and only the new and changed entries
+are copied. As with rsync, files are assumed to be unchanged if their
+size and modification time match (and the staged copy has a checksum
+for them, so files copied by an interrupted stage whose checksums
+weren't recorded are copied again); the checksums of unchanged files
+are kept from the cache of the staged copy. Entries which are only in
+the staged copy are removed if 'delete' is specified (and partial
+copies left by an interrupted stage are always removed).
+
+Example usage:
+
+>>> stage_dir(DataDir('/data/run1'),'/staging',nthreads=8)
+0
+
+"""
+
+import os
+import io
+import re
+import stat
+import errno
+import shutil
+import logging
+import tempfile
+from multiprocessing.pool import ThreadPool
+from .core import DataDir
+from .core import entry_type
+from .profiling import profiler
+from .progress import get_progress_reporter
+from .progress import format_bytes
+from .compression import get_codec
+from .compression import COMPRESSION_TYPES
+from . import hashing
+
+# Default number of copying threads
+STAGING_THREADS = 4
+
+# Tolerance when comparing modification times (seconds); times
+# are only copied with microsecond precision
+MODIFY_WINDOW = 0.001
+
+# Temporary files written by 'copy_file' (i.e. '.NAME.XXXXXX')
+PARTIAL_COPY = re.compile(r"^\.(.+)\.[A-Za-z0-9_]{6}$")
+
+#######################################################################
+# Classes
+#######################################################################
+
+class StagingPlan:
+    """
+    Class describing the transfers needed to stage a data dir
+
+    Entries are stored as tuples (relpath,src,dest), where
+    'relpath' is the path relative to the data dir and
+    'src' and 'dest' are the ArchiveFile instances in the
+    source and the staged copy (or None if not present),
+    in the lists:
+
+    new      : only in the source
+    changed  : in both but of different types, or files
+               with different sizes or timestamps (see
+               MODIFY_WINDOW), or
+               symlinks with different targets
+    deleted  : only in the staged copy
+    partial  : partial copies left in the staged copy by
+               an interrupted stage
+    unchanged: the same in both (directories and unchanged
+               files whose permissions differ are also
+               listed in 'update_attrs')
+
+    Entries are in the order of the scans, so directories
+    come before their contents.
+
+    """
+    def __init__(self):
+        self.new = []
+        self.changed = []
+        self.deleted = []
+        self.partial = []
+        self.unchanged = []
+        self.update_attrs = []
+
+    @property
+    def transfers(self):
+        """
+        Return the entries which need to be copied
+        """
+        return self.new + self.changed
+
+    @property
+    def nbytes(self):
+        """
+        Return the number of bytes of file data to copy
+        """
+        return sum([src.size for relpath,src,dest in self.transfers
+                    if entry_type(src) == 'file'])
+
+    def report(self,delete=False):
+        """
+        Print the plan
+        """
+        for status,entries in (('new',self.new),
+                               ('changed',self.changed),
+                               (('deleted' if delete else 'extra'),
+                                self.deleted),
+                               ('partial',self.partial)):
+            for relpath,src,dest in entries:
+                print "%s\t%s" % (status,relpath)
+        print "%d new, %d changed, %d %s, %d unchanged (%s to copy)" % \
+            (len(self.new),
+             len(self.changed),
+             len(self.deleted),
+             ('deleted' if delete else 'only in staged copy'),
+             len(self.unchanged),
+             format_bytes(self.nbytes))
+
+#######################################################################
+# Functions
+#######################################################################
+
+def plan_staging(datadir,staged=None,algorithm=hashing.DEFAULT_ALGORITHM):
+    """
+    Compare a data dir with its staged copy
+
+    Files are treated as changed if the size, timestamp
+    or type differs, or if the staged copy has no checksum
+    for 'algorithm' in its cache (e.g. because a previous
+    copy failed verification, or was still in progress
+    when staging was interrupted).
+
+    Arguments:
+      datadir: DataDir instance for the source
+      staged: DataDir instance for the staged copy (or
+        None if there isn't one yet)
+      algorithm: hash algorithm that the staged copy's
+        checksums are generated with
+
+    Returns a StagingPlan instance.
+    """
+    plan = StagingPlan()
+    src_dir = datadir.path
+    existing = {}
+    if staged is not None:
+        for f in staged.files():
+            existing[f.relpath(staged.path)] = f
+    for f in datadir.files():
+        relpath = f.relpath(src_dir)
+        ftype = entry_type(f)
+        if ftype is None:
+            logging.warning("%s: not a regular file, skipped" % f.path)
+            continue
+        dest = existing.pop(relpath,None)
+        if dest is None:
+            plan.new.append((relpath,f,None))
+        elif ftype != entry_type(dest):
+            plan.changed.append((relpath,f,dest))
+        elif ftype == 'file' and \
+             (f.size != dest.size or
+              abs(f.timestamp - dest.timestamp) > MODIFY_WINDOW or
+              dest.stored_checksums(algorithm)[0] is None):
+            plan.changed.append((relpath,f,dest))
+        elif ftype == 'link' and \
+             os.readlink(f.path) != os.readlink(dest.path):
+            plan.changed.append((relpath,f,dest))
+        else:
+            plan.unchanged.append((relpath,f,dest))
+            if ftype == 'dir' or \
+               (ftype == 'file' and f.mode != dest.mode):
+                plan.update_attrs.append((relpath,f,dest))
+    for relpath in existing:
+        dest = existing[relpath]
+        if is_partial_copy(relpath,datadir):
+            plan.partial.append((relpath,None,dest))
+        else:
+            plan.deleted.append((relpath,None,dest))
+    # Sort entries only in the staged copy by path
+    plan.deleted.sort()
+    plan.partial.sort()
+    return plan
+
+def stage_dir(datadir,staging_dir,nthreads=STAGING_THREADS,
+              algorithm=hashing.DEFAULT_ALGORITHM,progress=False,
+              dry_run=False,delete=False):
+    """
+    Make or update a staging copy of a data dir
+
+    Copies the data dir into 'staging_dir', generating
+    checksums for the files as they're copied and
+    writing them to the cache in the staged copy. If
+    the staged copy already exists then only new and
+    changed entries are copied (see 'plan_staging').
+
+    Arguments:
+      datadir: DataDir instance to stage
+      staging_dir: directory to make the copy under
+      nthreads: number of threads to copy files with
+      algorithm: hash algorithm to generate checksums
+        with (see 'hashing.available_algorithms')
+      progress: if True then report progress of the
+        copying on stderr
+      dry_run: if True then only report what would be
+        copied
+      delete: if True then remove entries from the
+        staged copy which aren't in the source
+
+    Returns zero on success, or the number of files
+    which couldn't be copied.
+    """
+    hashing.get_hasher(algorithm)
+    src = datadir.path
+    dest = os.path.join(os.path.abspath(staging_dir),datadir.name)
+    if os.path.isdir(dest):
+        staged = DataDir(dest)
+    else:
+        staged = None
+    with profiler.timer('stage_plan'):
+        plan = plan_staging(datadir,staged,algorithm)
+    if dry_run:
+        plan.report(delete=delete)
+        return 0
+    # Remove partial copies, deleted entries (deepest
+    # first) and entries which are changing type
+    removals = plan.partial
+    if delete:
+        removals = removals + plan.deleted
+    for relpath,f,d in sorted(removals,reverse=True):
+        remove_entry(d.path)
+    for relpath,f,d in plan.changed:
+        if entry_type(f) != entry_type(d):
+            remove_entry(d.path)
+    # Create the directory structure
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    for relpath,f,d in plan.transfers:
+        if entry_type(f) == 'dir' and \
+           not os.path.isdir(os.path.join(dest,relpath)):
+            os.makedirs(os.path.join(dest,relpath))
+    # Create the cache directory now, so that the timestamp
+    # set on the top-level directory below isn't changed
+    cachedir = os.path.join(dest,'.archiver')
+    if not os.path.isdir(cachedir):
+        os.mkdir(cachedir)
+    # Symlinks
+    for relpath,f,d in plan.transfers:
+        if entry_type(f) == 'link':
+            copy_symlink(f.path,os.path.join(dest,relpath))
+    # Permissions for unchanged files
+    for relpath,f,d in plan.update_attrs:
+        if entry_type(f) == 'file':
+            copy_owner(f.path,d.path)
+            os.chmod(d.path,stat.S_IMODE(f.mode))
+    # Files
+    files = [f for relpath,f,d in plan.transfers
+             if entry_type(f) == 'file']
+    progress = get_progress_reporter("Staging",plan.nbytes,
+                                     total_items=len(files),
+                                     enabled=progress)
+    nerrors = 0
+    checksums = {}
+    try:
+        with profiler.timer('stage',nbytes=plan.nbytes):
+            pool = ThreadPool(nthreads)
+            try:
+                sizes = dict([(f.path,f.size) for f in files])
+                jobs = [(f.path,os.path.join(dest,f.relpath(src)),
+                         algorithm,f.compression,
+                         f.stored_checksums(algorithm))
+                        for f in files]
+                for path,result,error in pool.imap_unordered(_copy_job,
+                                                             jobs):
+                    if error is not None:
+                        logging.error("%s: failed to copy: %s" %
+                                      (path,error))
+                        nerrors += 1
+                    else:
+                        checksums[os.path.relpath(path,src)] = result
+                        profiler.count('files_staged')
+                    progress.update(sizes[path],1)
+            except BaseException:
+                # Interrupted or failed: discard the queued copies
+                # rather than waiting for them to finish
+                pool.terminate()
+                pool.join()
+                raise
+            pool.close()
+            pool.join()
+        progress.finish()
+        # Set directory permissions and timestamps last (and
+        # deepest first), since copying the contents updates
+        # the timestamps
+        dirs = [(relpath,f) for relpath,f,d in plan.transfers +
+                plan.update_attrs if entry_type(f) == 'dir']
+        for relpath,f in sorted(dirs,reverse=True):
+            copy_owner(f.path,os.path.join(dest,relpath))
+            shutil.copystat(f.path,os.path.join(dest,relpath))
+        copy_owner(src,dest)
+        shutil.copystat(src,dest)
+    finally:
+        # Write the checksums to the cache (including
+        # for files copied before any interruption)
+        if staged is None:
+            staged = DataDir(dest)
+        else:
+            staged.rescan()
+        for f in staged.files():
+            try:
+                staged_checksums = checksums[f.relpath(dest)]
+            except KeyError:
+                continue
+            f.set_checksums(algorithm,*staged_checksums)
+        staged.write_cache()
+    return nerrors
+
+def is_partial_copy(relpath,datadir):
+    """
+    Check if a path is a partial copy left by 'copy_file'
+
+    Returns True if the basename of 'relpath' matches the
+    name of the temporary files written by 'copy_file'
+    for a file at the same location in 'datadir'.
+    """
+    dirn,name = os.path.split(relpath)
+    match = PARTIAL_COPY.match(name)
+    if match is None:
+        return False
+    return os.path.lexists(os.path.join(datadir.path,dirn,match.group(1)))
+
+def remove_entry(path):
+    """
+    Remove a file, symlink or directory (and its contents)
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+def copy_file(src,dest,algorithm=hashing.DEFAULT_ALGORITHM,
+              compression=None,block_size=None,expected_checksum=None):
+    """
+    Copy a file and generate its checksums
+
+    The contents of 'src' are read once (into a reusable
+    buffer) and are written to 'dest' and used to generate
+    the checksum. As with rsync, the data are written to
+    a temporary file in the same directory which is then
+    renamed to 'dest'. If 'compression' is one of the
+    COMPRESSION_TYPES then the data are also decompressed
+    to generate the checksum for the uncompressed contents
+    (if the codec can't decompress in-process then this
+    checksum is None). The permissions and timestamps of
+    'src' are copied to 'dest', along with the owner and
+    group where allowed (see 'copy_owner').
+
+    If 'expected_checksum' is given (e.g. the cached
+    checksum for 'src') and the checksum of the copied
+    data doesn't match then the temporary file is removed
+    and IOError is raised, so 'dest' is left untouched.
+
+    Returns tuple (checksum,checksum_uncompressed_contents).
+    """
+    if block_size is None:
+        block_size = hashing.BLOCK_SIZE
+    hasher = hashing.get_hasher(algorithm)
+    if not compression:
+        decompressor = None
+    elif compression in COMPRESSION_TYPES:
+        decompressor = get_codec(compression).decompressor()
+    else:
+        decompressor = None
+    if decompressor is not None:
+        uncompressed_hasher = hashing.get_hasher(algorithm)
+    fadvise = hashing.get_fadvise()
+    buf = bytearray(block_size)
+    fd,tmpfile = tempfile.mkstemp(dir=os.path.dirname(dest),
+                                  prefix=".%s." % os.path.basename(dest))
+    try:
+        with io.open(fd,'wb',buffering=0) as fout:
+            with io.open(src,'rb',buffering=0) as fin:
+                fadvise(fin.fileno(),0,0,hashing.POSIX_FADV_SEQUENTIAL)
+                offset = 0
+                while True:
+                    n = fin.readinto(buf)
+                    if not n:
+                        break
+                    data = buffer(buf,0,n)
+                    _write_all(fout,data)
+                    hasher.update(data)
+                    if decompressor is not None:
+                        uncompressed_hasher.update(
+                            decompressor.decompress(data))
+                    if hashing.DROP_CACHE:
+                        fadvise(fin.fileno(),offset,n,
+                                hashing.POSIX_FADV_DONTNEED)
+                    offset += n
+        checksum = hasher.hexdigest()
+        if expected_checksum is not None and \
+           checksum != expected_checksum:
+            raise IOError("%s checksum differs from cached value "
+                          "(file changed during copy?)" % algorithm)
+        copy_owner(src,tmpfile)
+        shutil.copystat(src,tmpfile)
+        os.rename(tmpfile,dest)
+    except Exception:
+        os.remove(tmpfile)
+        raise
+    if not compression:
+        uncompressed_checksum = checksum
+    elif decompressor is not None:
+        uncompressed_checksum = uncompressed_hasher.hexdigest()
+    else:
+        uncompressed_checksum = None
+    return (checksum,uncompressed_checksum)
+
+def copy_symlink(src,dest):
+    """
+    Copy a symlink
+
+    The new link has the same target as 'src' (which
+    isn't changed, even if it's a relative link), and the
+    same owner and group where allowed (see 'copy_owner').
+    An existing file or link at 'dest' is replaced.
+    """
+    if os.path.lexists(dest):
+        os.remove(dest)
+    os.symlink(os.readlink(src),dest)
+    copy_owner(src,dest)
+
+def copy_owner(src,dest):
+    """
+    Copy the owner and group of a file, dir or symlink
+
+    Symlinks themselves are updated (rather than their
+    targets). As with 'rsync -a', failures because the
+    user isn't allowed to change the ownership (e.g.
+    when not running as root) are ignored, so 'dest'
+    is left owned by the user.
+    """
+    st = os.lstat(src)
+    try:
+        os.lchown(dest,st.st_uid,st.st_gid)
+    except OSError,ex:
+        if ex.errno != errno.EPERM:
+            raise
+
+def _write_all(fp,data):
+    # Write all the data to an unbuffered file (which
+    # can return after a partial write)
+    n = fp.write(data)
+    while n < len(data):
+        n += fp.write(buffer(data,n))
+
+def _copy_job(args):
+    # Copy a file in a worker thread
+    # Returns tuple (path,checksums,error)
+    src,dest,algorithm,compression,stored = args
+    try:
+        result = copy_file(src,dest,algorithm,compression,
+                           expected_checksum=stored[0])
+    except Exception,ex:
+        # Includes errors from decompressing corrupt data, and
+        # checksums which don't match the cached value
+        return (src,None,ex)
+    checksum,uncompressed_checksum = result
+    if uncompressed_checksum is None:
+        # Use the cached checksum for the source if there is one
+        result = (checksum,stored[1])
+    return (src,result,None)
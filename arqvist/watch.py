@@ -0,0 +1,316 @@
+#!/bin/env python
+#
+#     watch.py: keep data dirs up to date with file system changes
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Keep data dirs up to date with file system changes
+
+Provides watchers which keep a DataDir (and its '.archiver' cache)
+up to date as files are created, deleted, renamed and modified,
+without rescanning the whole directory:
+
+>>> watcher = get_watcher(datadir)
+>>> if watcher.poll(timeout=1.0):
+...     print "Data dir has changed"
+
+On Linux the watcher uses inotify (via ctypes), so only the paths
+named in the events are examined and MD5 sums are only discarded
+for files which have actually been modified (see
+'DataDir.update_paths'). Otherwise (or if inotify can't be used,
+e.g. because the limit on the number of watches has been reached)
+the watcher falls back to rescanning the data dir at most every
+'interval' seconds (see 'DataDir.rescan').
+
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+import logging
+import ctypes
+import ctypes.util
+from .profiling import profiler
+
+# Minimum interval (in seconds) between rescans when polling
+POLL_INTERVAL = 5.0
+
+# Constants for inotify (from sys/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# Events to watch for
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | \
+             IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+             IN_ONLYDIR | IN_DONT_FOLLOW
+
+# Header of an inotify event (wd, mask, cookie, len)
+EVENT_HEADER = struct.Struct('iIII')
+
+# Size of buffer for reading events
+EVENT_BUFFER_SIZE = 64*1024
+
+#######################################################################
+# Classes
+#######################################################################
+
+class Watcher:
+    """
+    Base class for keeping a DataDir up to date
+
+    Subclasses should implement the 'poll' method.
+
+    """
+    def __init__(self,datadir,write_cache=True):
+        """
+        Create a new Watcher instance
+
+        Arguments:
+          datadir: DataDir instance to keep up to date
+          write_cache: if True then write the '.archiver'
+            cache (if present) whenever the DataDir
+            changes
+        """
+        self.datadir = datadir
+        self._write_cache = write_cache
+
+    def poll(self,timeout=0):
+        """
+        Apply any changes to the DataDir
+
+        Waits up to 'timeout' seconds for changes.
+
+        Returns True if the DataDir changed, False
+        otherwise.
+        """
+        raise NotImplementedError("Subclass must implement 'poll'")
+
+    def close(self):
+        """
+        Stop watching the data dir
+        """
+        pass
+
+    def _updated(self):
+        # Called when the DataDir has changed
+        profiler.count('watch_updates')
+        if self._write_cache:
+            self.datadir.write_cache()
+
+class PollingWatcher(Watcher):
+    """
+    Keep a DataDir up to date by rescanning it
+
+    The data dir is rescanned at most every 'interval'
+    seconds.
+
+    """
+    def __init__(self,datadir,interval=POLL_INTERVAL,write_cache=True):
+        Watcher.__init__(self,datadir,write_cache=write_cache)
+        self.interval = interval
+        self._last_scan = time.time()
+
+    def poll(self,timeout=0):
+        wait = self._last_scan + self.interval - time.time()
+        if wait > timeout:
+            # Not due for a rescan yet
+            if timeout > 0:
+                time.sleep(timeout)
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        changed = self.datadir.rescan()
+        self._last_scan = time.time()
+        if changed:
+            self._updated()
+        return changed
+
+class InotifyWatcher(Watcher):
+    """
+    Keep a DataDir up to date using inotify events
+
+    A watch is added for each directory in the data dir
+    (apart from '.archiver' cache directories), and new
+    directories are watched as they appear. Events are
+    collected on each call to 'poll' and the paths they
+    name are passed to 'DataDir.update_paths'; if the
+    kernel's event queue overflows then the data dir is
+    rescanned instead.
+
+    Raises OSError if inotify isn't available or the
+    watches can't be added.
+
+    """
+    def __init__(self,datadir,write_cache=True):
+        Watcher.__init__(self,datadir,write_cache=write_cache)
+        self._libc = get_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS,"inotify not available")
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK|IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err,os.strerror(err))
+        # Mapping of watch descriptors to directories
+        self._watches = {}
+        try:
+            self._add_watches(self.datadir.path)
+        except OSError:
+            self.close()
+            raise
+
+    def fileno(self):
+        """
+        Return the file descriptor for the inotify instance
+        """
+        return self._fd
+
+    def poll(self,timeout=0):
+        paths = set()
+        overflow = False
+        for path,mask in self._read_events(timeout):
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            paths.add(path)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE|IN_MOVED_TO):
+                    self._add_watches(path)
+                elif mask & IN_MOVED_FROM:
+                    self._remove_watches(path)
+        if overflow:
+            # Events were lost
+            logging.warning("%s: inotify event queue overflowed, "
+                            "rescanning" % self.datadir.path)
+            profiler.count('watch_overflows')
+            self._add_watches(self.datadir.path)
+            changed = self.datadir.rescan()
+        elif paths:
+            changed = self.datadir.update_paths(paths)
+        else:
+            changed = False
+        if changed:
+            self._updated()
+        return changed
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._watches = {}
+
+    def _add_watch(self,dirn):
+        # Add a watch for a single directory
+        wd = self._libc.inotify_add_watch(self._fd,dirn,WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT,errno.ENOTDIR):
+                # Removed in the meantime
+                return
+            raise OSError(err,os.strerror(err),dirn)
+        self._watches[wd] = dirn
+
+    def _add_watches(self,dirn):
+        # Add watches for a directory and its subdirectories
+        self._add_watch(dirn)
+        for d in os.walk(dirn):
+            d[1][:] = [x for x in d[1] if x != '.archiver']
+            for x in d[1]:
+                self._add_watch(os.path.join(d[0],x))
+
+    def _remove_watches(self,dirn):
+        # Remove watches for a directory and its subdirectories
+        # (e.g. when it's been moved)
+        prefix = dirn + os.sep
+        for wd,d in self._watches.items():
+            if d == dirn or d.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd,wd)
+                del(self._watches[wd])
+
+    def _read_events(self,timeout=0):
+        # Return list of (path,mask) tuples for pending events
+        events = []
+        ready = select.select([self._fd],[],[],timeout)[0]
+        while ready:
+            try:
+                buf = os.read(self._fd,EVENT_BUFFER_SIZE)
+            except OSError,ex:
+                if ex.errno in (errno.EAGAIN,errno.EINTR):
+                    break
+                raise
+            pos = 0
+            while pos < len(buf):
+                wd,mask,cookie,length = EVENT_HEADER.unpack_from(buf,pos)
+                pos += EVENT_HEADER.size
+                name = buf[pos:pos+length].rstrip('\0')
+                pos += length
+                profiler.count('watch_events')
+                if mask & IN_IGNORED:
+                    # Watch was removed (e.g. directory deleted)
+                    self._watches.pop(wd,None)
+                    continue
+                if mask & IN_Q_OVERFLOW:
+                    events.append((None,mask))
+                    continue
+                try:
+                    dirn = self._watches[wd]
+                except KeyError:
+                    # Stale event for a removed watch
+                    continue
+                events.append(((os.path.join(dirn,name) if name else dirn),
+                               mask))
+            # Collect any more events which are ready
+            ready = select.select([self._fd],[],[],0)[0]
+        return events
+
+#######################################################################
+# Functions
+#######################################################################
+
+def get_libc():
+    """
+    Return the C library (or None if inotify isn't available)
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+    except (OSError,AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int,
+                                       ctypes.c_char_p,
+                                       ctypes.c_uint32]
+    return libc
+
+def get_watcher(datadir,interval=POLL_INTERVAL,write_cache=True):
+    """
+    Return a Watcher for a DataDir
+
+    Returns an InotifyWatcher if possible, otherwise a
+    PollingWatcher which rescans at most every
+    'interval' seconds.
+    """
+    if get_libc() is not None:
+        try:
+            return InotifyWatcher(datadir,write_cache=write_cache)
+        except OSError,ex:
+            logging.warning("%s: unable to use inotify (%s), falling "
+                            "back to polling" % (datadir.path,ex))
+    return PollingWatcher(datadir,interval=interval,
+                          write_cache=write_cache)
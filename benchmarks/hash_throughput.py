@@ -0,0 +1,177 @@
+#!/bin/env python
+#
+#     hash_throughput.py: benchmark read paths for checksumming files
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Benchmark the read paths used for generating file checksums
+
+Compares the throughput of the following methods for reading a file
+and generating a checksum:
+
+md5sum  : bcftbx.Md5sum.md5sum (the original implementation, only
+          if bcftbx is installed)
+read    : loop calling 'read' with a fixed block size, which
+          allocates a new string for each block
+readinto: arqvist.hashing.hash_file reading into a reusable buffer
+mmap    : arqvist.hashing.hash_file reading via mmap
+
+Before each run the test file is dropped from the page cache using
+posix_fadvise (unless --warm is specified), so the timings include
+reading the data from disk; note that this only works for files on
+filesystems which honour the advice.
+
+Usage:
+
+    python benchmarks/hash_throughput.py [OPTIONS] [FILE]
+
+If FILE isn't supplied then a temporary file of random data is
+created.
+
+"""
+
+import os
+import sys
+import time
+import hashlib
+import tempfile
+import optparse
+
+# Make sure the arqvist package from this source tree is used
+sys.path.insert(0,os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+from arqvist import hashing
+
+#######################################################################
+# Methods
+#######################################################################
+
+def hash_md5sum(filen,algorithm,block_size):
+    import bcftbx.Md5sum as Md5sum
+    return Md5sum.md5sum(filen)
+
+def hash_read(filen,algorithm,block_size):
+    hasher = hashing.get_hasher(algorithm)
+    with open(filen,'rb') as fp:
+        while True:
+            data = fp.read(block_size)
+            if not data:
+                break
+            hasher.update(data)
+    return hasher.hexdigest()
+
+def hash_readinto(filen,algorithm,block_size):
+    return hashing.hash_file(filen,algorithm,block_size=block_size,
+                             use_mmap=False)
+
+def hash_mmap(filen,algorithm,block_size):
+    return hashing.hash_file(filen,algorithm,block_size=block_size,
+                             use_mmap=True)
+
+METHODS = (('md5sum',hash_md5sum),
+           ('read',hash_read),
+           ('readinto',hash_readinto),
+           ('mmap',hash_mmap),)
+
+#######################################################################
+# Functions
+#######################################################################
+
+def make_test_file(filen,size):
+    """
+    Write 'size' bytes of random data to a file
+    """
+    block = os.urandom(min(size,1024*1024))
+    with open(filen,'wb') as fp:
+        nbytes = 0
+        while nbytes < size:
+            data = block[:size-nbytes]
+            fp.write(data)
+            nbytes += len(data)
+
+def drop_from_cache(filen):
+    """
+    Ask the kernel to drop a file from the page cache
+    """
+    fd = os.open(filen,os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        hashing.get_fadvise()(fd,0,0,hashing.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def time_method(method,filen,algorithm,block_size,repeats,warm=False):
+    """
+    Return the best time for a method (or None if unavailable)
+    """
+    times = []
+    for i in range(repeats):
+        if not warm:
+            drop_from_cache(filen)
+        start = time.time()
+        try:
+            method(filen,algorithm,block_size)
+        except ImportError:
+            return None
+        times.append(time.time() - start)
+    return min(times)
+
+#######################################################################
+# Main program
+#######################################################################
+
+if __name__ == "__main__":
+    p = optparse.OptionParser(usage="%prog [OPTIONS] [FILE]",
+                              description="Compare the throughput of "
+                              "methods for generating checksums for FILE "
+                              "(or a temporary file of random data).")
+    p.add_option('--size',action='store',dest='size',type='int',
+                 default=256*1024*1024,help="Size of the temporary test "
+                 "file in bytes (default: 256M)")
+    p.add_option('--hash',action='store',dest='algorithm',default='md5',
+                 choices=hashing.available_algorithms(),
+                 help="Hash algorithm (default: md5)")
+    p.add_option('--block-size',action='store',dest='block_sizes',
+                 default='65536,1048576,4194304',
+                 help="Comma-separated list of block sizes to test "
+                 "(default: 65536,1048576,4194304)")
+    p.add_option('--repeats',action='store',dest='repeats',type='int',
+                 default=3,help="Number of times to run each method "
+                 "(default: 3)")
+    p.add_option('--warm',action='store_true',dest='warm',default=False,
+                 help="Don't drop the file from the page cache before "
+                 "each run")
+    options,args = p.parse_args()
+    block_sizes = [int(b) for b in options.block_sizes.split(',')]
+    tmp_file = None
+    if args:
+        filen = args[0]
+    else:
+        fd,tmp_file = tempfile.mkstemp(suffix='.dat')
+        os.close(fd)
+        print "Generating %d byte test file %s" % (options.size,tmp_file)
+        make_test_file(tmp_file,options.size)
+        filen = tmp_file
+    try:
+        size = os.path.getsize(filen)
+        print "# Method\tBlock size\tTime(s)\tMB/s"
+        for name,method in METHODS:
+            if name == 'md5sum' and options.algorithm != 'md5':
+                continue
+            for block_size in block_sizes:
+                elapsed = time_method(method,filen,options.algorithm,
+                                      block_size,options.repeats,
+                                      warm=options.warm)
+                if elapsed is None:
+                    print "%s\t-\tnot available" % name
+                    break
+                print "%s\t%d\t%.3f\t%.1f" % (name,block_size,elapsed,
+                                              (size/1048576.0/elapsed
+                                               if elapsed else 0.0))
+                if name == 'md5sum':
+                    # Block size is fixed
+                    break
+    finally:
+        if tmp_file:
+            os.remove(tmp_file)
@@ -0,0 +1,304 @@
+#!/bin/env python
+#
+#     make_ngs_tree.py: generate synthetic NGS directory trees
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Generate synthetic SOLiD and Illumina data directories for benchmarking
+
+The generated trees mimic the layouts seen in real data:
+
+SOLiD primary data:
+
+    SAMPLE/results.F1B1/libraries/LIBRARY/primary.TIMESTAMP/reads/
+        solid0127_20111207_FRAG_BC_SAMPLE_BC_LIBRARY_F3.csfasta
+        solid0127_20111207_FRAG_BC_SAMPLE_BC_LIBRARY_F3_QV.qual
+
+Illumina data:
+
+    PROJECT/fastqs/SAMPLE_S1_L001_R1_001.fastq(.gz)
+
+Analysis directories contain symlinks to a fraction of the primary
+data files plus some analysis products (e.g. BAM and GFF files).
+
+File counts, sizes, the fraction of files which are compressed and
+the fraction of primary data files linked from the analysis directory
+are all configurable. The random number generator is seeded so the
+same options always produce the same tree.
+
+Usage:
+
+    python benchmarks/make_ngs_tree.py [OPTIONS] DIR
+
+"""
+
+import os
+import bz2
+import gzip
+import random
+import optparse
+
+#######################################################################
+# Functions
+#######################################################################
+
+def make_records(kind,size,rng,read_length=50):
+    """
+    Generate file contents of approximately 'size' bytes
+
+    'kind' is one of 'csfasta', 'qual', 'fastq' or
+    'other'. A block of records is generated and then
+    repeated to reach the required size, which keeps
+    generation fast for large files.
+    """
+    if not size:
+        return ''
+    records = []
+    block_size = min(size,65536)
+    nbytes = 0
+    i = 0
+    while nbytes < block_size:
+        i += 1
+        if kind == 'csfasta':
+            record = ">%d_%d_%d_F3\nT%s\n" % \
+                     (i,rng.randint(1,2000),rng.randint(1,2000),
+                      ''.join([rng.choice('0123')
+                               for j in range(read_length)]))
+        elif kind == 'qual':
+            record = ">%d_%d_%d_F3\n%s\n" % \
+                     (i,rng.randint(1,2000),rng.randint(1,2000),
+                      ' '.join([str(rng.randint(0,33))
+                                for j in range(read_length)]))
+        elif kind == 'fastq':
+            record = "@READ:%d:%d:%d 1:N:0:1\n%s\n+\n%s\n" % \
+                     (i,rng.randint(1,2000),rng.randint(1,2000),
+                      ''.join([rng.choice('ACGT')
+                               for j in range(read_length)]),
+                      ''.join([rng.choice('?@ABCDEFGHI')
+                               for j in range(read_length)]))
+        else:
+            record = "%s\n" % ''.join([rng.choice('ACGTN\t ')
+                                       for j in range(80)])
+        records.append(record)
+        nbytes += len(record)
+    block = ''.join(records)
+    return (block * (size//len(block) + 1))[:size]
+
+def write_file(path,contents,compression=None):
+    """
+    Write contents to a file, optionally compressing it
+
+    'compression' can be None, 'bz2' or 'gz'; the
+    appropriate extension is appended to the path.
+
+    Returns the path of the file that was written.
+    """
+    if compression == 'bz2':
+        path = path + '.bz2'
+        fp = bz2.BZ2File(path,'w')
+    elif compression == 'gz':
+        path = path + '.gz'
+        fp = gzip.open(path,'wb')
+    else:
+        fp = open(path,'wb')
+    fp.write(contents)
+    fp.close()
+    return path
+
+def make_solid_tree(dirn,nsamples=2,nlibraries=4,file_size=65536,
+                    compressed_fraction=0.0,rng=None):
+    """
+    Create a SOLiD primary data directory
+
+    Creates 'nsamples' samples each with 'nlibraries'
+    libraries, each with a csfasta/qual file pair of
+    approximately 'file_size' bytes. A fraction
+    'compressed_fraction' of the files are compressed
+    with bzip2.
+
+    Returns a list of the primary data files.
+    """
+    if rng is None:
+        rng = random.Random(0)
+    files = []
+    instrument = 'solid0127_20111207_FRAG_BC'
+    for i in range(nsamples):
+        sample = "S%02d_POOL" % (i+1)
+        for j in range(nlibraries):
+            library = "%s%02d" % ('ABCDEFGH'[i % 8]*2,j+1)
+            timestamp = "201112%02d%02d%02d%02d%03d" % \
+                        (rng.randint(1,28),rng.randint(0,23),
+                         rng.randint(0,59),rng.randint(0,59),
+                         rng.randint(0,999))
+            reads = os.path.join(dirn,sample,'results.F1B1','libraries',
+                                 library,'primary.%s' % timestamp,'reads')
+            os.makedirs(reads)
+            name = "%s_%s_BC_%s" % (instrument,sample,library)
+            for ext,kind in (('_F3.csfasta','csfasta'),
+                             ('_F3_QV.qual','qual')):
+                compression = ('bz2' if rng.random() < compressed_fraction
+                               else None)
+                files.append(write_file(os.path.join(reads,name+ext),
+                                        make_records(kind,file_size,rng),
+                                        compression))
+    return files
+
+def make_illumina_tree(dirn,nprojects=2,nsamples=4,nlanes=1,
+                       file_size=65536,compressed_fraction=1.0,
+                       rng=None):
+    """
+    Create an Illumina data directory with paired-end FASTQs
+
+    Creates 'nprojects' projects each with 'nsamples'
+    samples, each with an R1/R2 pair of FASTQs of
+    approximately 'file_size' bytes for each of 'nlanes'
+    lanes. A fraction 'compressed_fraction' of the files
+    are compressed with gzip.
+
+    Returns a list of the FASTQ files.
+    """
+    if rng is None:
+        rng = random.Random(0)
+    files = []
+    for i in range(nprojects):
+        fastqs = os.path.join(dirn,"Project_%02d" % (i+1),'fastqs')
+        os.makedirs(fastqs)
+        for j in range(nsamples):
+            for lane in range(nlanes):
+                contents = make_records('fastq',file_size,rng)
+                compression = ('gz' if rng.random() < compressed_fraction
+                               else None)
+                for read in ('R1','R2'):
+                    name = "PJB%d-%d_S%d_L%03d_%s_001.fastq" % \
+                           (i+1,j+1,j+1,lane+1,read)
+                    files.append(write_file(os.path.join(fastqs,name),
+                                            contents,compression))
+    return files
+
+def make_analysis_dir(dirn,primary_data,symlink_ratio=0.5,
+                      nproducts=4,file_size=65536,
+                      compressed_fraction=0.0,rng=None):
+    """
+    Create an analysis directory linked to primary data
+
+    A fraction 'symlink_ratio' of the files in
+    'primary_data' are linked from the analysis dir
+    (using a mixture of absolute and relative links),
+    and 'nproducts' analysis products (BAM, GFF and
+    temporary files) are created for each linked file.
+
+    Returns a list of the symlinks.
+    """
+    if rng is None:
+        rng = random.Random(0)
+    links = []
+    for i,f in enumerate(primary_data):
+        if rng.random() >= symlink_ratio:
+            continue
+        subdir = os.path.join(dirn,"analysis_%02d" % (i//8+1))
+        if not os.path.exists(subdir):
+            os.makedirs(subdir)
+        link = os.path.join(subdir,os.path.basename(f))
+        if i % 2:
+            target = os.path.relpath(f,subdir)
+        else:
+            target = os.path.abspath(f)
+        os.symlink(target,link)
+        links.append(link)
+        for j in range(nproducts):
+            ext = ('bam','gff3','txt','tmp')[j % 4]
+            compression = ('bz2' if rng.random() < compressed_fraction
+                           else None)
+            name = "%s_%d.%s" % (os.path.basename(f).split('.')[0],j,ext)
+            write_file(os.path.join(subdir,name),
+                       make_records('other',file_size//4,rng),
+                       compression)
+    return links
+
+def make_ngs_tree(dirn,platform='solid',nsamples=2,nlibraries=4,
+                  file_size=65536,compressed_fraction=0.0,
+                  symlink_ratio=0.5,nproducts=4,seed=0):
+    """
+    Create a primary data directory and a linked analysis directory
+
+    'dirn' is created along with the subdirectories
+    'primary' and 'analysis'. 'platform' is either
+    'solid' or 'illumina' (for Illumina data
+    'nlibraries' is the number of samples per project
+    and 'nsamples' is the number of projects).
+
+    Returns a tuple (primary_dir,analysis_dir).
+    """
+    rng = random.Random(seed)
+    primary_dir = os.path.join(dirn,'primary')
+    analysis_dir = os.path.join(dirn,'analysis')
+    os.makedirs(primary_dir)
+    os.makedirs(analysis_dir)
+    if platform == 'solid':
+        files = make_solid_tree(primary_dir,nsamples=nsamples,
+                                nlibraries=nlibraries,
+                                file_size=file_size,
+                                compressed_fraction=compressed_fraction,
+                                rng=rng)
+    elif platform == 'illumina':
+        files = make_illumina_tree(primary_dir,nprojects=nsamples,
+                                   nsamples=nlibraries,
+                                   file_size=file_size,
+                                   compressed_fraction=compressed_fraction,
+                                   rng=rng)
+    else:
+        raise Exception("Unrecognised platform: '%s'" % platform)
+    make_analysis_dir(analysis_dir,files,symlink_ratio=symlink_ratio,
+                      nproducts=nproducts,file_size=file_size,rng=rng)
+    return (primary_dir,analysis_dir)
+
+#######################################################################
+# Main program
+#######################################################################
+
+if __name__ == "__main__":
+    p = optparse.OptionParser(usage="%prog [OPTIONS] DIR",
+                              description="Generate a synthetic NGS "
+                              "data directory DIR for benchmarking.")
+    p.add_option('--platform',action='store',dest='platform',
+                 default='solid',
+                 help="Type of data to generate: 'solid' or 'illumina' "
+                 "(default: solid)")
+    p.add_option('--samples',action='store',dest='nsamples',type='int',
+                 default=2,help="Number of samples (SOLiD) or projects "
+                 "(Illumina) (default: 2)")
+    p.add_option('--libraries',action='store',dest='nlibraries',
+                 type='int',default=4,help="Number of libraries per "
+                 "sample (SOLiD) or samples per project (Illumina) "
+                 "(default: 4)")
+    p.add_option('--file-size',action='store',dest='file_size',
+                 type='int',default=65536,help="Approximate size of each "
+                 "primary data file in bytes (default: 65536)")
+    p.add_option('--compressed',action='store',dest='compressed_fraction',
+                 type='float',default=0.0,help="Fraction of primary "
+                 "data files to compress (default: 0.0)")
+    p.add_option('--symlinks',action='store',dest='symlink_ratio',
+                 type='float',default=0.5,help="Fraction of primary "
+                 "data files to link from the analysis dir (default: 0.5)")
+    p.add_option('--products',action='store',dest='nproducts',type='int',
+                 default=4,help="Number of analysis products for each "
+                 "linked file (default: 4)")
+    p.add_option('--seed',action='store',dest='seed',type='int',
+                 default=0,help="Seed for random number generator "
+                 "(default: 0)")
+    options,args = p.parse_args()
+    if len(args) != 1:
+        p.error("Need to supply an output directory")
+    primary_dir,analysis_dir = make_ngs_tree(
+        args[0],
+        platform=options.platform,
+        nsamples=options.nsamples,
+        nlibraries=options.nlibraries,
+        file_size=options.file_size,
+        compressed_fraction=options.compressed_fraction,
+        symlink_ratio=options.symlink_ratio,
+        nproducts=options.nproducts,
+        seed=options.seed)
+    print "Primary data : %s" % primary_dir
+    print "Analysis dir : %s" % analysis_dir
@@ -0,0 +1,318 @@
+#!/bin/env python
+#
+#     run_benchmarks.py: benchmark suite for arqvist hot paths
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Benchmark suite for the arqvist hot paths
+
+Generates a synthetic NGS tree (see make_ngs_tree.py) and times the
+following scenarios:
+
+scan        : DataDir scan of the primary data dir
+write_cache : DataDir.write_cache with MD5 sums populated
+update_cache: DataDir.update_cache from an existing cache
+md5sums     : DataDir.md5sums (without a cache)
+solid_scan  : SolidDataDir scan (including _populate)
+populate    : SolidDataDir._populate on an existing instance
+match       : SolidDataDir.match_primary_data against the
+              analysis dir
+compress    : compress_files for csfasta and qual files (on a
+              fresh copy of the primary data for each repeat)
+
+Each repeat of each scenario runs in a separate process, so the
+peak memory use (maximum resident set size) can be measured along
+with the wall time.
+
+Results are printed as a table and can also be written as JSON
+using --json, so regressions can be tracked over time.
+
+Usage:
+
+    python benchmarks/run_benchmarks.py [OPTIONS] [SCENARIO ...]
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import optparse
+import platform
+import resource
+import traceback
+import subprocess
+import multiprocessing
+from Queue import Empty
+
+# Make sure the arqvist package from this source tree is used
+sys.path.insert(0,os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+from make_ngs_tree import make_ngs_tree
+
+#######################################################################
+# Scenarios
+#######################################################################
+
+# Each scenario has a 'setup' function (which is not timed) and a
+# 'run' function (which is). Both are called with a dictionary
+# holding the paths to the primary and analysis dirs; 'setup' can
+# add items to this dictionary for use by 'run'.
+
+def setup_none(ctx):
+    pass
+
+def run_scan(ctx):
+    from arqvist.core import DataDir
+    ctx['datadir'] = DataDir(ctx['primary'])
+
+def setup_with_md5s(ctx):
+    from arqvist.core import DataDir
+    d = DataDir(ctx['primary'])
+    d.md5sums()
+    ctx['datadir'] = d
+
+def run_write_cache(ctx):
+    d = ctx['datadir']
+    d.init_cache()
+    d.write_cache()
+
+def setup_update_cache(ctx):
+    setup_with_md5s(ctx)
+    run_write_cache(ctx)
+
+def run_update_cache(ctx):
+    ctx['datadir'].update_cache()
+
+def run_md5sums(ctx):
+    from arqvist.core import DataDir
+    DataDir(ctx['primary']).md5sums()
+
+def run_solid_scan(ctx):
+    from arqvist.solid import SolidDataDir
+    ctx['datadir'] = SolidDataDir(ctx['primary'])
+
+def run_populate(ctx):
+    ctx['datadir']._populate()
+
+def run_match(ctx):
+    ctx['datadir'].match_primary_data(ctx['analysis'])
+
+def setup_compress(ctx):
+    # Compress a copy of the primary data
+    primary = ctx['primary'].rstrip(os.sep) + '.copy'
+    if os.path.exists(primary):
+        shutil.rmtree(primary)
+    shutil.copytree(ctx['primary'],primary,symlinks=True)
+    ctx['primary'] = primary
+
+def run_compress(ctx):
+    from arqvist.cli import compress_files
+    compress_files(ctx['primary'],('csfasta','qual'))
+
+SCENARIOS = (('scan',setup_none,run_scan),
+             ('write_cache',setup_with_md5s,run_write_cache),
+             ('update_cache',setup_update_cache,run_update_cache),
+             ('md5sums',setup_none,run_md5sums),
+             ('solid_scan',setup_none,run_solid_scan),
+             ('populate',run_solid_scan,run_populate),
+             ('match',run_solid_scan,run_match),
+             ('compress',setup_compress,run_compress),)
+
+#######################################################################
+# Functions
+#######################################################################
+
+def run_scenario(setup,run,ctx,queue):
+    """
+    Run a scenario (in a child process)
+
+    Puts a tuple (wall_time,cpu_time,max_rss_kb) on
+    the queue, or (None,traceback) if the scenario
+    raised an exception.
+    """
+    # Suppress output from arqvist
+    devnull = open(os.devnull,'w')
+    sys.stdout = devnull
+    try:
+        setup(ctx)
+        cpu_start = time.clock()
+        start = time.time()
+        run(ctx)
+        wall_time = time.time() - start
+        cpu_time = time.clock() - cpu_start
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Clean up any cache created by the scenario
+        cachedir = os.path.join(ctx['primary'],'.archiver')
+        if 'datadir' in ctx:
+            del(ctx['datadir'])
+        if os.path.exists(cachedir):
+            shutil.rmtree(cachedir)
+    except Exception:
+        queue.put((None,traceback.format_exc()))
+        return
+    queue.put((wall_time,cpu_time,max_rss))
+
+def time_scenario(setup,run,ctx,repeats):
+    """
+    Run a scenario multiple times
+
+    Returns a list of (wall_time,cpu_time,max_rss_kb)
+    tuples (one for each repeat).
+
+    Raises RuntimeError if the scenario fails (or the
+    child process exits without reporting a result).
+    """
+    results = []
+    for i in range(repeats):
+        queue = multiprocessing.Queue()
+        p = multiprocessing.Process(target=run_scenario,
+                                    args=(setup,run,dict(ctx),queue))
+        p.start()
+        result = None
+        while result is None:
+            try:
+                result = queue.get(timeout=1)
+            except Empty:
+                if p.exitcode is not None:
+                    # Check for a result put just before exiting
+                    try:
+                        result = queue.get(timeout=1)
+                    except Empty:
+                        raise RuntimeError("Scenario exited with status "
+                                           "%s and no result" % p.exitcode)
+        p.join()
+        if result[0] is None:
+            raise RuntimeError("Scenario failed:\n%s" % result[1])
+        results.append(result)
+    return results
+
+def tree_stats(dirn):
+    """
+    Return the number of files and total size of a tree
+    """
+    nfiles = 0
+    size = 0
+    for d in os.walk(dirn):
+        for f in d[2]:
+            nfiles += 1
+            size += os.lstat(os.path.join(d[0],f)).st_size
+    return (nfiles,size)
+
+def median(values):
+    """
+    Return the median of a list of values
+    """
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n//2]
+    return (values[n//2-1] + values[n//2])/2.0
+
+def git_revision():
+    """
+    Return the git revision of the source tree (or None)
+    """
+    try:
+        with open(os.devnull,'w') as devnull:
+            return subprocess.check_output(
+                ['git','rev-parse','HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=devnull).strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+#######################################################################
+# Main program
+#######################################################################
+
+if __name__ == "__main__":
+    p = optparse.OptionParser(usage="%prog [OPTIONS] [SCENARIO ...]",
+                              description="Run benchmarks for arqvist on "
+                              "a synthetic NGS data tree. Available "
+                              "scenarios: %s (default is to run all)." %
+                              ', '.join([s[0] for s in SCENARIOS]))
+    p.add_option('--platform',action='store',dest='platform',
+                 default='solid',
+                 help="Type of data to generate: 'solid' or 'illumina' "
+                 "(default: solid)")
+    p.add_option('--samples',action='store',dest='nsamples',type='int',
+                 default=4,help="Number of samples (default: 4)")
+    p.add_option('--libraries',action='store',dest='nlibraries',
+                 type='int',default=8,help="Number of libraries per "
+                 "sample (default: 8)")
+    p.add_option('--file-size',action='store',dest='file_size',
+                 type='int',default=1048576,help="Approximate size of "
+                 "each primary data file in bytes (default: 1048576)")
+    p.add_option('--compressed',action='store',dest='compressed_fraction',
+                 type='float',default=0.0,help="Fraction of primary "
+                 "data files to compress (default: 0.0)")
+    p.add_option('--symlinks',action='store',dest='symlink_ratio',
+                 type='float',default=0.5,help="Fraction of primary "
+                 "data files to link from the analysis dir (default: 0.5)")
+    p.add_option('--repeats',action='store',dest='repeats',type='int',
+                 default=3,help="Number of times to run each scenario "
+                 "(default: 3)")
+    p.add_option('--dir',action='store',dest='working_dir',default=None,
+                 help="Generate the test tree under WORKING_DIR (default: "
+                 "a temporary directory which is removed afterwards)")
+    p.add_option('--json',action='store',dest='json_file',default=None,
+                 help="Write results to JSON_FILE")
+    options,args = p.parse_args()
+    scenarios = [s for s in SCENARIOS if not args or s[0] in args]
+    # Generate the test tree
+    working_dir = tempfile.mkdtemp(dir=options.working_dir)
+    try:
+        print "Generating test data under %s" % working_dir
+        primary,analysis = make_ngs_tree(
+            os.path.join(working_dir,'ngs'),
+            platform=options.platform,
+            nsamples=options.nsamples,
+            nlibraries=options.nlibraries,
+            file_size=options.file_size,
+            compressed_fraction=options.compressed_fraction,
+            symlink_ratio=options.symlink_ratio)
+        nfiles,size = tree_stats(primary)
+        print "Primary data: %d files, %.1f MB" % (nfiles,size/1048576.0)
+        ctx = { 'primary': primary,
+                'analysis': analysis }
+        results = { 'revision': git_revision(),
+                    'python': sys.version.split()[0],
+                    'platform': platform.platform(),
+                    'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'options': dict(vars(options)),
+                    'nfiles': nfiles,
+                    'size': size,
+                    'scenarios': {} }
+        print "# Scenario\tWall(s)\tCPU(s)\tFiles/s\tMB/s\tMaxRSS(MB)"
+        for name,setup,run in scenarios:
+            timings = time_scenario(setup,run,ctx,options.repeats)
+            wall_time = median([t[0] for t in timings])
+            cpu_time = median([t[1] for t in timings])
+            max_rss = max([t[2] for t in timings])/1024.0
+            files_per_sec = (nfiles/wall_time if wall_time else 0.0)
+            mb_per_sec = (size/1048576.0/wall_time if wall_time else 0.0)
+            results['scenarios'][name] = {
+                'wall_times': [t[0] for t in timings],
+                'cpu_times': [t[1] for t in timings],
+                'median_wall_time': wall_time,
+                'median_cpu_time': cpu_time,
+                'files_per_sec': files_per_sec,
+                'mb_per_sec': mb_per_sec,
+                'max_rss_mb': max_rss,
+            }
+            print "%s\t%.3f\t%.3f\t%.1f\t%.1f\t%.1f" % (name,
+                                                       wall_time,
+                                                       cpu_time,
+                                                       files_per_sec,
+                                                       mb_per_sec,
+                                                       max_rss)
+        if options.json_file:
+            with open(options.json_file,'w') as fp:
+                json.dump(results,fp,indent=2,sort_keys=True)
+            print "Results written to %s" % options.json_file
+    finally:
+        shutil.rmtree(working_dir)
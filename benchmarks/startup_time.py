@@ -0,0 +1,146 @@
+#!/bin/env python
+#
+#     startup_time.py: benchmark start up time for arqvist
+#     Copyright (C) University of Manchester 2016 Peter Briggs
+#
+
+"""
+Benchmark the start up time of the 'arqvist' command
+
+Measures the wall time taken to import the arqvist.cli module and to
+run 'arqvist --version' in a fresh interpreter, and the time taken
+to import each of the arqvist modules (and their dependencies).
+Also checks that the slow-to-import dependencies aren't loaded when
+the CLI is imported.
+
+Exits with a non-zero status if the median import time exceeds the
+limit set by --max-time, or if any of the slow dependencies are
+loaded, so it can be used as a regression check.
+
+Usage:
+
+    python benchmarks/startup_time.py [--repeats N] [--max-time SECS]
+
+"""
+
+import os
+import sys
+import time
+import json
+import optparse
+import subprocess
+
+# Modules which should not be imported on start up
+LAZY_MODULES = ('auto_process_ngs.applications',
+                'bcftbx.SolidData',
+                'arqvist.solid',
+                'arqvist.fastq',
+                'arqvist.server',
+                'multiprocessing',
+                'ctypes',)
+
+# Modules to time individually
+MODULES = ('bcftbx.utils',
+           'bcftbx.cmdparse',
+           'auto_process_ngs.applications',
+           'bcftbx.SolidData',
+           'arqvist.core',
+           'arqvist.solid',
+           'arqvist.fastq',
+           'arqvist.server',
+           'arqvist.cli',)
+
+def time_command(cmd,repeats):
+    """
+    Run a command repeatedly and return the wall times
+    """
+    times = []
+    with open(os.devnull,'w') as devnull:
+        for i in range(repeats):
+            start_time = time.time()
+            subprocess.call(cmd,stdout=devnull,stderr=devnull)
+            times.append(time.time() - start_time)
+    return times
+
+def median(values):
+    """
+    Return the median of a list of values
+    """
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n//2]
+    return (values[n//2-1] + values[n//2])/2.0
+
+def loaded_modules(python):
+    """
+    Return the lazy modules loaded by importing arqvist.cli
+    """
+    script = "import sys,json,arqvist.cli; " \
+             "print(json.dumps([m for m in %r if m in sys.modules]))" % \
+             (LAZY_MODULES,)
+    output = subprocess.check_output([python,'-c',script])
+    return json.loads(output.strip().split('\n')[-1])
+
+if __name__ == "__main__":
+    p = optparse.OptionParser(usage="%prog [OPTIONS]",
+                              description="Benchmark start up time for "
+                              "the arqvist utility")
+    p.add_option('--repeats',action='store',dest='repeats',type='int',
+                 default=20,
+                 help="Number of times to repeat each measurement "
+                 "(default: 20)")
+    p.add_option('--max-time',action='store',dest='max_time',
+                 type='float',default=None,
+                 help="Fail if median time to import the CLI exceeds "
+                 "MAX_TIME seconds")
+    p.add_option('--json',action='store',dest='json_file',default=None,
+                 help="Write results to JSON_FILE")
+    options,args = p.parse_args()
+    python = sys.executable
+    results = { 'python': sys.version.split()[0],
+                'repeats': options.repeats,
+                'modules': {} }
+    # Baseline interpreter start up
+    baseline = median(time_command([python,'-c','pass'],options.repeats))
+    results['interpreter'] = baseline
+    print "Interpreter start up:\t%.3fs" % baseline
+    # Individual modules
+    print "Module import times (excluding interpreter start up):"
+    for module in MODULES:
+        t = median(time_command([python,'-c','import %s' % module],
+                                options.repeats))
+        results['modules'][module] = t - baseline
+        print "- %s\t%.3fs" % (module,t - baseline)
+    # Import the CLI and run '--version'
+    cli_import = median(time_command([python,'-c','import arqvist.cli'],
+                                     options.repeats))
+    results['cli_import'] = cli_import
+    print "Import arqvist.cli:\t%.3fs" % cli_import
+    version = median(time_command([python,'-c',
+                                   "import sys; "
+                                   "sys.argv = ['arqvist','--version']; "
+                                   "import arqvist.cli; "
+                                   "arqvist.cli.main()"],
+                                  options.repeats))
+    results['version'] = version
+    print "arqvist --version:\t%.3fs" % version
+    # Per-module breakdown from the interpreter, if available
+    if sys.version_info >= (3,7):
+        print "Run '%s -X importtime -c \"import arqvist.cli\"' for a " \
+            "detailed breakdown" % python
+    # Check for modules which should be loaded lazily
+    loaded = loaded_modules(python)
+    results['lazy_modules_loaded'] = loaded
+    status = 0
+    if loaded:
+        print "FAILED: modules loaded on start up: %s" % ', '.join(loaded)
+        status = 1
+    if options.max_time is not None and cli_import > options.max_time:
+        print "FAILED: import time %.3fs exceeds limit of %.3fs" % \
+            (cli_import,options.max_time)
+        status = 1
+    if options.json_file:
+        with open(options.json_file,'w') as fp:
+            json.dump(results,fp,indent=2)
+    sys.exit(status)
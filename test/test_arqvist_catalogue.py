@@ -0,0 +1,118 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/catalogue package
+import os
+import unittest
+import utils
+from arqvist.core import DataDir
+from arqvist.catalogue import Catalogue
+
+class TestCatalogue(unittest.TestCase):
+    """Tests for the Catalogue class
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+        self.db_file = os.path.join(self.wd,'catalogue.db')
+        # First run
+        self.run1 = utils.make_subdir(self.wd,'run1')
+        utils.make_file('ex1.csfasta',dirn=self.run1,text="12345")
+        utils.make_file('ex1.qual',dirn=self.run1,text="1234")
+        utils.make_file('ex1.fastq.bz2',dirn=self.run1,text="123",
+                        compress='bz2')
+        utils.make_symlink('link.fastq','ex1.fastq.bz2',dirn=self.run1)
+        # Second run
+        self.run2 = utils.make_subdir(self.wd,'run2')
+        utils.make_file('ex2.csfasta',dirn=self.run2,text="12")
+        utils.make_file('ex2.fastq',dirn=self.run2,text="1")
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def _catalogue(self):
+        cat = Catalogue(self.db_file)
+        cat.add(DataDir(self.run1))
+        cat.add(DataDir(self.run2))
+        return cat
+    def test_runs(self):
+        cat = self._catalogue()
+        self.assertEqual([r[0] for r in cat.runs()],[self.run1,self.run2])
+        self.assertEqual([r[1] for r in cat.runs()],[4,2])
+    def test_summary_by_run(self):
+        cat = self._catalogue()
+        self.assertEqual(cat.summary(by=('run',),extensions=('csfasta',)),
+                         [(self.run1,1,5),(self.run2,1,2)])
+    def test_summary_uncompressed(self):
+        cat = self._catalogue()
+        self.assertEqual(cat.summary(by=('run',),extensions=('fastq',),
+                                     compression=('none',)),
+                         [(self.run2,1,1)])
+        bz2_size = os.path.getsize(os.path.join(self.run1,'ex1.fastq.bz2'))
+        self.assertEqual(cat.summary(by=('run','compression'),
+                                     extensions=('fastq',)),
+                         [(self.run1,'bz2',1,bz2_size),
+                          (self.run2,'',1,1)])
+    def test_summary_no_grouping(self):
+        cat = self._catalogue()
+        self.assertEqual(cat.summary(by=(),extensions=('csfasta','qual')),
+                         [(3,11)])
+        self.assertEqual(cat.summary(by=(),extensions=('bam',)),[(0,0)])
+    def test_summary_runs(self):
+        cat = self._catalogue()
+        self.assertEqual(cat.summary(by=('name',),runs=('*2',)),
+                         [('run2',2,3)])
+    def test_summary_bad_field(self):
+        cat = self._catalogue()
+        self.assertRaises(Exception,cat.summary,by=('colour',))
+    def test_refresh(self):
+        cat = self._catalogue()
+        utils.make_file('ex3.csfasta',dirn=self.run2,text="123")
+        cat.add(DataDir(self.run2))
+        self.assertEqual(cat.summary(by=('run',),extensions=('csfasta',)),
+                         [(self.run1,1,5),(self.run2,2,5)])
+        # Reopen
+        cat.close()
+        cat = Catalogue(self.db_file)
+        self.assertEqual(len(cat.runs()),2)
+    def test_remove(self):
+        cat = self._catalogue()
+        self.assertTrue(cat.remove(self.run1))
+        self.assertFalse(cat.remove(self.run1))
+        self.assertEqual([r[0] for r in cat.runs()],[self.run2])
+        columns,rows = cat.execute("SELECT COUNT(*) AS n FROM files")
+        self.assertEqual(columns,['n'])
+        self.assertEqual(rows,[(2,)])
+    def test_non_utf8_paths(self):
+        cat = Catalogue(self.db_file)
+        run3 = utils.make_subdir(self.wd,'run\xff')
+        run4 = utils.make_subdir(self.wd,'run\xfe')
+        utils.make_file('ex\xff.fastq',dirn=run3,text="12")
+        utils.make_file('ex\xfe.fastq',dirn=run4,text="1")
+        cat.add(DataDir(run3))
+        cat.add(DataDir(run4))
+        self.assertEqual(sorted([r[0] for r in cat.runs()]),
+                         sorted([run3,run4]))
+        self.assertEqual(cat.summary(by=('run',),runs=('*\xff',)),
+                         [(run3,1,2)])
+        columns,rows = cat.execute("SELECT relpath FROM files "
+                                   "ORDER BY relpath")
+        self.assertEqual(rows,[('ex\xfe.fastq',),('ex\xff.fastq',)])
+        self.assertTrue(cat.remove(run3))
+        self.assertEqual([r[0] for r in cat.runs()],[run4])
+    def test_libraries(self):
+        cat = Catalogue(self.db_file)
+        cat.add(DataDir(self.run1),libraries=[MockLibrary('PB','PB1'),
+                                              MockLibrary('KL','KL2')])
+        self.assertEqual(cat.libraries(),
+                         [(self.run1,'KL','KL2','KL','20111014',1),
+                          (self.run1,'PB','PB1','PB','20111014',1)])
+        self.assertEqual(cat.libraries(groups=('PB',)),
+                         [(self.run1,'PB','PB1','PB','20111014',1)])
+
+class MockLibrary:
+    # Mock version of the SolidLibrary class
+    def __init__(self,sample,library):
+        self.sample_name = sample
+        self.library_name = library
+        self.name = library
+        self.group = sample
+        self.timestamps = ['20111014']
+    def get_file_sets(self):
+        return [None]
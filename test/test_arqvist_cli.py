@@ -0,0 +1,294 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/cli package
+import os
+import sys
+import imp
+import json
+import unittest
+import subprocess
+import utils
+import arqvist
+
+#
+# Tests
+
+from arqvist.core import DataDir
+from arqvist.cli import analyse_symlinks
+class TestAnalyseSymlinks(unittest.TestCase):
+    def setUp(self):
+        # Create test directory with links
+        self.dir_ = utils.make_temp_dir()
+        self.data_dir = utils.make_subdir(self.dir_,'data')
+        utils.make_file('test.txt',dirn=self.data_dir)
+        utils.make_symlink('rellink','test.txt',dirn=self.data_dir)
+        utils.make_symlink('brklink','missing.txt',dirn=self.data_dir)
+        utils.make_symlink('extlink',os.path.join(self.dir_,'elsewhere'),
+                           dirn=self.data_dir)
+    def tearDown(self):
+        # Remove test directory and contents
+        utils.rmdir(self.dir_)
+    def test_analyse_symlinks(self):
+        symlinks = analyse_symlinks(DataDir(self.data_dir))
+        status = dict([(os.path.basename(ln.path),st)
+                       for ln,st,target,alt_target in symlinks])
+        self.assertEqual(status,{ 'rellink': '-r-',
+                                  'brklink': '-rX',
+                                  'extlink': 'EAX' })
+
+from arqvist.cli import Shell
+class TestShell(unittest.TestCase):
+    def setUp(self):
+        # Create test directory
+        self.dir_ = utils.make_temp_dir()
+        utils.make_file('test.txt',dirn=self.dir_)
+        utils.make_symlink('rellink','test.txt',dirn=self.dir_)
+    def tearDown(self):
+        # Remove test directory and contents
+        utils.rmdir(self.dir_)
+    def test_symlinks_are_memoised(self):
+        shell = Shell(self.dir_)
+        symlinks = shell.symlinks
+        self.assertEqual(len(symlinks),1)
+        self.assertTrue(shell.symlinks is symlinks)
+    def test_refresh(self):
+        shell = Shell(self.dir_)
+        symlinks = shell.symlinks
+        utils.make_symlink('rellink2','test.txt',dirn=self.dir_)
+        shell.do_refresh('')
+        self.assertEqual(len(shell.symlinks),2)
+
+class TestStartup(unittest.TestCase):
+    def test_slow_modules_not_imported(self):
+        # Check that slow dependencies (as listed by the start
+        # up benchmark) aren't loaded on import
+        top_dir = os.path.dirname(os.path.dirname(arqvist.__file__))
+        startup_time = imp.load_source(
+            'startup_time',os.path.join(top_dir,'benchmarks',
+                                        'startup_time.py'))
+        lazy_modules = startup_time.LAZY_MODULES
+        self.assertTrue('multiprocessing' in lazy_modules)
+        self.assertTrue('ctypes' in lazy_modules)
+        script = "import sys,json,arqvist.cli; " \
+                 "print(json.dumps([m for m in %r " \
+                 "if m in sys.modules]))" % (lazy_modules,)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [top_dir] + env.get('PYTHONPATH','').split(os.pathsep))
+        output = subprocess.check_output([sys.executable,'-c',script],
+                                         env=env)
+        self.assertEqual(json.loads(output.strip().split('\n')[-1]),[])
+
+from arqvist.cli import run_batch
+class TestRunBatch(unittest.TestCase):
+    def setUp(self):
+        # Create test directory
+        self.dir_ = utils.make_temp_dir()
+        self.data_dir = utils.make_subdir(self.dir_,'data')
+        utils.make_file('test.txt',dirn=self.data_dir,
+                        text="This is some text")
+        utils.make_file('test.tmp',dirn=self.data_dir)
+        self.out_dir = os.path.join(self.dir_,'out')
+    def tearDown(self):
+        # Remove test directory and contents
+        utils.rmdir(self.dir_)
+    def test_run_batch(self):
+        n_failed = run_batch(self.data_dir,
+                             ('list_files --minsize 1',
+                              'temp_files',
+                              'md5sums',),
+                             outdir=self.out_dir)
+        self.assertEqual(n_failed,0)
+        self.assertEqual(sorted(os.listdir(self.out_dir)),
+                         ['01_list_files.txt',
+                          '02_temp_files.txt',
+                          '03_md5sums.txt'])
+        md5sums = open(os.path.join(self.out_dir,
+                                    '03_md5sums.txt')).read().split('\n')
+        self.assertEqual(sorted(md5sums),
+                         ['',
+                          "97214f63224bc1e9cc4da377aadce7c7  test.txt",
+                          "d41d8cd98f00b204e9800998ecf8427e  test.tmp"])
+    def test_run_batch_skips_empty_commands(self):
+        n_failed = run_batch(self.data_dir,
+                             ('','temp_files','  '),
+                             outdir=self.out_dir)
+        self.assertEqual(n_failed,0)
+        self.assertEqual(os.listdir(self.out_dir),['02_temp_files.txt'])
+    def test_run_batch_bad_commands(self):
+        n_failed = run_batch(self.data_dir,
+                             ('shell',
+                              'list_files --no-such-option',
+                              'temp_files',),
+                             outdir=self.out_dir)
+        self.assertEqual(n_failed,2)
+        self.assertTrue(os.path.exists(os.path.join(self.out_dir,
+                                                    '03_temp_files.txt')))
+
+from StringIO import StringIO
+from arqvist.cli import list_files
+from arqvist.cli import find_symlinks
+from arqvist.cli import find_tmp_files
+from arqvist.output import NdjsonWriter
+class TestJsonOutput(unittest.TestCase):
+    def setUp(self):
+        # Create test directory
+        self.dir_ = utils.make_temp_dir()
+        self.data_dir = utils.make_subdir(self.dir_,'data')
+        utils.make_file('test.txt',dirn=self.data_dir,
+                        text="This is some text")
+        utils.make_file('test.tmp',dirn=self.data_dir)
+        utils.make_symlink('brklink','missing.txt',dirn=self.data_dir)
+        self.fp = StringIO()
+        self.output = NdjsonWriter(self.fp)
+    def tearDown(self):
+        # Remove test directory and contents
+        utils.rmdir(self.dir_)
+    def records(self):
+        return [json.loads(line) for line in self.fp.getvalue().split('\n')
+                if line]
+    def test_list_files(self):
+        list_files(self.data_dir,output=self.output)
+        records = self.records()
+        self.assertEqual(sorted([(r['type'],r['relpath'],r['classifier'])
+                                 for r in records[:-1]]),
+                         [('file','brklink','@'),
+                          ('file','test.tmp',''),
+                          ('file','test.txt','')])
+        self.assertEqual(records[-1]['type'],'summary')
+        self.assertEqual(records[-1]['nfiles'],3)
+    def test_symlinks(self):
+        find_symlinks(self.data_dir,output=self.output)
+        records = self.records()
+        self.assertEqual(len(records),1)
+        self.assertEqual(records[0]['type'],'symlink')
+        self.assertEqual(records[0]['path'],'brklink')
+        self.assertEqual(records[0]['status'],'-rX')
+        self.assertEqual(records[0]['target'],'missing.txt')
+        self.assertTrue(records[0]['broken'])
+        self.assertFalse(records[0]['external'])
+    def test_temp_files(self):
+        find_tmp_files(self.data_dir,output=self.output)
+        self.assertEqual(self.records(),
+                         [{'type': 'temp_file','path': 'test.tmp','size': 0},
+                          {'type': 'summary','nfiles': 1,'size': 0}])
+    def test_info(self):
+        DataDir(self.data_dir).info(output=self.output)
+        records = self.records()
+        self.assertEqual(len(records),1)
+        self.assertEqual(records[0]['type'],'datadir')
+        self.assertEqual(records[0]['path'],self.data_dir)
+        self.assertEqual(records[0]['nfiles'],3)
+        self.assertEqual(records[0]['temp_files'],1)
+    def test_run_batch_json(self):
+        out_dir = os.path.join(self.dir_,'out')
+        n_failed = run_batch(self.data_dir,('temp_files --json',),
+                             outdir=out_dir)
+        self.assertEqual(n_failed,0)
+        with open(os.path.join(out_dir,'01_temp_files.txt')) as fp:
+            records = [json.loads(line) for line in fp]
+        self.assertEqual([r['type'] for r in records],
+                         ['temp_file','summary'])
+    def test_main_json(self):
+        # Check that only records are written to stdout
+        script = "import sys; from arqvist.cli import main; " \
+                 "main(sys.argv[1:])"
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(arqvist.__file__))] +
+            env.get('PYTHONPATH','').split(os.pathsep))
+        output = subprocess.check_output([sys.executable,'-c',script,
+                                          'list_files','--json',
+                                          self.data_dir],
+                                         env=env)
+        records = [json.loads(line) for line in output.strip().split('\n')]
+        self.assertEqual([r['type'] for r in records],
+                         ['file','file','file','summary'])
+
+from arqvist.cli import find_duplicates
+class TestFindDuplicates(unittest.TestCase):
+    def setUp(self):
+        # Create test directory
+        self.dir_ = utils.make_temp_dir()
+        utils.make_file('test1.txt',dirn=self.dir_,text="Same text")
+        utils.make_file('test2.txt',dirn=self.dir_,text="Same text")
+    def tearDown(self):
+        # Remove test directory and contents
+        utils.rmdir(self.dir_)
+    def test_find_duplicates_weak_hash(self):
+        self.assertRaises(ValueError,find_duplicates,self.dir_,
+                          algorithm='crc32')
+
+from arqvist.cli import plan_compression
+class TestPlanCompression(unittest.TestCase):
+    def setUp(self):
+        # Create test directory
+        self.dir_ = utils.make_temp_dir()
+        self.data_dir = utils.make_subdir(self.dir_,'data')
+        run1 = utils.make_subdir(self.data_dir,'run1')
+        run2 = utils.make_subdir(self.data_dir,'run2')
+        utils.make_file('test1.fastq',dirn=run1,text="ACGT\n"*1000)
+        utils.make_file('test2.fastq',dirn=run2,text="ACGT\n"*1000)
+        utils.make_file('test3.fastq.bz2',dirn=run2,text="ACGT\n"*1000,
+                        compress='bz2')
+        utils.make_file('test.txt',dirn=self.data_dir,text="Text\n"*100)
+    def tearDown(self):
+        # Remove test directory and contents
+        utils.rmdir(self.dir_)
+    def test_plan_compression(self):
+        stdout = sys.stdout
+        try:
+            sys.stdout = open(os.devnull,'w')
+            plan = plan_compression(self.data_dir,('fastq','txt'),
+                                    codec='gzip',sample_size=1024)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        self.assertEqual(plan.total.nfiles,3)
+        self.assertEqual(plan.total.size,10500)
+        self.assertTrue(plan.total.ratio > 1.0)
+        self.assertEqual([(g[0],g[1].nfiles)
+                          for g in plan.groups('extension')],
+                         [('fastq',2),('other',1)])
+        self.assertEqual([(g[0],g[1].nfiles)
+                          for g in plan.groups('subdir')],
+                         [('.',1),('run1',1),('run2',1)])
+        # Check nothing was compressed
+        self.assertTrue(os.path.exists(os.path.join(self.data_dir,'run1',
+                                                    'test1.fastq')))
+
+from arqvist.cli import catalogue_dirs
+from arqvist.cli import query_catalogue
+class TestCatalogueOutput(unittest.TestCase):
+    def setUp(self):
+        # Create test directory with a non-ASCII run name
+        self.dir_ = utils.make_temp_dir()
+        self.run = utils.make_subdir(self.dir_,'run\xc3\xa9')
+        utils.make_file('test.fastq',dirn=self.run,text="ACGT\n")
+        self.db_file = os.path.join(self.dir_,'runs.db')
+        self.out_file = os.path.join(self.dir_,'out.txt')
+    def tearDown(self):
+        # Remove test directory and contents
+        utils.rmdir(self.dir_)
+    def _output(self,func,*args,**kws):
+        # Run a function with stdout redirected to a file
+        stdout = sys.stdout
+        try:
+            sys.stdout = open(self.out_file,'w')
+            func(*args,**kws)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        return open(self.out_file).read()
+    def test_non_ascii_paths(self):
+        self._output(catalogue_dirs,self.db_file,[self.run])
+        self.assertTrue(self.run in
+                        self._output(catalogue_dirs,self.db_file,[]))
+        self.assertTrue(self.run in
+                        self._output(query_catalogue,self.db_file))
+        self.assertTrue(self.run in
+                        self._output(query_catalogue,self.db_file,
+                                     sql="SELECT path FROM runs"))
+        self.assertTrue("Removing" not in
+                        self._output(catalogue_dirs,self.db_file,[],
+                                     refresh=True))
@@ -0,0 +1,263 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/compression package
+import os
+import bz2
+import gzip
+import struct
+import unittest
+import utils
+from arqvist.compression import get_codec
+from arqvist.compression import open_file
+from arqvist.compression import bgzf_block
+from arqvist.compression import write_bgzf
+from arqvist.compression import XzPipe
+from arqvist.compression import BGZF_BLOCK_SIZE
+from arqvist.compression import BGZF_EOF
+
+TEXT = "This is some text\n"
+
+def have_program(name):
+    # Check if a program is on the PATH
+    for d in os.environ.get('PATH','').split(os.pathsep):
+        if os.access(os.path.join(d,name),os.X_OK):
+            return True
+    return False
+
+class TestGetCodec(unittest.TestCase):
+    """Tests for the get_codec function
+    """
+    def test_get_codec(self):
+        self.assertEqual(get_codec('bz2').ext,'bz2')
+        self.assertEqual(get_codec('gzip').ext,'gz')
+        self.assertEqual(get_codec('gz').name,'gzip')
+        self.assertEqual(get_codec('bgzf').ext,'gz')
+        self.assertEqual(get_codec('xz').ext,'xz')
+        self.assertEqual(get_codec().name,'bz2')
+    def test_get_codec_unknown(self):
+        self.assertRaises(ValueError,get_codec,'zip')
+
+class TestOpenFile(unittest.TestCase):
+    """Tests for the open_file function
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def test_open_uncompressed(self):
+        filen = utils.make_file('test.txt',dirn=self.wd,text=TEXT)
+        self.assertEqual(open_file(filen).read(),TEXT)
+    def test_open_bz2(self):
+        filen = utils.make_file('test.txt.bz2',dirn=self.wd,text=TEXT,
+                                compress='bz2')
+        self.assertEqual(open_file(filen).read(),TEXT)
+    def test_open_gz(self):
+        filen = os.path.join(self.wd,'test.txt.gz')
+        fp = gzip.open(filen,'wb')
+        fp.write(TEXT)
+        fp.close()
+        self.assertEqual(open_file(filen).read(),TEXT)
+    def test_open_xz(self):
+        if not have_program('xz'):
+            raise unittest.SkipTest("'xz' not available")
+        filen = utils.make_file('test.txt',dirn=self.wd,text=TEXT)
+        self.assertEqual(get_codec('xz').compress(filen,filen+'.xz'),0)
+        fp = open_file(filen+'.xz')
+        self.assertEqual(fp.read(),TEXT)
+        fp.close()
+
+class TestBgzf(unittest.TestCase):
+    """Tests for BGZF compression
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def test_bgzf_block(self):
+        block = bgzf_block(TEXT)
+        # Check the BC subfield holds the block size minus one
+        self.assertEqual(block[:4],"\x1f\x8b\x08\x04")
+        self.assertEqual(block[12:14],"BC")
+        self.assertEqual(struct.unpack('<H',block[16:18])[0],len(block)-1)
+        # Check the trailer has the uncompressed size
+        self.assertEqual(struct.unpack('<I',block[-4:])[0],len(TEXT))
+    def test_write_bgzf(self):
+        # Data spanning multiple blocks
+        data = ''.join(["%d\n" % i for i in xrange(50000)])
+        self.assertTrue(len(data) > 2*BGZF_BLOCK_SIZE)
+        filen = utils.make_file('test.txt',dirn=self.wd,text=data)
+        bgzf = filen + '.gz'
+        write_bgzf(filen,bgzf)
+        self.assertTrue(open(bgzf,'rb').read().endswith(BGZF_EOF))
+        # Check it can be read as ordinary gzip
+        self.assertEqual(gzip.GzipFile(bgzf,'rb').read(),data)
+    def test_write_bgzf_empty_file(self):
+        filen = utils.make_file('empty.txt',dirn=self.wd,text="")
+        write_bgzf(filen,filen+'.gz')
+        self.assertEqual(open(filen+'.gz','rb').read(),BGZF_EOF)
+        self.assertEqual(gzip.GzipFile(filen+'.gz','rb').read(),"")
+
+class TestXzPipe(unittest.TestCase):
+    """Tests for the XzPipe class
+    """
+    def setUp(self):
+        if not have_program('xz'):
+            raise unittest.SkipTest("'xz' not available")
+        self.wd = utils.make_temp_dir()
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def test_xz_pipe(self):
+        filen = utils.make_file('test.txt',dirn=self.wd,text=TEXT*3)
+        get_codec('xz').compress(filen,filen+'.xz')
+        fp = XzPipe(filen+'.xz')
+        self.assertEqual([line for line in fp],[TEXT]*3)
+        fp.close()
+    def test_xz_pipe_bad_file(self):
+        filen = utils.make_file('test.txt.xz',dirn=self.wd,text=TEXT)
+        fp = XzPipe(filen)
+        fp.read()
+        self.assertRaises(IOError,fp.close)
+
+class TestCodecData(unittest.TestCase):
+    """Tests for compressing and decompressing data in memory
+    """
+    def test_compress_data(self):
+        data = TEXT*1000
+        for name in ('bz2','gzip','bgzf','xz'):
+            if name == 'xz' and not have_program('xz'):
+                continue
+            codec = get_codec(name)
+            cdata = codec.compress_data(data)
+            self.assertTrue(len(cdata) < len(data))
+            self.assertEqual(codec.decompress_data(cdata),data)
+
+from arqvist.compression import sample_blocks
+from arqvist.compression import estimate_compression
+class TestSampleBlocks(unittest.TestCase):
+    """Tests for the sample_blocks function
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+        self.filen = utils.make_file('test.txt',dirn=self.wd,
+                                     text=''.join([chr(ord('a')+i)*10
+                                                   for i in range(10)]))
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def test_sample_blocks_whole_file(self):
+        self.assertEqual(list(sample_blocks(self.filen,nsamples=4,
+                                            sample_size=25)),
+                         [open(self.filen).read()])
+    def test_sample_blocks(self):
+        self.assertEqual(list(sample_blocks(self.filen,nsamples=3,
+                                            sample_size=10)),
+                         ['a'*10,'e'*5+'f'*5,'j'*10])
+    def test_sample_blocks_single(self):
+        self.assertEqual(list(sample_blocks(self.filen,nsamples=1,
+                                            sample_size=10)),
+                         ['a'*10])
+
+class TestEstimateCompression(unittest.TestCase):
+    """Tests for the estimate_compression function
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def test_estimate_compression(self):
+        filen = utils.make_file('test.txt',dirn=self.wd,text=TEXT*1000)
+        sampled,compressed,compress_time,verify_time = \
+            estimate_compression(filen,'gzip',nsamples=2,sample_size=1000)
+        self.assertEqual(sampled,2000)
+        self.assertTrue(0 < compressed < sampled)
+        self.assertTrue(compress_time >= 0.0)
+        self.assertTrue(verify_time >= 0.0)
+
+from arqvist.compression import CompressionPlan
+class TestCompressionPlan(unittest.TestCase):
+    """Tests for the CompressionPlan class
+    """
+    def test_compression_plan(self):
+        plan = CompressionPlan()
+        plan.add(1000,(100,25,0.1,0.05),groups=(('extension','fastq'),
+                                                ('subdir','run1')))
+        plan.add(3000,(100,50,0.2,0.0),groups=(('extension','fastq'),
+                                               ('subdir','run2')))
+        plan.add(0,(0,0,0.0,0.0),groups=(('extension','other'),
+                                         ('subdir','run2')))
+        self.assertEqual(plan.total.nfiles,3)
+        self.assertEqual(plan.total.size,4000)
+        self.assertAlmostEqual(plan.total.compressed_size,1750.0)
+        self.assertAlmostEqual(plan.total.saving,2250.0)
+        self.assertAlmostEqual(plan.total.time,7.5)
+        self.assertEqual([g[0] for g in plan.groups('extension')],
+                         ['fastq','other'])
+        run2 = dict(plan.groups('subdir'))['run2']
+        self.assertEqual(run2.nfiles,2)
+        self.assertAlmostEqual(run2.ratio,2.0)
+
+class TestDecompressor(unittest.TestCase):
+    """Tests for incremental decompression
+    """
+    def _decompress(self,codec,cdata,chunk_size):
+        d = codec.decompressor()
+        return ''.join([d.decompress(cdata[i:i+chunk_size])
+                        for i in xrange(0,len(cdata),chunk_size)])
+    def test_decompressor(self):
+        data = TEXT*1000
+        for name in ('bz2','gzip'):
+            codec = get_codec(name)
+            cdata = codec.compress_data(data)
+            for chunk_size in (1,7,len(cdata)):
+                self.assertEqual(self._decompress(codec,cdata,chunk_size),
+                                 data)
+    def test_decompressor_multiple_streams(self):
+        data = TEXT*100000
+        # BGZF is multi-member gzip
+        codec = get_codec('bgzf')
+        cdata = codec.compress_data(data)
+        self.assertEqual(self._decompress(codec,cdata,1000),data)
+        # Concatenated bzip2 streams
+        codec = get_codec('bz2')
+        cdata = codec.compress_data(data) + codec.compress_data(data)
+        self.assertEqual(self._decompress(codec,cdata,len(cdata)),data*2)
+        self.assertEqual(self._decompress(codec,cdata,1000),data*2)
+
+from arqvist.compression import gzip_uncompressed_size
+class TestGzipUncompressedSize(unittest.TestCase):
+    """Tests for getting the uncompressed size of gzip files
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def test_gzip(self):
+        filen = os.path.join(self.wd,'test.txt.gz')
+        fp = gzip.GzipFile(filen,'wb')
+        fp.write(TEXT*100)
+        fp.close()
+        # Size of plain gzip isn't known from the trailer
+        self.assertEqual(gzip_uncompressed_size(filen),None)
+        self.assertEqual(get_codec('gz').uncompressed_size(filen),None)
+    def test_bgzf(self):
+        data = ''.join(["%d\n" % i for i in xrange(50000)])
+        filen = utils.make_file('test.txt',dirn=self.wd,text=data)
+        write_bgzf(filen,filen+'.gz')
+        self.assertEqual(gzip_uncompressed_size(filen+'.gz'),len(data))
+        self.assertEqual(get_codec('gz').uncompressed_size(filen+'.gz'),
+                         len(data))
+    def test_bgzf_empty_file(self):
+        filen = utils.make_file('empty.txt',dirn=self.wd,text="")
+        write_bgzf(filen,filen+'.gz')
+        self.assertEqual(gzip_uncompressed_size(filen+'.gz'),0)
+    def test_truncated_bgzf(self):
+        data = ''.join(["%d\n" % i for i in xrange(50000)])
+        filen = utils.make_file('test.txt',dirn=self.wd,text=data)
+        write_bgzf(filen,filen+'.gz')
+        bgzf = open(filen+'.gz','rb').read()
+        with open(filen+'.gz','wb') as fp:
+            fp.write(bgzf[:len(bgzf)//2])
+        self.assertEqual(gzip_uncompressed_size(filen+'.gz'),None)
+    def test_not_gzip(self):
+        filen = utils.make_file('test.txt',dirn=self.wd,text=TEXT)
+        self.assertEqual(gzip_uncompressed_size(filen),None)
+        self.assertEqual(get_codec('bz2').uncompressed_size(filen),None)
@@ -3,6 +3,7 @@
 # Unit tests for the arqvist package
 import os
 import pwd
+import gzip
 import grp
 import unittest
 import utils
@@ -45,6 +46,22 @@ class TestArchiveFile(unittest.TestCase):
                                           '97214f63224bc1e9cc4da377aadce7c7'))
         self.assertEqual(f.md5,'c032b31c8a39aaa53b0c6df004e95a64')
         self.assertEqual(f.uncompressed_md5,'97214f63224bc1e9cc4da377aadce7c7')
+    def test_get_checksums(self):
+        filen = utils.make_file('test.txt',dirn=self.dir_,text="This is some text")
+        f = ArchiveFile(filen)
+        sha256 = '2263d8dd95ccfe1ad45d732c6eaaf59b3345e6647331605cb15aae52002dff75'
+        self.assertEqual(f.stored_checksums('sha256'),(None,None))
+        self.assertEqual(f.get_checksums('sha256'),(sha256,sha256))
+        self.assertEqual(f.stored_checksums('sha256'),(sha256,sha256))
+        self.assertEqual(f.md5,None)
+        self.assertEqual(f.get_checksums('md5'),('97214f63224bc1e9cc4da377aadce7c7',
+                                                 '97214f63224bc1e9cc4da377aadce7c7'))
+        self.assertEqual(f.md5,'97214f63224bc1e9cc4da377aadce7c7')
+    def test_get_checksums_compressed_file(self):
+        filen = utils.make_file('test.txt.bz2',dirn=self.dir_,text="This is some text",
+                                compress='bz2')
+        f = ArchiveFile(filen)
+        self.assertEqual(f.get_checksums('crc32')[1],'9f4b7f7b')
     def test_compress(self):
         filen = utils.make_file('test.txt',dirn=self.dir_,text="This is some text")
         f = ArchiveFile(filen)
@@ -54,6 +71,50 @@ class TestArchiveFile(unittest.TestCase):
         self.assertEqual(f.compression,'bz2')
         self.assertEqual(f.get_md5sums(),('c032b31c8a39aaa53b0c6df004e95a64',
                                           '97214f63224bc1e9cc4da377aadce7c7'))
+    def test_compress_bgzf(self):
+        filen = utils.make_file('test.txt',dirn=self.dir_,text="This is some text")
+        os.chmod(filen,0644)
+        f = ArchiveFile(filen)
+        f.get_checksums('sha1')
+        self.assertEqual(f.compress(codec='bgzf'),0)
+        self.assertEqual(f.path,filen+'.gz')
+        self.assertEqual(f.compression,'gz')
+        self.assertFalse(os.path.exists(filen))
+        self.assertEqual(os.stat(f.path).st_mode & 0777,0644)
+        self.assertEqual(f.md5,None)
+        self.assertEqual(f.stored_checksums('sha1'),
+                         (None,'482cb0cfcbed6740a2bcb659c9ccc22a4d27b369'))
+        self.assertEqual(f.get_md5sums()[1],'97214f63224bc1e9cc4da377aadce7c7')
+    def test_get_uncompressed_size(self):
+        filen = utils.make_file('test.txt',dirn=self.dir_,text="This is some text")
+        self.assertEqual(ArchiveFile(filen).get_uncompressed_size(),17)
+        self.assertEqual(ArchiveFile(filen).compress(codec='bgzf'),0)
+        self.assertEqual(ArchiveFile(filen+'.gz').get_uncompressed_size(),17)
+        bzfilen = utils.make_file('test2.txt.bz2',dirn=self.dir_,
+                                  text="This is some text",compress='bz2')
+        self.assertEqual(ArchiveFile(bzfilen).get_uncompressed_size(),None)
+    def test_get_prefix_checksum(self):
+        filen = utils.make_file('test.txt',dirn=self.dir_,text="This is some text")
+        bzfilen = utils.make_file('test2.txt.bz2',dirn=self.dir_,
+                                  text="This is some text",compress='bz2')
+        f = ArchiveFile(filen)
+        bzf = ArchiveFile(bzfilen)
+        # Prefix only
+        self.assertEqual(f.get_prefix_checksum('md5',nbytes=4),
+                         '77631ca4f0e08419b70726a447333ab6')
+        self.assertEqual(f.get_prefix_checksum('md5',nbytes=4),
+                         bzf.get_prefix_checksum('md5',nbytes=4))
+        self.assertEqual(f.md5,None)
+        # Whole contents
+        self.assertEqual(bzf.get_prefix_checksum('md5'),
+                         '97214f63224bc1e9cc4da377aadce7c7')
+        self.assertEqual(bzf.stored_checksums('md5'),
+                         (None,'97214f63224bc1e9cc4da377aadce7c7'))
+        self.assertEqual(f.get_prefix_checksum('md5'),
+                         '97214f63224bc1e9cc4da377aadce7c7')
+        self.assertEqual(f.stored_checksums('md5'),
+                         ('97214f63224bc1e9cc4da377aadce7c7',
+                          '97214f63224bc1e9cc4da377aadce7c7'))
     def test_repr_(self):
         filen = utils.make_file('test.txt',dirn=self.dir_)
         f = ArchiveFile(filen)
@@ -110,6 +171,10 @@ class TestArchiveSymlink(unittest.TestCase):
         self.assertEqual(ArchiveSymlink(self.brklink).alternative_target,None)
         self.assertEqual(ArchiveSymlink(self.altlink).alternative_target,
                          self.bzfilen)
+    def test_alternative_target_xz(self):
+        xzfilen = utils.make_file('test4.txt.xz',dirn=self.dir_)
+        xzlink = utils.make_symlink('xzlink','test4.txt',dirn=self.dir_)
+        self.assertEqual(ArchiveSymlink(xzlink).alternative_target,xzfilen)
     def test_classifier(self):
         self.assertEqual(ArchiveSymlink(self.abslink).classifier,'A-')
         self.assertEqual(ArchiveSymlink(self.rellink).classifier,'r-')
@@ -235,6 +300,138 @@ class TestDataDir(unittest.TestCase):
         external = DataDir(self.analysis_dir).related_dirs()
         self.assertEqual(len(external),1)
         self.assertEqual(external[0],self.primary_data_dir)
+    def test_rescan(self):
+        # Check that rescan picks up changes and keeps MD5 sums
+        d = DataDir(self.primary_data_dir)
+        for f in d.files():
+            f.get_md5sums()
+        self.assertFalse(d.rescan())
+        self.assertEqual(len(d),4)
+        for f in d.files():
+            self.assertNotEqual(f.md5,None)
+        # Add and remove files
+        utils.make_file('test3.csfasta',dirn=self.primary_data_dir)
+        os.remove(os.path.join(self.primary_data_dir,'test1.csfasta'))
+        self.assertTrue(d.rescan())
+        self.assertEqual(len(d),4)
+        for f in d.files():
+            if f.basename == 'test3.csfasta':
+                self.assertEqual(f.md5,None)
+            else:
+                self.assertNotEqual(f.md5,None)
+    def test_rescan_permissions(self):
+        # Check that rescan picks up changes to permissions
+        d = DataDir(self.primary_data_dir)
+        d.md5sums()
+        path = os.path.join(self.primary_data_dir,'test1.csfasta')
+        md5 = d.files(pattern='test1.csfasta')[0].md5
+        os.chmod(path,0600)
+        self.assertTrue(d.rescan())
+        f = d.files(pattern='test1.csfasta')[0]
+        self.assertEqual(f.mode,os.lstat(path).st_mode)
+        self.assertEqual(f.md5,md5)
+    def test_update_cache_moved_files(self):
+        # Check that cached MD5 sums are kept for moved files
+        d = DataDir(self.primary_data_dir)
+        d.init_cache()
+        d.md5sums()
+        md5 = d.files(pattern='test1.csfasta')[0].md5
+        d.write_cache()
+        del(d)
+        reads = utils.make_subdir(self.primary_data_dir,'reads')
+        os.rename(os.path.join(self.primary_data_dir,'test1.csfasta'),
+                  os.path.join(reads,'sample1.csfasta'))
+        d = DataDir(self.primary_data_dir)
+        f = d.files(pattern='sample1.csfasta')[0]
+        self.assertEqual(f.md5,md5)
+        self.assertEqual(f.uncompressed_md5,md5)
+        self.assertEqual(d.md5sums_pending(),[])
+    def test_rescan_moved_files(self):
+        # Check that rescan keeps MD5 sums for moved files
+        d = DataDir(self.primary_data_dir)
+        d.md5sums()
+        md5 = d.files(pattern='test1.csfasta')[0].md5
+        os.rename(os.path.join(self.primary_data_dir,'test1.csfasta'),
+                  os.path.join(self.primary_data_dir,'sample1.csfasta'))
+        self.assertTrue(d.rescan())
+        self.assertEqual(d.files(pattern='sample1.csfasta')[0].md5,md5)
+        self.assertEqual(d.files(pattern='test1.csfasta'),[])
+    def test_update_paths(self):
+        # Check that update_paths applies changes and keeps MD5 sums
+        d = DataDir(self.primary_data_dir)
+        d.md5sums()
+        self.assertFalse(d.update_paths([f.path for f in d.files()]))
+        # New, modified, removed and renamed files
+        utils.make_file('test3.csfasta',dirn=self.primary_data_dir)
+        with open(os.path.join(self.primary_data_dir,'test2.csfasta'),
+                  'a') as fp:
+            fp.write("More data\n")
+        os.remove(os.path.join(self.primary_data_dir,'test1_QV.qual'))
+        md5 = d.files(pattern='test1.csfasta')[0].md5
+        os.rename(os.path.join(self.primary_data_dir,'test1.csfasta'),
+                  os.path.join(self.primary_data_dir,'sample1.csfasta'))
+        self.assertTrue(d.update_paths(['test3.csfasta',
+                                        'test2.csfasta',
+                                        'test1_QV.qual',
+                                        'test1.csfasta',
+                                        'sample1.csfasta']))
+        self.assertEqual(sorted([f.basename for f in d.files()]),
+                         ['sample1.csfasta','test2.csfasta',
+                          'test2_QV.qual','test3.csfasta'])
+        self.assertEqual(len(d),4)
+        self.assertEqual(d.files(pattern='sample1.csfasta')[0].md5,md5)
+        self.assertEqual(d.files(pattern='test2.csfasta')[0].md5,None)
+        self.assertEqual(d.files(pattern='test3.csfasta')[0].md5,None)
+        self.assertNotEqual(d.files(pattern='test2_QV.qual')[0].md5,None)
+        self.assertEqual(d.summary(),
+                         DataDir(self.primary_data_dir).summary())
+    def test_update_paths_dirs(self):
+        # Check that update_paths handles added and removed dirs
+        d = DataDir(self.example_dir)
+        new_dir = utils.make_subdir(self.dir_,'new_dir')
+        utils.make_file('test4.fastq',dirn=new_dir)
+        os.rename(new_dir,os.path.join(self.example_dir,'new_dir'))
+        self.assertTrue(d.update_paths(['new_dir']))
+        self.assertEqual(len(d.files(pattern='test4.fastq')),1)
+        utils.rmdir(self.analysis_dir)
+        self.assertTrue(d.update_paths([self.analysis_dir]))
+        self.assertEqual(d.files(subdir='analysis'),[])
+        self.assertEqual(d.summary(),DataDir(self.example_dir).summary())
+        # Paths outside the data dir and in the cache are ignored
+        d.init_cache()
+        self.assertFalse(d.update_paths([self.dir_,'.archiver']))
+    def test_cache_multiple_checksums(self):
+        # Check that checksums for other algorithms are cached
+        d = DataDir(self.primary_data_dir)
+        d.init_cache()
+        d.md5sums()
+        d.checksums('sha1')
+        d.write_cache()
+        del(d)
+        d = DataDir(self.primary_data_dir)
+        self.assertEqual(d.checksums_pending('md5'),[])
+        self.assertEqual(d.checksums_pending('sha1'),[])
+        self.assertEqual(len(d.checksums_pending('sha256')),4)
+    def test_md5sums_pending(self):
+        # Check that files without MD5 sums are reported
+        d = DataDir(self.analysis_dir)
+        self.assertEqual(len(d.md5sums_pending()),5)
+        d.md5sums()
+        self.assertEqual(d.md5sums_pending(),[])
+    def test_md5sums_progress(self):
+        # Check that progress is updated for each file
+        class Progress:
+            nbytes = 0
+            nitems = 0
+            def update(self,nbytes=0,nitems=0):
+                self.nbytes += nbytes
+                self.nitems += nitems
+        d = DataDir(self.analysis_dir)
+        size = sum([f.size for f in d.md5sums_pending()])
+        progress = Progress()
+        d.md5sums(progress=progress)
+        self.assertEqual(progress.nitems,5)
+        self.assertEqual(progress.nbytes,size)
     def test_md5sums(self):
         raise NotImplementedError
     def test_set_permissions(self):
@@ -244,6 +441,95 @@ class TestDataDir(unittest.TestCase):
     def test_copy_to(self):
         raise NotImplementedError
 
+from arqvist.core import checksum_candidates
+from arqvist.compression import write_bgzf
+class TestChecksumCandidates(unittest.TestCase):
+    # Tests for the arqvist.core.checksum_candidates function
+    def setUp(self):
+        self.dir_ = utils.make_temp_dir()
+        self.text = ''.join(["Line %d\n" % i for i in xrange(20000)])
+    def tearDown(self):
+        utils.rmdir(self.dir_)
+    def files(self,*names):
+        return [ArchiveFile(os.path.join(self.dir_,name)) for name in names]
+    def make_gzip(self,name,text):
+        fp = gzip.GzipFile(os.path.join(self.dir_,name),'wb')
+        fp.write(text)
+        fp.close()
+    def test_compressed_duplicate(self):
+        utils.make_file('test.txt',dirn=self.dir_,text=self.text)
+        self.make_gzip('test2.txt.gz',self.text)
+        files = self.files('test.txt','test2.txt.gz')
+        self.assertEqual([f.basename for f in
+                          checksum_candidates(files,prefix_size=1024)],
+                         ['test.txt','test2.txt.gz'])
+    def test_different_sizes(self):
+        utils.make_file('test.txt',dirn=self.dir_,text=self.text)
+        # Size is only known for BGZF
+        filen = utils.make_file('test2.txt',dirn=self.dir_,
+                                text=self.text+"More")
+        write_bgzf(filen,filen+'.gz')
+        os.remove(filen)
+        files = self.files('test.txt','test2.txt.gz')
+        self.assertEqual(checksum_candidates(files,prefix_size=1024),[])
+        self.assertEqual(files[1].uncompressed_md5,None)
+    def test_different_prefixes(self):
+        utils.make_file('test.txt',dirn=self.dir_,text=self.text)
+        self.make_gzip('test2.txt.gz',"X"+self.text[1:])
+        # bzip2 size isn't known without decompressing
+        utils.make_file('test3.txt.bz2',dirn=self.dir_,
+                        text="Y"+self.text[1:],compress='bz2')
+        files = self.files('test.txt','test2.txt.gz','test3.txt.bz2')
+        self.assertEqual(checksum_candidates(files,prefix_size=1024),[])
+        self.assertEqual(files[0].uncompressed_md5,None)
+        self.assertEqual(files[1].uncompressed_md5,None)
+    def test_multi_member_gzip(self):
+        # Concatenated gzip files (e.g. merged lanes) only have
+        # the size of the last member in the final trailer
+        utils.make_file('all.txt',dirn=self.dir_,text=self.text)
+        half = len(self.text)//2
+        self.make_gzip('p1.txt.gz',self.text[:half])
+        self.make_gzip('p2.txt.gz',self.text[half:])
+        with open(os.path.join(self.dir_,'copy.txt.gz'),'wb') as fp:
+            for name in ('p1.txt.gz','p2.txt.gz'):
+                fp.write(open(os.path.join(self.dir_,name),'rb').read())
+        files = self.files('all.txt','copy.txt.gz')
+        self.assertEqual([f.basename for f in
+                          checksum_candidates(files,prefix_size=1024)],
+                         ['all.txt','copy.txt.gz'])
+    def test_same_prefix(self):
+        utils.make_file('test.txt',dirn=self.dir_,text=self.text)
+        self.make_gzip('test2.txt.gz',self.text[:-1]+"X")
+        files = self.files('test.txt','test2.txt.gz')
+        self.assertEqual(len(checksum_candidates(files,prefix_size=1024)),2)
+    def test_small_files(self):
+        utils.make_file('test.txt',dirn=self.dir_,text="This is some text")
+        utils.make_file('test2.txt.bz2',dirn=self.dir_,
+                        text="This is some text",compress='bz2')
+        files = self.files('test.txt','test2.txt.bz2')
+        # Whole contents fit in the prefix so no full checksums
+        # are needed
+        self.assertEqual(checksum_candidates(files),[])
+        self.assertEqual(files[0].uncompressed_md5,
+                         '97214f63224bc1e9cc4da377aadce7c7')
+        self.assertEqual(files[1].uncompressed_md5,
+                         '97214f63224bc1e9cc4da377aadce7c7')
+    def test_stored_checksums(self):
+        utils.make_file('test.txt',dirn=self.dir_,text=self.text)
+        utils.make_file('test2.txt',dirn=self.dir_,text=self.text)
+        files = self.files('test.txt','test2.txt')
+        files[0].get_md5sums()
+        self.assertEqual(checksum_candidates(files),[files[1]])
+
+from arqvist.core import get_alternative_paths
+class TestGetAlternativePaths(unittest.TestCase):
+    # Tests for the arqvist.core.get_alternative_paths function
+    def test_get_alternative_paths(self):
+        self.assertEqual(get_alternative_paths('test.fastq'),
+                         ['test.fastq.gz','test.fastq.bz2','test.fastq.xz'])
+        self.assertEqual(get_alternative_paths('test.fastq.bz2')[-1],
+                         'test.fastq')
+
 from arqvist.core import strip_extensions
 class TestStripExtensions(unittest.TestCase):
     # Tests for the arqvist.core.strip_extensions function
@@ -261,6 +547,7 @@ class TestGetFileExtensions(unittest.TestCase):
         self.assertEqual(get_file_extensions('test.fastq'),('fastq',''))
         self.assertEqual(get_file_extensions('test.fastq.gz'),('fastq','gz'))
         self.assertEqual(get_file_extensions('test.file.fastq.gz'),('fastq','gz'))
+        self.assertEqual(get_file_extensions('test.fastq.xz'),('fastq','xz'))
 
 from arqvist.core import get_size
 class TestGetSize(unittest.TestCase):
@@ -280,6 +567,24 @@ class TestGetSize(unittest.TestCase):
         filen = utils.make_file('test.txt',dirn=self.dir_,text="This is some text")
         self.assertEqual(get_size(self.dir_),os.stat(filen).st_size + 4096)
 
+from arqvist.core import lookup_user
+from arqvist.core import lookup_group
+class TestLookupUserAndGroup(unittest.TestCase):
+    # Tests for the arqvist.core.lookup_user and lookup_group functions
+    def test_lookup_user(self):
+        uid = os.getuid()
+        self.assertEqual(lookup_user(uid),pwd.getpwuid(uid).pw_name)
+        self.assertTrue(uid in arqvist.core._USER_NAMES)
+    def test_lookup_group(self):
+        gid = os.getgid()
+        self.assertEqual(lookup_group(gid),grp.getgrgid(gid).gr_name)
+        self.assertTrue(gid in arqvist.core._GROUP_NAMES)
+    def test_lookup_missing_user_and_group(self):
+        uid = max([u.pw_uid for u in pwd.getpwall()]) + 1
+        gid = max([g.gr_gid for g in grp.getgrall()]) + 1
+        self.assertEqual(lookup_user(uid),None)
+        self.assertEqual(lookup_group(gid),None)
+
 from arqvist.core import convert_size
 class TestConvertSize(unittest.TestCase):
     # Tests for the arqvist.core.convert_size function
@@ -289,3 +594,20 @@ class TestConvertSize(unittest.TestCase):
         self.assertEqual(convert_size('1M'),1048576.0)
         self.assertEqual(convert_size('1G'),1073741824.0)
         self.assertEqual(convert_size('1T'),1099511627776.0)
+
+from arqvist.core import format_checksums
+from arqvist.core import parse_checksums
+class TestFormatChecksums(unittest.TestCase):
+    # Tests for the arqvist.core.format_checksums and
+    # parse_checksums functions
+    def test_format_checksums(self):
+        self.assertEqual(format_checksums({}),'')
+        self.assertEqual(format_checksums({'sha1': ('abc','def'),
+                                           'crc32': ('012','012'),
+                                           'sha256': ('xyz',None)}),
+                         'crc32=012:012,sha1=abc:def')
+    def test_parse_checksums(self):
+        self.assertEqual(parse_checksums(''),{})
+        self.assertEqual(parse_checksums('crc32=012:012,sha1=abc:def'),
+                         {'sha1': ('abc','def'),
+                          'crc32': ('012','012')})
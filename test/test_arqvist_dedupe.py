@@ -0,0 +1,167 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/dedupe package
+import os
+import unittest
+import utils
+from arqvist.core import DataDir
+from arqvist.dedupe import duplicate_groups
+from arqvist.dedupe import dedupe_files
+from arqvist.dedupe import undo_dedupe
+from arqvist.dedupe import same_contents
+from arqvist.dedupe import replace_with_link
+from arqvist.dedupe import read_manifest
+
+class DedupeTestCase(unittest.TestCase):
+    """Base class for tests deduplicating data dirs
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+        self.primary = utils.make_subdir(self.wd,'primary')
+        self.analysis = utils.make_subdir(self.wd,'analysis')
+        reads = utils.make_subdir(self.analysis,'reads')
+        utils.make_file('test1.fastq',dirn=self.primary,text="Reads 1")
+        utils.make_file('test2.fastq',dirn=self.primary,text="Reads 2")
+        utils.make_file('test1.fastq',dirn=reads,text="Reads 1")
+        utils.make_file('copy.fastq',dirn=reads,text="Reads 1")
+        utils.make_file('test2.fastq',dirn=reads,text="Reads 2")
+        utils.make_file('other.fastq',dirn=reads,text="Reads 3")
+        utils.make_file('empty1',dirn=self.primary,text="")
+        utils.make_file('empty2',dirn=reads,text="")
+        # Distinct timestamps for the copies
+        for i,f in enumerate(('test1.fastq','copy.fastq','test2.fastq')):
+            os.utime(os.path.join(reads,f),(1000000000+i,1000000000+i))
+        self.reads = reads
+        self.reads_mtime = os.lstat(reads).st_mtime
+        self.manifest = os.path.join(self.wd,'dedupe.tsv')
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def datadirs(self):
+        return [DataDir(self.primary,read_cache=False),
+                DataDir(self.analysis,read_cache=False)]
+    def dedupe(self,**kws):
+        groups = duplicate_groups(self.datadirs())
+        with open(self.manifest,'w') as fp:
+            return dedupe_files(groups,fp,**kws)
+
+class TestDuplicateGroups(DedupeTestCase):
+    """Tests for the duplicate_groups function
+    """
+    def test_duplicate_groups(self):
+        groups = duplicate_groups(self.datadirs())
+        self.assertEqual([[f.path for f in g] for g in groups],
+                         [[os.path.join(self.primary,'test1.fastq'),
+                           os.path.join(self.reads,'copy.fastq'),
+                           os.path.join(self.reads,'test1.fastq')],
+                          [os.path.join(self.primary,'test2.fastq'),
+                           os.path.join(self.reads,'test2.fastq')]])
+
+class TestDedupeFiles(DedupeTestCase):
+    """Tests for the dedupe_files function
+    """
+    def test_dedupe_files(self):
+        result = self.dedupe()
+        keeper1 = os.stat(os.path.join(self.primary,'test1.fastq'))
+        keeper2 = os.stat(os.path.join(self.primary,'test2.fastq'))
+        for f,keeper in (('test1.fastq',keeper1),
+                         ('copy.fastq',keeper1),
+                         ('test2.fastq',keeper2)):
+            st = os.lstat(os.path.join(self.reads,f))
+            self.assertEqual((st.st_dev,st.st_ino),
+                             (keeper.st_dev,keeper.st_ino))
+        self.assertNotEqual(os.lstat(os.path.join(self.reads,
+                                                  'other.fastq')).st_ino,
+                            keeper1.st_ino)
+        self.assertEqual(len(result.hardlinks),3)
+        self.assertEqual(result.symlinks,[])
+        self.assertEqual(result.skipped,[])
+        self.assertEqual(result.nbytes,21)
+        self.assertAlmostEqual(os.lstat(self.reads).st_mtime,
+                               self.reads_mtime,places=5)
+        self.assertEqual(len(read_manifest(self.manifest)),3)
+    def test_dedupe_files_dry_run(self):
+        result = self.dedupe(dry_run=True)
+        self.assertEqual(len(result.hardlinks),3)
+        self.assertEqual(os.lstat(os.path.join(self.reads,
+                                               'copy.fastq')).st_nlink,1)
+        self.assertEqual(read_manifest(self.manifest),[])
+    def test_dedupe_files_skips_different_permissions(self):
+        copy = os.path.join(self.reads,'copy.fastq')
+        os.chmod(copy,0o600)
+        result = self.dedupe()
+        self.assertEqual(result.skipped,[copy])
+        self.assertEqual(os.lstat(copy).st_nlink,1)
+        self.assertEqual(len(result.hardlinks),2)
+    def test_dedupe_files_skips_changed_contents(self):
+        groups = duplicate_groups(self.datadirs())
+        # Change the contents without changing the size or timestamp
+        copy = os.path.join(self.reads,'copy.fastq')
+        st = os.lstat(copy)
+        with open(copy,'w') as fp:
+            fp.write("Reads X")
+        os.utime(copy,(st.st_atime,st.st_mtime))
+        with open(self.manifest,'w') as fp:
+            result = dedupe_files(groups,fp)
+        self.assertEqual(result.skipped,[copy])
+        self.assertEqual(open(copy).read(),"Reads X")
+    def test_dedupe_files_verify_with_hash(self):
+        result = self.dedupe(verify='sha256')
+        self.assertEqual(len(result.hardlinks),3)
+
+class TestUndoDedupe(DedupeTestCase):
+    """Tests for the undo_dedupe function
+    """
+    def test_undo_dedupe(self):
+        before = dict([(f,os.lstat(os.path.join(self.reads,f)))
+                       for f in ('test1.fastq','copy.fastq','test2.fastq')])
+        self.dedupe()
+        restored,skipped = undo_dedupe(self.manifest)
+        self.assertEqual(len(restored),3)
+        self.assertEqual(skipped,[])
+        for f in before:
+            path = os.path.join(self.reads,f)
+            st = os.lstat(path)
+            self.assertEqual(st.st_nlink,1)
+            self.assertEqual(st.st_mtime,before[f].st_mtime)
+            self.assertEqual(st.st_mode,before[f].st_mode)
+        self.assertEqual(open(os.path.join(self.reads,'copy.fastq')).read(),
+                         "Reads 1")
+        self.assertEqual(os.lstat(os.path.join(self.primary,
+                                               'test1.fastq')).st_nlink,1)
+        self.assertAlmostEqual(os.lstat(self.reads).st_mtime,
+                               self.reads_mtime,places=5)
+    def test_undo_dedupe_skips_changed_links(self):
+        self.dedupe()
+        copy = os.path.join(self.reads,'copy.fastq')
+        os.remove(copy)
+        utils.make_file('copy.fastq',dirn=self.reads,text="New")
+        restored,skipped = undo_dedupe(self.manifest)
+        self.assertEqual(skipped,[copy])
+        self.assertEqual(open(copy).read(),"New")
+
+class TestReplaceWithLink(DedupeTestCase):
+    """Tests for the replace_with_link function
+    """
+    def test_replace_with_symlink(self):
+        copy = os.path.join(self.reads,'copy.fastq')
+        target = os.path.join(self.primary,'test1.fastq')
+        replace_with_link(copy,target,'symlink')
+        self.assertEqual(os.readlink(copy),
+                         os.path.join('..','..','primary','test1.fastq'))
+        self.assertEqual(open(copy).read(),"Reads 1")
+        self.assertAlmostEqual(os.lstat(self.reads).st_mtime,
+                               self.reads_mtime,places=5)
+        self.assertEqual(sorted(os.listdir(self.reads)),
+                         ['copy.fastq','empty2','other.fastq',
+                          'test1.fastq','test2.fastq'])
+
+class TestSameContents(DedupeTestCase):
+    """Tests for the same_contents function
+    """
+    def test_same_contents(self):
+        self.assertTrue(same_contents(
+            os.path.join(self.primary,'test1.fastq'),
+            os.path.join(self.reads,'copy.fastq')))
+        self.assertFalse(same_contents(
+            os.path.join(self.primary,'test1.fastq'),
+            os.path.join(self.reads,'other.fastq'),block_size=2))
@@ -0,0 +1,108 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/export package
+import os
+import unittest
+import utils
+from arqvist.core import DataDir
+from arqvist.export import export_datadir
+from arqvist.export import iter_rows
+from arqvist.export import iter_row_groups
+from arqvist.export import get_numpy_module
+from arqvist.export import get_pyarrow_module
+from arqvist.export import EXPORT_COLUMNS
+
+class ExportTestCase(unittest.TestCase):
+    """Base class for tests exporting a data dir
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+        self.dirn = utils.make_subdir(self.wd,'data')
+        subdir = utils.make_subdir(self.dirn,'reads')
+        utils.make_file('test1.fastq',dirn=subdir,text="Reads 1")
+        utils.make_file('test2.fastq.bz2',dirn=subdir,text="Reads 2",
+                        compress='bz2')
+        utils.make_file('README',dirn=self.dirn,text="Test data")
+        utils.make_symlink('link',os.path.join('reads','test1.fastq'),
+                           dirn=self.dirn)
+        self.datadir = DataDir(self.dirn)
+        self.datadir.files(pattern='test1.fastq')[0].get_md5sums()
+        self.outdir = utils.make_subdir(self.wd,'out')
+    def tearDown(self):
+        utils.rmdir(self.wd)
+
+class TestIterRows(ExportTestCase):
+    """Tests for the iter_rows and iter_row_groups functions
+    """
+    def test_iter_rows(self):
+        rows = dict([(row[0],row) for row in iter_rows(self.datadir)])
+        self.assertEqual(sorted(rows.keys()),
+                         ['README','link','reads',
+                          'reads/test1.fastq','reads/test2.fastq.bz2'])
+        row = rows['reads/test1.fastq']
+        self.assertEqual(len(row),len(EXPORT_COLUMNS))
+        st = os.lstat(os.path.join(self.dirn,'reads','test1.fastq'))
+        self.assertEqual(row[1:7],(st.st_size,st.st_blocks,st.st_mtime,
+                                   st.st_uid,st.st_gid,st.st_mode))
+        self.assertEqual(row[7],'fastq')
+        self.assertNotEqual(row[9],None)
+        self.assertEqual(rows['reads/test2.fastq.bz2'][8],'bz2')
+        self.assertEqual(rows['reads/test2.fastq.bz2'][9],None)
+    def test_iter_row_groups(self):
+        groups = list(iter_row_groups(self.datadir,row_group_size=2))
+        self.assertEqual([len(g) for g in groups],[2,2,1])
+
+class TestExportNpz(ExportTestCase):
+    """Tests for exporting to NumPy .npz files
+    """
+    def setUp(self):
+        if get_numpy_module() is None:
+            raise unittest.SkipTest("'numpy' not available")
+        ExportTestCase.setUp(self)
+    def test_export_npz(self):
+        import numpy
+        outfile = os.path.join(self.outdir,'inventory.npz')
+        self.assertEqual(export_datadir(self.datadir,outfile,
+                                        row_group_size=2),5)
+        data = numpy.load(outfile)
+        self.assertEqual(sorted(data.keys()),
+                         sorted([c[0] for c in EXPORT_COLUMNS] +
+                                ['datadir']))
+        self.assertEqual(str(data['datadir']),self.dirn)
+        rows = list(iter_rows(self.datadir))
+        self.assertEqual(list(data['path']),[r[0] for r in rows])
+        self.assertEqual(list(data['size']),[r[1] for r in rows])
+        self.assertEqual(list(data['mtime']),[r[3] for r in rows])
+        self.assertEqual(list(data['md5']),[(r[9] if r[9] else '')
+                                            for r in rows])
+        # No temporary files left behind
+        self.assertEqual(os.listdir(self.outdir),['inventory.npz'])
+
+class TestExportParquet(ExportTestCase):
+    """Tests for exporting to Parquet files
+    """
+    def setUp(self):
+        if get_pyarrow_module() is None:
+            raise unittest.SkipTest("'pyarrow' not available")
+        ExportTestCase.setUp(self)
+    def test_export_parquet(self):
+        import pyarrow.parquet
+        outfile = os.path.join(self.outdir,'inventory.parquet')
+        self.assertEqual(export_datadir(self.datadir,outfile,
+                                        row_group_size=2),5)
+        pq = pyarrow.parquet.ParquetFile(outfile)
+        self.assertEqual(pq.metadata.num_row_groups,3)
+        self.assertEqual(pq.schema.names,[c[0] for c in EXPORT_COLUMNS])
+        table = pq.read().to_pydict()
+        rows = list(iter_rows(self.datadir))
+        self.assertEqual(table['path'],[r[0] for r in rows])
+        self.assertEqual(table['size'],[r[1] for r in rows])
+        self.assertEqual(table['md5'],[r[9] for r in rows])
+
+class TestExportFormat(ExportTestCase):
+    """Tests for the export format
+    """
+    def test_bad_format(self):
+        self.assertRaises(Exception,export_datadir,self.datadir,
+                          os.path.join(self.outdir,'inventory.parquet'),
+                          format='csv')
@@ -0,0 +1,173 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/fastq package
+import os
+import gzip
+import unittest
+import utils
+import arqvist
+
+# Example FASTQ data
+FASTQ_R1 = """@READ1/1
+ACGTACGT
++
+IIIIIIII
+@READ2/1
+ACGTAC
++
+IIIIII
+"""
+FASTQ_R2 = """@READ1/2
+TTGTACGT
++
+IIIIIIII
+@READ2/2
+TTGTAC
++
+IIIIII
+"""
+
+#
+# Tests
+
+from arqvist.fastq import FastqStats
+class TestFastqStats(unittest.TestCase):
+    def test_add_read(self):
+        stats = FastqStats()
+        stats.add_read('READ1',8)
+        stats.add_read('READ2',6)
+        self.assertEqual(stats.nreads,2)
+        self.assertEqual(stats.min_length,6)
+        self.assertEqual(stats.max_length,8)
+        self.assertEqual(stats.mean_length,7.0)
+        self.assertEqual(stats.lengths(),'6-8 (7.0)')
+    def test_to_and_from_line(self):
+        stats = FastqStats()
+        stats.add_read('READ1',8)
+        md5,stats2 = FastqStats.from_line(stats.to_line('abc123'))
+        self.assertEqual(md5,'abc123')
+        self.assertEqual(stats2.nreads,1)
+        self.assertEqual(stats2.min_length,8)
+        self.assertEqual(stats2.max_length,8)
+        self.assertEqual(stats2.names_digest,stats.names_digest)
+        self.assertEqual(stats2.status,'ok')
+
+from arqvist.fastq import scan_fastq
+class TestScanFastq(unittest.TestCase):
+    def setUp(self):
+        # Create test directory
+        self.dir_ = utils.make_temp_dir()
+    def tearDown(self):
+        # Remove test directory and contents
+        utils.rmdir(self.dir_)
+    def test_scan_fastq(self):
+        filen = utils.make_file('test_R1.fastq',dirn=self.dir_,
+                                text=FASTQ_R1)
+        stats = scan_fastq(filen)
+        self.assertEqual(stats.status,'ok')
+        self.assertEqual(stats.nreads,2)
+        self.assertEqual(stats.lengths(),'6-8 (7.0)')
+    def test_scan_fastq_bz2(self):
+        filen = utils.make_file('test_R1.fastq.bz2',dirn=self.dir_,
+                                text=FASTQ_R1,compress='bz2')
+        stats = scan_fastq(filen)
+        self.assertEqual(stats.status,'ok')
+        self.assertEqual(stats.nreads,2)
+    def test_scan_truncated_fastq(self):
+        filen = utils.make_file('test_R1.fastq',dirn=self.dir_,
+                                text=FASTQ_R1[:-10])
+        stats = scan_fastq(filen)
+        self.assertEqual(stats.status,'truncated')
+        self.assertEqual(stats.nreads,1)
+    def test_scan_truncated_gzipped_fastq(self):
+        filen = os.path.join(self.dir_,'test_R1.fastq.gz')
+        fp = gzip.open(filen,'wb')
+        fp.write(FASTQ_R1*100)
+        fp.close()
+        data = open(filen,'rb').read()
+        open(filen,'wb').write(data[:len(data)/2])
+        self.assertEqual(scan_fastq(filen).status,'truncated')
+    def test_scan_corrupt_fastq(self):
+        filen = utils.make_file('test_R1.fastq',dirn=self.dir_,
+                                text=FASTQ_R1.replace('+','-'))
+        self.assertEqual(scan_fastq(filen).status,'corrupt')
+
+from arqvist.fastq import get_pair_name
+class TestGetPairName(unittest.TestCase):
+    def test_get_pair_name(self):
+        self.assertEqual(get_pair_name('/data/PJB_S1_L001_R1_001.fastq.gz'),
+                         '/data/PJB_S1_L001_R2_001.fastq.gz')
+        self.assertEqual(get_pair_name('PJB_R1.fastq'),'PJB_R2.fastq')
+        self.assertEqual(get_pair_name('PJB_S1_L001_R2_001.fastq.gz'),None)
+        self.assertEqual(get_pair_name('PJB.fastq'),None)
+
+from arqvist.core import DataDir
+from arqvist import fastq
+from arqvist.fastq import get_fastq_stats
+from arqvist.fastq import check_pairs
+class TestGetFastqStats(unittest.TestCase):
+    def setUp(self):
+        # Create test directory
+        self.dir_ = utils.make_temp_dir()
+        utils.make_file('PJB_R1.fastq',dirn=self.dir_,text=FASTQ_R1)
+        utils.make_file('PJB_R2.fastq',dirn=self.dir_,text=FASTQ_R2)
+        utils.make_file('PB_R1.fastq',dirn=self.dir_,text=FASTQ_R1)
+        utils.make_file('PB_R2.fastq',dirn=self.dir_,text=FASTQ_R2[:-7])
+    def tearDown(self):
+        # Remove test directory and contents
+        utils.rmdir(self.dir_)
+    def test_get_fastq_stats(self):
+        results = get_fastq_stats(DataDir(self.dir_),nprocs=2)
+        self.assertEqual(len(results),4)
+        for f,stats in results:
+            if f.basename == 'PB_R2.fastq':
+                self.assertEqual(stats.status,'truncated')
+            else:
+                self.assertEqual(stats.status,'ok')
+                self.assertEqual(stats.nreads,2)
+    def test_get_fastq_stats_with_cache(self):
+        d = DataDir(self.dir_)
+        d.init_cache()
+        results = get_fastq_stats(d,nprocs=2)
+        self.assertTrue(os.path.exists(os.path.join(self.dir_,
+                                                    '.archiver',
+                                                    'fastqinfo')))
+        for f,stats in results:
+            self.assertNotEqual(f.md5,None)
+        # Rerun using the cached values
+        results2 = get_fastq_stats(d,nprocs=2)
+        self.assertEqual([s.nreads for f,s in results],
+                         [s.nreads for f,s in results2])
+    def test_get_fastq_stats_cached_run_no_pool(self):
+        d = DataDir(self.dir_)
+        d.init_cache()
+        get_fastq_stats(d,nprocs=2)
+        # Rerun without being able to start worker processes
+        Pool = fastq.multiprocessing.Pool
+        def no_pool(*args,**kws):
+            raise Exception("Pool shouldn't be created")
+        fastq.multiprocessing.Pool = no_pool
+        try:
+            self.assertEqual(len(get_fastq_stats(d,nprocs=2)),4)
+        finally:
+            fastq.multiprocessing.Pool = Pool
+    def test_get_fastq_stats_drops_stale_cache_entries(self):
+        d = DataDir(self.dir_)
+        d.init_cache()
+        get_fastq_stats(d,nprocs=2)
+        cachefile = os.path.join(self.dir_,'.archiver','fastqinfo')
+        self.assertEqual(len(open(cachefile).readlines()),3)
+        # Remove a file and change another
+        os.remove(os.path.join(self.dir_,'PB_R2.fastq'))
+        utils.make_file('PJB_R2.fastq',dirn=self.dir_,text=FASTQ_R1)
+        d = DataDir(self.dir_)
+        self.assertEqual(len(get_fastq_stats(d,nprocs=2)),3)
+        self.assertEqual(len(open(cachefile).readlines()),1)
+    def test_check_pairs(self):
+        pairs = check_pairs(get_fastq_stats(DataDir(self.dir_),nprocs=2))
+        self.assertEqual(len(pairs),2)
+        for r1,r2,status in pairs:
+            if r1.basename == 'PJB_R1.fastq':
+                self.assertEqual(status,'ok')
+            else:
+                self.assertEqual(status,'not checked (invalid file)')
@@ -0,0 +1,114 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/hashing package
+import os
+import bz2
+import unittest
+import utils
+from arqvist import hashing
+from arqvist.hashing import available_algorithms
+from arqvist.hashing import get_hasher
+from arqvist.hashing import hash_file
+
+# Checksums for "This is some text"
+CHECKSUMS = {
+    'md5': '97214f63224bc1e9cc4da377aadce7c7',
+    'sha1': '482cb0cfcbed6740a2bcb659c9ccc22a4d27b369',
+    'sha256': '2263d8dd95ccfe1ad45d732c6eaaf59b3345e6647331605cb15aae52002dff75',
+    'crc32': '9f4b7f7b',
+}
+
+class TestAvailableAlgorithms(unittest.TestCase):
+    """Tests for the available_algorithms function
+    """
+    def test_available_algorithms(self):
+        algorithms = available_algorithms()
+        for algorithm in ('md5','sha1','sha256','crc32'):
+            self.assertTrue(algorithm in algorithms)
+    def test_available_algorithms_not_weak(self):
+        algorithms = available_algorithms(weak=False)
+        for algorithm in ('md5','sha1','sha256'):
+            self.assertTrue(algorithm in algorithms)
+        self.assertFalse('crc32' in algorithms)
+
+class TestGetHasher(unittest.TestCase):
+    """Tests for the get_hasher function
+    """
+    def test_get_hasher(self):
+        for algorithm in CHECKSUMS:
+            hasher = get_hasher(algorithm)
+            hasher.update("This is ")
+            hasher.update("some text")
+            self.assertEqual(hasher.hexdigest(),CHECKSUMS[algorithm])
+    def test_get_hasher_unknown_algorithm(self):
+        self.assertRaises(ValueError,get_hasher,'md4x')
+
+class TestHashFile(unittest.TestCase):
+    """Tests for the hash_file function
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def test_hash_file(self):
+        filen = utils.make_file('test.txt',dirn=self.wd,
+                                text="This is some text")
+        for algorithm in CHECKSUMS:
+            self.assertEqual(hash_file(filen,algorithm),
+                             CHECKSUMS[algorithm])
+    def test_hash_file_small_blocks(self):
+        filen = utils.make_file('test.txt',dirn=self.wd,
+                                text="This is some text")
+        self.assertEqual(hash_file(filen,'sha256',block_size=3),
+                         CHECKSUMS['sha256'])
+    def test_hash_file_object(self):
+        filen = utils.make_file('test.txt.bz2',dirn=self.wd,
+                                text="This is some text",compress='bz2')
+        fp = bz2.BZ2File(filen,'r')
+        self.assertEqual(hash_file(fp,'sha1'),CHECKSUMS['sha1'])
+        fp.close()
+    def test_hash_file_mmap(self):
+        filen = utils.make_file('test.txt',dirn=self.wd,
+                                text="This is some text")
+        for algorithm in CHECKSUMS:
+            self.assertEqual(hash_file(filen,algorithm,block_size=4,
+                                       use_mmap=True),
+                             CHECKSUMS[algorithm])
+    def test_hash_empty_file(self):
+        filen = utils.make_file('empty.txt',dirn=self.wd,text="")
+        md5 = 'd41d8cd98f00b204e9800998ecf8427e'
+        self.assertEqual(hash_file(filen),md5)
+        self.assertEqual(hash_file(filen,use_mmap=True),md5)
+    def test_hash_file_callback(self):
+        filen = utils.make_file('test.txt',dirn=self.wd,
+                                text="This is some text")
+        for use_mmap in (False,True):
+            blocks = []
+            hash_file(filen,block_size=5,use_mmap=use_mmap,
+                      callback=blocks.append)
+            self.assertEqual(blocks,[5,5,5,2])
+    def test_hash_file_no_drop_cache(self):
+        filen = utils.make_file('test.txt',dirn=self.wd,
+                                text="This is some text")
+        self.assertEqual(hash_file(filen,drop_cache=False),
+                         CHECKSUMS['md5'])
+
+class TestConfigure(unittest.TestCase):
+    """Tests for the configure function
+    """
+    def setUp(self):
+        self.defaults = (hashing.BLOCK_SIZE,hashing.USE_MMAP,
+                         hashing.DROP_CACHE)
+    def tearDown(self):
+        hashing.BLOCK_SIZE,hashing.USE_MMAP,hashing.DROP_CACHE = \
+            self.defaults
+    def test_configure(self):
+        hashing.configure(block_size=4096)
+        self.assertEqual(hashing.BLOCK_SIZE,4096)
+        self.assertEqual(hashing.USE_MMAP,self.defaults[1])
+        hashing.configure(use_mmap=True,drop_cache=False)
+        self.assertEqual(hashing.BLOCK_SIZE,4096)
+        self.assertTrue(hashing.USE_MMAP)
+        self.assertFalse(hashing.DROP_CACHE)
+    def test_configure_bad_block_size(self):
+        self.assertRaises(ValueError,hashing.configure,block_size=0)
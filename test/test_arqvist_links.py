@@ -0,0 +1,155 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/links package
+import os
+import unittest
+import utils
+from arqvist.core import DataDir
+from arqvist.links import PathIndex
+from arqvist.links import plan_repairs
+from arqvist.links import apply_repairs
+from arqvist.links import replace_symlink
+
+class LinksTestCase(unittest.TestCase):
+    """Base class for tests repairing links
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+        self.dirn = utils.make_subdir(self.wd,'analysis')
+        self.data = utils.make_subdir(self.dirn,'data')
+        self.links = utils.make_subdir(self.dirn,'links')
+        utils.make_file('reads1.fastq.bz2',dirn=self.data,text="Reads 1",
+                        compress='bz2')
+        utils.make_file('reads2.fastq',dirn=self.data,text="Reads 2")
+        # Relative link broken by compression
+        utils.make_symlink('reads1.fastq',
+                           os.path.join('..','data','reads1.fastq'),
+                           dirn=self.links)
+        # Working absolute link
+        utils.make_symlink('reads2.fastq',
+                           os.path.join(self.data,'reads2.fastq'),
+                           dirn=self.links)
+        # Broken link with no alternative
+        utils.make_symlink('missing.fastq',
+                           os.path.join('..','data','missing.fastq'),
+                           dirn=self.links)
+        self.links_mtime = os.lstat(self.links).st_mtime
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def plan(self,index=None,**kws):
+        datadir = DataDir(self.dirn,read_cache=False)
+        repairs,unresolved = plan_repairs(datadir,index=index,**kws)
+        return (dict([(os.path.basename(r.path),r) for r in repairs]),
+                [os.path.basename(p) for p in unresolved])
+
+class TestPathIndex(LinksTestCase):
+    """Tests for the PathIndex class
+    """
+    def test_exists(self):
+        index = PathIndex([DataDir(self.dirn,read_cache=False)])
+        self.assertTrue(index.exists(os.path.join(self.data,
+                                                  'reads2.fastq')))
+        self.assertFalse(index.exists(os.path.join(self.data,
+                                                   'reads1.fastq')))
+        self.assertTrue(index.exists(self.dirn))
+        self.assertTrue(index.exists(self.wd))
+    def test_exists_under_link(self):
+        elsewhere = utils.make_subdir(self.wd,'elsewhere')
+        utils.make_file('test.txt',dirn=elsewhere)
+        utils.make_symlink('linkdir',elsewhere,dirn=self.dirn)
+        index = PathIndex([DataDir(self.dirn,read_cache=False)])
+        self.assertTrue(index.exists(os.path.join(self.dirn,'linkdir',
+                                                  'test.txt')))
+    def test_find(self):
+        index = PathIndex([DataDir(self.dirn,read_cache=False)])
+        self.assertEqual(index.find('reads2.fastq'),
+                         [os.path.join(self.data,'reads2.fastq')])
+        self.assertEqual(index.find('missing.fastq'),[])
+
+class TestPlanRepairs(LinksTestCase):
+    """Tests for the plan_repairs function
+    """
+    def test_plan_repairs(self):
+        repairs,unresolved = self.plan()
+        self.assertEqual(sorted(repairs.keys()),['reads1.fastq'])
+        self.assertEqual(repairs['reads1.fastq'].new_target,
+                         os.path.join('..','data','reads1.fastq.bz2'))
+        self.assertEqual(repairs['reads1.fastq'].reason,'alternative')
+        self.assertEqual(unresolved,['missing.fastq'])
+    def test_plan_repairs_relative(self):
+        repairs,unresolved = self.plan(relative=True)
+        self.assertEqual(sorted(repairs.keys()),
+                         ['reads1.fastq','reads2.fastq'])
+        self.assertEqual(repairs['reads2.fastq'].new_target,
+                         os.path.join('..','data','reads2.fastq'))
+        self.assertEqual(repairs['reads2.fastq'].reason,'relative')
+    def test_plan_repairs_rebase(self):
+        utils.make_symlink('moved.fastq',
+                           os.path.join('/old/location','data',
+                                        'reads2.fastq'),
+                           dirn=self.links)
+        repairs,unresolved = self.plan(rebase=('/old/location',self.dirn))
+        self.assertEqual(repairs['moved.fastq'].new_target,
+                         os.path.join(self.data,'reads2.fastq'))
+        self.assertEqual(repairs['moved.fastq'].reason,'rebase')
+    def test_plan_repairs_search(self):
+        search_dir = utils.make_subdir(self.wd,'search')
+        utils.make_file('missing.fastq.gz',dirn=search_dir)
+        index = PathIndex([DataDir(self.dirn,read_cache=False),
+                           DataDir(search_dir,read_cache=False)])
+        repairs,unresolved = self.plan(index=index,search=True)
+        self.assertEqual(repairs['missing.fastq'].new_target,
+                         os.path.join('..','..','search',
+                                      'missing.fastq.gz'))
+        self.assertEqual(repairs['missing.fastq'].reason,'search')
+        self.assertEqual(unresolved,[])
+    def test_plan_repairs_search_ambiguous(self):
+        search_dir = utils.make_subdir(self.wd,'search')
+        utils.make_file('missing.fastq',dirn=search_dir)
+        utils.make_file('missing.fastq.gz',dirn=search_dir)
+        index = PathIndex([DataDir(self.dirn,read_cache=False),
+                           DataDir(search_dir,read_cache=False)])
+        repairs,unresolved = self.plan(index=index,search=True)
+        self.assertEqual(unresolved,['missing.fastq'])
+
+class TestApplyRepairs(LinksTestCase):
+    """Tests for the apply_repairs function
+    """
+    def test_apply_repairs(self):
+        datadir = DataDir(self.dirn,read_cache=False)
+        repairs,unresolved = plan_repairs(datadir,relative=True)
+        updated = apply_repairs(repairs)
+        self.assertEqual(len(updated),2)
+        self.assertEqual(os.readlink(os.path.join(self.links,
+                                                  'reads1.fastq')),
+                         os.path.join('..','data','reads1.fastq.bz2'))
+        self.assertEqual(os.readlink(os.path.join(self.links,
+                                                  'reads2.fastq')),
+                         os.path.join('..','data','reads2.fastq'))
+        self.assertAlmostEqual(os.lstat(self.links).st_mtime,
+                               self.links_mtime,places=5)
+    def test_apply_repairs_dry_run(self):
+        datadir = DataDir(self.dirn,read_cache=False)
+        repairs,unresolved = plan_repairs(datadir)
+        self.assertEqual(len(apply_repairs(repairs,dry_run=True)),1)
+        self.assertEqual(os.readlink(os.path.join(self.links,
+                                                  'reads1.fastq')),
+                         os.path.join('..','data','reads1.fastq'))
+    def test_apply_repairs_skips_changed_links(self):
+        datadir = DataDir(self.dirn,read_cache=False)
+        repairs,unresolved = plan_repairs(datadir)
+        link = os.path.join(self.links,'reads1.fastq')
+        os.remove(link)
+        os.symlink('elsewhere',link)
+        self.assertEqual(apply_repairs(repairs),[])
+        self.assertEqual(os.readlink(link),'elsewhere')
+
+class TestReplaceSymlink(LinksTestCase):
+    """Tests for the replace_symlink function
+    """
+    def test_replace_symlink(self):
+        link = os.path.join(self.links,'missing.fastq')
+        replace_symlink(link,'reads2.fastq')
+        self.assertEqual(os.readlink(link),'reads2.fastq')
+        self.assertEqual(sorted(os.listdir(self.links)),
+                         ['missing.fastq','reads1.fastq','reads2.fastq'])
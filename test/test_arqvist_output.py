@@ -0,0 +1,42 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/output package
+import sys
+import json
+import unittest
+from StringIO import StringIO
+from arqvist.output import NdjsonWriter
+
+class TestNdjsonWriter(unittest.TestCase):
+    """Tests for the NdjsonWriter class
+    """
+    def test_write(self):
+        fp = StringIO()
+        output = NdjsonWriter(fp)
+        output.write('file',path='test.txt',size=10)
+        output.write('summary',nfiles=1)
+        self.assertEqual(output.nrecords,2)
+        lines = fp.getvalue().split('\n')
+        self.assertEqual(lines[-1],'')
+        self.assertEqual([json.loads(line) for line in lines[:-1]],
+                         [{'type': 'file','path': 'test.txt','size': 10},
+                          {'type': 'summary','nfiles': 1}])
+    def test_write_invalid_utf8(self):
+        fp = StringIO()
+        NdjsonWriter(fp).write('file',path='bad\xffname',
+                               paths=['ok','bad\xff'])
+        record = json.loads(fp.getvalue())
+        self.assertEqual(record['path'],u'bad\ufffdname')
+        self.assertEqual(record['paths'],[u'ok',u'bad\ufffd'])
+    def test_write_to_stdout(self):
+        # Default is whatever stdout is when the record is written
+        output = NdjsonWriter()
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            output.write('file',path='test.txt')
+            written = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(json.loads(written),
+                         {'type': 'file','path': 'test.txt'})
@@ -0,0 +1,113 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/profiling package
+import os
+import json
+import unittest
+import utils
+from StringIO import StringIO
+from arqvist.profiling import Profiler
+
+#
+# Profiler
+#
+class TestProfiler(unittest.TestCase):
+    """Tests for the Profiler class
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+
+    def tearDown(self):
+        utils.rmdir(self.wd)
+
+    def test_disabled_profiler_does_nothing(self):
+        p = Profiler()
+        p.count('files_scanned')
+        with p.timer('md5',nbytes=100,item='file1'):
+            pass
+        self.assertEqual(p.counters,{})
+        self.assertEqual(p.phases,{})
+        self.assertEqual(p.slowest(),[])
+
+    def test_count(self):
+        p = Profiler()
+        p.enable()
+        p.count('files_scanned')
+        p.count('files_scanned',4)
+        p.count('cache_hits')
+        self.assertEqual(p.counters,{'files_scanned': 5,
+                                     'cache_hits': 1})
+
+    def test_timer(self):
+        p = Profiler()
+        p.enable()
+        with p.timer('md5',nbytes=100,item='file1'):
+            pass
+        with p.timer('md5',nbytes=50,item='file2'):
+            pass
+        with p.timer('stat'):
+            pass
+        phases = p.phases
+        self.assertEqual(sorted(phases.keys()),['md5','stat'])
+        self.assertEqual(phases['md5']['calls'],2)
+        self.assertEqual(phases['md5']['bytes'],150)
+        self.assertEqual(phases['stat']['calls'],1)
+        self.assertEqual(sorted([x[1] for x in p.slowest()]),
+                         ['file1','file2'])
+
+    def test_timer_records_time_on_exception(self):
+        p = Profiler()
+        p.enable()
+        try:
+            with p.timer('compress'):
+                raise OSError("Failed")
+        except OSError:
+            pass
+        self.assertEqual(p.phases['compress']['calls'],1)
+
+    def test_slowest(self):
+        p = Profiler()
+        p.enable()
+        p.add_time('md5',0.1,item='file1')
+        p.add_time('md5',0.3,item='file2')
+        p.add_time('compress',0.2,item='file3')
+        self.assertEqual([x[1] for x in p.slowest(2)],['file2','file3'])
+
+    def test_compression_ratio(self):
+        p = Profiler()
+        p.enable()
+        self.assertEqual(p.compression_ratio,None)
+        p.count('compress_bytes_in',400)
+        p.count('compress_bytes_out',100)
+        self.assertEqual(p.compression_ratio,4.0)
+
+    def test_enable_resets_data(self):
+        p = Profiler()
+        p.enable()
+        p.count('cache_hits')
+        p.enable()
+        self.assertEqual(p.counters,{})
+
+    def test_report(self):
+        p = Profiler()
+        p.enable()
+        p.add_time('md5',0.5,nbytes=1048576,item='file1')
+        p.count('files_scanned',2)
+        fp = StringIO()
+        p.report(fp=fp)
+        report = fp.getvalue()
+        self.assertTrue("md5\t1\t0.500\t1048576\t2.0\n" in report)
+        self.assertTrue("files_scanned\t2\n" in report)
+
+    def test_write_json(self):
+        p = Profiler()
+        p.enable()
+        p.add_time('md5',0.5,nbytes=1048576,item='file1')
+        p.count('files_scanned',2)
+        json_file = os.path.join(self.wd,'profile.json')
+        p.write_json(json_file)
+        data = json.load(open(json_file))
+        self.assertEqual(data['counters'],{'files_scanned': 2})
+        self.assertEqual(data['phases']['md5']['calls'],1)
+        self.assertEqual(data['phases']['md5']['mb_per_sec'],2.0)
+        self.assertEqual(data['items'][0]['item'],'file1')
@@ -0,0 +1,96 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/progress package
+import unittest
+from StringIO import StringIO
+from arqvist.progress import ProgressReporter
+from arqvist.progress import NullProgressReporter
+from arqvist.progress import get_progress_reporter
+from arqvist.progress import format_bytes
+from arqvist.progress import format_time
+
+#
+# ProgressReporter
+#
+class TestProgressReporter(unittest.TestCase):
+    """Tests for the ProgressReporter class
+    """
+    def test_update_counts_bytes_and_items(self):
+        fp = StringIO()
+        p = ProgressReporter("Test",1000,total_items=4,fp=fp,tty=False)
+        p.update(100,1)
+        p.update(150,1)
+        self.assertEqual(p.bytes_done,250)
+        self.assertEqual(p.items_done,2)
+
+    def test_no_output_before_interval(self):
+        fp = StringIO()
+        p = ProgressReporter("Test",1000,fp=fp,tty=False,interval=3600)
+        p.update(100)
+        self.assertEqual(fp.getvalue(),"")
+
+    def test_log_output(self):
+        fp = StringIO()
+        p = ProgressReporter("Test",2048,total_items=2,fp=fp,tty=False,
+                             interval=0)
+        p.update(1024,1)
+        lines = fp.getvalue().split('\n')
+        self.assertEqual(len(lines),2)
+        self.assertTrue(lines[0].startswith('['))
+        self.assertTrue("Test: 1.0K/2.0K (50.0%) 1/2 items" in lines[0])
+        self.assertTrue("/s" in lines[0])
+
+    def test_tty_output(self):
+        fp = StringIO()
+        p = ProgressReporter("Test",2048,fp=fp,tty=True,interval=0)
+        p.update(1024)
+        p.update(1024)
+        p.finish()
+        output = fp.getvalue()
+        self.assertTrue(output.startswith("\rTest: 1.0K/2.0K (50.0%)"))
+        self.assertEqual(output.count('\r'),3)
+        self.assertTrue(output.endswith("\n"))
+        self.assertEqual(output.count('\n'),1)
+
+    def test_eta(self):
+        p = ProgressReporter("Test",2048,fp=StringIO(),tty=False)
+        p._start_time -= 10.0
+        p._samples[0] = (p._start_time,0)
+        p.update(1024)
+        # 1024 bytes in 10s, so about 10s remaining
+        self.assertAlmostEqual(p.eta,10.0,places=0)
+
+    def test_zero_total(self):
+        fp = StringIO()
+        p = ProgressReporter("Test",0,fp=fp,tty=False,interval=0)
+        p.update(0)
+        p.finish()
+        self.assertTrue("Test: 0B in 0:00:00" in fp.getvalue())
+
+class TestGetProgressReporter(unittest.TestCase):
+    """Tests for the get_progress_reporter function
+    """
+    def test_get_progress_reporter(self):
+        self.assertTrue(isinstance(get_progress_reporter("Test",100),
+                                   ProgressReporter))
+        self.assertTrue(isinstance(get_progress_reporter("Test",100,
+                                                         enabled=False),
+                                   NullProgressReporter))
+
+class TestFormatBytes(unittest.TestCase):
+    """Tests for the format_bytes function
+    """
+    def test_format_bytes(self):
+        self.assertEqual(format_bytes(0),"0B")
+        self.assertEqual(format_bytes(1023),"1023B")
+        self.assertEqual(format_bytes(1536),"1.5K")
+        self.assertEqual(format_bytes(3*1024*1024*1024),"3.0G")
+        self.assertEqual(format_bytes(2048*1024**4),"2048.0T")
+
+class TestFormatTime(unittest.TestCase):
+    """Tests for the format_time function
+    """
+    def test_format_time(self):
+        self.assertEqual(format_time(0),"0:00:00")
+        self.assertEqual(format_time(61.4),"0:01:01")
+        self.assertEqual(format_time(3*3600+5),"3:00:05")
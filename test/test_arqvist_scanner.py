@@ -0,0 +1,75 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/scanner package
+import os
+import unittest
+import utils
+from arqvist.core import DataDir
+from arqvist.core import ArchiveFile
+from arqvist import scanner
+from arqvist.scanner import scan_dir
+
+class TestScanDir(unittest.TestCase):
+    """Tests for the scan_dir function
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+        self.dirn = utils.make_subdir(self.wd,'data')
+        for name in ('a','b','c'):
+            subdir = utils.make_subdir(self.dirn,name)
+            utils.make_file('%s.fastq' % name,dirn=subdir,
+                            text="Data for %s" % name)
+            subsubdir = utils.make_subdir(subdir,'sub')
+            utils.make_file('%s.txt' % name,dirn=subsubdir,text=name)
+        utils.make_file('top.txt',dirn=self.dirn,text="Top level")
+        utils.make_symlink('link',os.path.join('a','a.fastq'),
+                           dirn=self.dirn)
+        utils.make_symlink('dir_link','b',dirn=self.dirn)
+        utils.make_symlink('broken_link','missing',dirn=self.dirn)
+        archiver = utils.make_subdir(self.dirn,'.archiver')
+        utils.make_file('cache',dirn=archiver,text="cache")
+        utils.make_subdir(archiver,'sub')
+        utils.make_file('in_archiver_sub.txt',
+                        dirn=os.path.join(archiver,'sub'),
+                        text="hidden?")
+        nested = utils.make_subdir(os.path.join(self.dirn,'c'),'.archiver')
+        utils.make_file('nested_cache',dirn=nested,text="cache")
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def test_scan_dir_matches_walk(self):
+        walk = list(DataDir(self.dirn,files=[])._walk())
+        for nthreads in (1,2,8):
+            self.assertEqual([f.path for f in
+                              scan_dir(self.dirn,ArchiveFile,
+                                       nthreads=nthreads)],
+                             walk)
+    def test_scan_dir_symlinks(self):
+        files = dict([(os.path.basename(f.path),f)
+                      for f in scan_dir(self.dirn,ArchiveFile,nthreads=4)])
+        self.assertTrue(files['dir_link'].is_link)
+        self.assertFalse(files['dir_link'].is_dir)
+        self.assertTrue(files['broken_link'].is_link)
+        self.assertTrue(files['sub'].is_dir)
+    def test_datadir_scan_threads(self):
+        serial = DataDir(self.dirn,read_cache=False)
+        threaded = DataDir(self.dirn,read_cache=False,scan_threads=4)
+        self.assertEqual([f.path for f in threaded.files()],
+                         [f.path for f in serial.files()])
+        self.assertEqual(threaded.summary(),serial.summary())
+
+class TestConfigure(unittest.TestCase):
+    """Tests for the configure function
+    """
+    def setUp(self):
+        self.scan_threads = scanner.SCAN_THREADS
+    def tearDown(self):
+        scanner.SCAN_THREADS = self.scan_threads
+    def test_configure(self):
+        scanner.configure(threads=8)
+        self.assertEqual(scanner.SCAN_THREADS,8)
+        scanner.configure()
+        self.assertEqual(scanner.SCAN_THREADS,8)
+        scanner.configure(threads=0)
+        self.assertEqual(scanner.SCAN_THREADS,0)
+    def test_configure_bad_threads(self):
+        self.assertRaises(ValueError,scanner.configure,threads=-1)
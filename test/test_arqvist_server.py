@@ -0,0 +1,135 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/server package
+import os
+import sys
+import threading
+import unittest
+import utils
+import arqvist
+
+#
+# Tests
+
+from arqvist.server import DataDirStore
+class TestDataDirStore(unittest.TestCase):
+    def setUp(self):
+        # Create test directory
+        self.dir_ = utils.make_temp_dir()
+        utils.make_file('test1.fastq',dirn=self.dir_)
+    def tearDown(self):
+        # Remove test directory and contents
+        utils.rmdir(self.dir_)
+    def test_get(self):
+        # Check the same instance is returned each time
+        store = DataDirStore()
+        d = store.get(self.dir_)
+        self.assertEqual(len(d),1)
+        self.assertTrue(store.get(self.dir_) is d)
+        self.assertEqual(len(store),1)
+    def test_get_with_refresh(self):
+        # Check that changes are picked up on refresh
+        store = DataDirStore(refresh_interval=0)
+        d = store.get(self.dir_)
+        self.assertEqual(len(d),1)
+        utils.make_file('test2.fastq',dirn=self.dir_)
+        self.assertEqual(len(store.get(self.dir_)),2)
+    def test_get_view(self):
+        # Check views are kept until the data dir changes
+        store = DataDirStore(refresh_interval=0)
+        d = store.get(self.dir_)
+        view = store.get_view(self.dir_,'files',lambda d: d.files())
+        self.assertEqual(view,d.files())
+        self.assertTrue(store.get_view(self.dir_,'files',list) is view)
+        utils.make_file('test2.fastq',dirn=self.dir_)
+        self.assertEqual(len(store.get_view(self.dir_,'files',
+                                            lambda d: d.files())),2)
+        self.assertEqual(len(store),1)
+
+from arqvist.server import DataDirServer
+from arqvist.server import send_request
+class TestDataDirServer(unittest.TestCase):
+    def setUp(self):
+        # Create test directory and start server
+        self.dir_ = utils.make_temp_dir()
+        self.data_dir = utils.make_subdir(self.dir_,'data')
+        utils.make_file('test1.fastq',dirn=self.data_dir)
+        self.socket_path = os.path.join(self.dir_,'arqvist.sock')
+        def handler(argv,store):
+            print "%s: %d" % (argv[0],len(store.get(argv[1])))
+            return 0
+        self.server = DataDirServer(self.socket_path,handler,
+                                    DataDirStore())
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+    def tearDown(self):
+        # Stop server and remove test directory
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        utils.rmdir(self.dir_)
+    def test_send_request(self):
+        self.assertEqual(send_request(self.socket_path,['info',self.data_dir]),
+                         (0,"info: 1\n"))
+    def test_send_empty_request(self):
+        self.assertEqual(send_request(self.socket_path,[]),(0,''))
+
+from arqvist.core import DataDir
+from arqvist.cli import handle_request
+class TestHandleRequest(unittest.TestCase):
+    def setUp(self):
+        # Create test directory with a cache
+        self.dir_ = utils.make_temp_dir()
+        utils.make_file('test1.fastq',dirn=self.dir_,text="Reads")
+        utils.make_file('test2.fastq',dirn=self.dir_,text="Reads")
+        utils.make_file('test.csfasta',dirn=self.dir_,text="Colour space")
+        os.mkdir(os.path.join(self.dir_,'.archiver'))
+    def tearDown(self):
+        # Remove test directory and contents
+        utils.rmdir(self.dir_)
+    def test_solid_query_keeps_md5sums(self):
+        # Check that MD5 sums generated by one query aren't lost
+        # after a SOLiD query on the same directory
+        store = DataDirStore()
+        stdout = sys.stdout
+        try:
+            sys.stdout = open(os.devnull,'w')
+            handle_request(['duplicates',self.dir_],store)
+            handle_request(['report_solid',self.dir_],store)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        self.assertEqual(len(store),1)
+        store.write_caches()
+        for f in DataDir(self.dir_).files(extensions=('fastq',)):
+            self.assertNotEqual(f.md5,None)
+
+from arqvist.cli import main
+class TestServedOutput(unittest.TestCase):
+    def setUp(self):
+        # Create test directory with a non-ASCII name and start
+        # a server handling requests as for 'arqvist serve'
+        self.dir_ = utils.make_temp_dir()
+        self.data_dir = utils.make_subdir(self.dir_,'run\xc3\xb1')
+        utils.make_file('test\xc3\xb1.fastq',dirn=self.data_dir)
+        self.socket_path = os.path.join(self.dir_,'arqvist.sock')
+        self.out_file = os.path.join(self.dir_,'out.txt')
+        self.server = DataDirServer(self.socket_path,handle_request,
+                                    DataDirStore())
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+    def tearDown(self):
+        # Stop server and remove test directory
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        utils.rmdir(self.dir_)
+    def test_non_ascii_output(self):
+        stdout = sys.stdout
+        try:
+            sys.stdout = open(self.out_file,'w')
+            main(['list_files','--server',self.socket_path,self.data_dir])
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        self.assertTrue('test\xc3\xb1.fastq' in open(self.out_file).read())
@@ -0,0 +1,136 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/shards package
+import os
+import unittest
+import utils
+from arqvist.core import DataDir
+from arqvist.shards import shard_entries
+from arqvist.shards import walk_shard
+from arqvist.shards import scan_shard
+from arqvist.shards import merge_shards
+from arqvist.shards import read_partial
+
+class ShardsTestCase(unittest.TestCase):
+    """Base class for tests using a data dir to shard
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+        self.dirn = utils.make_subdir(self.wd,'data')
+        for name in ('a','b','c'):
+            subdir = utils.make_subdir(self.dirn,name)
+            utils.make_file('%s.fastq' % name,dirn=subdir,
+                            text="Data for %s" % name)
+            subsubdir = utils.make_subdir(subdir,'sub')
+            utils.make_file('%s.txt' % name,dirn=subsubdir,text=name)
+        utils.make_file('top.txt',dirn=self.dirn,text="Top level")
+        utils.make_symlink('link',os.path.join('a','a.fastq'),
+                           dirn=self.dirn)
+        os.mkdir(os.path.join(self.dirn,'.archiver'))
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def relpaths(self,paths):
+        return sorted([os.path.relpath(p,self.dirn) for p in paths])
+
+class TestShardEntries(ShardsTestCase):
+    """Tests for the shard_entries and walk_shard functions
+    """
+    def test_shard_entries(self):
+        self.assertEqual(shard_entries(self.dirn,2,0),
+                         [(os.path.join(self.dirn,'top.txt'),True)])
+        self.assertEqual(shard_entries(self.dirn,2,1),
+                         [(os.path.join(self.dirn,'a'),True),
+                          (os.path.join(self.dirn,'b'),True),
+                          (os.path.join(self.dirn,'c'),True),
+                          (os.path.join(self.dirn,'link'),True)])
+    def test_shard_entries_are_stable(self):
+        # Adding entries doesn't move the others between shards
+        shards = [shard_entries(self.dirn,3,i) for i in range(3)]
+        utils.make_file('new.txt',dirn=self.dirn,text="New")
+        new_file = (os.path.join(self.dirn,'new.txt'),True)
+        for i in range(3):
+            entries = shard_entries(self.dirn,3,i)
+            if new_file in entries:
+                entries.remove(new_file)
+            self.assertEqual(entries,shards[i])
+    def test_shard_entries_depth(self):
+        entries = shard_entries(self.dirn,1,0,depth=2)
+        self.assertTrue((os.path.join(self.dirn,'a'),False) in entries)
+        self.assertTrue((os.path.join(self.dirn,'a','sub'),True) in entries)
+        self.assertTrue((os.path.join(self.dirn,'top.txt'),True)
+                        in entries)
+    def test_shard_entries_bad_index(self):
+        self.assertRaises(ValueError,shard_entries,self.dirn,2,2)
+    def test_walk_shards_covers_data_dir(self):
+        for depth in (1,2,3):
+            paths = []
+            for i in range(3):
+                paths.extend(walk_shard(self.dirn,3,i,depth=depth))
+            self.assertEqual(self.relpaths(paths),
+                             self.relpaths(DataDir(self.dirn)._walk()))
+
+class TestMergeShards(ShardsTestCase):
+    """Tests for scanning and merging shards
+    """
+    def _scan_shards(self,nshards,algorithm=None):
+        partial_files = []
+        for i in range(nshards):
+            partial_file = os.path.join(self.wd,'shard%d.tsv' % i)
+            scan_shard(self.dirn,nshards,i,partial_file,
+                       algorithm=algorithm)
+            partial_files.append(partial_file)
+        return partial_files
+    def test_read_partial(self):
+        partial_file = self._scan_shards(2)[1]
+        dirn,nshards,index,entries = read_partial(partial_file)
+        self.assertEqual((dirn,nshards,index),(self.dirn,2,1))
+        self.assertEqual(self.relpaths([f.path for f in entries]),
+                         ['a','a/a.fastq','a/sub','a/sub/a.txt',
+                          'b','b/b.fastq','b/sub','b/sub/b.txt',
+                          'c','c/c.fastq','c/sub','c/sub/c.txt','link'])
+        link = [f for f in entries if f.basename == 'link'][0]
+        self.assertTrue(link.is_link)
+        self.assertFalse(link.is_dir)
+    def test_merge_shards_matches_single_scan(self):
+        partial_files = self._scan_shards(3,algorithm='md5')
+        merged = merge_shards(self.dirn,partial_files)
+        merged_cache = open(os.path.join(self.dirn,'.archiver',
+                                         'md5info')).read()
+        del(merged)
+        # Compare with a single process scan
+        os.remove(os.path.join(self.dirn,'.archiver','md5info'))
+        datadir = DataDir(self.dirn)
+        datadir.md5sums()
+        datadir.write_cache()
+        self.assertEqual(open(os.path.join(self.dirn,'.archiver',
+                                           'md5info')).read(),
+                         merged_cache)
+        merged = merge_shards(self.dirn,partial_files,write_cache=False)
+        self.assertEqual(merged.summary(),datadir.summary())
+        self.assertEqual(merged.md5sums_pending(),[])
+    def test_scan_shard_uses_cache(self):
+        datadir = DataDir(self.dirn)
+        datadir.md5sums()
+        datadir.write_cache()
+        del(datadir)
+        partial_file = os.path.join(self.wd,'shard.tsv')
+        shard = scan_shard(self.dirn,2,0,partial_file)
+        self.assertEqual(shard.md5sums_pending(),[])
+        # Cache isn't overwritten by the shard
+        del(shard)
+        self.assertEqual(len(DataDir(self.dirn).md5sums_pending()),0)
+        self.assertEqual(len(open(os.path.join(self.dirn,'.archiver',
+                                               'md5info')).readlines()),
+                         len(DataDir(self.dirn).files()))
+    def test_merge_shards_missing_shard(self):
+        partial_files = self._scan_shards(3)
+        self.assertRaises(Exception,merge_shards,self.dirn,
+                          partial_files[:2])
+    def test_merge_shards_inconsistent_shards(self):
+        partial_files = self._scan_shards(3)
+        partial_file = os.path.join(self.wd,'other.tsv')
+        scan_shard(self.dirn,2,1,partial_file)
+        self.assertRaises(Exception,merge_shards,self.dirn,
+                          partial_files + [partial_file])
+        self.assertRaises(Exception,merge_shards,self.dirn,
+                          partial_files + [partial_files[0]])
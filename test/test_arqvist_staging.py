@@ -0,0 +1,302 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/staging package
+import os
+import bz2
+import time
+import shutil
+import hashlib
+import unittest
+import utils
+from arqvist.core import DataDir
+from arqvist import staging
+from arqvist.staging import stage_dir
+from arqvist.staging import copy_file
+from arqvist.staging import copy_symlink
+from arqvist.staging import plan_staging
+from arqvist.staging import is_partial_copy
+
+TEXT = "This is some text\n"
+
+def md5(s):
+    return hashlib.md5(s).hexdigest()
+
+class TestCopyFile(unittest.TestCase):
+    """Tests for the copy_file function
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def test_copy_file(self):
+        src = utils.make_file('test.txt',dirn=self.wd,text=TEXT)
+        os.chmod(src,0640)
+        os.utime(src,(1000000000,1000000000))
+        dest = os.path.join(self.wd,'copy.txt')
+        self.assertEqual(copy_file(src,dest),(md5(TEXT),md5(TEXT)))
+        self.assertEqual(open(dest).read(),TEXT)
+        st = os.stat(dest)
+        self.assertEqual(st.st_mode & 0777,0640)
+        self.assertEqual(st.st_mtime,1000000000)
+        # No temporary files left behind
+        self.assertEqual(sorted(os.listdir(self.wd)),
+                         ['copy.txt','test.txt'])
+    def test_copy_file_small_blocks(self):
+        src = utils.make_file('test.txt',dirn=self.wd,text=TEXT)
+        dest = os.path.join(self.wd,'copy.txt')
+        self.assertEqual(copy_file(src,dest,'sha1',block_size=4)[0],
+                         hashlib.sha1(TEXT).hexdigest())
+        self.assertEqual(open(dest).read(),TEXT)
+    def test_copy_compressed_file(self):
+        src = utils.make_file('test.txt.bz2',dirn=self.wd,text=TEXT,
+                              compress='bz2')
+        dest = os.path.join(self.wd,'copy.txt.bz2')
+        self.assertEqual(copy_file(src,dest,compression='bz2'),
+                         (md5(open(src,'rb').read()),md5(TEXT)))
+        self.assertEqual(bz2.BZ2File(dest).read(),TEXT)
+    def test_copy_file_replaces_readonly_file(self):
+        src = utils.make_file('test.txt',dirn=self.wd,text=TEXT)
+        dest = utils.make_file('copy.txt',dirn=self.wd,text="old")
+        os.chmod(dest,0444)
+        copy_file(src,dest)
+        self.assertEqual(open(dest).read(),TEXT)
+    @unittest.skipIf(os.geteuid() != 0,"needs to run as root")
+    def test_copy_file_owner(self):
+        src = utils.make_file('test.txt',dirn=self.wd,text=TEXT)
+        os.chown(src,12345,23456)
+        dest = os.path.join(self.wd,'copy.txt')
+        copy_file(src,dest)
+        st = os.stat(dest)
+        self.assertEqual((st.st_uid,st.st_gid),(12345,23456))
+    def test_copy_file_checksum_mismatch(self):
+        src = utils.make_file('test.txt',dirn=self.wd,text=TEXT)
+        dest = utils.make_file('copy.txt',dirn=self.wd,text="old")
+        self.assertRaises(IOError,copy_file,src,dest,
+                          expected_checksum=md5("other"))
+        # Destination is untouched and no temporary files left
+        self.assertEqual(open(dest).read(),"old")
+        self.assertEqual(sorted(os.listdir(self.wd)),
+                         ['copy.txt','test.txt'])
+        self.assertEqual(copy_file(src,dest,expected_checksum=md5(TEXT)),
+                         (md5(TEXT),md5(TEXT)))
+
+class TestCopySymlink(unittest.TestCase):
+    """Tests for the copy_symlink function
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def test_copy_symlink(self):
+        src = utils.make_symlink('link',os.path.join('..','missing'),
+                                 dirn=self.wd)
+        dest = os.path.join(self.wd,'copy')
+        copy_symlink(src,dest)
+        self.assertEqual(os.readlink(dest),os.path.join('..','missing'))
+        # Replace existing link
+        copy_symlink(utils.make_symlink('link2','target',dirn=self.wd),
+                     dest)
+        self.assertEqual(os.readlink(dest),'target')
+    @unittest.skipIf(os.geteuid() != 0,"needs to run as root")
+    def test_copy_symlink_owner(self):
+        src = utils.make_symlink('link','target',dirn=self.wd)
+        os.lchown(src,12345,23456)
+        dest = os.path.join(self.wd,'copy')
+        copy_symlink(src,dest)
+        st = os.lstat(dest)
+        self.assertEqual((st.st_uid,st.st_gid),(12345,23456))
+
+class TestStageDir(unittest.TestCase):
+    """Tests for the stage_dir function
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+        self.src = utils.make_subdir(self.wd,'run')
+        subdir = utils.make_subdir(self.src,'sub')
+        utils.make_file('test.txt',dirn=subdir,text=TEXT)
+        utils.make_file('test.txt.bz2',dirn=self.src,text=TEXT,
+                        compress='bz2')
+        utils.make_symlink('link',os.path.join('sub','test.txt'),
+                           dirn=self.src)
+        utils.make_subdir(subdir,'empty')
+        os.utime(subdir,(1000000000,1000000000))
+        os.utime(self.src,(1000000000,1000000000))
+        self.staging = utils.make_subdir(self.wd,'staging')
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def test_stage_dir(self):
+        status = stage_dir(DataDir(self.src),self.staging,nthreads=2)
+        self.assertEqual(status,0)
+        dest = os.path.join(self.staging,'run')
+        self.assertEqual(open(os.path.join(dest,'sub','test.txt')).read(),
+                         TEXT)
+        self.assertEqual(os.readlink(os.path.join(dest,'link')),
+                         os.path.join('sub','test.txt'))
+        self.assertTrue(os.path.isdir(os.path.join(dest,'sub','empty')))
+        for d in ('.','sub'):
+            self.assertEqual(os.stat(os.path.join(dest,d)).st_mtime,
+                             1000000000)
+        # Checksums are loaded from the cache
+        staged = DataDir(dest)
+        md5s = dict([(f.relpath(dest),(f.md5,f.uncompressed_md5))
+                     for f in staged.files()])
+        self.assertEqual(md5s['sub/test.txt'],(md5(TEXT),md5(TEXT)))
+        self.assertEqual(md5s['test.txt.bz2'][1],md5(TEXT))
+        self.assertEqual(md5s['link'],(None,None))
+        self.assertEqual(staged.md5sums_pending(),[])
+    def test_stage_dir_dry_run(self):
+        status = stage_dir(DataDir(self.src),self.staging,dry_run=True)
+        self.assertEqual(status,0)
+        self.assertEqual(os.listdir(self.staging),[])
+    def test_stage_dir_update(self):
+        stage_dir(DataDir(self.src),self.staging)
+        dest = os.path.join(self.staging,'run')
+        # Modify the source and staged copy
+        utils.make_file('new.txt',dirn=self.src,text=TEXT)
+        utils.make_file('test.txt',dirn=os.path.join(self.src,'sub'),
+                        text=TEXT*2)
+        os.remove(os.path.join(self.src,'test.txt.bz2'))
+        utils.make_file('extra.txt',dirn=dest,text=TEXT)
+        utils.make_file('.new.txt.a1b2c3',dirn=dest,text="partial")
+        # Update without deleting
+        self.assertEqual(stage_dir(DataDir(self.src),self.staging),0)
+        self.assertEqual(sorted(os.listdir(dest)),
+                         ['.archiver','extra.txt','link','new.txt',
+                          'sub','test.txt.bz2'])
+        self.assertEqual(open(os.path.join(dest,'sub','test.txt')).read(),
+                         TEXT*2)
+        staged = DataDir(dest)
+        md5s = dict([(f.relpath(dest),f.md5) for f in staged.files()])
+        self.assertEqual(md5s['new.txt'],md5(TEXT))
+        self.assertEqual(md5s['sub/test.txt'],md5(TEXT*2))
+        self.assertNotEqual(md5s['test.txt.bz2'],None)
+        # Update and delete
+        self.assertEqual(stage_dir(DataDir(self.src),self.staging,
+                                   delete=True),0)
+        self.assertEqual(sorted(os.listdir(dest)),
+                         ['.archiver','link','new.txt','sub'])
+
+class _InterruptingProgress:
+    # Progress reporter which raises KeyboardInterrupt
+    # after a number of updates
+    def __init__(self,nupdates):
+        self.nupdates = nupdates
+    def update(self,nbytes,nitems=0):
+        self.nupdates -= 1
+        if self.nupdates <= 0:
+            raise KeyboardInterrupt()
+    def finish(self):
+        pass
+
+class TestStageDirInterrupted(unittest.TestCase):
+    """Tests for interrupting and resuming stage_dir
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+        self.src = utils.make_subdir(self.wd,'run')
+        for i in range(20):
+            utils.make_file('test%02d.txt' % i,dirn=self.src,
+                            text=TEXT*(i+1)*1000)
+        self.staging = utils.make_subdir(self.wd,'staging')
+        self.dest = os.path.join(self.staging,'run')
+        self.get_progress_reporter = staging.get_progress_reporter
+        staging.get_progress_reporter = \
+            lambda *args,**kws: _InterruptingProgress(2)
+    def tearDown(self):
+        staging.get_progress_reporter = self.get_progress_reporter
+        utils.rmdir(self.wd)
+    def test_stage_dir_interrupted(self):
+        self.assertRaises(KeyboardInterrupt,stage_dir,
+                          DataDir(self.src),self.staging,nthreads=1)
+        # The remaining copies were abandoned
+        copied = [f for f in os.listdir(self.dest)
+                  if f.startswith('test')]
+        self.assertTrue(len(copied) < 20)
+    def test_stage_dir_resume(self):
+        self.assertRaises(KeyboardInterrupt,stage_dir,
+                          DataDir(self.src),self.staging,nthreads=1)
+        # Simulate a copy which finished without its checksum
+        # being recorded
+        for f in sorted(os.listdir(self.src)):
+            if not os.path.exists(os.path.join(self.dest,f)):
+                shutil.copy2(os.path.join(self.src,f),self.dest)
+                break
+        staging.get_progress_reporter = self.get_progress_reporter
+        self.assertEqual(stage_dir(DataDir(self.src),self.staging),0)
+        staged = DataDir(self.dest)
+        self.assertEqual(len(staged.files()),20)
+        self.assertEqual(staged.md5sums_pending(),[])
+        for f in staged.files():
+            self.assertEqual(f.md5,md5(open(f.path).read()))
+
+class TestPlanStaging(unittest.TestCase):
+    """Tests for the plan_staging function
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+        self.src = utils.make_subdir(self.wd,'run')
+        utils.make_subdir(self.src,'sub')
+        utils.make_file('test1.txt',dirn=self.src,text=TEXT)
+        utils.make_file('test2.txt',dirn=self.src,text=TEXT)
+        utils.make_symlink('link','test1.txt',dirn=self.src)
+        self.staging = utils.make_subdir(self.wd,'staging')
+        stage_dir(DataDir(self.src),self.staging)
+        self.dest = os.path.join(self.staging,'run')
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def _plan(self):
+        plan = plan_staging(DataDir(self.src),DataDir(self.dest))
+        return dict([(status,sorted([e[0] for e in getattr(plan,status)]))
+                     for status in ('new','changed','deleted','partial',
+                                    'unchanged')])
+    def test_plan_staging_no_staged_copy(self):
+        plan = plan_staging(DataDir(self.src))
+        self.assertEqual(sorted([e[0] for e in plan.new]),
+                         ['link','sub','test1.txt','test2.txt'])
+        self.assertEqual(plan.nbytes,2*len(TEXT))
+    def test_plan_staging_unchanged(self):
+        plan = self._plan()
+        self.assertEqual(plan['unchanged'],
+                         ['link','sub','test1.txt','test2.txt'])
+        for status in ('new','changed','deleted','partial'):
+            self.assertEqual(plan[status],[])
+    def test_plan_staging_changes(self):
+        utils.make_file('test3.txt',dirn=self.src,text=TEXT)
+        utils.make_file('test1.txt',dirn=self.src,text=TEXT*2)
+        os.remove(os.path.join(self.src,'link'))
+        utils.make_symlink('link','test2.txt',dirn=self.src)
+        os.remove(os.path.join(self.src,'test2.txt'))
+        utils.make_subdir(self.src,'test2.txt')
+        utils.make_file('extra.txt',dirn=self.dest,text=TEXT)
+        utils.make_file('.test3.txt.a1b2c3',dirn=self.dest,text=TEXT)
+        plan = self._plan()
+        self.assertEqual(plan['new'],['test3.txt'])
+        self.assertEqual(plan['changed'],['link','test1.txt','test2.txt'])
+        self.assertEqual(plan['deleted'],['extra.txt'])
+        self.assertEqual(plan['partial'],['.test3.txt.a1b2c3'])
+        self.assertEqual(plan['unchanged'],['sub'])
+    def test_plan_staging_missing_staged_checksum(self):
+        datadir = DataDir(self.src)
+        staged = DataDir(self.dest)
+        for f in staged.files():
+            if f.basename == 'test1.txt':
+                f.set_checksums('md5',None,None)
+        plan = plan_staging(datadir,staged)
+        self.assertEqual([e[0] for e in plan.changed],['test1.txt'])
+        self.assertEqual(sorted([e[0] for e in plan.unchanged]),
+                         ['link','sub','test2.txt'])
+
+class TestIsPartialCopy(unittest.TestCase):
+    """Tests for the is_partial_copy function
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+        utils.make_file('test.txt',dirn=self.wd,text=TEXT)
+    def tearDown(self):
+        utils.rmdir(self.wd)
+    def test_is_partial_copy(self):
+        datadir = DataDir(self.wd)
+        self.assertTrue(is_partial_copy('.test.txt.Ab_12z',datadir))
+        self.assertFalse(is_partial_copy('.test.txt.Ab_12z.gz',datadir))
+        self.assertFalse(is_partial_copy('.other.txt.Ab_12z',datadir))
+        self.assertFalse(is_partial_copy('test.txt',datadir))
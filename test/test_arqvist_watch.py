@@ -0,0 +1,119 @@
+#!/bin/env python
+#
+# Unit tests for the arqvist/watch package
+import os
+import unittest
+import utils
+from arqvist.core import DataDir
+from arqvist.watch import get_libc
+from arqvist.watch import get_watcher
+from arqvist.watch import InotifyWatcher
+from arqvist.watch import PollingWatcher
+
+class WatcherTestCase(unittest.TestCase):
+    """Base class for tests watching a data dir
+    """
+    def setUp(self):
+        self.wd = utils.make_temp_dir()
+        self.dirn = utils.make_subdir(self.wd,'data')
+        subdir = utils.make_subdir(self.dirn,'reads')
+        utils.make_file('test1.fastq',dirn=subdir,text="Reads 1")
+        utils.make_file('test2.fastq',dirn=subdir,text="Reads 2")
+        utils.make_file('README',dirn=self.dirn,text="Test data")
+        self.datadir = DataDir(self.dirn)
+        self.datadir.init_cache()
+        self.datadir.md5sums()
+        self.datadir.write_cache()
+        self.watcher = None
+    def tearDown(self):
+        if self.watcher is not None:
+            self.watcher.close()
+        utils.rmdir(self.wd)
+    def make_changes(self):
+        # Create, modify, delete and rename files and dirs
+        reads = os.path.join(self.dirn,'reads')
+        utils.make_file('test3.fastq',dirn=reads,text="Reads 3")
+        with open(os.path.join(reads,'test1.fastq'),'a') as fp:
+            fp.write("More reads\n")
+        os.remove(os.path.join(self.dirn,'README'))
+        os.rename(os.path.join(reads,'test2.fastq'),
+                  os.path.join(reads,'sample2.fastq'))
+        new_dir = utils.make_subdir(self.dirn,'analysis')
+        utils.make_file('results.txt',dirn=new_dir,text="Results")
+    def check_changes(self):
+        # Check the data dir and cache match a new scan
+        d = self.datadir
+        self.assertEqual(sorted([f.relpath(self.dirn) for f in d.files()]),
+                         ['analysis',
+                          'analysis/results.txt',
+                          'reads',
+                          'reads/sample2.fastq',
+                          'reads/test1.fastq',
+                          'reads/test3.fastq'])
+        self.assertEqual(d.summary(),DataDir(self.dirn).summary())
+        self.assertEqual(d.files(pattern='test1.fastq')[0].md5,None)
+        self.assertNotEqual(d.files(pattern='sample2.fastq')[0].md5,None)
+        # Cache has been updated
+        with open(os.path.join(self.dirn,'.archiver','md5info')) as fp:
+            cached = sorted([line.split('\t')[0] for line in fp])
+        self.assertEqual(cached,
+                         sorted([f.relpath(self.dirn) for f in d.files()]))
+
+class TestInotifyWatcher(WatcherTestCase):
+    """Tests for the InotifyWatcher class
+    """
+    def setUp(self):
+        if get_libc() is None:
+            raise unittest.SkipTest("inotify not available")
+        WatcherTestCase.setUp(self)
+    def test_no_changes(self):
+        self.watcher = InotifyWatcher(self.datadir)
+        self.assertFalse(self.watcher.poll())
+    def test_changes(self):
+        self.watcher = InotifyWatcher(self.datadir)
+        self.make_changes()
+        self.assertTrue(self.watcher.poll(timeout=1.0))
+        self.check_changes()
+    def test_changes_in_new_dir(self):
+        self.watcher = InotifyWatcher(self.datadir)
+        new_dir = utils.make_subdir(self.dirn,'analysis')
+        self.assertTrue(self.watcher.poll(timeout=1.0))
+        utils.make_file('results.txt',dirn=new_dir,text="Results")
+        self.assertTrue(self.watcher.poll(timeout=1.0))
+        self.assertEqual(len(self.datadir.files(pattern='results.txt')),1)
+    def test_moved_dir(self):
+        self.watcher = InotifyWatcher(self.datadir)
+        os.rename(os.path.join(self.dirn,'reads'),
+                  os.path.join(self.dirn,'fastqs'))
+        self.assertTrue(self.watcher.poll(timeout=1.0))
+        utils.make_file('test3.fastq',dirn=os.path.join(self.dirn,'fastqs'),
+                        text="Reads 3")
+        self.assertTrue(self.watcher.poll(timeout=1.0))
+        self.assertEqual(self.datadir.summary(),DataDir(self.dirn).summary())
+        self.assertEqual(self.datadir.files(subdir='reads'),[])
+        self.assertEqual(self.datadir.checksums_pending('md5'),
+                         self.datadir.files(pattern='test3.fastq'))
+
+class TestPollingWatcher(WatcherTestCase):
+    """Tests for the PollingWatcher class
+    """
+    def test_changes(self):
+        self.watcher = PollingWatcher(self.datadir,interval=0)
+        self.assertFalse(self.watcher.poll())
+        self.make_changes()
+        self.assertTrue(self.watcher.poll())
+        self.check_changes()
+    def test_interval(self):
+        self.watcher = PollingWatcher(self.datadir,interval=3600)
+        self.make_changes()
+        self.assertFalse(self.watcher.poll())
+
+class TestGetWatcher(WatcherTestCase):
+    """Tests for the get_watcher function
+    """
+    def test_get_watcher(self):
+        self.watcher = get_watcher(self.datadir)
+        if get_libc() is not None:
+            self.assertTrue(isinstance(self.watcher,InotifyWatcher))
+        else:
+            self.assertTrue(isinstance(self.watcher,PollingWatcher))